@@ -1,5 +1,6 @@
 import re
 
+from questions.db_router import replica_reads
 from questions.models import Tag
 
 FIELD_NAME__TAG_ID_PREFIX = 'field_name__tag_id=' # e.g. field_name__tag_id=5
@@ -36,6 +37,7 @@ class TagList:
         # e.g., [1, 2]
         return self.id_int_list
     
+    @replica_reads()
     def as_form_fields_list(self, user):  # previously called get_tag_fields()
     # Get all tags for {user}.  Return a list of dicts, sorted by tag name, where each dict has the fields for one tag,
     # with tag_form_name and tag_form_label to be used in the HTML form.
@@ -1,11 +1,38 @@
 from django.db import models
+from django.db.models import Prefetch, Q
 from django.contrib import admin
-from django.urls import reverse
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from django.utils.html import format_html
 
 from pagedown.widgets import AdminPagedownWidget
 
-from .models import Answer, Attempt, Tag, Question, QuestionTag, Schedule, TagLineage
+from .db_router import replica_reads
+from .duplicates import DEFAULT_THRESHOLD, find_duplicate_clusters
+from .models import Answer, ArchivedHistory, Attempt, Job, Tag, Question, QuestionTag, OfflineReview, Schedule, SlowQuery, StudySession, TagLineage
+from .search import ANSWER_SEARCH, ATTEMPT_SEARCH, QUESTION_SEARCH
+
+class ReplicaChangelistAdmin(admin.ModelAdmin):
+    # Read the changelist (the list of objects) from the read replica, if there is one.  See questions.db_router.
+    def changelist_view(self, request, extra_context=None):
+        with replica_reads():
+            return super().changelist_view(request, extra_context=extra_context)
+
+
+class FullTextSearchAdmin(ReplicaChangelistAdmin):
+    # Search the question/answer/attempt text with the full-text search tables (see questions.search), rather than
+    # with icontains scans of all the text.  search_fields is then only used for the cheap fields (ids and tag names).
+    full_text_searches = []  # [(SearchIndex, field), ...], e.g., [(QUESTION_SEARCH, 'pk')]; see SearchIndex.filter_q()
+
+    def get_search_results(self, request, queryset, search_term):
+        queryset_fields, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if not search_term.strip():
+            return queryset_fields, may_have_duplicates
+        q = Q()
+        for search, field in self.full_text_searches:
+            q |= search.filter_q(text=search_term, field=field, using=queryset.db)
+        return queryset_fields | queryset.filter(q), may_have_duplicates
+
 
 class AnswerQuestionRelationshipInline(admin.TabularInline):
     model = Question
@@ -21,15 +48,21 @@ class TagQuestionRelationshipInline(admin.TabularInline):
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
-class AnswerAdmin(admin.ModelAdmin):
+class AnswerAdmin(FullTextSearchAdmin):
     # Show questions that are linked with this answer
     inlines = [AnswerQuestionRelationshipInline]
     list_display = ['id', 'datetime_added', 'datetime_updated', 'user', 'answer', 'question_display']
     formfield_overrides = {
         models.TextField: {'widget': AdminPagedownWidget},
     }
-    # enable searching for Answer's on these two fields
-    search_fields = ['answer', 'question__question']
+    list_select_related = ['user']
+    # enable searching for Answer's on their id, and on the text of the answer and its questions
+    full_text_searches = [(ANSWER_SEARCH, 'pk'), (QUESTION_SEARCH, 'question')]
+    search_fields = ['=pk']
+
+    def get_queryset(self, request):
+        # Get the questions of all the answers on the page in one query (for question_display), rather than one each
+        return super().get_queryset(request).prefetch_related('question_set')
     
     def get_form(self, request, obj=None, **kwargs):
         '''Default the user field to the current user.'''
@@ -50,14 +83,20 @@ class AnswerAdmin(admin.ModelAdmin):
     question_display.short_description = 'Question(s)'
 
 
-class AttemptAdmin(admin.ModelAdmin):
+class AttemptAdmin(FullTextSearchAdmin):
     list_display = ['id', 'datetime_added', 'tags_display', 'attempt', 'user', 'question']
+    list_select_related = ['user', 'question']
     formfield_overrides = {
         models.TextField: {'widget': AdminPagedownWidget},
     }
     readonly_fields = ('datetime_added', 'datetime_updated')
-    # enable searching for Attempt's on these fields
-    search_fields = ['attempt', 'question__id', 'question__question', 'question__tag__name']
+    # enable searching for Attempt's on these fields, and on the text of the attempt and its question
+    full_text_searches = [(ATTEMPT_SEARCH, 'pk'), (QUESTION_SEARCH, 'question')]
+    search_fields = ['=question__id', 'question__tag__name']
+
+    def get_queryset(self, request):
+        # Get the tags of all the questions on the page in one query (for tags_display), rather than one each
+        return super().get_queryset(request).prefetch_related('question__tag_set')
 
     def tags_display(self, obj):
         # Use for list_display to show the names of all the tags (a many-to-many field)
@@ -66,12 +105,14 @@ class AttemptAdmin(admin.ModelAdmin):
         ])
     tags_display.short_description = "Tags"
 
-class QuestionTagAdmin(admin.ModelAdmin):
+class QuestionTagAdmin(FullTextSearchAdmin):
     # exclude questions, otherwise questions will be shown as a vertical inline as well as the horizontal inline
     list_display = ['datetime_added', 'datetime_updated', 'tag_name', 'link_to_tag', 'link_to_question', 'user', 'question']
+    list_select_related = ['user', 'tag', 'question']
     list_per_page = 5000  # how many items to show per page
     ordering = ('tag__name', 'question')
-    search_fields = ['tag__name', 'question__question']
+    full_text_searches = [(QUESTION_SEARCH, 'question')]
+    search_fields = ['tag__name']
 
     def tag_name(self, obj):
         # obj is a QuestionTag object
@@ -99,11 +140,12 @@ class QuestionTagAdmin(admin.ModelAdmin):
 
     link_to_tag.short_description = 'Edit tag'  # the column heading
 
-class TagAdmin(admin.ModelAdmin):
+class TagAdmin(ReplicaChangelistAdmin):
     # exclude questions, otherwise questions will be shown as a vertical inline as well as the horizontal inline
     exclude = ('questions',)
     inlines = [TagQuestionRelationshipInline]
     list_display = ['datetime_added', 'datetime_updated', 'name', 'pk', 'user']
+    list_select_related = ['user']
     list_per_page = 999  # how many items to show per page
     ordering = ('name', 'pk')
     search_fields = ['name']
@@ -115,9 +157,10 @@ class TagAdmin(admin.ModelAdmin):
             form.base_fields['user'].initial = request.user
         return form
 
-class TagLineageAdmin(admin.ModelAdmin):
+class TagLineageAdmin(ReplicaChangelistAdmin):
     # I have not found a way to include the links in the ordering, hence two columns each for the parent and the child.
     list_display = ['datetime_added', 'datetime_updated', 'parent_name', 'child_name', 'parent_link', 'child_link', 'user']
+    list_select_related = ['user', 'parent_tag', 'child_tag']
     list_per_page = 5000  # how many items to show per page
     ordering = ('parent_tag__name', 'child_tag__name')
     search_fields = ['parent_tag__name', 'child_tag__name']
@@ -161,15 +204,17 @@ class TagLineageAdmin(admin.ModelAdmin):
     parent_name.admin_order_field = 'parent__name'  # Sort by parent_tag.name rather than default of parent_tag.id
     parent_name.short_description = 'Parent'  # column heading
 
-class QuestionAdmin(admin.ModelAdmin):
+class QuestionAdmin(FullTextSearchAdmin):
     inlines = [TagQuestionRelationshipInline]
     list_display = ['pk', 'datetime_added', 'datetime_updated', 'tags_display', 'user', 'question', 'answer']
+    list_select_related = ['user', 'answer']
     # list_filter = ['',]
     formfield_overrides = {
         models.TextField: {'widget': AdminPagedownWidget},
     }
-    # enable searching for Question's on these two fields
-    search_fields = ['answer__answer', 'pk', 'question', 'tag__name']
+    # enable searching for Question's on these fields, and on the question and answer text
+    full_text_searches = [(QUESTION_SEARCH, 'pk')]
+    search_fields = ['=pk', 'tag__name']
 
     def get_form(self, request, obj=None, **kwargs):
         '''Default the user field to the current user.'''
@@ -178,15 +223,45 @@ class QuestionAdmin(admin.ModelAdmin):
             form.base_fields['user'].initial = request.user
         return form
 
+    def get_queryset(self, request):
+        # Get the tags of all the questions on the page in one query (for tags_display), rather than one each
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('tag_set', queryset=Tag.objects.order_by('name')))
+
     def tags_display(self, obj):
-        # Use for list_display to show the names of all the tags (a many-to-many field)
+        # Use for list_display to show the names of all the tags (a many-to-many field), sorted by the prefetch
         return ", ".join([
-            tag.name for tag in obj.tag_set.all().order_by('name')
+            tag.name for tag in obj.tag_set.all()
         ])
     tags_display.short_description = "Tags"
 
+    def get_urls(self):
+        # Add the duplicates page: /admin/questions/question/duplicates/
+        return [
+            path('duplicates/', self.admin_site.admin_view(self.duplicates_view), name='questions_question_duplicates'),
+        ] + super().get_urls()
+
+    def duplicates_view(self, request):
+        # List the current user's clusters of duplicate and near-duplicate questions (see questions.duplicates)
+        try:
+            threshold = float(request.GET.get('threshold', DEFAULT_THRESHOLD))
+        except ValueError:
+            threshold = DEFAULT_THRESHOLD
+        with replica_reads():
+            clusters = find_duplicate_clusters(user=request.user, threshold=threshold)
+            questions = Question.objects.select_related('answer').in_bulk(
+                [question_id for cluster in clusters for question_id in cluster])
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title='Duplicate questions',
+            threshold=threshold,
+            clusters=[[questions[question_id] for question_id in cluster] for cluster in clusters],
+        )
+        return TemplateResponse(request, 'admin/questions/question/duplicates.html', context)
 
-class ScheduleAdmin(admin.ModelAdmin):
+
+class ScheduleAdmin(ReplicaChangelistAdmin):
     list_display = [
         'id',
         'datetime_added',
@@ -199,11 +274,51 @@ class ScheduleAdmin(admin.ModelAdmin):
         'user',
         'question',
     ]
+    list_select_related = ['user', 'question']
+
+class ArchivedHistoryAdmin(ReplicaChangelistAdmin):
+    list_display = ['id', 'datetime_added', 'datetime_updated', 'count_schedules', 'count_attempts', 'user', 'question']
+    list_select_related = ['user', 'question']
+
+class OfflineReviewAdmin(ReplicaChangelistAdmin):
+    list_display = ['id', 'datetime_added', 'client_id', 'user', 'question']
+    list_select_related = ['user', 'question']
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'datetime_added', 'name', 'status', 'priority', 'attempts', 'run_after', 'datetime_finished', 'worker']
+    list_filter = ['status', 'name']
+
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'datetime_added', 'duration_ms', 'origin', 'view', 'db_alias', 'has_plan', 'sql_display']
+    list_filter = ['db_alias', 'view']
+    search_fields = ['origin', 'view', 'sql']
+    ordering = ['-id']
+    readonly_fields = [field.name for field in SlowQuery._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(boolean=True, description='plan')
+    def has_plan(self, obj):
+        return bool(obj.plan)
+
+    @admin.display(description='sql')
+    def sql_display(self, obj):
+        return obj.sql[:100]
+
+class StudySessionAdmin(ReplicaChangelistAdmin):
+    list_display = ['id', 'datetime_updated', 'query_name', 'tag_ids_selected', 'cards_per_tag', 'tag_index', 'count_answered_for_tag', 'user']
+    list_select_related = ['user']
 
 admin.site.register(Answer, AnswerAdmin)
+admin.site.register(ArchivedHistory, ArchivedHistoryAdmin)
 admin.site.register(Attempt, AttemptAdmin)
+admin.site.register(Job, JobAdmin)
 admin.site.register(Tag, TagAdmin)
 admin.site.register(TagLineage, TagLineageAdmin)
+admin.site.register(OfflineReview, OfflineReviewAdmin)
 admin.site.register(Question, QuestionAdmin)
 admin.site.register(QuestionTag, QuestionTagAdmin)
-admin.site.register(Schedule, ScheduleAdmin)
\ No newline at end of file
+admin.site.register(Schedule, ScheduleAdmin)
+admin.site.register(SlowQuery, SlowQueryAdmin)
+admin.site.register(StudySession, StudySessionAdmin)
\ No newline at end of file
@@ -0,0 +1,19 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+class QuestionsConfig(AppConfig):
+    name = 'questions'
+
+    def ready(self):
+        # Register the signal receivers that keep the full-text search tables and the duplicate index up to date,
+        # that invalidate the cached due forecasts, that add the tombstones for incremental backups, and that count
+        # the writes for the metrics
+        from questions import backups, due_forecast, duplicates, metrics, search  # noqa: F401
+        post_migrate.connect(_create_partitions, sender=self)
+
+
+def _create_partitions(using, **kwargs):
+    # Keep the partitions of the history tables created ahead of time, if they are partitioned (see questions.partitions)
+    from questions.partitions import create_all_partitions
+    create_all_partitions(using=using)
@@ -0,0 +1,236 @@
+import json
+import os
+from collections import defaultdict
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from emailusername.models import User
+from questions.duplicates import rebuild_duplicate_index
+from questions.partitions import is_partitioned
+from questions.models import (
+    Answer, ArchivedHistory, Attempt, DeletedRow, OfflineReview, Question, QuestionTag, Schedule, StudySession, Tag,
+    TagLineage)
+from questions.search import ANSWER_SEARCH, ATTEMPT_SEARCH, QUESTION_SEARCH
+from questions.user_archive import open_archive, to_json
+
+'''
+Incremental backups: a base snapshot of all the tables, then deltas with only the rows changed since the previous
+backup, so that a nightly backup reads only a day's changes, rather than dumping the whole database.
+
+    - Changed rows: every model (except User) has datetime_updated (see CreatedBy), so a delta has the rows with
+      datetime_updated at or after the previous backup's watermark (the time that it started), less WATERMARK_OVERLAP,
+      for transactions that were still open then.  Rows in more than one backup are upserted again, which is harmless.
+      The users table is small, and has no datetime_updated, so each backup has all of it.  Rows imported with
+      import_user_archive get the time of the import as their datetime_updated, so the next delta has them.
+    - Deleted rows: a trigger on each table adds a tombstone (DeletedRow) for each deleted row (see the
+      0023_tombstone_triggers migration), and a delta has the tombstones added since the previous backup.  Being in
+      the db, the triggers also see QuerySet._raw_delete()'s, and deletes stay Django's fast deletes (a post_delete
+      receiver would make Django load and delete the rows one at a time).  A new base deletes the tombstones that it no
+      longer needs.
+    - QuerySet.update() doesn't set datetime_updated, so code that uses it sets it explicitly (e.g., BulkReschedule),
+      or take a new base (--full) afterwards (e.g., after backfill_interval_secs).
+
+Each backup is a file in the backup directory, in the format of questions.user_archive (compressed JSON lines), but
+with all the users' rows, and their ids:
+    {"format": 1, "type": "delta", "since": "<iso datetime>", "watermark": "<iso datetime>"}
+    {"section": "questions_question"}
+    {"id": 5, "datetime_added": "<iso datetime>", ..., "user_id": 1, "question": "...", "answer_id": 7}
+    ...
+    {"section": "deleted"}
+    {"table": "questions_schedule", "row_id": 9}
+and MANIFEST_NAME lists the backups, in order, with their watermarks.  Restoring applies the newest base, then each
+delta after it (each in one transaction), upserting the rows by id (with their timestamps) and deleting the
+tombstoned rows, then rebuilds the derived tables (the search and duplicate indexes).
+'''
+
+BACKUP_FORMAT_VERSION = 1
+BACKUP_MODELS = [
+    User, Tag, TagLineage, Answer, Question, QuestionTag, Attempt, Schedule, ArchivedHistory, StudySession, OfflineReview]
+MODELS_BY_TABLE = {model._meta.db_table: model for model in BACKUP_MODELS}
+SECTION_DELETED = 'deleted'
+MANIFEST_NAME = 'manifest.json'
+WATERMARK_OVERLAP = timezone.timedelta(minutes=5)
+
+
+def read_manifest(backup_dir):
+    path = os.path.join(backup_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return dict(format=BACKUP_FORMAT_VERSION, backups=[])
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def _write_manifest(backup_dir, manifest):
+    # Write to a temporary file, then rename it, so that a failed write doesn't lose the manifest
+    path = os.path.join(backup_dir, MANIFEST_NAME)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def create_backup(backup_dir, full=False):
+    # Write a backup of the rows changed since the last backup in backup_dir (or of all the rows, for the first backup,
+    # or if full), and add it to the manifest.  Returns the manifest entry: {"file", "type", "since", "watermark", "counts"}.
+    os.makedirs(backup_dir, exist_ok=True)
+    manifest = read_manifest(backup_dir)
+    full = full or not manifest['backups']
+    since = None if full else parse_datetime(manifest['backups'][-1]['watermark'])
+    backup_type = 'base' if full else 'delta'
+    # All the sections are read from one snapshot (as pg_dump does), so that the rows inserted during the backup
+    # (e.g., a question and its schedules) are in all of its sections or none of them.  On sqlite, the transaction's
+    # read lock keeps the writers out until it's done.
+    is_snapshot = connection.vendor == 'postgresql' and not connection.in_atomic_block
+    with transaction.atomic():
+        if is_snapshot:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        # Before the snapshot (its first query), so that the rows committed after it are in the next delta
+        watermark = timezone.now()
+        file_name = f'{backup_type}-{watermark:%Y%m%d-%H%M%S-%f}.jsonl.gz'
+        with open_archive(os.path.join(backup_dir, file_name), mode='wt') as file:
+            counts = write_backup(file=file, backup_type=backup_type, since=since, watermark=watermark)
+    entry = dict(file=file_name, type=backup_type, since=since and since.isoformat(), watermark=watermark.isoformat(),
+                 counts=counts)
+    manifest['backups'].append(entry)
+    _write_manifest(backup_dir, manifest)
+    if full:
+        # The base has all the rows, so the older tombstones are no longer needed
+        DeletedRow.objects.filter(datetime_deleted__lt=watermark - WATERMARK_OVERLAP).delete()
+    return entry
+
+
+def write_backup(file, backup_type, since, watermark, chunk_size=2000):
+    # Write the rows changed since since (all the rows, if since is None), and the tombstones.  Returns {section: count}.
+    counts = {}
+    file.write(json.dumps(dict(format=BACKUP_FORMAT_VERSION, type=backup_type, since=since, watermark=watermark),
+                          default=to_json) + '\n')
+    for model in BACKUP_MODELS:
+        queryset = model.objects.all()
+        if since is not None and _has_datetime_updated(model):
+            queryset = queryset.filter(datetime_updated__gte=since - WATERMARK_OVERLAP)
+        counts[model._meta.db_table] = _write_section(
+            file=file, section=model._meta.db_table, chunk_size=chunk_size,
+            rows=queryset.order_by('pk').values(*(field.attname for field in model._meta.concrete_fields)))
+    if since is not None:
+        counts[SECTION_DELETED] = _write_section(
+            file=file, section=SECTION_DELETED, chunk_size=chunk_size,
+            rows=DeletedRow.objects.filter(datetime_deleted__gte=since - WATERMARK_OVERLAP)
+            .order_by('id').values('table', 'row_id'))
+    return counts
+
+
+def _write_section(file, section, rows, chunk_size):
+    file.write(json.dumps(dict(section=section)) + '\n')
+    count = 0
+    for row in rows.iterator(chunk_size=chunk_size):
+        file.write(json.dumps(row, default=to_json) + '\n')
+        count += 1
+    return count
+
+
+def _has_datetime_updated(model):
+    return any(field.name == 'datetime_updated' for field in model._meta.concrete_fields)
+
+
+def restore_backups(backup_dir, until=None, batch_size=1000):
+    # Restore the newest base in backup_dir, and the deltas after it (up to and including the file until, if given),
+    # e.g., into a new, migrated database.  Returns [(file name, {section: count}), ...].
+    backups = read_manifest(backup_dir)['backups']
+    if until is not None:
+        names = [entry['file'] for entry in backups]
+        if until not in names:
+            raise ValueError(f'Not in the manifest: [{until}]')
+        backups = backups[:names.index(until) + 1]
+    bases = [num for num, entry in enumerate(backups) if entry['type'] == 'base']
+    if not bases:
+        raise ValueError(f'No base backup in [{backup_dir}]')
+    results = []
+    for entry in backups[bases[-1]:]:
+        with open_archive(os.path.join(backup_dir, entry['file']), mode='rt') as file:
+            results.append((entry['file'], apply_backup(file=file, batch_size=batch_size)))
+    _reset_sequences()
+    # The derived tables aren't in the backups
+    for search in (QUESTION_SEARCH, ANSWER_SEARCH, ATTEMPT_SEARCH):
+        if search.is_supported():
+            search.rebuild()
+    rebuild_duplicate_index()
+    return results
+
+
+@transaction.atomic
+def apply_backup(file, batch_size=1000):
+    # Apply one backup file: upsert its rows, and delete its tombstoned rows.  Returns {section: count}.
+    header = json.loads(file.readline() or '{}')
+    if header.get('format') != BACKUP_FORMAT_VERSION:
+        raise ValueError(f"Unsupported backup format: [{header.get('format')}]")
+    counts = defaultdict(int)
+    section = None
+    batch = []
+    for line_num, line in enumerate(file, start=2):
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if 'section' in row:
+            _apply_rows(section=section, rows=batch, counts=counts)
+            batch = []
+            section = row['section']
+            if section not in MODELS_BY_TABLE and section != SECTION_DELETED:
+                raise ValueError(f'Line [{line_num}]: unknown section: [{section}]')
+            continue
+        if section is None:
+            raise ValueError(f'Line [{line_num}]: row before the first section')
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _apply_rows(section=section, rows=batch, counts=counts)
+            batch = []
+    _apply_rows(section=section, rows=batch, counts=counts)
+    return dict(counts)
+
+
+def _apply_rows(section, rows, counts):
+    if not rows:
+        return
+    counts[section] += len(rows)
+    if section == SECTION_DELETED:
+        ids_by_table = defaultdict(list)
+        for row in rows:
+            ids_by_table[row['table']].append(row['row_id'])
+        for table, ids in ids_by_table.items():
+            if table in MODELS_BY_TABLE:
+                MODELS_BY_TABLE[table].objects.filter(pk__in=ids).delete()
+        return
+    _upsert(model=MODELS_BY_TABLE[section], rows=rows)
+
+
+def _upsert(model, rows):
+    # Insert the rows with their ids and timestamps, or update the rows that already have those ids: one INSERT ... ON
+    # CONFLICT DO UPDATE per row, with executemany().  Not bulk_create(update_conflicts=True): it sets the timestamps to
+    # now (auto_now, auto_now_add) before inserting, and a partitioned table's conflict target has to be its primary
+    # key, (id, datetime_added) (see questions.partitions), so datetime_added has to be the row's own.  (A row's
+    # datetime_added doesn't change once it's committed, so (id, datetime_added) finds the same row as id does.)
+    fields = model._meta.concrete_fields
+    quote_name = connection.ops.quote_name
+    table = model._meta.db_table
+    unique_columns = ['id', 'datetime_added'] if is_partitioned(table=table) else [model._meta.pk.column]
+    columns = [field.column for field in fields]
+    sql = (
+        f'INSERT INTO {quote_name(table)} ({", ".join(quote_name(column) for column in columns)}) '
+        f'VALUES ({", ".join(["%s"] * len(columns))}) '
+        f'ON CONFLICT ({", ".join(quote_name(column) for column in unique_columns)}) DO UPDATE SET '
+        + ', '.join(f'{quote_name(column)} = EXCLUDED.{quote_name(column)}' for column in columns if column not in unique_columns))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(field.to_python(row.get(field.attname)), connection=connection) for field in fields]
+            for row in rows])
+
+
+def _reset_sequences():
+    # The rows were inserted with their ids, so move the id sequences past them (as loaddata does), for postgres
+    statements = connection.ops.sequence_reset_sql(no_style(), BACKUP_MODELS)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
@@ -0,0 +1,38 @@
+from django.db.models import BigIntegerField, Func
+
+'''
+Database functions (query expressions) for date arithmetic that Django has no portable function for.
+'''
+
+
+class SecondsBetween(Func):
+    # The number of whole seconds from start to end (two DateTimeField expressions), computed by the db, e.g.,
+    #   Schedule.objects.update(interval_secs=SecondsBetween('date_show_next', 'datetime_added'))
+    # (Django's Extract('epoch') of a DurationField only works on Postgres.)
+    arity = 2
+    output_field = BigIntegerField()
+
+    def __init__(self, end, start, **extra):
+        super().__init__(end, start, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # Postgres
+        return super().as_sql(
+            compiler, connection, template='CAST(ROUND(EXTRACT(EPOCH FROM (%(expressions)s))) AS BIGINT)',
+            arg_joiner=' - ', **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # julianday() is in days, with sub-second precision (unixepoch() needs sqlite 3.38+)
+        clone = self.copy()
+        clone.set_source_expressions([
+            Func(expression, function='julianday') for expression in self.get_source_expressions()])
+        return super(SecondsBetween, clone).as_sql(
+            compiler, connection, template='CAST(ROUND((%(expressions)s) * 86400) AS INTEGER)',
+            arg_joiner=' - ', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        # TIMESTAMPDIFF(unit, start, end)
+        clone = self.copy()
+        clone.set_source_expressions(self.get_source_expressions()[::-1])
+        return super(SecondsBetween, clone).as_sql(
+            compiler, connection, template='TIMESTAMPDIFF(SECOND, %(expressions)s)', **extra_context)
@@ -0,0 +1,147 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+'''
+Send read-only work (the scheduler, the tag hierarchy, the tag list, and the admin changelists) to a read replica,
+when one is configured (settings.DATABASES[REPLICA_DB_ALIAS]).
+
+Reads only go to the replica inside a "with replica_reads():" block (or a function decorated with @replica_reads()),
+during a request (see ReplicaPinningMiddleware).  Everything else (e.g., management commands), and all writes, use the
+primary (DEFAULT_DB_ALIAS).
+
+Read-your-writes: the replica may not have a write yet, so reads stay on the primary:
+    - for a request that may write (an unsafe method such as POST)
+    - for the rest of a request after it saves a model (e.g., a GET that updates User.last_login)
+    - for settings.DB_REPLICA_PIN_SECONDS after either of those, for later requests in the same session
+'''
+
+REPLICA_DB_ALIAS = 'replica'
+SESSION_KEY_PIN_PRIMARY_UNTIL = 'db_pin_primary_until'  # timestamp until which the session's reads use the primary
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')  # the other methods may write
+
+_replica_reads = ContextVar('replica_reads', default=False)  # True inside replica_reads()
+_pinned_to_primary = ContextVar('pinned_to_primary', default=False)  # True after a write, or for a pinned session
+_wrote = ContextVar('wrote', default=False)  # True after a model is saved in this request
+_in_request = ContextVar('in_request', default=False)  # True while ReplicaPinningMiddleware is handling a request
+
+
+@contextmanager
+def replica_reads():
+    '''
+    Within this block (or decorated function), reads go to the replica, unless pinned to the primary.
+    '''
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def pin_to_primary():
+    '''
+    Send reads to the primary for the rest of this request.
+    '''
+    _pinned_to_primary.set(True)
+
+
+def is_pinned_to_primary():
+    return _pinned_to_primary.get()
+
+
+def _is_replica_configured():
+    return REPLICA_DB_ALIAS in connections.settings
+
+
+@receiver(post_save)
+def _pin_to_primary_after_write(sender, **kwargs):
+    # The replica may not have this write yet, so read from the primary from now on.
+    # (Deletes aren't handled here, because a post_delete receiver for all models would stop Django from doing
+    # fast deletes.  Deletes are done by unsafe requests, e.g., POSTs, which are already pinned.)
+    _wrote.set(True)
+    pin_to_primary()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not (_replica_reads.get() and _in_request.get() and _is_replica_configured()):
+            return DEFAULT_DB_ALIAS
+        if _pinned_to_primary.get():
+            return DEFAULT_DB_ALIAS
+        # Reads in a transaction on the primary must see the transaction's changes (e.g., in tests)
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, so objects from either can be related
+        return True
+
+
+class ReplicaPinningMiddleware:
+    '''
+    Read-your-writes for a session: a request that may write (an unsafe method such as POST), or that did write,
+    pins the session's reads to the primary for the next settings.DB_REPLICA_PIN_SECONDS.
+    Must come after SessionMiddleware.  Sync and async capable, so that an async view (e.g., view_question_async)
+    isn't run in a thread under ASGI.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+        tokens = self._start(request=request, pin_primary_until=request.session.get(SESSION_KEY_PIN_PRIMARY_UNTIL, 0))
+        try:
+            response = self.get_response(request)
+            if self._should_pin(request):
+                request.session[SESSION_KEY_PIN_PRIMARY_UNTIL] = timezone.now().timestamp() + settings.DB_REPLICA_PIN_SECONDS
+        finally:
+            self._finish(tokens)
+        return response
+
+    async def __acall__(self, request):
+        tokens = self._start(
+            request=request, pin_primary_until=await request.session.aget(SESSION_KEY_PIN_PRIMARY_UNTIL, 0))
+        try:
+            response = await self.get_response(request)
+            if self._should_pin(request):
+                await request.session.aset(
+                    SESSION_KEY_PIN_PRIMARY_UNTIL, timezone.now().timestamp() + settings.DB_REPLICA_PIN_SECONDS)
+        finally:
+            self._finish(tokens)
+        return response
+
+    def _start(self, request, pin_primary_until):
+        is_unsafe = request.method not in SAFE_METHODS
+        is_session_pinned = timezone.now().timestamp() < pin_primary_until
+        # Always set these (rather than relying on the defaults), since a thread's context is reused across requests
+        return (
+            _pinned_to_primary.set(is_unsafe or is_session_pinned),
+            _wrote.set(False),
+            _in_request.set(True),
+        )
+
+    def _should_pin(self, request):
+        return request.method not in SAFE_METHODS or _wrote.get()
+
+    def _finish(self, tokens):
+        token_pinned, token_wrote, token_in_request = tokens
+        _pinned_to_primary.reset(token_pinned)
+        _wrote.reset(token_wrote)
+        _in_request.reset(token_in_request)
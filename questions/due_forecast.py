@@ -0,0 +1,164 @@
+import datetime
+
+from django.core.cache import cache
+from django.db.models import Count, DateTimeField, F, Q, Value
+from django.db.models.functions import Greatest, Trunc
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from questions.db_router import replica_reads
+from questions.get_next_question import QuestionSelection
+from questions.models import Schedule
+
+'''
+A forecast of how many cards come due in each hour, day, or week of the next N days, for a tag selection.
+
+The buckets are counted with a single GROUP BY over each question's newest Schedule.date_show_next (the same
+"newest schedule" as NextQuestion uses to pick due questions), truncated to the bucket with Trunc() (date_trunc()
+on Postgres; a strftime()-style function on sqlite).
+
+Forecasts are cached per (user, tag selection, ...) until the user's next Schedule write, or until the first bucket
+is over.  After an answer, the forecast of the answer's tag selection is computed again by a background job (see
+enqueue_due_forecast_refresh()), so that the forecast view doesn't wait for it.  Note that with multiple server processes, settings.CACHES needs a cache that is shared by the processes
+(e.g., memcached or redis), so that a Schedule write in one process invalidates the forecasts cached by the others.
+'''
+
+BUCKET_HOUR = 'hour'
+BUCKET_DAY = 'day'
+BUCKET_WEEK = 'week'
+BUCKETS = (BUCKET_HOUR, BUCKET_DAY, BUCKET_WEEK)
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 366
+REFRESH_DELAY = timezone.timedelta(seconds=30)  # see enqueue_due_forecast_refresh()
+
+
+def _get_cache_key_generation(user_id):
+    return f'due_forecast:generation:{user_id}'
+
+
+def invalidate_due_forecasts(user_id):
+    # Start a new cache generation for the user, so that the forecasts cached for the previous one aren't used.
+    # Called on each Schedule save/delete; call it after changing Schedule's without them (e.g., QuerySet.update()).
+    cache.set(_get_cache_key_generation(user_id), timezone.now().timestamp(), timeout=None)
+
+
+def enqueue_due_forecast_refresh(user_id, tag_ids_selected, search_text=None):
+    # Compute the (default) forecast for the tag selection again in a background job (see questions.jobs), after
+    # REFRESH_DELAY, so that the next request for it is served from the cache.  The answers in the meantime are
+    # coalesced into the one pending job.
+    from questions.jobs import enqueue
+    tag_ids_str = ','.join(str(id_) for id_ in sorted(tag_ids_selected))
+    enqueue(
+        'refresh_due_forecast', priority=-1, delay=REFRESH_DELAY,
+        coalesce_key=f'refresh_due_forecast:{user_id}:{tag_ids_str}:{search_text or ""}',
+        user_id=user_id, tag_ids_selected=sorted(tag_ids_selected), search_text=search_text or None)
+
+
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Schedule)
+def _invalidate_due_forecasts(sender, instance, **kwargs):
+    invalidate_due_forecasts(user_id=instance.user_id)
+
+
+class DueForecast(QuestionSelection):
+    def __init__(self, user, tag_ids_selected, bucket=BUCKET_DAY, days=DEFAULT_DAYS, search_text=None):
+        # bucket: one of BUCKETS
+        # days: how many days ahead to forecast, from the start of the current bucket
+        if bucket not in BUCKETS:
+            raise ValueError(f'Invalid bucket: [{bucket}]')
+        if not 1 <= days <= MAX_DAYS:
+            raise ValueError(f'Invalid days: [{days}]')
+        self._bucket = bucket
+        self._days = days
+
+        self.bucket_starts = []  # the start of each bucket (in the current time zone), e.g., each midnight for BUCKET_DAY
+        self.counts = []  # the number of questions that come due in each bucket, e.g., self.counts[0] for self.bucket_starts[0]
+        self.count_overdue = None  # the number of questions that were due before the first bucket
+
+        self._get_bucket_starts()
+        super().__init__(tag_ids_selected=tag_ids_selected, user=user, search_text=search_text)
+        self._get_forecast()
+
+    def as_dict(self):
+        return dict(
+            bucket=self._bucket,
+            days=self._days,
+            count_overdue=self.count_overdue,
+            buckets=[
+                dict(start=bucket_start.isoformat(), count=count)
+                for bucket_start, count in zip(self.bucket_starts, self.counts)
+            ],
+        )
+
+    def _get_bucket_starts(self):
+        # Side effects: set the following attributes:
+        #   self.bucket_starts
+        #   self._datetime_end  # the end of the last bucket
+        now = timezone.localtime()
+        start = now.replace(minute=0, second=0, microsecond=0)
+        if self._bucket in (BUCKET_DAY, BUCKET_WEEK):
+            start = start.replace(hour=0)
+        if self._bucket == BUCKET_WEEK:
+            # Weeks start on Monday, like Trunc('week')
+            start -= timezone.timedelta(days=start.weekday())
+        self._datetime_end = start + timezone.timedelta(days=self._days)
+        bucket_start = start
+        while bucket_start < self._datetime_end:
+            self.bucket_starts.append(bucket_start)
+            bucket_start = self._get_next_bucket_start(bucket_start=bucket_start)
+
+    def _get_next_bucket_start(self, bucket_start):
+        if self._bucket == BUCKET_HOUR:
+            # Add an hour of elapsed time (in UTC), since an hour of wall-clock time may not exist across a DST change
+            return timezone.localtime(bucket_start.astimezone(datetime.timezone.utc) + timezone.timedelta(hours=1))
+        # Add a day or week of wall-clock time (datetime arithmetic in the local time zone), so that the buckets
+        # stay at midnight across DST changes
+        step = timezone.timedelta(days=1) if self._bucket == BUCKET_DAY else timezone.timedelta(weeks=1)
+        return timezone.localtime(bucket_start + step)
+
+    def _get_cache_key(self):
+        generation = cache.get(_get_cache_key_generation(self._user.id), 0)
+        return ':'.join(str(part) for part in (
+            'due_forecast', self._user.id, generation, ','.join(str(id_) for id_ in sorted(self._tag_ids_selected)),
+            self._search_text or '', self._bucket, self._days, self.bucket_starts[0].isoformat()))
+
+    @replica_reads()
+    def _get_forecast(self):
+        # Side effects: set the following attributes:
+        #   self.counts
+        #   self.count_overdue
+        cache_key = self._get_cache_key()
+        cached = cache.get(cache_key)
+        if cached is None:
+            cached = self._count_buckets()
+            # Also expire it when the first bucket is over, since the buckets move then
+            first_bucket_end = self._get_next_bucket_start(bucket_start=self.bucket_starts[0])
+            timeout = max(1, (first_bucket_end - timezone.now()).total_seconds())
+            cache.set(cache_key, cached, timeout=timeout)
+        self.count_overdue, counts_by_bucket_start = cached
+        self.counts = [counts_by_bucket_start.get(bucket_start, 0) for bucket_start in self.bucket_starts]
+
+    def _count_buckets(self):
+        # Return (count_overdue, {bucket_start: count, ...}) from one GROUP BY query.
+        # Questions that are overdue are grouped with the first bucket (Greatest()), and counted separately (filter=).
+        first_bucket_start = self.bucket_starts[0]
+        rows = (self._get_scheduled_questions()
+                .filter(last_schedule_date_show_next__lt=self._datetime_end)
+                .annotate(bucket_start=Trunc(
+                    Greatest(F('last_schedule_date_show_next'), Value(first_bucket_start, output_field=DateTimeField())),
+                    self._bucket,
+                    output_field=DateTimeField()))
+                .order_by()
+                .values('bucket_start')
+                .annotate(
+                    count=Count('id'),
+                    count_overdue=Count('id', filter=Q(last_schedule_date_show_next__lt=first_bucket_start))))
+
+        count_overdue = 0
+        counts_by_bucket_start = {}
+        for row in rows:
+            count_overdue += row['count_overdue']
+            counts_by_bucket_start[timezone.localtime(row['bucket_start'])] = row['count'] - row['count_overdue']
+        return count_overdue, counts_by_bucket_start
@@ -0,0 +1,217 @@
+import hashlib
+import random
+import re
+
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from questions.models import Answer, Question, QuestionLSHBucket
+
+'''
+Finding duplicate and near-duplicate questions (comparing each question's text with its answer's text).
+
+    - Exact duplicates: Question.content_hash is a hash of the normalized text (lowercase words, without punctuation
+      or extra whitespace), so a user's exact duplicates are one indexed lookup (see the importer's --skip-duplicates).
+    - Near duplicates: each question's text is split into shingles (each run of SHINGLE_WORDS words), and summarized
+      by a MinHash signature (NUM_PERMUTATIONS minimum hashes, whose fraction of matching values estimates the
+      Jaccard similarity of the shingles).  The signature is split into NUM_BANDS bands, and each band is hashed into
+      a bucket (QuestionLSHBucket).  Questions that share a bucket in any band are candidates, and each pair in a
+      bucket is compared (by their shingles' Jaccard similarity), except pairs already in the same cluster.  A bucket
+      of more than MAX_BUCKET_ALL_PAIRS questions (rare, e.g., many short questions with the same words) is compared
+      with the bucket's "anchors": each question is compared with the anchors until one is similar, and a question
+      similar to none of them becomes an anchor.  Buckets are small, so finding the clusters takes near-linear time,
+      instead of comparing every pair of questions.
+With 8 bands of 4 rows, pairs with a similarity of 0.8 are candidates with a probability of 97%, and pairs with a
+similarity of 0.3 with a probability of 6%.
+
+The content_hash is set on save (see Question.save(), and the Answer receiver below), since it's one hash of text that's
+already loaded.  The buckets are maintained by background jobs, enqueued on save, so a save doesn't wait for the MinHash
+and the buckets' delete and inserts; run "./manage.py run_worker".  bulk_create() and QuerySet.update() don't call
+save() or send post_save, so after using them, call update_duplicate_index() for the question ids, or run
+"./manage.py find_duplicates --rebuild".
+'''
+
+SHINGLE_WORDS = 3
+NUM_BANDS = 8
+ROWS_PER_BAND = 4
+NUM_PERMUTATIONS = NUM_BANDS * ROWS_PER_BAND
+DEFAULT_THRESHOLD = 0.5  # the minimum Jaccard similarity of near duplicates
+MAX_BUCKET_ALL_PAIRS = 50  # compare every pair of questions in buckets of up to this many questions
+
+# The "permutations" of the MinHash are the hash functions (a * x + b) mod a prime, with fixed a and b, so that the
+# signatures don't change between runs
+_PRIME = (1 << 61) - 1
+_random = random.Random(20261019)
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+
+def get_words(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def get_content_hash(question, answer):
+    # The hash of the normalized text of a question and its answer (answer may be None)
+    text = ' '.join(get_words(question)) + '\n' + ' '.join(get_words(answer))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def get_shingles(question, answer):
+    words = get_words(question) + get_words(answer)
+    if len(words) <= SHINGLE_WORDS:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[num:num + SHINGLE_WORDS]) for num in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def get_minhash(shingles):
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big') for shingle in shingles]
+    return [min((a * x + b) % _PRIME for x in hashes) for a, b in _PERMUTATIONS]
+
+
+def get_lsh_buckets(minhash):
+    # Return the bucket of each band of the signature (a signed 64-bit int, for a BigIntegerField)
+    return [
+        int.from_bytes(
+            hashlib.blake2b(repr(minhash[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]).encode(), digest_size=8).digest(),
+            'big', signed=True)
+        for band in range(NUM_BANDS)
+    ]
+
+
+def get_jaccard(shingles_1, shingles_2):
+    if not shingles_1 or not shingles_2:
+        return 0.0
+    return len(shingles_1 & shingles_2) / len(shingles_1 | shingles_2)
+
+
+def update_duplicate_index(question_ids, using='default'):
+    # (Re)compute the LSH buckets of the questions, and their content_hash (which is normally set on save already, but
+    # not after bulk_create() or QuerySet.update())
+    if not question_ids:
+        return
+    with transaction.atomic(using=using):
+        _update_duplicate_index(question_ids=question_ids, using=using)
+
+
+def _update_duplicate_index(question_ids, using):
+    rows = list(Question.objects.using(using).filter(id__in=question_ids)
+                .values_list('id', 'user_id', 'question', 'answer__answer', 'content_hash'))
+    content_hashes = {}
+    buckets = []
+    for question_id, user_id, question, answer, content_hash in rows:
+        content_hash_new = get_content_hash(question=question, answer=answer)
+        if content_hash_new != content_hash:
+            content_hashes[question_id] = content_hash_new
+        shingles = get_shingles(question=question, answer=answer)
+        if shingles:
+            buckets += [
+                (question_id, user_id, band, bucket)
+                for band, bucket in enumerate(get_lsh_buckets(get_minhash(shingles)))]
+    # The rows are written with executemany(), rather than a save() per row (which would send post_save again), or
+    # bulk_update()'s CASE per row, or bulk_create()'s compiling of a model instance per row (8 per question)
+    QuestionLSHBucket.objects.using(using).filter(question_id__in=question_ids).delete()
+    with connections[using].cursor() as cursor:
+        if content_hashes:
+            cursor.executemany(
+                f'UPDATE {Question._meta.db_table} SET content_hash = %s WHERE id = %s',
+                [(content_hash, question_id) for question_id, content_hash in content_hashes.items()])
+        cursor.executemany(
+            f'INSERT INTO {QuestionLSHBucket._meta.db_table} (question_id, user_id, band, bucket) VALUES (%s, %s, %s, %s)',
+            buckets)
+
+
+def rebuild_duplicate_index(batch_size=1000, using='default'):
+    # Recompute the index for all the questions.  Returns the number of questions.
+    ids = list(Question.objects.using(using).order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        update_duplicate_index(question_ids=ids[start:start + batch_size], using=using)
+    return len(ids)
+
+
+def find_duplicate_clusters(user, threshold=DEFAULT_THRESHOLD, using='default'):
+    # Return the user's clusters of duplicate questions: [[question id, ...], ...], the largest clusters first.
+    # The questions in a cluster are connected by pairs with a Jaccard similarity of at least threshold.
+    same_bucket = QuestionLSHBucket.objects.using(using).filter(
+        user=user, band=OuterRef('band'), bucket=OuterRef('bucket')).exclude(question_id=OuterRef('question_id'))
+    rows = (QuestionLSHBucket.objects.using(using)
+            .filter(Exists(same_bucket), user=user)
+            .order_by('band', 'bucket', 'question_id')
+            .values_list('band', 'bucket', 'question_id'))
+    # The question ids of each shared bucket
+    buckets = {}
+    for band, bucket, question_id in rows:
+        buckets.setdefault((band, bucket), []).append(question_id)
+    if not buckets:
+        return []
+
+    candidate_ids = {question_id for question_ids in buckets.values() for question_id in question_ids}
+    shingles = {
+        question_id: get_shingles(question=question, answer=answer)
+        for question_id, question, answer in Question.objects.using(using).filter(id__in=candidate_ids)
+        .values_list('id', 'question', 'answer__answer')
+    }
+    # Union-find of the pairs that are similar enough
+    parents = {}
+    pairs_dissimilar = set()  # the pairs compared already (e.g., in another band) that aren't similar enough
+
+    def find(question_id):
+        while parents.get(question_id, question_id) != question_id:
+            question_id = parents[question_id]
+        return question_id
+
+    def is_similar(question_id_1, question_id_2):
+        # Return True if the questions are in the same cluster, comparing them (and joining their clusters) if needed
+        root_1, root_2 = find(question_id_1), find(question_id_2)
+        if root_1 == root_2:
+            return True
+        pair = (min(question_id_1, question_id_2), max(question_id_1, question_id_2))
+        if pair in pairs_dissimilar:
+            return False
+        if get_jaccard(shingles.get(question_id_1), shingles.get(question_id_2)) < threshold:
+            pairs_dissimilar.add(pair)
+            return False
+        parents[max(root_1, root_2)] = min(root_1, root_2)
+        return True
+
+    for question_ids in buckets.values():
+        if len(question_ids) <= MAX_BUCKET_ALL_PAIRS:
+            for num, question_id_1 in enumerate(question_ids):
+                for question_id_2 in question_ids[num + 1:]:
+                    is_similar(question_id_1, question_id_2)
+        else:
+            anchor_ids = []
+            for question_id in question_ids:
+                if not any(is_similar(anchor_id, question_id) for anchor_id in anchor_ids):
+                    anchor_ids.append(question_id)
+    clusters = {}
+    for question_id in parents:
+        clusters.setdefault(find(question_id), set()).add(question_id)
+    for root, cluster in clusters.items():
+        cluster.add(root)
+    return sorted((sorted(cluster) for cluster in clusters.values()), key=lambda cluster: (-len(cluster), cluster[0]))
+
+
+def enqueue_duplicate_index_updates(question_ids):
+    # Update the questions' index in a background job (see questions.jobs), one pending job per question
+    from questions.jobs import enqueue
+    for question_id in question_ids:
+        enqueue('update_duplicate_index', coalesce_key=f'update_duplicate_index:{question_id}', question_ids=[question_id])
+
+
+@receiver(post_save, sender=Question)
+def _update_question_duplicate_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        enqueue_duplicate_index_updates(question_ids=[instance.id])
+
+
+@receiver(post_save, sender=Answer)
+def _update_answer_duplicate_index(sender, instance, raw=False, **kwargs):
+    # The answer text is part of each of its questions' text
+    if not raw:
+        rows = list(instance.question_set.values_list('id', 'question', 'content_hash'))
+        for question_id, question, content_hash in rows:
+            content_hash_new = get_content_hash(question=question, answer=instance.answer)
+            if content_hash_new != content_hash:
+                Question.objects.filter(id=question_id).update(content_hash=content_hash_new)
+        enqueue_duplicate_index_updates(question_ids=[question_id for question_id, _, _ in rows])
@@ -16,6 +16,7 @@ QUERY_REINFORCE_THEN_UNSEEN = 'REINFORCE, UNSEEN'
 QUERY_REINFORCE_THEN_UNSEEN_THEN_FUTURE = 'REINFORCE, UNSEEN, FUTURE'
 QUERY_UNSEEN_THEN_OLDEST_DUE = 'UNSEEN, OLDEST DUE'
 QUERY_UNSEEN_THEN_OLDEST_DUE_THEN_FUTURE = 'UNSEEN, OLDEST DUE, FUTURE'
+QUERY_RANDOM_IN_DUE_WINDOW = 'RANDOM IN DUE WINDOW'
 
 QUERY_CHOICES = (
     (QUERY_UNSEEN, f'{QUERY_UNSEEN}: ordered by date created ascending'),
@@ -26,6 +27,7 @@ QUERY_CHOICES = (
     (QUERY_OLDEST_DUE_OR_UNSEEN_BY_TAG, f'{QUERY_OLDEST_DUE_OR_UNSEEN_BY_TAG}: For each question, look at Schedule.datetime_added, or if no Schedules (unseen), then the Question.datetime_added.'),  # This is by oldest viewed tag.  Could also be called QUERYY_OLDEST_DUE_OR_UNSEEN_BY_OLDEST_VIEWED_TAG, but I chose to shorten it.
     (QUERY_UNSEEN_BY_OLDEST_VIEWED_TAG, f'{QUERY_UNSEEN_BY_OLDEST_VIEWED_TAG}: "oldest-viewed tag" is the tag with the oldest Schedule.datetime_added.  Or, if no Schedules, then the oldest Question.datetime_added.'),
     (QUERY_UNSEEN_THEN_OLDEST_DUE, f'{QUERY_UNSEEN_THEN_OLDEST_DUE}: UNSEEN, then DUE'),
+    (QUERY_RANDOM_IN_DUE_WINDOW, f'{QUERY_RANDOM_IN_DUE_WINDOW}: a random note from those due within 1 day after the oldest due date'),
 )
 
 ALL_QUERY_NAMES = (
@@ -41,7 +43,8 @@ ALL_QUERY_NAMES = (
     QUERY_REINFORCE_THEN_UNSEEN,
     QUERY_REINFORCE_THEN_UNSEEN_THEN_FUTURE,
     QUERY_UNSEEN_THEN_OLDEST_DUE,
-    QUERY_UNSEEN_THEN_OLDEST_DUE_THEN_FUTURE
+    QUERY_UNSEEN_THEN_OLDEST_DUE_THEN_FUTURE,
+    QUERY_RANDOM_IN_DUE_WINDOW,
 )
 
 class PagedownWidgetAligned(PagedownWidget):
@@ -59,6 +62,9 @@ class FormFlashcard(forms.Form):
     )
     hidden_query_name = forms.CharField(widget=forms.HiddenInput())
     hidden_question_id = forms.IntegerField(widget=forms.HiddenInput())
+    hidden_search_text = forms.CharField(widget=forms.HiddenInput(), required=False)
+    hidden_study_session_id = forms.IntegerField(widget=forms.HiddenInput(), required=False)
+    hidden_study_session_tag_id = forms.IntegerField(widget=forms.HiddenInput(), required=False)
     hidden_tag_ids_selected = forms.CharField(widget=forms.HiddenInput())
 
     percent_correct = forms.DecimalField(
@@ -84,4 +90,15 @@ class FormSelectTags(forms.Form):
     query_name = forms.ChoiceField(
         choices=QUERY_CHOICES,
         required=True
-    )
\ No newline at end of file
+    )
+    # Only show questions whose question or answer text contains all of these words
+    search_text = forms.CharField(
+        label='Matching text',
+        required=False
+    )
+    # If given, a study session goes through the selected tags one at a time, this many cards from each (see StudySession)
+    cards_per_tag = forms.IntegerField(
+        label='Cards per tag',
+        min_value=1,
+        required=False
+    )
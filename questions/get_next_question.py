@@ -1,47 +1,190 @@
-from django.db.models import Case, F, OuterRef, Q, Subquery, When
+import asyncio
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from django.db import connection, connections
+from django.db.models import Case, Count, Exists, F, OuterRef, Q, Subquery, When
 from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 
-from questions.forms import QUERY_OLDEST_DUE, QUERY_FUTURE, QUERY_REINFORCE, QUERY_UNSEEN, QUERY_OLDEST_DUE_OR_UNSEEN, QUERY_OLDEST_DUE_OR_UNSEEN_BY_TAG, QUERY_UNSEEN_BY_OLDEST_VIEWED_TAG, QUERY_UNSEEN_THEN_OLDEST_DUE
+from questions.forms import QUERY_OLDEST_DUE, QUERY_FUTURE, QUERY_REINFORCE, QUERY_UNSEEN, QUERY_OLDEST_DUE_OR_UNSEEN, QUERY_OLDEST_DUE_OR_UNSEEN_BY_TAG, QUERY_UNSEEN_BY_OLDEST_VIEWED_TAG, QUERY_UNSEEN_THEN_OLDEST_DUE, QUERY_RANDOM_IN_DUE_WINDOW
+from questions.db_router import replica_reads
 from questions.get_tag_hierarchy import expand_all_tag_ids, get_tag_hierarchy
-from questions.models import Question, Schedule, Tag
+from questions.metrics import NEXT_QUESTION_SECONDS
+from questions.models import ArchivedHistory, Question, QuestionTag, Schedule, Tag
+from questions.search import QUESTION_SEARCH
 from questions.VerifyTagIds import VerifyTagIds
 
-class NextQuestion:
-    def __init__(self, query_name, tag_ids_selected, user):
-        self._query_name = query_name
+# The Schedule fields that _annotate_last_schedule() adds to the picked question (as "last_schedule_<field>")
+LAST_SCHEDULE_FIELDS = ('id', 'datetime_added', 'date_show_next', 'interval_num', 'interval_unit')
+
+# QUERY_RANDOM_IN_DUE_WINDOW picks a random question from those due within this long after the oldest due date
+RANDOM_DUE_WINDOW = timezone.timedelta(days=1)
+RANDOM_DUE_CANDIDATES = 10  # the number of questions that QUERY_RANDOM_IN_DUE_WINDOW picks one of, at its probe
+
+def _can_query_concurrently():
+    # Return True if queries can run concurrently on other db connections and see the same data as this connection.
+    # They can't if this connection is in a transaction (other connections can't see its uncommitted changes, e.g., in tests),
+    # or if the db is an in-memory sqlite db (each connection has its own db).  They don't unless the connections are
+    # pooled (QM_DB_POOL): otherwise each concurrent query would open a connection of its own (and close it, see
+    # _run_in_own_connection()), and the connects would cost more than the overlapping round trips save.
+    if not connection.settings_dict.get('OPTIONS', {}).get('pool'):
+        return False
+    if connection.in_atomic_block:
+        return False
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        return False
+    return True
+
+def _run_in_own_connection(func):
+    # Return a function that calls func and then closes its thread's db connections (or returns them to the pool).
+    # These threads (thread_sensitive=False) are from the event loop's executor, not a request, so Django never closes
+    # their connections; with persistent connections (CONN_MAX_AGE) each executor thread would keep one open for good.
+    def wrapper():
+        try:
+            func()
+        finally:
+            connections.close_all()
+    return wrapper
+
+class QuestionSelection:
+    # The user's questions with the selected tags (or their descendants), matching search_text, and the queries over
+    # them.  NextQuestion picks a question from them; DueForecast, BulkReschedule and OfflineDeck use them too.
+    def __init__(self, tag_ids_selected, user, search_text=None):
+        # search_text: if given, only questions whose question or answer text matches all of its words (see questions.search)
+        # Set the following attributes:
+        #   self._search_text
+        #   self._tag_ids_selected
+        #   self._user
+        #   self._tag_hierarchy
+        #   self._tag_ids_selected_expanded
+        #   self._tag_ids_selected_implicit_descendants
+        #   self._queryset__questions_tagged
+        self._search_text = search_text.strip() if search_text else None
         self._tag_ids_selected = tag_ids_selected
         self._user = user
 
         VerifyTagIds(tag_ids=tag_ids_selected, user=user)
-        
+
         self._tag_hierarchy = get_tag_hierarchy(user=user)
         self._tag_ids_selected_expanded = expand_all_tag_ids(hierarchy=self._tag_hierarchy, tag_ids=self._tag_ids_selected)
         self._tag_ids_selected_implicit_descendants = self._tag_ids_selected_expanded - set(self._tag_ids_selected)
-        
+
+        self._queryset__questions_tagged = self._get_queryset_questions_with_tags(tag_ids=self._tag_ids_selected_expanded)
+
+    def _get_queryset_questions_with_tags(self, tag_ids):
+        # Return a queryset of the user's questions that have at least one of tag_ids.
+        # Use an EXISTS semi-join on QuestionTag rather than joining to it, so that a question with multiple
+        # matching tags is only returned once.  This avoids the need for .distinct(), which forces the db to
+        # de-duplicate (Unique/HashAggregate) and sort the whole annotated set before it can apply LIMIT 1.
+        # Only select Question.id: the question text can be many KB, and _load_question() loads the picked question in full.
+        queryset = Question.objects.filter(
+            Exists(QuestionTag.objects.filter(question=OuterRef('pk'), tag__id__in=tag_ids)),
+            user=self._user).only('id')
+        return self._filter_search_text(queryset=queryset)
+
+    def _filter_search_text(self, queryset):
+        # Return queryset filtered to the questions matching self._search_text, if any.
+        # The match uses the full-text search index (an indexed id lookup), rather than scanning the question text.
+        # The search SQL is for the db that the queryset reads from (e.g., the replica; see questions.db_router).
+        if not self._search_text:
+            return queryset
+        return queryset.filter(QUESTION_SEARCH.filter_q(text=self._search_text, using=queryset.db))
+
+    def _filter_seen(self, queryset, seen):
+        # Return queryset filtered to the questions that have at least one Schedule (seen=True) or no Schedules (seen=False).
+        # Like _get_queryset_questions_with_tags(), use an EXISTS semi-join rather than a join to Schedule.
+        exists_schedule = Exists(Schedule.objects.filter(question=OuterRef('pk')))
+        return queryset.filter(exists_schedule if seen else ~exists_schedule)
+
+    def _annotate_last_schedule(self, queryset):
+        # Annotate each question in queryset with the LAST_SCHEDULE_FIELDS of its newest Schedule for self._user,
+        # e.g., last_schedule_date_show_next.  The annotations are None for questions with no Schedules.
+        # This lets the picked question carry its last schedule, so _get_last_schedule_added() doesn't need another query.
+        schedules_for_question = (Schedule.objects
+                     .filter(user=self._user, question=OuterRef('pk'))
+                     .order_by('-datetime_added'))
+        return queryset.annotate(**{
+            f'last_schedule_{field}': Subquery(schedules_for_question.values(field)[:1])
+            for field in LAST_SCHEDULE_FIELDS
+        })
+
+    def _get_scheduled_questions(self):
+        # Return "scheduled_questions": self._queryset__questions_tagged that have at least one schedule,
+        # annotated with their newest schedule (e.g., last_schedule_date_show_next).
+        scheduled_questions = self._filter_seen(queryset=self._queryset__questions_tagged, seen=True)
+
+        # Only use the newest schedule for each question
+        return self._annotate_last_schedule(queryset=scheduled_questions)
+
+class NextQuestion(QuestionSelection):
+    @replica_reads()
+    def __init__(self, query_name, tag_ids_selected, user, get_counts=True, search_text=None, study_session=None):
+        # get_counts=False is used by acreate(), which gets the counts itself, concurrently
+        # search_text: if given, only questions whose question or answer text matches all of its words (see questions.search)
+        # study_session: if given (a StudySession for these tags), pick from the session's current tag only
+        start = time.perf_counter()
+        self._query_name = query_name
+        self._study_session = study_session
+        super().__init__(tag_ids_selected=tag_ids_selected, user=user, search_text=search_text)
+
         self.count_questions_due = None  # questions due (date_show_next < now); does NOT include unseen questions
         self.count_questions_unseen = None  
-        self.count_questions_tagged = None  # questions with at least one tag in self._tag_ids_selected_expanded
+        self.count_questions_tagged = None  # questions with at least one tag in self._tag_ids_selected_expanded (and matching self._search_text)
         self.count_recent_seen_mins_30 = None  # questions seen in the last 30 minutes
         self.count_recent_seen_mins_60 = None  # questions seen in the last 60 minutes
         self.count_times_question_seen = None
+
+        self.last_schedule_added = None  # the newest Schedule for self.question (unsaved copy built from the annotations), or None
         
         self.oldest_viewed_tag = None
         
         self.question = None
 
+        self.study_session_tag_id = None  # the study session's current tag, if there's a study_session
+        self.study_session_tag_name = None  # the name of the study session's current tag, if there's a study_session
+
         self.tag_names_for_question = None  # list of tag names for the question
         self.tag_names_selected = None  # list of tag names for the tags selected for the query
         self.tag_names_selected_implicit_descendants = None  # list of tag names for the tags selected for the query
-        
-        self._queryset__questions_tagged = None
-
-        self._queryset__questions_tagged = Question.objects.filter(
-            user=self._user,
-            questiontag__tag__id__in=self._tag_ids_selected_expanded)
 
         self._get_question()
-        self._get_all_counts()
+        if get_counts:
+            self._get_all_counts()
+            NEXT_QUESTION_SECONDS.observe(time.perf_counter() - start, query_name=query_name)
+
+    @classmethod
+    async def acreate(cls, query_name, tag_ids_selected, user, search_text=None, study_session=None):
+        # Async version of NextQuestion(query_name, tag_ids_selected, user, search_text, study_session).
+        # Pick the question, and then get the counts, which don't depend on each other, concurrently (with pooled
+        # connections, see _can_query_concurrently(); otherwise one after the other).
+        # Each count runs in its own thread with its own db connection, so that the db round trips overlap.
+        start = time.perf_counter()
+        with replica_reads():
+            nq = await sync_to_async(cls)(
+                query_name=query_name, tag_ids_selected=tag_ids_selected, user=user, get_counts=False, search_text=search_text,
+                study_session=study_session)
+            if await sync_to_async(_can_query_concurrently)():
+                await asyncio.gather(*[
+                    sync_to_async(_run_in_own_connection(func), thread_sensitive=False)()
+                    for func in nq._get_count_functions()
+                ])
+            else:
+                await sync_to_async(nq._get_all_counts)()
+        NEXT_QUESTION_SECONDS.observe(time.perf_counter() - start, query_name=query_name)
+        return nq
+
+    def _get_count_functions(self):
+        # Return the functions that set the count attributes.  They are independent of each other, and only depend on
+        # self.question and self._queryset__questions_tagged, so they can run in any order, or concurrently.
+        return [
+            self._get_count_recent_seen,
+            self._get_count_questions_due,
+            self._get_count_questions_unseen,
+            self._get_count_times_question_seen,
+            self._get_count_questions_tagged,
+        ]
 
     def _get_all_counts(self):
         # Returns: None
@@ -53,12 +196,14 @@ class NextQuestion:
         #   self.count_recent_seen_mins_60
         #   self.count_times_question_seen
         
-        self._get_count_recent_seen()
-        self._get_count_questions_due()
-        self._get_count_questions_unseen()
-        self._get_count_times_question_seen()
-        self.count_questions_tagged = self._queryset__questions_tagged.distinct().count()
-        
+        for get_count in self._get_count_functions():
+            get_count()
+
+    def _get_count_questions_tagged(self):
+        # Side effects: set this attribute:
+        #   self.count_questions_tagged
+        self.count_questions_tagged = self._queryset__questions_tagged.count()
+
     def _get_count_questions_due(self):
         # Given self._queryset__questions_tagged,
         # count the number of questions that are scheduled before now (not including unseen questions).
@@ -74,7 +219,7 @@ class NextQuestion:
         self.count_questions_due = self._queryset__questions_tagged.annotate(
             latest_date_show_next=Subquery(subquery_latest_dateshownext_for_question.values('date_show_next')[:1])
         ).filter(Q(latest_date_show_next__lte=timezone.now())
-        ).distinct().count()
+        ).count()
     
     def _get_count_questions_unseen(self):
         # Given self._queryset__questions_tagged,
@@ -82,8 +227,7 @@ class NextQuestion:
         # Returns: None
         # Side effects: set this attribute:
         #   self.count_questions_unseen
-        self.count_questions_unseen = self._queryset__questions_tagged.filter(
-            schedule__isnull=True).distinct().count()
+        self.count_questions_unseen = self._filter_seen(queryset=self._queryset__questions_tagged, seen=False).count()
         
     def _get_count_recent_seen(self):
         # Side effects: set these attributes:
@@ -93,9 +237,13 @@ class NextQuestion:
         thirty_minutes_ago = now - timezone.timedelta(minutes=30)
         sixty_minutes_ago = now - timezone.timedelta(minutes=60)
         
-        schedules = Schedule.objects.filter(user=self._user)
-        self.count_recent_seen_mins_30 = schedules.filter(datetime_added__gte=thirty_minutes_ago).count()
-        self.count_recent_seen_mins_60 = schedules.filter(datetime_added__gte=sixty_minutes_ago).count()
+        # One query, over only the last 60 minutes of schedules (with partitioned history tables, only the newest
+        # partition is read; see questions.partitions)
+        counts = Schedule.objects.filter(user=self._user, datetime_added__gte=sixty_minutes_ago).aggregate(
+            mins_30=Count('id', filter=Q(datetime_added__gte=thirty_minutes_ago)),
+            mins_60=Count('id'))
+        self.count_recent_seen_mins_30 = counts['mins_30']
+        self.count_recent_seen_mins_60 = counts['mins_60']
 
     def _get_count_times_question_seen(self):
         # Get the count of schedules for the question
@@ -103,45 +251,50 @@ class NextQuestion:
         # Side effects: set this attribute:
         #   self.count_times_question_seen
 
+        # Includes the Schedule's archived by "./manage.py archive_history" (ArchivedHistory.count_schedules),
+        # added in the same query.
+
         self.count_times_question_seen = 0
         if self.question:
-            self.count_times_question_seen = Schedule.objects.filter(question=self.question, user=self._user).count()
+            count_schedules = (Schedule.objects
+                               .filter(question=OuterRef('pk'), user=self._user)
+                               .order_by()
+                               .values('question')
+                               .annotate(count=Count('id'))
+                               .values('count'))
+            count_schedules_archived = (ArchivedHistory.objects
+                                        .filter(question=OuterRef('pk'), user=self._user)
+                                        .values('count_schedules'))
+            self.count_times_question_seen = (Question.objects
+                .filter(pk=self.question.pk)
+                .annotate(count_times_seen=(
+                    Coalesce(Subquery(count_schedules), 0) + Coalesce(Subquery(count_schedules_archived), 0)))
+                .values_list('count_times_seen', flat=True)
+                .get())
 
     def _get_next_question_due(self):
         # Find all questions created by user which have one or more of tag_ids_selected.  Of those questions, find the ones that are due, i.e., with the newest schedule with a date_show_next in the past.  Of those, find the question with the oldest Schedule.date_show_next.
         # Side effects: set the following attributes:
         #   self.question
         
-        # Get "scheduled_questions" (tagged_questions that have at least one schedule).
-        scheduled_questions = self._queryset__questions_tagged.filter(schedule__isnull=False)
-        
-        # schedules -- all Schedules for the user for each question, newest first by datetime_added
-        # OuterRef('pk') refers to the question.pk for each question
-        schedules_for_question = (Schedule.objects
-                     .filter(user=self._user, question=OuterRef('pk'))
-                     .order_by('-datetime_added'))
-
-        # Only use the newest schedule for each question
-        scheduled_questions = scheduled_questions.annotate(date_show_next=Subquery(schedules_for_question[:1].values('date_show_next')))
-        scheduled_questions = scheduled_questions.annotate(sched_date_added=Subquery(schedules_for_question[:1].values('datetime_added')))
+        scheduled_questions = self._get_scheduled_questions()
 
         if self._query_name in [QUERY_OLDEST_DUE, QUERY_REINFORCE, QUERY_UNSEEN_THEN_OLDEST_DUE]:
-            subquery_by_date_show_next = Q(date_show_next__lte=timezone.now())
+            subquery_by_date_show_next = Q(last_schedule_date_show_next__lte=timezone.now())
         elif self._query_name == QUERY_FUTURE:
-            subquery_by_date_show_next = Q(date_show_next__gt=timezone.now())
+            subquery_by_date_show_next = Q(last_schedule_date_show_next__gt=timezone.now())
         else:
             raise ValueError(f"Unknown query name for get_next_question_due: [{self._query_name}]")
 
         scheduled_questions = scheduled_questions.filter(subquery_by_date_show_next)
-        scheduled_questions = scheduled_questions.distinct()
 
         if self._query_name == QUERY_REINFORCE:
             # Pick the question with the newest Schedule.date_added
-            scheduled_questions = scheduled_questions.order_by('-sched_date_added')
+            scheduled_questions = scheduled_questions.order_by('-last_schedule_datetime_added')
             self.question = scheduled_questions.first()
         elif self._query_name in [QUERY_OLDEST_DUE, QUERY_FUTURE, QUERY_UNSEEN_THEN_OLDEST_DUE]:
             # Pick the question with the oldest Schedule.date_show_next
-            scheduled_questions = scheduled_questions.order_by('date_show_next')
+            scheduled_questions = scheduled_questions.order_by('last_schedule_date_show_next')
             self.question = scheduled_questions.first()
         else: 
             raise ValueError(f"Unknown query name for get_next_question_due: [{self._query_name}]")
@@ -153,31 +306,26 @@ class NextQuestion:
         #   -or-, if no Schedules for a question (unseen), then:
         #   b) the oldest Question.datetime_added.
 
-        # Get the latest schedule for each question
-        subquery_latest_schedule = Schedule.objects.filter(
-            question=OuterRef('pk'),
-            user=self._user
-        ).order_by('-datetime_added')
-
         if tags and (tags == [None]):
             self.question = None
             return
         elif tags:
-            queryset = Question.objects.filter(questiontag__tag__in=tags, user=self._user)
+            queryset = self._get_queryset_questions_with_tags(tag_ids=[tag.id for tag in tags])
         else:
             queryset = self._queryset__questions_tagged
 
         # Annotate questions with either their latest schedule's date_show_next or their creation date
         # Coalesce() takes the first non-null value from the list of arguments.
-        questions = queryset.annotate(
+        questions = self._annotate_last_schedule(queryset=queryset).annotate(
             due_or_unseen_date=Coalesce(
-                Subquery(subquery_latest_schedule.values('date_show_next')[:1]),  # due date
+                F('last_schedule_date_show_next'),  # due date
                 F('datetime_added')  # date the unseen question was added
             )
-        ).distinct()
+        )
 
         # Order by the oldest due/created date and get the first one
-        self.question = questions.order_by('due_or_unseen_date').first()        
+        self.question = questions.order_by('due_or_unseen_date').first()
+
     def _get_next_question_oldest_due_or_unseen_by_tag(self):
         # Find the tag with the older of the oldest Schedule.date_show_next, or, if no Schedules, then the oldest Question.datetime_added.  For that tag, return the oldest question with those criteria.
         oldest_tag = self._get_oldest_viewed_tag(only_unseen_tags=False)
@@ -189,7 +337,7 @@ class NextQuestion:
         #   self.question
         
         # Filter for unseen questions (no schedules)
-        unseen_questions = self._queryset__questions_tagged.filter(schedule__isnull=True)
+        unseen_questions = self._filter_seen(queryset=self._queryset__questions_tagged, seen=False)
 
         # Get the oldest unseen question based on datetime_added
         oldest_unseen_question = unseen_questions.order_by('datetime_added').first()
@@ -207,22 +355,24 @@ class NextQuestion:
             user=self._user
         ).order_by('-datetime_added').values('datetime_added')[0:1]
 
-        subquery_newest_unseen_question_dateadded_for_tag = Question.objects.filter(
-            questiontag__tag=OuterRef('pk'),
-            user=self._user,
-            schedule__isnull=True
+        subquery_newest_unseen_question_dateadded_for_tag = self._filter_seen(
+            queryset=self._filter_search_text(queryset=Question.objects.filter(
+                questiontag__tag=OuterRef('pk'),
+                user=self._user)),
+            seen=False
         ).order_by('-datetime_added').values('datetime_added')[0:1]
 
-        # Since the filter is joining on the QuestionTag and Question models, tags that have no questions will be excluded,
+        # Only select tags that have at least one of the user's questions (or, if only_unseen_tags, at least one
+        # of the user's unseen questions).  Tags that have no questions will be excluded.
+        # Use EXISTS rather than joining on the QuestionTag and Question models, so that .distinct() isn't needed.
+        tag_questions = self._filter_search_text(
+            queryset=Question.objects.filter(questiontag__tag=OuterRef('pk'), user=self._user))
+        if only_unseen_tags:
+            tag_questions = self._filter_seen(queryset=tag_questions, seen=False)
         oldest_tags = Tag.objects.filter(
-            questiontag__question__user=self._user,
+            Exists(tag_questions),
             id__in=self._tag_ids_selected_expanded
         )
-
-        if only_unseen_tags:
-            oldest_tags = oldest_tags.filter(
-                questiontag__question__schedule__isnull=True  # only select tags with unseen questions
-            )
         
         # In the following query, I initially used Min() instead of Least(), which didn't require the Coalesce() functions.
         # The Min() solution worked in sqlite, but for Postgresql, it cannot take the Min() of two timestamp-with-timezone's:
@@ -244,7 +394,7 @@ class NextQuestion:
                             Coalesce(F('newest_unseen_question_dateadded_for_tag'), timezone.now() - timezone.timedelta(weeks=ONE_THOUSAND_YEARS_IN_WEEKS))
                         )
             ),
-        ).distinct().order_by('last_viewed_date')
+        ).order_by('last_viewed_date')
         
         self.oldest_viewed_tag = oldest_tags.first()
 
@@ -263,13 +413,58 @@ class NextQuestion:
         # Get the oldest unseen question for the oldest tag
         self.question = None
         if oldest_tag:
-            self.question = Question.objects.filter(
-                questiontag__tag=oldest_tag,
-                user=self._user,
-                schedule__isnull=True
+            self.question = self._filter_seen(
+                queryset=self._get_queryset_questions_with_tags(tag_ids=[oldest_tag.id]),
+                seen=False
             ).order_by('datetime_added').first()
         
 
+    def _get_next_question_random_in_due_window(self):
+        # Pick a question at random from the scheduled questions whose due date is within RANDOM_DUE_WINDOW after the
+        # oldest due date (e.g., the oldest is due 1/5 9:00, so pick from those due 1/5 9:00 - 1/6 9:00).
+        # Finding the oldest due date costs the same as QUERY_OLDEST_DUE (a question's due date is its newest
+        # Schedule's, so no index has it).  Then, rather than counting or sorting the window (order_by('?')), probe the
+        # (user, date_show_next) index at a random time in the window for the RANDOM_DUE_CANDIDATES Schedules due last
+        # at or before it that are the newest for their question, and whose question is selected (there's at least the
+        # oldest), and pick one of them uniformly.  So the pick costs an index probe more than QUERY_OLDEST_DUE,
+        # whatever the size of the window.  The candidates are weighted by the time until the next due date in the
+        # window (the newest gets the rest of the window), which matters less the more candidates there are.
+        # Questions due at the same time (e.g., rescheduled together) are equally likely: if the candidates are all
+        # due at the same time, there may be more of them, so they're probed again at a random id (a query more, only
+        # then).
+        # Side effects: set the following attributes:
+        #   self.question
+        self.question = None
+        oldest = self._get_scheduled_questions().order_by('last_schedule_date_show_next').first()
+        if oldest is None or oldest.last_schedule_date_show_next is None:
+            return
+        newer = Schedule.objects.filter(question=OuterRef('question'), user=OuterRef('user')).filter(
+            Q(datetime_added__gt=OuterRef('datetime_added')) |
+            Q(datetime_added=OuterRef('datetime_added'), id__gt=OuterRef('id')))
+        schedules_newest = (Schedule.objects
+                            .filter(user=self._user, date_show_next__gte=oldest.last_schedule_date_show_next)
+                            .filter(~Exists(newer), Exists(self._queryset__questions_tagged.filter(pk=OuterRef('question'))))
+                            .values('question_id', *LAST_SCHEDULE_FIELDS))
+        candidates = list(schedules_newest
+                          .filter(date_show_next__lte=oldest.last_schedule_date_show_next + RANDOM_DUE_WINDOW * random.random())
+                          .order_by('-date_show_next', '-id')[:RANDOM_DUE_CANDIDATES])
+        if len(candidates) == RANDOM_DUE_CANDIDATES and candidates[0]['date_show_next'] == candidates[-1]['date_show_next']:
+            # A tie that may have more questions than the candidates: probe it at a random id, down to its first id
+            tied = schedules_newest.filter(date_show_next=candidates[0]['date_show_next'])
+            id_first = tied.order_by('id').values_list('id', flat=True).first()
+            candidates = list(tied
+                              .filter(id__lte=random.randint(id_first, candidates[0]['id']))
+                              .order_by('-id')[:RANDOM_DUE_CANDIDATES])
+        if not candidates:
+            # The oldest was rescheduled since it was found
+            self.question = oldest
+            return
+        schedule = candidates[random.randrange(len(candidates))]
+        # The picked question, with its newest schedule as the last_schedule_* annotations (see _load_question())
+        self.question = Question(id=schedule['question_id'])
+        for field in LAST_SCHEDULE_FIELDS:
+            setattr(self.question, f'last_schedule_{field}', schedule[field])
+
     def _get_next_question_unseen_then_oldest_due(self):
         self._get_next_question_unseen()
         if not self.question:
@@ -277,6 +472,46 @@ class NextQuestion:
         
 
     def _get_question(self):
+        if self._study_session:
+            self._pick_question_in_study_session()
+        else:
+            self._pick_question()
+        self._load_question()
+        self._get_last_schedule_added()
+        self._get_tag_names()
+
+    def _pick_question_in_study_session(self):
+        # Pick a question (for self._query_name) from the study session's current tag only, rather than from all the
+        # selected tags, dropping the tags that have no question to pick until one does (or the round is over).
+        # The counts are still for all the selected tags.  The tags are only dropped from self._study_session in memory,
+        # not saved, because this runs for GETs (and on a replica); the answer's POST saves them (see
+        # StudySession.record_answer()).
+        # Side effects: set the following attributes:
+        #   self.question
+        #   self.study_session_tag_id
+        #   self.study_session_tag_name
+        queryset_selected = self._queryset__questions_tagged
+        tag_ids_selected_expanded = self._tag_ids_selected_expanded
+        try:
+            for _ in range(len(self._study_session.tag_ids_remaining)):
+                tag_id = self._study_session.get_current_tag_id()
+                if tag_id not in self._tag_hierarchy:
+                    # e.g., the tag was deleted
+                    self._study_session.drop_current_tag()
+                    continue
+                self._tag_ids_selected_expanded = {tag_id}
+                self._queryset__questions_tagged = self._get_queryset_questions_with_tags(tag_ids=[tag_id])
+                self._pick_question()
+                if self.question:
+                    self.study_session_tag_id = tag_id
+                    self.study_session_tag_name = str(self._tag_hierarchy[tag_id]['tag_name'])
+                    return
+                self._study_session.drop_current_tag()
+        finally:
+            self._queryset__questions_tagged = queryset_selected
+            self._tag_ids_selected_expanded = tag_ids_selected_expanded
+
+    def _pick_question(self):
         if self._query_name in [QUERY_OLDEST_DUE, QUERY_FUTURE, QUERY_REINFORCE]:
             self._get_next_question_due()
         elif self._query_name == QUERY_UNSEEN:
@@ -289,26 +524,51 @@ class NextQuestion:
             self._get_next_question_oldest_due_or_unseen()
         elif self._query_name == QUERY_OLDEST_DUE_OR_UNSEEN_BY_TAG:
             self._get_next_question_oldest_due_or_unseen_by_tag()
+        elif self._query_name == QUERY_RANDOM_IN_DUE_WINDOW:
+            self._get_next_question_random_in_due_window()
         else:
             raise ValueError(f'Invalid query_name: [{self._query_name}]')
-        self._get_tag_names()
+
+    def _load_question(self):
+        # The pick queries only select Question.id (plus their annotations), because Question.question and Answer.answer
+        # are markdown text that can be many KB.  Load the one picked question in full, along with its answer, in a single query.
+        # Side effects: replace self.question with the fully-loaded question (keeping the last_schedule_* annotations)
+        if self.question is None:
+            return
+        question_picked = self.question
+        self.question = Question.objects.select_related('answer').get(pk=question_picked.pk)
+        for field in LAST_SCHEDULE_FIELDS:
+            if hasattr(question_picked, f'last_schedule_{field}'):
+                setattr(self.question, f'last_schedule_{field}', getattr(question_picked, f'last_schedule_{field}'))
+
+    def _get_last_schedule_added(self):
+        # Build self.last_schedule_added from the last_schedule_* annotations on self.question, if the pick query added them.
+        # (The unseen queries don't add them, because an unseen question has no Schedules.)
+        # Side effects: set this attribute:
+        #   self.last_schedule_added
+        self.last_schedule_added = None
+        if self.question and getattr(self.question, 'last_schedule_id', None) is not None:
+            self.last_schedule_added = Schedule(
+                question=self.question,
+                user=self._user,
+                **{field: getattr(self.question, f'last_schedule_{field}') for field in LAST_SCHEDULE_FIELDS}
+            )
    
   
     def _get_tag_names(self):
+        # Get the tag names from self._tag_hierarchy (which already has the tag names and each tag's question ids),
+        # rather than querying the db again.
+        def tag_names(tag_ids):
+            return sorted(str(self._tag_hierarchy[tag_id]['tag_name']) for tag_id in tag_ids)
+
         self.tag_names_for_question = []
         if self.question:
-            self.tag_names_for_question = \
-                sorted([
-                    str(
-                        qtag.tag.name
-                    ) for qtag in self.question.questiontag_set.all()
-                ])
-        
-        self.tag_names_selected = [
-            # Note: _tag_ids_selected, not _tag_ids_selected_expanded
-            str(tag.name) for tag in Tag.objects.filter(id__in=self._tag_ids_selected)
-        ]
-        
-        self.tag_names_selected_implicit_descendants = [
-            str(tag.name) for tag in Tag.objects.filter(id__in=self._tag_ids_selected_implicit_descendants)
-        ]
\ No newline at end of file
+            self.tag_names_for_question = tag_names([
+                tag_id for tag_id, tag_info in self._tag_hierarchy.items()
+                if self.question.id in tag_info['question_ids_for_tag']
+            ])
+
+        # Note: _tag_ids_selected, not _tag_ids_selected_expanded
+        self.tag_names_selected = tag_names(self._tag_ids_selected)
+
+        self.tag_names_selected_implicit_descendants = tag_names(self._tag_ids_selected_implicit_descendants)
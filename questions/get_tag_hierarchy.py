@@ -1,5 +1,8 @@
+import time
 from collections import defaultdict
 
+from questions.db_router import replica_reads
+from questions.metrics import TAG_HIERARCHY_SECONDS, TAG_HIERARCHY_TAGS
 from questions.models import QuestionTag, Tag, TagLineage
 
 '''
@@ -21,6 +24,7 @@ The "hierarchy" data structure looks like this:
     }
 '''
 
+@replica_reads()
 def get_tag_hierarchy(user):
     '''
     Return a "hierarchy" dict per the description at the top of this file.
@@ -80,6 +84,7 @@ def get_tag_hierarchy(user):
         else:
             raise ValueError(f'type_=[{type_}] but must be either "ancestors" or "descendants"')
 
+    start = time.perf_counter()
     tags = Tag.objects.filter(user=user)
     tag_lineages = TagLineage.objects.filter(user=user).values('child_tag_id', 'parent_tag_id')
     tag_id_children = defaultdict(set)
@@ -105,12 +110,14 @@ def get_tag_hierarchy(user):
         hierarchy[tag.id]['count_questions_all'] = len(hierarchy[tag.id]['question_ids_for_all'])
         hierarchy[tag.id]['tag_name'] = tag.name
 
+    TAG_HIERARCHY_SECONDS.observe(time.perf_counter() - start)
+    TAG_HIERARCHY_TAGS.observe(len(hierarchy))
     return hierarchy
 
 def get_question_tags(user):
     '''
     Return a dict of all question_id's for each tag_id.
-    Use a single query, getting all QuestionTag's for <user>, and return them in a data structure like this:
+    Use a single query, getting all QuestionTag's for <user>'s tags, and return them in a data structure like this:
     {
       <tag_id>: {<question_id>, <question_id>, ...},
       ...
@@ -123,8 +130,10 @@ def get_question_tags(user):
       Data structure per above
     '''
     
+    # Filter on the tag's user rather than QuestionTag.user, because QuestionTag's added through the admin inlines
+    # don't have a user.  This matches NextQuestion, which selects questions by tag regardless of QuestionTag.user.
     ret = defaultdict(set)
-    for qt in QuestionTag.objects.filter(user=user).values('tag_id', 'question_id'):
+    for qt in QuestionTag.objects.filter(tag__user=user).values('tag_id', 'question_id'):
         tag_id = qt['tag_id']
         ret[tag_id].add(qt['question_id'])
     return ret
@@ -0,0 +1,213 @@
+import logging
+import os
+import socket
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from questions.models import Job
+
+'''
+A small background job queue in the database, for work that doesn't need to happen in the request (e.g., re-indexing,
+or warming a cache), run by "./manage.py run_worker" (one or more processes).
+
+    - Register a function as a job with @register_job('<name>'), and enqueue a call of it (e.g., from a view or a
+      signal receiver) with enqueue('<name>', **kwargs).  The kwargs are stored as JSON.  A job enqueued in a
+      transaction is seen by the workers only when the transaction commits.
+    - priority: the pending jobs are run highest priority first, then oldest first.
+    - Coalescing: enqueue(..., coalesce_key=...) adds nothing if a job with the same key is pending (one indexed
+      lookup, and a partial unique index for concurrent enqueues), e.g., one "rebuild the index" job for many changes.  A job that is already running isn't coalesced with,
+      since it may have read the data before the change.
+    - Retries: a job that raises is run again after RETRY_BACKOFF * 2^(attempts - 1), up to its max_attempts, and then
+      is "failed", with the traceback in Job.error.  A job whose worker died (running for longer than
+      the worker's --stale-secs) is made pending again.
+    - Claiming: on Postgres (and other dbs with it), SELECT ... FOR UPDATE SKIP LOCKED, so that workers don't wait for
+      each other's locks, or claim the same job.  On sqlite (which locks the whole db for writes), the job is claimed
+      with a conditional UPDATE (... WHERE status = 'pending'), and a worker that loses the race tries the next job.
+    - No worker: the jobs just stay pending, so enqueue() logs a warning when the pending job it's coalesced with is
+      overdue by more than settings.JOB_PENDING_WARNING_SECS (without another query).
+'''
+
+logger = logging.getLogger(__name__)
+
+RETRY_BACKOFF = timezone.timedelta(seconds=30)
+
+_jobs = {}  # {name: function}
+
+
+def register_job(name):
+    # Decorator to register a function as a job named name
+    def decorator(function):
+        if name in _jobs and _jobs[name] is not function:
+            raise ValueError(f'A job is already registered with the name: [{name}]')
+        _jobs[name] = function
+        return function
+    return decorator
+
+
+def get_registered_job_names():
+    return sorted(_jobs)
+
+
+def enqueue(name, priority=0, delay=None, coalesce_key='', max_attempts=3, **kwargs):
+    # Add a job to run the function registered as name with kwargs, after delay (a timedelta), if given.
+    # Returns the Job, or the pending Job it was coalesced with (see coalesce_key above).
+    if name not in _jobs:
+        raise ValueError(f'No job registered with the name: [{name}]')
+    job = Job(name=name, args=kwargs, priority=priority, coalesce_key=coalesce_key, max_attempts=max_attempts,
+              run_after=timezone.now() + (delay or timezone.timedelta(0)))
+    if not coalesce_key:
+        job.save()
+        return job
+    while True:
+        pending = Job.objects.filter(coalesce_key=coalesce_key, status=Job.STATUS_PENDING).first()
+        if pending is not None:
+            _warn_if_overdue(pending)
+            # A job with the key is pending; raise its priority if this one's is higher
+            if priority > pending.priority:
+                Job.objects.filter(id=pending.id, priority__lt=priority).update(priority=priority)
+                pending.priority = priority
+            return pending
+        try:
+            with transaction.atomic(using=router.db_for_write(Job)):
+                job.save()
+            return job
+        except IntegrityError:
+            # Another process enqueued a job with the key since the lookup (and a worker may have claimed it since the
+            # insert failed), so look again
+            continue
+
+
+def _warn_if_overdue(job):
+    overdue = timezone.now() - job.run_after
+    if overdue > timezone.timedelta(seconds=settings.JOB_PENDING_WARNING_SECS):
+        logger.warning('Job [%s] (%s) has been pending for %d seconds past when it was due; is "./manage.py run_worker" '
+                       'running?', job.id, job.name, overdue.total_seconds())
+
+
+def get_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim_job(worker):
+    # Claim the next pending job that is due: set it running, and return it (or None if there isn't one)
+    using = router.db_for_write(Job)
+    skip_locked = connections[using].features.has_select_for_update_skip_locked
+    while True:
+        with transaction.atomic(using=using):
+            queryset = (Job.objects
+                        .filter(status=Job.STATUS_PENDING, run_after__lte=timezone.now())
+                        .order_by('-priority', 'run_after', 'id'))
+            if skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            job = queryset.first()
+            if job is None:
+                return None
+            now = timezone.now()
+            claimed = Job.objects.filter(id=job.id, status=Job.STATUS_PENDING).update(
+                status=Job.STATUS_RUNNING, attempts=F('attempts') + 1, datetime_started=now, worker=worker,
+                datetime_updated=now)
+        if claimed:
+            job.refresh_from_db()
+            return job
+        # Another worker claimed it first (sqlite, without the row lock), so try the next one
+
+
+def run_job(job):
+    # Run a claimed job, and record the result: done, pending again (to retry), or failed.  Returns True if it succeeded.
+    # A job registered by a module that the worker hasn't imported fails like a job that raises.
+    try:
+        # Each job is one transaction, so that a failed attempt leaves nothing half done for its retry
+        with transaction.atomic():
+            _jobs[job.name](**job.args)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.STATUS_PENDING
+            job.run_after = timezone.now() + RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        else:
+            job.status = Job.STATUS_FAILED
+            job.datetime_finished = timezone.now()
+        _save_result(job)
+        return False
+    job.status = Job.STATUS_DONE
+    job.datetime_finished = timezone.now()
+    _save_result(job)
+    return True
+
+
+def _save_result(job):
+    try:
+        with transaction.atomic(using=router.db_for_write(Job)):
+            job.save(update_fields=['status', 'run_after', 'error', 'datetime_finished', 'datetime_updated'])
+    except IntegrityError:
+        # A retry can't be pending along with a newer job with the same coalesce_key, which will do the same work
+        job.status = Job.STATUS_DONE
+        job.save(update_fields=['status', 'error', 'datetime_finished', 'datetime_updated'])
+
+
+def run_pending_jobs(worker=None):
+    # Claim and run the pending jobs that are due, until there are none (e.g., in tests, or a script that needs their
+    # results now, rather than when a worker gets to them).  Returns the number of jobs run.
+    worker = worker or get_worker_name()
+    count = 0
+    while (job := claim_job(worker=worker)) is not None:
+        run_job(job)
+        count += 1
+    return count
+
+
+def requeue_stale_jobs(stale_after):
+    # Make the jobs that have been running for longer than stale_after (a timedelta; e.g., their worker was killed)
+    # pending again, or failed, if they have no attempts left.  Returns the number of jobs.
+    stale = Job.objects.filter(status=Job.STATUS_RUNNING, datetime_started__lt=timezone.now() - stale_after)
+    count = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.STATUS_FAILED, error='stale: the worker stopped', datetime_finished=timezone.now())
+    for job in stale.filter(attempts__lt=F('max_attempts')):
+        job.status = Job.STATUS_PENDING
+        job.run_after = timezone.now()
+        job.error = 'stale: the worker stopped'
+        _save_result(job)
+        count += 1
+    return count
+
+
+def delete_finished_jobs(older_than):
+    # Delete the done and failed jobs that finished more than older_than (a timedelta) ago.  Returns the number deleted.
+    count, _ = Job.objects.filter(
+        status__in=(Job.STATUS_DONE, Job.STATUS_FAILED), datetime_finished__lt=timezone.now() - older_than).delete()
+    return count
+
+
+# The jobs.  (The imports are in the functions, so that the modules that enqueue jobs can import this one.)
+
+@register_job('update_duplicate_index')
+def _update_duplicate_index(question_ids):
+    from questions.duplicates import update_duplicate_index
+    update_duplicate_index(question_ids=question_ids)
+
+
+@register_job('rebuild_duplicate_index')
+def _rebuild_duplicate_index():
+    from questions.duplicates import rebuild_duplicate_index
+    rebuild_duplicate_index()
+
+
+@register_job('rebuild_search_index')
+def _rebuild_search_index():
+    from questions.search import ANSWER_SEARCH, ATTEMPT_SEARCH, QUESTION_SEARCH
+    for search in (QUESTION_SEARCH, ANSWER_SEARCH, ATTEMPT_SEARCH):
+        if search.is_supported():
+            search.rebuild()
+
+
+@register_job('refresh_due_forecast')
+def _refresh_due_forecast(user_id, tag_ids_selected, bucket='day', days=30, search_text=None):
+    # Compute (and cache) a due forecast, so that the next request for it is served from the cache
+    from questions.due_forecast import DueForecast
+    from questions.models import User
+    DueForecast(user=User.objects.get(id=user_id), tag_ids_selected=tag_ids_selected, bucket=bucket, days=days,
+                search_text=search_text)
@@ -0,0 +1,126 @@
+import gzip
+import json
+import os
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from questions.models import ArchivedHistory, Attempt, Schedule
+
+'''
+Archive old, superseded Schedule's and Attempt's: move them out of their tables and into gzipped JSONL files
+(one JSON object per row), so that the tables (and the scheduler's "newest schedule for each question" queries)
+don't keep growing with years of history.
+
+A row is archived if it was added more than --keep-days ago, and it is not the newest Schedule (or Attempt) for its
+question and user.  So the scheduler still has each question's newest schedule, and recent history is kept.
+The number of rows archived for each question/user is added to ArchivedHistory (e.g., for count_times_question_seen).
+
+Rows are archived in batches of --batch-size, each in its own short transaction, so that locks are never held for long.
+Each batch is written to its own file ("<table>-<time>-<batch number>.jsonl.gz"), which is flushed to disk (fsync),
+closed and renamed into place before the batch's rows are deleted.  So a crash (or power loss) never loses a deleted
+row, or leaves a truncated file; it may leave a file with rows that are still in the table (if the delete didn't
+commit), which are archived again by the next run (use the "id" to de-duplicate).
+'''
+
+
+class Command(BaseCommand):
+    help = ('Move Schedule and Attempt rows older than --keep-days, except the newest for each question, '
+            'into gzipped JSONL archive files, in batches')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=365, help='Keep all history added in the last N days')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows to archive per transaction')
+        parser.add_argument('--archive-dir', type=str, default='archive', help='Directory for the archive files')
+        parser.add_argument('--user-id', type=int, default=None, help='Only archive the history of this user')
+
+    def handle(self, *args, **options):
+        self._options = options
+        cutoff = timezone.now() - timezone.timedelta(days=options['keep_days'])
+        os.makedirs(options['archive_dir'], exist_ok=True)
+        timestamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+
+        for model, count_field in ((Schedule, 'count_schedules'), (Attempt, 'count_attempts')):
+            path_prefix = os.path.join(options['archive_dir'], f'{model._meta.db_table}-{timestamp}')
+            count, count_files = self._archive(model=model, count_field=count_field, cutoff=cutoff, path_prefix=path_prefix)
+            self.stdout.write(
+                f'{model._meta.db_table}: archived [{count}] to [{count_files}] files [{path_prefix}-*.jsonl.gz]')
+
+    def _get_queryset_superseded(self, model, cutoff):
+        # Return the rows of model added before cutoff that have a newer row for the same question and user.
+        # (Uses the (question, user, -datetime_added) index for Schedule.)
+        newer = model.objects.filter(question=OuterRef('question'), user=OuterRef('user')).filter(
+            Q(datetime_added__gt=OuterRef('datetime_added')) |
+            Q(datetime_added=OuterRef('datetime_added'), id__gt=OuterRef('id')))
+        queryset = model.objects.filter(Exists(newer), datetime_added__lt=cutoff)
+        if self._options['user_id'] is not None:
+            queryset = queryset.filter(user_id=self._options['user_id'])
+        return queryset
+
+    def _archive(self, model, count_field, cutoff, path_prefix):
+        # Archive the superseded rows of model in batches, each to its own file, and return the number of rows archived
+        # and the number of files
+        count = 0
+        count_files = 0
+        id_last = 0
+        while True:
+            with transaction.atomic():
+                rows = list(self._get_queryset_superseded(model=model, cutoff=cutoff)
+                            .filter(id__gt=id_last)
+                            .order_by('id')
+                            .values()[:self._options['batch_size']])
+                if not rows:
+                    return count, count_files
+                # The file is on disk before the rows are deleted
+                _write_archive_file(path=f'{path_prefix}-{count_files:06d}.jsonl.gz', rows=rows)
+                self._add_archived_counts(
+                    counts=Counter((row['question_id'], row['user_id']) for row in rows), count_field=count_field)
+                # The archived rows are never the newest for their question, so they don't need the post_delete
+                # receivers (e.g., the due forecast's); a raw delete also avoids loading them again.  (The db's
+                # triggers add the tombstones for incremental backups; see questions.backups.)
+                model.objects.filter(id__in=[row['id'] for row in rows])._raw_delete(using=router.db_for_write(model))
+            count += len(rows)
+            count_files += 1
+            id_last = rows[-1]['id']
+
+    def _add_archived_counts(self, counts, count_field):
+        # counts: {(question_id, user_id): number of rows archived, ...}
+        # Add counts to ArchivedHistory.<count_field>, with one query to read, one to update, and one to create.
+        question_ids = {question_id for question_id, _ in counts}
+        existing = {
+            (history.question_id, history.user_id): history
+            for history in ArchivedHistory.objects.filter(question_id__in=question_ids)
+            if (history.question_id, history.user_id) in counts
+        }
+        for key, history in existing.items():
+            setattr(history, count_field, getattr(history, count_field) + counts[key])
+            history.datetime_updated = timezone.now()  # bulk_update() doesn't set auto_now fields
+        ArchivedHistory.objects.bulk_update(existing.values(), fields=[count_field, 'datetime_updated'])
+        ArchivedHistory.objects.bulk_create([
+            ArchivedHistory(question_id=question_id, user_id=user_id, **{count_field: count})
+            for (question_id, user_id), count in counts.items()
+            if (question_id, user_id) not in existing
+        ])
+
+
+def _write_archive_file(path, rows):
+    # Write rows as gzipped JSONL to a temporary file, flush it to disk, and rename it to path, so that path is either
+    # complete and durable, or doesn't exist
+    path_tmp = f'{path}.tmp'
+    with open(path_tmp, 'wb') as file:
+        with gzip.GzipFile(fileobj=file, mode='wb') as gzip_file:
+            for row in rows:
+                gzip_file.write((json.dumps(row, cls=DjangoJSONEncoder) + '\n').encode('utf-8'))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path_tmp, path)
+    # Make the rename durable too
+    directory = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
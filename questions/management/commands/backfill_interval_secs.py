@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Greatest, Least
+
+from questions.db_functions import SecondsBetween
+from questions.models import MAX_INTERVAL_SECS, Schedule
+
+'''
+Set Schedule.interval_secs for the schedules saved before it was set by Schedule.save() (i.e., where it's NULL).
+
+interval_secs is computed by the db (date_show_next - datetime_added, in seconds), with one UPDATE per batch of
+--batch-size schedules, each in its own short transaction, so the history can be backfilled while the app is running.
+'''
+
+
+class Command(BaseCommand):
+    help = 'Set interval_secs (date_show_next - datetime_added) for the schedules that don\'t have it, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of schedules to update per transaction')
+
+    def handle(self, *args, **options):
+        count = 0
+        id_last = 0
+        while True:
+            with transaction.atomic():
+                ids = list(Schedule.objects
+                           .filter(id__gt=id_last, interval_secs__isnull=True, date_show_next__isnull=False)
+                           .order_by('id')
+                           .values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                # Limited to what fits in an IntegerField, like Schedule.set_date_show_next()
+                Schedule.objects.filter(id__in=ids).update(interval_secs=Least(
+                    Greatest(SecondsBetween('date_show_next', 'datetime_added'), Value(-MAX_INTERVAL_SECS)),
+                    Value(MAX_INTERVAL_SECS)))
+            count += len(ids)
+            id_last = ids[-1]
+        self.stdout.write(f'interval_secs set for [{count}] schedules')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from questions.backups import create_backup
+
+
+class Command(BaseCommand):
+    help = ('Back up the rows changed (and deleted) since the last backup in --backup-dir, or all the rows for the '
+            'first backup or with --full (see questions.backups)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backup-dir', type=str, default='backups', help='Directory for the backup files and manifest')
+        parser.add_argument('--full', action='store_true', help='Take a new base backup of all the rows')
+
+    def handle(self, *args, **options):
+        entry = create_backup(backup_dir=options['backup_dir'], full=options['full'])
+        self.stdout.write(f"{entry['type']}: [{entry['file']}] since [{entry['since'] or '-'}]")
+        for section, count in entry['counts'].items():
+            self.stdout.write(f'    {section}: [{count}]')
@@ -0,0 +1,108 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from emailusername.models import User
+from questions.forms import QUERY_CHOICES, QUERY_RANDOM_IN_DUE_WINDOW
+from questions.get_next_question import RANDOM_DUE_WINDOW, NextQuestion
+from questions.models import Answer, Question, QuestionTag, Schedule, Tag
+
+BENCHMARK_USER_EMAIL = 'benchmark_next_question@example.com'
+
+
+class NextQuestionOrderByRandom(NextQuestion):
+    # The naive QUERY_RANDOM_IN_DUE_WINDOW, with order_by('?'), which sorts all the questions in the window by a
+    # random key.  Benchmarked as a baseline for NextQuestion's index probe.
+    def _get_next_question_random_in_due_window(self):
+        scheduled_questions = self._get_scheduled_questions()
+        oldest_due = scheduled_questions.order_by('last_schedule_date_show_next').first()
+        self.question = oldest_due and scheduled_questions.filter(
+            last_schedule_date_show_next__lte=oldest_due.last_schedule_date_show_next + RANDOM_DUE_WINDOW,
+        ).order_by('?').first()
+
+
+class Command(BaseCommand):
+    help = ('Benchmark NextQuestion for each query name against a generated dataset with large notes.  '
+            'The dataset is created in a transaction that is rolled back, so nothing is saved.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=1000, help='Number of questions to generate')
+        parser.add_argument('--tags', type=int, default=10, help='Number of tags to generate')
+        parser.add_argument('--note-kb', type=int, default=8, help='Size in KB of each question and each answer')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of times to run each query name')
+
+    def handle(self, *args, **options):
+        self._options = options
+        with transaction.atomic():
+            user, tags = self._create_dataset()
+            self.stdout.write(
+                f"questions=[{options['questions']}] tags=[{options['tags']}] note-kb=[{options['note_kb']}] repeat=[{options['repeat']}]")
+            self.stdout.write(f"{'query name':<32} {'ms/card':>10} {'queries/card':>13} {'bytes/card':>12} {'pick bytes':>12}")
+            for query_name, _ in QUERY_CHOICES:
+                self._benchmark_query_name(query_name=query_name, user=user, tag_ids=[tag.id for tag in tags])
+            self._benchmark_query_name(
+                query_name=QUERY_RANDOM_IN_DUE_WINDOW, user=user, tag_ids=[tag.id for tag in tags],
+                next_question_class=NextQuestionOrderByRandom, label=f"{QUERY_RANDOM_IN_DUE_WINDOW} (order_by('?'))")
+            transaction.set_rollback(True)
+
+    def _benchmark_query_name(self, query_name, user, tag_ids, next_question_class=NextQuestion, label=None):
+        durations_ms = []
+        for _ in range(self._options['repeat']):
+            with CaptureQueriesContext(connection) as context:
+                time_start = time.perf_counter()
+                next_question_class(query_name=query_name, tag_ids_selected=tag_ids, user=user)
+                durations_ms.append((time.perf_counter() - time_start) * 1000)
+        # Bytes are measured from the queries of the last run
+        bytes_per_query = [self._count_bytes_fetched(sql=query['sql']) for query in context.captured_queries]
+        bytes_pick = sum(
+            num_bytes for query, num_bytes in zip(context.captured_queries, bytes_per_query)
+            if self._is_pick_query(sql=query['sql']))
+        self.stdout.write(
+            f"{label or query_name:<32} {statistics.median(durations_ms):>10.2f} {len(context.captured_queries):>13} "
+            f"{sum(bytes_per_query):>12} {bytes_pick:>12}")
+
+    def _is_pick_query(self, sql):
+        # Return True if sql is one of the queries that ranks the questions to pick one, e.g., ORDER BY due date, LIMIT 1
+        # (as opposed to the counts, or loading the picked question).
+        return sql.startswith('SELECT') and 'FROM "questions_question"' in sql and 'ORDER BY' in sql and 'LIMIT 1' in sql
+
+    def _count_bytes_fetched(self, sql):
+        # Re-run the (already interpolated) sql and return the approximate number of bytes in the rows it returns,
+        # counting each non-NULL value as the length of its utf-8 text.
+        if not sql.startswith('SELECT'):
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return sum(
+                len(str(value).encode('utf-8'))
+                for row in cursor.fetchall()
+                for value in row
+                if value is not None)
+
+    def _create_dataset(self):
+        # Create a user with tags and questions/answers of --note-kb each.
+        # Half of the questions are seen, with schedules alternating between due and not yet due.
+        num_questions = self._options['questions']
+        note = 'x' * (self._options['note_kb'] * 1024)
+        now = timezone.now()
+
+        user = User.objects.create(email=BENCHMARK_USER_EMAIL)
+        tags = Tag.objects.bulk_create([Tag(name=f'benchmark tag {num}', user=user) for num in range(self._options['tags'])])
+        answers = Answer.objects.bulk_create([Answer(answer=note, user=user) for _ in range(num_questions)])
+        questions = Question.objects.bulk_create([
+            Question(question=note, answer=answer, user=user) for answer in answers])
+        QuestionTag.objects.bulk_create([
+            QuestionTag(question=question, tag=tags[num % len(tags)], user=user)
+            for num, question in enumerate(questions)])
+        # Set date_show_next explicitly (rather than from an interval), so that some are due
+        Schedule.objects.bulk_create([
+            Schedule(
+                question=question,
+                user=user,
+                date_show_next=now + timezone.timedelta(hours=(num if num % 4 else -num)))
+            for num, question in enumerate(questions[:num_questions // 2])])
+        return user, tags
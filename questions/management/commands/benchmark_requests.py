@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.test import Client
+
+from emailusername.models import User
+
+
+class Command(BaseCommand):
+    help = ('Measure requests per second for GETs of a page, closing or reusing the db connection between requests '
+            'per the db settings (QM_DB_CONN_MAX_AGE, QM_DB_POOL, ...), the way the server does.  '
+            'e.g., run it once with QM_DB_CONN_MAX_AGE=0 and once with QM_DB_POOL=True to compare.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='User ID to log in as', required=True)
+        parser.add_argument('--path', type=str, default='/select-tags/', help='Path to GET, e.g., "/question/?query_name=UNSEEN&tag_ids_selected=1"')
+        parser.add_argument('--requests', type=int, default=200, help='Number of requests')
+
+    def handle(self, *args, **options):
+        client = Client()
+        client.force_login(User.objects.get(id=options['user_id']))
+        close_old_connections()
+
+        time_start = time.perf_counter()
+        for _ in range(options['requests']):
+            # The test Client doesn't close connections at the start and end of each request (the server does),
+            # so do it here, so that each request pays for a new connection unless connections are reused.
+            close_old_connections()
+            response = client.get(options['path'])
+            close_old_connections()
+            if response.status_code != 200:
+                raise Exception(f"GET [{options['path']}] returned status_code=[{response.status_code}]")
+        duration_secs = time.perf_counter() - time_start
+
+        self.stdout.write(
+            f"vendor=[{connection.vendor}] CONN_MAX_AGE=[{connection.settings_dict['CONN_MAX_AGE']}] "
+            f"CONN_HEALTH_CHECKS=[{connection.settings_dict['CONN_HEALTH_CHECKS']}] "
+            f"pool=[{'pool' in connection.settings_dict.get('OPTIONS', {})}] "
+            f"DB_POOL_MIN_SIZE=[{settings.DB_POOL_MIN_SIZE}] DB_POOL_MAX_SIZE=[{settings.DB_POOL_MAX_SIZE}]")
+        self.stdout.write(
+            f"requests=[{options['requests']}] seconds=[{duration_secs:.2f}] "
+            f"requests/sec=[{options['requests'] / duration_secs:.1f}]")
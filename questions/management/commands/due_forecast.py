@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from questions.due_forecast import BUCKET_DAY, BUCKETS, DEFAULT_DAYS, DueForecast
+from questions.models import User
+from questions.TagList import TagList
+
+
+class Command(BaseCommand):
+    help = 'Show how many questions come due in each hour, day, or week of the next N days for the selected tags'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='User ID', required=True)
+        parser.add_argument('--tag-ids', type=str, help='Comma-separated tag IDs, e.g., "1,2,3"', required=True)
+        parser.add_argument('--bucket', choices=BUCKETS, default=BUCKET_DAY, help='Size of each bucket')
+        parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help='Number of days to forecast')
+        parser.add_argument('--search-text', type=str, default='', help='Only questions matching this text')
+
+    def handle(self, *args, **options):
+        forecast = DueForecast(
+            user=User.objects.get(id=options['user_id']),
+            tag_ids_selected=TagList(id_comma_str=options['tag_ids']).as_id_int_list(),
+            bucket=options['bucket'],
+            days=options['days'],
+            search_text=options['search_text'])
+        self.stdout.write(f"{'overdue':<25} {forecast.count_overdue:>6}")
+        for bucket_start, count in zip(forecast.bucket_starts, forecast.counts):
+            self.stdout.write(f"{bucket_start.strftime('%Y-%m-%d %H:%M %a'):<25} {count:>6}")
@@ -13,6 +13,8 @@ class Command(BaseCommand):
         # question_tags = models.QuestionTag.objects.all()
         # user = models.User.objects.all()[0]
         # question_tags = models.QuestionTag.objects.filter(tag__in=user_tags)
+        # Get the answers, and the tags of all the questions, with the questions, rather than with a query per question
+        questions = questions.select_related('answer').prefetch_related('questiontag_set__tag')
         for num, question in enumerate(questions.order_by('id')):
             question_ = question.question.replace(CHAR_CR, '')
             print(f'\n======================================== id=[{question.id}] ==')
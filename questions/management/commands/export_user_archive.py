@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from questions.models import User
+from questions.user_archive import export_user_archive, open_archive
+
+
+class Command(BaseCommand):
+    help = ("Export a user's tags, questions, answers and history to a compressed JSONL archive "
+            "(see questions.user_archive), e.g., to move the deck to another instance with import_user_archive")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='User ID', required=True)
+        parser.add_argument('--file', type=str, required=True,
+                            help='Path of the archive, e.g., "user-1.jsonl.gz" (or "user-1.jsonl.zst" for zstd)')
+
+    def handle(self, *args, **options):
+        user = User.objects.get(id=options['user_id'])
+        try:
+            with open_archive(options['file'], mode='wt') as file:
+                counts = export_user_archive(user=user, file=file)
+        except ValueError as exception:
+            raise CommandError(str(exception))
+        for section, count in counts.items():
+            self.stdout.write(f'{section}: exported [{count}]')
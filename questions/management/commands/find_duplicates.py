@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from questions.duplicates import DEFAULT_THRESHOLD, find_duplicate_clusters, rebuild_duplicate_index
+from questions.models import Question, User
+
+
+class Command(BaseCommand):
+    help = ('List the clusters of duplicate and near-duplicate questions for a user (see questions.duplicates), '
+            'optionally rebuilding the duplicate index first')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, default=None, help='User ID (required, unless only rebuilding)')
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='The minimum similarity (Jaccard similarity of the word shingles, 0-1) of near duplicates')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rebuild the duplicate index for all the questions, e.g., after a bulk insert or update')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of questions to index per batch')
+
+    def handle(self, *args, **options):
+        if not 0 < options['threshold'] <= 1:
+            raise CommandError(f"Invalid threshold: [{options['threshold']}]")
+        if options['rebuild']:
+            count = rebuild_duplicate_index(batch_size=options['batch_size'])
+            self.stdout.write(f'indexed [{count}] questions')
+        if options['user_id'] is None:
+            if not options['rebuild']:
+                raise CommandError('--user-id is required')
+            return
+
+        clusters = find_duplicate_clusters(user=User.objects.get(id=options['user_id']), threshold=options['threshold'])
+        questions = Question.objects.in_bulk([question_id for cluster in clusters for question_id in cluster])
+        for cluster in clusters:
+            self.stdout.write(f'cluster of [{len(cluster)}] questions:')
+            for question_id in cluster:
+                self.stdout.write(f'    [{question_id}] {questions[question_id].question[:80]!r}')
+        self.stdout.write(f'found [{len(clusters)}] clusters')
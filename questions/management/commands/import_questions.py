@@ -0,0 +1,222 @@
+import contextlib
+import csv
+import itertools
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from emailusername.models import User
+from questions.duplicates import get_content_hash, update_duplicate_index
+from questions.models import Answer, Question, QuestionTag, Tag, TagLineage
+from questions.search import ANSWER_SEARCH, QUESTION_SEARCH
+
+'''
+Import questions (with their answers and tags) from a CSV, JSONL or Markdown file, e.g., notes exported from another app.
+
+Each record has a question, an optional answer, and optional tag names:
+    - csv: columns "question", "answer", "tags" (comma-separated tag names)
+    - jsonl: one JSON object per line: {"question": "...", "answer": "...", "tags": ["tag 1", "tag 2"]}
+    - markdown: notes separated by a line "---"; in each note, "Q:" starts the question, "A:" starts the answer
+      (each can continue on the following lines), and a line "tags: tag 1, tag 2" sets the tags, e.g.,
+            Q: What does a list comprehension return?
+            A: A list.
+            tags: python, syntax
+            ---
+A tag name can be a path of nested tags, like Anki's: "lang::python" tags the question with "python", and makes
+"python" a child of "lang" (TagLineage).  Tags are looked up by name (the user's existing tags), and created if missing;
+with --parent-tag, the top-level tags that the import creates are made children of that tag.
+
+The records are streamed, and written in batches of --batch-size with bulk_create(), each batch in its own
+transaction.  bulk_create() doesn't send post_save, so the search index (see questions.search) and the duplicate index
+(see questions.duplicates) are updated per batch.  With --skip-duplicates, the records whose normalized question and
+answer are the same as an existing question's (or an earlier record's) are skipped, with one lookup of the indexed
+content hashes per batch.
+'''
+
+FORMATS = ('csv', 'jsonl', 'markdown')
+EXTENSION_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.json': 'jsonl', '.md': 'markdown', '.markdown': 'markdown'}
+TAG_PATH_SEPARATOR = '::'
+
+
+def read_csv_records(file):
+    for record in csv.DictReader(file):
+        yield dict(
+            question=record.get('question') or '',
+            answer=record.get('answer') or '',
+            tags=(record.get('tags') or '').split(','))
+
+
+def read_jsonl_records(file):
+    for line_num, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exception:
+            raise CommandError(f'Line [{line_num}]: invalid JSON: {exception}')
+        tags = record.get('tags') or []
+        yield dict(
+            question=record.get('question') or '',
+            answer=record.get('answer') or '',
+            tags=tags.split(',') if isinstance(tags, str) else tags)
+
+
+def read_markdown_records(file):
+    record = dict(question=[], answer=[], tags=[])
+    part = None  # the part that the current line continues: 'question', 'answer', or None
+    for line in itertools.chain(file, ['---\n']):
+        line = line.rstrip('\n')
+        if line.strip() == '---':
+            if record['question'] or record['answer']:
+                yield dict(
+                    question='\n'.join(record['question']).strip(),
+                    answer='\n'.join(record['answer']).strip(),
+                    tags=record['tags'])
+            record = dict(question=[], answer=[], tags=[])
+            part = None
+        elif line.startswith('Q:'):
+            part = 'question'
+            record[part].append(line[2:].strip())
+        elif line.startswith('A:'):
+            part = 'answer'
+            record[part].append(line[2:].strip())
+        elif line.lower().startswith('tags:'):
+            record['tags'] = line[5:].split(',')
+            part = None
+        elif part:
+            record[part].append(line)
+
+
+READERS = dict(csv=read_csv_records, jsonl=read_jsonl_records, markdown=read_markdown_records)
+
+
+class Command(BaseCommand):
+    help = ('Import questions, answers and tags from a CSV, JSONL or Markdown file, creating missing tags, '
+            'in batches of bulk inserts')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=str, required=True, help='Path to the file to import ("-" for stdin)')
+        parser.add_argument('--format', choices=FORMATS, default=None, help='Default: from the file extension')
+        parser.add_argument('--user-id', type=int, required=True, help='User ID')
+        parser.add_argument('--parent-tag', type=str, default=None,
+                            help='Make the top-level tags created by the import children of this tag (created if missing)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of records to import per transaction')
+        parser.add_argument('--skip-duplicates', action='store_true',
+                            help='Skip the records with the same question and answer as an existing question')
+        parser.add_argument('--dry-run', action='store_true', help='Dry run to validate.  Don\'t make any changes.')
+
+    def handle(self, *args, **options):
+        self._options = options
+        self._user = User.objects.get(id=options['user_id'])
+        file_format = options['format'] or EXTENSION_FORMATS.get(os.path.splitext(options['file'])[1].lower())
+        if file_format is None:
+            raise CommandError(f"Unknown format for [{options['file']}]; use --format")
+        self._counts = dict(questions=0, answers=0, tags=0, tag_lineages=0, skipped=0, duplicates=0)
+        self._content_hashes_imported = set()
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN: no changes made.\n'))
+        # For a dry run, import everything in one transaction that is rolled back, so that the counts are the same
+        with transaction.atomic() if options['dry_run'] else contextlib.nullcontext():
+            self._load_tags()
+            file = sys.stdin if options['file'] == '-' else open(options['file'], newline='', encoding='utf-8')
+            with file:
+                records = READERS[file_format](file)
+                while batch := list(itertools.islice(records, options['batch_size'])):
+                    with transaction.atomic():
+                        self._import_batch(records=batch)
+            if options['dry_run']:
+                transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported [{questions}] questions, [{answers}] answers, [{tags}] new tags, [{tag_lineages}] new tag lineages; '
+            'skipped [{skipped}] records without a question, [{duplicates}] duplicates'.format(**self._counts)))
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN: no changes made.\n'))
+
+    def _load_tags(self):
+        # Build the name => id map of the user's tags (the oldest tag, for duplicate names), and the set of lineages,
+        # so that each batch only queries for what it creates.
+        self._tag_ids_by_name = {}
+        for tag_id, name in Tag.objects.filter(user=self._user).order_by('-id').values_list('id', 'name'):
+            self._tag_ids_by_name[name] = tag_id
+        self._lineages = set(TagLineage.objects.filter(user=self._user).values_list('parent_tag_id', 'child_tag_id'))
+        self._parent_tag_id = None
+        if self._options['parent_tag']:
+            tag_ids_by_name, _ = self._get_tag_ids(names=[self._options['parent_tag']])
+            self._parent_tag_id = tag_ids_by_name[self._options['parent_tag']]
+
+    def _get_tag_ids(self, names):
+        # Return ({name: tag id} for names, the names of the tags created), creating the missing tags with one bulk insert
+        names_new = sorted({name for name in names if name not in self._tag_ids_by_name})
+        tags_new = Tag.objects.bulk_create([Tag(name=name, user=self._user) for name in names_new])
+        self._tag_ids_by_name.update((tag.name, tag.id) for tag in tags_new)
+        self._counts['tags'] += len(tags_new)
+        return {name: self._tag_ids_by_name[name] for name in names}, set(names_new)
+
+    def _get_tag_ids_for_records(self, records):
+        # Return [[tag id, ...] for each record], creating the missing tags and lineages for the tag paths
+        paths = [
+            [[part.strip() for part in tag.split(TAG_PATH_SEPARATOR) if part.strip()] for tag in record['tags']]
+            for record in records]
+        tag_ids_by_name, names_new = self._get_tag_ids(names=[name for record_paths in paths for path in record_paths for name in path])
+        lineages = {
+            (tag_ids_by_name[parent], tag_ids_by_name[child])
+            for record_paths in paths for path in record_paths for parent, child in zip(path, path[1:])}
+        if self._parent_tag_id:
+            # The new tags that aren't children in a path are top-level
+            children_in_paths = {child for record_paths in paths for path in record_paths for child in path[1:]}
+            lineages.update(
+                (self._parent_tag_id, tag_ids_by_name[name]) for name in names_new - children_in_paths
+                if tag_ids_by_name[name] != self._parent_tag_id)
+        lineages_new = lineages - self._lineages
+        TagLineage.objects.bulk_create([
+            TagLineage(parent_tag_id=parent_tag_id, child_tag_id=child_tag_id, user=self._user)
+            for parent_tag_id, child_tag_id in sorted(lineages_new)])
+        self._lineages.update(lineages_new)
+        self._counts['tag_lineages'] += len(lineages_new)
+        return [sorted({tag_ids_by_name[path[-1]] for path in record_paths if path}) for record_paths in paths]
+
+    def _import_batch(self, records):
+        records_valid = [record for record in records if str(record['question']).strip()]
+        self._counts['skipped'] += len(records) - len(records_valid)
+        content_hashes = [get_content_hash(question=record['question'], answer=record['answer']) for record in records_valid]
+        if self._options['skip_duplicates']:
+            records_valid, content_hashes = self._exclude_duplicates(records=records_valid, content_hashes=content_hashes)
+        tag_ids_for_records = self._get_tag_ids_for_records(records=records_valid)
+
+        answers = Answer.objects.bulk_create([
+            Answer(answer=record['answer'], user_id=self._user.id) for record in records_valid if record['answer']])
+        answers_iter = iter(answers)
+        questions = Question.objects.bulk_create([
+            Question(
+                question=record['question'], answer_id=next(answers_iter).id if record['answer'] else None,
+                content_hash=content_hash, user_id=self._user.id)
+            for record, content_hash in zip(records_valid, content_hashes)])
+        QuestionTag.objects.bulk_create([
+            QuestionTag(question_id=question.id, tag_id=tag_id, user_id=self._user.id)
+            for question, tag_ids in zip(questions, tag_ids_for_records)
+            for tag_id in tag_ids])
+        ANSWER_SEARCH.update(ids=[answer.id for answer in answers])
+        QUESTION_SEARCH.update(ids=[question.id for question in questions])
+        update_duplicate_index(question_ids=[question.id for question in questions])
+        self._counts['questions'] += len(questions)
+        self._counts['answers'] += len(answers)
+
+    def _exclude_duplicates(self, records, content_hashes):
+        # Return (records, content_hashes) without the records that duplicate an existing question or an earlier record
+        content_hashes_existing = set(Question.objects
+            .filter(user=self._user, content_hash__in=set(content_hashes))
+            .values_list('content_hash', flat=True))
+        records_new, content_hashes_new = [], []
+        for record, content_hash in zip(records, content_hashes):
+            if content_hash in content_hashes_existing or content_hash in self._content_hashes_imported:
+                self._counts['duplicates'] += 1
+                continue
+            self._content_hashes_imported.add(content_hash)
+            records_new.append(record)
+            content_hashes_new.append(content_hash)
+        return records_new, content_hashes_new
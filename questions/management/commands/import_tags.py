@@ -47,6 +47,8 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.WARNING('DRY RUN: no changes made.\n'))
     
     def _set_user_and_tag_hierarchy(self):
+        # The hierarchy is built once; each change updates the parts of it that are checked (the names, parents and
+        # children), rather than building the whole hierarchy again after each change
         self._user = User.objects.get(id=self._options['user_id'])
         self._tag_hierarchy = get_tag_hierarchy(user=self._user)
 
@@ -114,7 +116,8 @@ class Command(BaseCommand):
                         parent_tag=parent_tag,
                         child_tag=child_tag, 
                         user=self._user)
-                    self._tag_hierarchy = get_tag_hierarchy(user=self._user)
+                    self._tag_hierarchy[child_tag.id]['parents'].add(parent_tag.id)
+                    self._tag_hierarchy[parent_tag.id]['children'].add(child_tag.id)
                 elif col_name in (COLUMN_NAME_CHILD_TAG_IDS_TO_REMOVE, COLUMN_NAME_PARENT_TAG_IDS_TO_REMOVE):
                     # verify that the lineage exists
                     if parent_tag.id not in self._tag_hierarchy[child_tag.id]['parents']:
@@ -132,7 +135,8 @@ class Command(BaseCommand):
                         parent_tag_id=parent_tag.id,
                         child_tag_id=child_tag.id,
                     ).delete()
-                    self._tag_hierarchy = get_tag_hierarchy(user=self._user)
+                    self._tag_hierarchy[child_tag.id]['parents'].discard(parent_tag.id)
+                    self._tag_hierarchy[parent_tag.id]['children'].discard(child_tag.id)
 
     def _process_tag_renames(self):
         if tag_new_name := self._row.get(COLUMN_NAME_TAG_RENAME):
@@ -148,5 +152,4 @@ class Command(BaseCommand):
             if not self._options['dry_run']:
                 self._main_tag.name = tag_new_name
                 self._main_tag.save()
-                # A change was made, so update the tag hierarchy
-                self._tag_hierarchy = get_tag_hierarchy(user=self._user)
\ No newline at end of file
+                self._tag_hierarchy[self._main_tag.id]['tag_name'] = tag_new_name
\ No newline at end of file
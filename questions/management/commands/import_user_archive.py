@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from questions.models import User
+from questions.user_archive import UserArchiveImport, open_archive
+
+
+class Command(BaseCommand):
+    help = ("Import an archive made by export_user_archive for a user (e.g., on another instance), with new ids, "
+            "in batches of bulk inserts in one transaction")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='User ID to import the archive for', required=True)
+        parser.add_argument('--file', type=str, required=True, help='Path of the archive')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows to insert per bulk insert')
+
+    def handle(self, *args, **options):
+        archive_import = UserArchiveImport(user=User.objects.get(id=options['user_id']), batch_size=options['batch_size'])
+        try:
+            with open_archive(options['file'], mode='rt') as file:
+                counts = archive_import.run(file=file)
+        except ValueError as exception:
+            raise CommandError(str(exception))
+        for section, count in counts.items():
+            self.stdout.write(f'{section}: imported [{count}]')
+        if archive_import.skipped:
+            self.stdout.write(self.style.WARNING(
+                f'skipped [{archive_import.skipped}] rows that refer to rows not in the archive'))
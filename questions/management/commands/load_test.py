@@ -0,0 +1,245 @@
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.utils import timezone
+
+from emailusername.models import User
+from questions.duplicates import update_duplicate_index
+from questions.forms import QUERY_CHOICES
+from questions.models import Answer, Question, QuestionTag, Schedule, Tag, TagLineage
+from questions.search import ANSWER_SEARCH, QUESTION_SEARCH
+from questions.TagList import FIELD_NAME__TAG_ID_PREFIX
+
+'''
+A load test of a running server: --users concurrent simulated reviewers, each going through the real flow of
+questions/views.py (GET /select-tags/, POST /select-tags/, GET /question/, POST an answer to /question/, then
+GET /question/ and answer again, --answers times), for each query name (QUERY_CHOICES) in turn.  Writes JSON with
+the throughput of each query name, and the latency percentiles of each endpoint for each query name, e.g., to
+compare before and after a change:
+    ./manage.py runserver --noreload &  # or gunicorn, with the settings to test
+    ./manage.py load_test --users=20 --output=before.json
+
+The users (LOAD_TEST_EMAIL_FORMAT) are created in the server's database (the same settings as the server), each with
+a tag tree (lineages), and questions with answers, half of them seen (with schedules, some due).  They are deleted
+and created again unless --no-seed.  Each simulated user is logged in with a session created here (like
+Client.force_login()), and sends the CSRF token from its cookie.
+'''
+
+LOAD_TEST_EMAIL_FORMAT = 'load_test_{num}@example.com'
+ENDPOINT_SELECT_TAGS_GET = 'GET /select-tags/'
+ENDPOINT_SELECT_TAGS_POST = 'POST /select-tags/'
+ENDPOINT_QUESTION_GET = 'GET /question/'
+ENDPOINT_ANSWER_POST = 'POST /question/'
+PERCENTILES = (50, 95, 99)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Return the redirect responses, so that each request is timed on its own
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def get_percentile(values_sorted, percent):
+    # The nearest-rank percentile of a sorted list
+    if not values_sorted:
+        return None
+    return values_sorted[max(0, -(-percent * len(values_sorted) // 100) - 1)]
+
+
+class SimulatedUser:
+    # One reviewer's session against the server at base_url
+    def __init__(self, base_url, session_id, tag_ids, record):
+        self.base_url = base_url.rstrip('/')
+        self.tag_ids = tag_ids
+        self._record = record  # record(endpoint, seconds, is_error)
+        self._cookies = CookieJar()
+        self._opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self._cookies), NoRedirect)
+        self._session_id = session_id
+
+    def review(self, query_name, answers):
+        # Select the tags and query_name, then answer up to answers questions.  Returns the number answered.
+        self._request(ENDPOINT_SELECT_TAGS_GET, '/select-tags/')
+        location = self._request(
+            ENDPOINT_SELECT_TAGS_POST, '/select-tags/',
+            data=dict(query_name=query_name, **{f'{FIELD_NAME__TAG_ID_PREFIX}{tag_id}': 'on' for tag_id in self.tag_ids}),
+            expect_redirect=True)
+        count_answered = 0
+        for _ in range(answers):
+            if not location:
+                break
+            html = self._request(ENDPOINT_QUESTION_GET, location)
+            match = html and re.search(r'name="hidden_question_id" value="(\d+)"', html)
+            if not match:
+                break  # no question to answer
+            location = self._request(ENDPOINT_ANSWER_POST, '/question/', expect_redirect=True, data=dict(
+                hidden_question_id=match.group(1),
+                hidden_query_name=query_name,
+                hidden_tag_ids_selected=','.join(str(tag_id) for tag_id in self.tag_ids),
+                attempt='load test attempt',
+                percent_correct=random.choice([50, 80, 100]),
+                percent_importance=80,
+                interval_num=random.randint(1, 10),
+                interval_unit=random.choice(['minutes', 'hours', 'days'])))
+            if location:  # the answer was saved (an error, e.g., a locked database, isn't counted)
+                count_answered += 1
+        return count_answered
+
+    def _request(self, endpoint, path, data=None, expect_redirect=False):
+        # Send the request, and record its latency.  Returns the redirect location (if expect_redirect), or the html.
+        url = path if path.startswith('http') else self.base_url + path
+        headers = {'Cookie': f'sessionid={self._session_id}'}
+        csrf_token = next((cookie.value for cookie in self._cookies if cookie.name == 'csrftoken'), None)
+        if csrf_token:
+            headers['Cookie'] += f'; csrftoken={csrf_token}'
+            headers['X-CSRFToken'] = csrf_token
+        request = urllib.request.Request(
+            url, headers=headers, data=urllib.parse.urlencode(data).encode() if data is not None else None)
+        start = time.perf_counter()
+        try:
+            with self._opener.open(request, timeout=60) as response:
+                body = response.read().decode('utf-8')
+                status = response.status
+                location = response.headers.get('Location')
+        except urllib.error.HTTPError as error:
+            body, status, location = '', error.code, error.headers.get('Location')
+        except (urllib.error.URLError, OSError):
+            body, status, location = '', None, None
+        is_redirect = status in (301, 302, 303)
+        self._record(endpoint, time.perf_counter() - start, is_error=(not is_redirect if expect_redirect else status != 200))
+        if expect_redirect:
+            return location if is_redirect else None
+        return body if status == 200 else None
+
+
+class Command(BaseCommand):
+    help = ('Load test a running server with concurrent simulated reviewers, for each query name, and write the '
+            'throughput and latency percentiles as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', type=str, default='http://localhost:8000', help='The server to test')
+        parser.add_argument('--users', type=int, default=10, help='Number of concurrent simulated users')
+        parser.add_argument('--answers', type=int, default=10, help='Number of questions each user answers per query name')
+        parser.add_argument('--query-names', type=str, nargs='*', default=None,
+                            help='Query names to test (default: all)')
+        parser.add_argument('--questions', type=int, default=200, help='Number of questions per user, when seeding')
+        parser.add_argument('--tags', type=int, default=20, help='Number of tags per user, when seeding')
+        parser.add_argument('--no-seed', action='store_true', help='Use the users from a previous run')
+        parser.add_argument('--output', type=str, default=None, help='Write the JSON to this file (default: stdout)')
+
+    def handle(self, *args, **options):
+        query_names = options['query_names'] or [query_name for query_name, _ in QUERY_CHOICES]
+        unknown = set(query_names) - {query_name for query_name, _ in QUERY_CHOICES}
+        if unknown:
+            raise CommandError(f'Unknown query names: [{sorted(unknown)}]')
+        users = [self._get_user(num=num, seed=not options['no_seed'], options=options) for num in range(options['users'])]
+        simulated_users_args = [
+            dict(session_id=self._get_session_id(user), tag_ids=list(Tag.objects.filter(user=user).values_list('id', flat=True)))
+            for user in users]
+
+        results = dict(
+            base_url=options['base_url'], users=options['users'], answers=options['answers'],
+            questions=options['questions'], tags=options['tags'], datetime=timezone.now().isoformat(), query_names={})
+        for query_name in query_names:
+            latencies = defaultdict(list)  # {endpoint: [seconds, ...]}
+            errors = defaultdict(int)
+            lock = threading.Lock()
+
+            def record(endpoint, seconds, is_error):
+                with lock:
+                    latencies[endpoint].append(seconds)
+                    errors[endpoint] += is_error
+
+            simulated_users = [
+                SimulatedUser(base_url=options['base_url'], record=record, **args) for args in simulated_users_args]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=len(simulated_users)) as executor:
+                answered = sum(executor.map(
+                    lambda simulated_user: simulated_user.review(query_name=query_name, answers=options['answers']),
+                    simulated_users))
+            duration_secs = time.perf_counter() - start
+            count_requests = sum(len(seconds) for seconds in latencies.values())
+            results['query_names'][query_name] = dict(
+                seconds=round(duration_secs, 3),
+                requests=count_requests,
+                requests_per_sec=round(count_requests / duration_secs, 2),
+                answers=answered,
+                answers_per_sec=round(answered / duration_secs, 2),
+                endpoints={endpoint: self._get_stats(seconds=seconds, errors=errors[endpoint])
+                           for endpoint, seconds in latencies.items()})
+            self.stderr.write(
+                f'{query_name:<32} requests/sec=[{count_requests / duration_secs:.1f}] answers=[{answered}] '
+                f'errors=[{sum(errors.values())}]')
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def _get_stats(self, seconds, errors):
+        seconds = sorted(seconds)
+        return dict(
+            count=len(seconds),
+            errors=errors,
+            mean_ms=round(sum(seconds) / len(seconds) * 1000, 2),
+            **{f'p{percent}_ms': round(get_percentile(seconds, percent) * 1000, 2) for percent in PERCENTILES},
+            max_ms=round(seconds[-1] * 1000, 2))
+
+    def _get_session_id(self, user):
+        # Create a logged-in session in the server's database, as Client.force_login() does
+        client = Client()
+        client.force_login(user)
+        return client.cookies['sessionid'].value
+
+    def _get_user(self, num, seed, options):
+        email = LOAD_TEST_EMAIL_FORMAT.format(num=num)
+        if not seed:
+            user = User.objects.filter(email=email).first()
+            if user is None:
+                raise CommandError(f'No user [{email}]: run without --no-seed first')
+            return user
+        User.objects.filter(email=email).delete()
+        user = User.objects.create(email=email)
+        self._seed(user=user, num_questions=options['questions'], num_tags=options['tags'])
+        return user
+
+    def _seed(self, user, num_questions, num_tags):
+        # Create tags in a tree (each tag's parent is an earlier tag), and questions with answers, each with one or two
+        # tags.  Half of the questions are seen: each has a few schedules, the newest due in the past or the future.
+        now = timezone.now()
+        tags = Tag.objects.bulk_create([Tag(name=f'load test tag {num}', user=user) for num in range(num_tags)])
+        TagLineage.objects.bulk_create([
+            TagLineage(parent_tag=tags[random.randrange(num)], child_tag=tag, user=user)
+            for num, tag in enumerate(tags) if num])
+        answers = Answer.objects.bulk_create([
+            Answer(answer=f'answer {num} ' + 'lorem ipsum ' * random.randint(5, 50), user=user)
+            for num in range(num_questions)])
+        questions = Question.objects.bulk_create([
+            Question(question=f'question {num} ' + 'dolor sit amet ' * random.randint(5, 50), answer=answer, user=user)
+            for num, answer in enumerate(answers)])
+        QuestionTag.objects.bulk_create([
+            QuestionTag(question=question, tag=tag, user=user)
+            for question in questions
+            for tag in random.sample(tags, k=min(len(tags), random.randint(1, 2)))])
+        Schedule.objects.bulk_create([
+            Schedule(
+                question=question, user=user, interval_num=1, interval_unit='days', percent_correct=80,
+                date_show_next=now + timezone.timedelta(hours=random.randint(-24 * 30, 24 * 30)))
+            for question in questions[:num_questions // 2]
+            for _ in range(random.randint(1, 3))])
+        # bulk_create() doesn't send post_save, so update the search and duplicate indexes here
+        QUESTION_SEARCH.update(ids=[question.id for question in questions])
+        ANSWER_SEARCH.update(ids=[answer.id for answer in answers])
+        update_duplicate_index(question_ids=[question.id for question in questions])
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from questions.partitions import PARTITIONED_TABLES, create_all_partitions, is_partitioned, is_supported, partition_table
+
+
+class Command(BaseCommand):
+    help = ('Create the monthly partitions of the history tables (Schedule and Attempt) ahead of time, e.g., daily '
+            'from cron.  With --convert, first convert the tables to partitioned tables.  Postgres only; '
+            'see questions.partitions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=settings.DB_PARTITION_MONTHS_AHEAD,
+                            help='Create partitions for this many months after the current month')
+        parser.add_argument('--convert', action='store_true', help='Convert the tables to partitioned tables first')
+
+    def handle(self, *args, **options):
+        if not is_supported():
+            self.stdout.write('Partitioning is only supported on postgres; nothing to do')
+            return
+        if options['convert']:
+            for table in PARTITIONED_TABLES:
+                if not is_partitioned(table=table):
+                    partition_table(table=table, months_ahead=options['months_ahead'])
+                    self.stdout.write(f'{table}: converted to a partitioned table')
+        for partition in create_all_partitions(months_ahead=options['months_ahead']):
+            self.stdout.write(f'created partition [{partition}]')
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(table=table):
+                self.stdout.write(f'{table}: not partitioned (use --convert)')
@@ -0,0 +1,31 @@
+import glob
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from questions.profiling import PROFILE_FILE_SUFFIX, PROFILE_HEADER, get_profile_token, read_collapsed, summarize
+
+'''
+Print the split of the time of the profiled requests (see questions.profiling) between the ORM, get_tag_hierarchy,
+template rendering, etc., or (--token) a header value for profiling a request, e.g.,
+    curl -H "X-Quizme-Profile: $(./manage.py profile_requests --token)" https://.../question/
+'''
+
+
+class Command(BaseCommand):
+    help = 'Summarize the request profiles in PROFILE_DIR (or the given files), or print a token for profiling a request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Profile files (default: all in PROFILE_DIR)')
+        parser.add_argument('--token', action='store_true', help=f'Print a value for the {PROFILE_HEADER} header')
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(get_profile_token())
+            return
+        paths = options['paths'] or sorted(glob.glob(os.path.join(settings.PROFILE_DIR, f'*{PROFILE_FILE_SUFFIX}')))
+        for path in paths:
+            counts = read_collapsed(path)
+            split = ', '.join(f'{category} {fraction:.0%}' for category, fraction in summarize(counts).items())
+            self.stdout.write(f'{os.path.basename(path)}: [{sum(counts.values())}] samples: {split}')
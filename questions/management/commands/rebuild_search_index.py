@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from questions.search import ANSWER_SEARCH, ATTEMPT_SEARCH, QUESTION_SEARCH
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the full-text search tables (see questions.search) from all questions, answers and attempts, '
+            'e.g., after objects were created with bulk_create() or QuerySet.update(), which don\'t send post_save.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of objects to index per query')
+
+    def handle(self, *args, **options):
+        for search in (QUESTION_SEARCH, ANSWER_SEARCH, ATTEMPT_SEARCH):
+            if not search.is_supported():
+                self.stdout.write(f'{search.table_name}: not supported by this db; searches use icontains')
+                continue
+            count = search.rebuild(batch_size=options['batch_size'])
+            self.stdout.write(f'{search.table_name}: indexed [{count}]')
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from questions.models import User
+from questions.reschedule import BulkReschedule
+from questions.TagList import TagList
+
+
+class Command(BaseCommand):
+    help = ('Reschedule the questions for the selected tags (and their descendants) in bulk, e.g., after a vacation: '
+            'shift their due dates (--shift-days), or spread the due questions over the next days (--spread-days)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='User ID', required=True)
+        parser.add_argument('--tag-ids', type=str, help='Comma-separated tag IDs, e.g., "1,2,3"', required=True)
+        parser.add_argument('--search-text', type=str, default='', help='Only questions matching this text')
+        strategy = parser.add_mutually_exclusive_group(required=True)
+        strategy.add_argument('--shift-days', type=float, help='Move the due dates by this many days (negative for earlier)')
+        strategy.add_argument('--spread-days', type=int, help='Spread the due questions evenly over this many days')
+        parser.add_argument('--only-due', action='store_true', help='With --shift-days, only shift the questions that are due now')
+        parser.add_argument('--max-per-day', type=int, default=None, help='With --spread-days, the most questions per day')
+
+    def handle(self, *args, **options):
+        reschedule = BulkReschedule(
+            user=User.objects.get(id=options['user_id']),
+            tag_ids_selected=TagList(id_comma_str=options['tag_ids']).as_id_int_list(),
+            search_text=options['search_text'])
+        try:
+            if options['shift_days'] is not None:
+                count = reschedule.shift(delta=timezone.timedelta(days=options['shift_days']), only_due=options['only_due'])
+            else:
+                count = reschedule.spread(days=options['spread_days'], max_per_day=options['max_per_day'])
+        except ValueError as exception:
+            raise CommandError(str(exception))
+        self.stdout.write(f'rescheduled [{count}] questions')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from questions.backups import restore_backups
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the database from the newest base backup in --backup-dir plus the deltas after it '
+            '(see questions.backups), e.g., into a new database after "./manage.py migrate"')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backup-dir', type=str, default='backups', help='Directory of the backup files and manifest')
+        parser.add_argument('--until', type=str, default=None, help='Stop after this backup file (a point-in-time restore)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows to upsert per bulk insert')
+
+    def handle(self, *args, **options):
+        try:
+            results = restore_backups(backup_dir=options['backup_dir'], until=options['until'], batch_size=options['batch_size'])
+        except ValueError as exception:
+            raise CommandError(str(exception))
+        for file_name, counts in results:
+            self.stdout.write(f'[{file_name}]: restored [{sum(counts.values())}] rows')
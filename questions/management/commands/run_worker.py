@@ -0,0 +1,56 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from questions.jobs import claim_job, delete_finished_jobs, get_worker_name, requeue_stale_jobs, run_job
+from questions.slow_queries import capture_slow_queries
+
+
+class Command(BaseCommand):
+    help = ('Run the background jobs (see questions.jobs): claim and run the pending jobs, highest priority first, '
+            'polling for new ones.  Run more than one to run jobs in parallel.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-secs', type=float, default=1.0, help='Seconds to wait when there are no jobs')
+        parser.add_argument('--once', action='store_true', help='Run the pending jobs, then exit')
+        parser.add_argument('--max-jobs', type=int, default=None, help='Exit after running this many jobs')
+        parser.add_argument('--stale-secs', type=int, default=3600,
+                            help='Requeue the jobs that have been running for longer than this (their worker stopped)')
+        parser.add_argument('--keep-days', type=int, default=7, help='Delete the finished jobs older than this')
+
+    def handle(self, *args, **options):
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        worker = get_worker_name()
+        stale_after = timezone.timedelta(seconds=options['stale_secs'])
+        count_run = count_failed = 0
+        self._clean_up(stale_after=stale_after, keep_days=options['keep_days'])
+        while not self._stopping and (options['max_jobs'] is None or count_run < options['max_jobs']):
+            close_old_connections()
+            job = claim_job(worker=worker)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_secs'])
+                self._clean_up(stale_after=stale_after, keep_days=options['keep_days'])
+                continue
+            started = time.perf_counter()
+            with capture_slow_queries(view=f'job:{job.name}'):
+                succeeded = run_job(job)
+            count_run += 1
+            count_failed += not succeeded
+            self.stdout.write(
+                f'job [{job.id}] [{job.name}] attempt [{job.attempts}]: '
+                f'{job.status if succeeded else job.status + " (error)"} in [{time.perf_counter() - started:.3f}] secs')
+        self.stdout.write(f'ran [{count_run}] jobs; [{count_failed}] errors')
+
+    def _clean_up(self, stale_after, keep_days):
+        requeue_stale_jobs(stale_after=stale_after)
+        delete_finished_jobs(older_than=timezone.timedelta(days=keep_days))
+
+    def _stop(self, signum, frame):
+        # Finish the current job, then exit
+        self._stopping = True
@@ -0,0 +1,272 @@
+import atexit
+import bisect
+import contextlib
+import glob
+import json
+import math
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from questions.models import Attempt, Schedule
+
+'''
+Metrics in the Prometheus text exposition format, served at /metrics (see views.view_metrics), e.g., for scraping by
+a local Prometheus:
+    - quizme_next_question_seconds{query_name}: the time to pick the next question (and get its counts)
+    - quizme_tag_hierarchy_seconds, quizme_tag_hierarchy_tags: the time to build a user's tag hierarchy, and its size
+    - quizme_request_seconds{view}, quizme_request_db_queries{view}: the time of each request, and its db queries
+    - quizme_attempts_written_total, quizme_schedules_written_total
+Counters and histograms only (no gauges), so that the values of many processes can be added together.
+
+The metrics are kept in memory, in each process.  With more than one process (e.g., gunicorn workers), set
+settings.METRICS_DIR (QM_METRICS_DIR) to a directory shared by the processes: each process writes its metrics to its
+own file there (at most every FLUSH_SECS, after a request), and /metrics adds up all the files.  The files of
+processes that have exited are kept, so that the counters don't go down; empty the directory when restarting the
+server.
+'''
+
+FLUSH_SECS = 1.0
+BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_QUERIES = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+BUCKETS_TAGS = (10, 50, 100, 500, 1000, 5000, 10000)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}  # {name: Counter or Histogram}
+        self._lock = threading.Lock()
+        self._time_flushed = 0.0
+        self._is_dirty = False
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        metric._registry = self
+        return metric
+
+    def get_state(self):
+        # {name: {labels json: value}}, where the value is a number (Counter) or [bucket counts..., sum, count]
+        with self._lock:
+            return {name: {key: _copy(value) for key, value in metric._values.items()} for name, metric in self._metrics.items()}
+
+    def flush(self, directory=None, force=False):
+        # Write this process's metrics to its file in directory (settings.METRICS_DIR), if anything changed since the
+        # last write, which was at least FLUSH_SECS ago (or force)
+        directory = directory or settings.METRICS_DIR
+        if not directory or not self._is_dirty or (not force and time.monotonic() - self._time_flushed < FLUSH_SECS):
+            return
+        self._is_dirty = False
+        self._time_flushed = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(self.get_state(), file)
+        os.replace(f'{path}.tmp', path)
+
+    def render(self, directory=None):
+        # Return the metrics in the text exposition format: this process's, or the sum of all the processes' in
+        # directory (settings.METRICS_DIR)
+        directory = directory or settings.METRICS_DIR
+        if directory:
+            self.flush(directory=directory, force=True)
+            states = []
+            for path in sorted(glob.glob(os.path.join(directory, 'metrics-*.json'))):
+                with open(path, encoding='utf-8') as file:
+                    states.append(json.load(file))
+        else:
+            states = [self.get_state()]
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            values = {}
+            for state in states:
+                for key, value in state.get(name, {}).items():
+                    values[key] = _add(values[key], value) if key in values else value
+            lines += metric.render(values)
+        return '\n'.join(lines) + '\n'
+
+
+class Counter:
+    type_ = 'counter'
+
+    def __init__(self, name, help_, label_names=()):
+        self.name = name
+        self.help = help_
+        self.label_names = label_names
+        self._values = {}  # {labels json: value}
+        self._registry = None
+
+    def inc(self, amount=1, **labels):
+        key = _get_key(self, labels)
+        with self._registry._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+            self._registry._is_dirty = True
+
+    def render(self, values):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type_}']
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(json.loads(key))} {_format_number(value)}')
+        return lines
+
+
+class Histogram(Counter):
+    type_ = 'histogram'
+
+    def __init__(self, name, help_, buckets, label_names=()):
+        super().__init__(name=name, help_=help_, label_names=label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _get_key(self, labels)
+        with self._registry._lock:
+            # [the count of each bucket (not cumulative; the last is +Inf), sum, count]
+            values = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0, 0])
+            values[bisect.bisect_left(self.buckets, value)] += 1
+            values[-2] += value
+            values[-1] += 1
+            self._registry._is_dirty = True
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        # Observe the seconds that the block takes
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self, values):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type_}']
+        for key, value in sorted(values.items()):
+            labels = json.loads(key)
+            cumulative = 0
+            for bucket, count in zip(self.buckets + (math.inf,), value):
+                cumulative += count
+                le = '+Inf' if bucket == math.inf else _format_number(bucket)
+                lines.append(f'{self.name}_bucket{_format_labels(dict(labels, le=le))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_number(value[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {value[-1]}')
+        return lines
+
+
+def _get_key(metric, labels):
+    if set(labels) != set(metric.label_names):
+        raise ValueError(f'Metric [{metric.name}] has the labels [{metric.label_names}], not [{tuple(labels)}]')
+    return json.dumps([[name, str(labels[name])] for name in metric.label_names])
+
+
+def _copy(value):
+    return list(value) if isinstance(value, list) else value
+
+
+def _add(value_1, value_2):
+    if isinstance(value_1, list):
+        return [number_1 + number_2 for number_1, number_2 in zip(value_1, value_2)]
+    return value_1 + value_2
+
+
+def _format_labels(labels):
+    if isinstance(labels, list):
+        labels = dict(labels)
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_number(number):
+    return repr(float(number)) if isinstance(number, float) else str(number)
+
+
+REGISTRY = Registry()
+NEXT_QUESTION_SECONDS = REGISTRY.register(Histogram(
+    'quizme_next_question_seconds', 'Seconds to pick the next question and get its counts',
+    buckets=BUCKETS_SECONDS, label_names=('query_name',)))
+TAG_HIERARCHY_SECONDS = REGISTRY.register(Histogram(
+    'quizme_tag_hierarchy_seconds', 'Seconds to build a tag hierarchy', buckets=BUCKETS_SECONDS))
+TAG_HIERARCHY_TAGS = REGISTRY.register(Histogram(
+    'quizme_tag_hierarchy_tags', 'Number of tags in a built tag hierarchy', buckets=BUCKETS_TAGS))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'quizme_request_seconds', 'Seconds to handle a request', buckets=BUCKETS_SECONDS, label_names=('view',)))
+REQUEST_DB_QUERIES = REGISTRY.register(Histogram(
+    'quizme_request_db_queries', 'Number of db queries per request', buckets=BUCKETS_QUERIES, label_names=('view',)))
+ATTEMPTS_WRITTEN = REGISTRY.register(Counter('quizme_attempts_written_total', 'Number of Attempts written'))
+SCHEDULES_WRITTEN = REGISTRY.register(Counter('quizme_schedules_written_total', 'Number of Schedules written'))
+# Write the last changes of a process that is exiting (e.g., a gunicorn worker restarted after --max-requests)
+atexit.register(REGISTRY.flush, force=True)
+
+
+class MetricsMiddleware:
+    '''
+    Observe the time and the number of db queries of each request, by view (the url name), and write this process's
+    metrics to settings.METRICS_DIR (if set) every FLUSH_SECS.
+    The queries are counted on the connections of the thread that runs the request's sync code: with an async view
+    under ASGI, that's sync_to_async()'s thread for the request (not those of NextQuestion.acreate()'s concurrent
+    counts).  Sync and async capable, so that an async view isn't run in a thread.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+        observation = self._start()
+        try:
+            return self.get_response(request)
+        finally:
+            self._finish(request=request, observation=observation)
+
+    async def __acall__(self, request):
+        # The wrappers are added to (and removed from) the connections of the request's sync_to_async() thread, where
+        # its queries run (thread_sensitive)
+        observation = await sync_to_async(self._start)()
+        try:
+            return await self.get_response(request)
+        finally:
+            await sync_to_async(self._finish)(request=request, observation=observation)
+
+    def _start(self):
+        # Count the queries on this thread's connections.  Returns the observation for _finish().
+        count_queries = [0]
+
+        def count(execute, sql, params, many, context):
+            count_queries[0] += 1
+            return execute(sql, params, many, context)
+
+        stack = contextlib.ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(count))
+        return stack, count_queries, time.perf_counter()
+
+    def _finish(self, request, observation):
+        stack, count_queries, start = observation
+        stack.close()
+        view = request.resolver_match.url_name if request.resolver_match else None
+        REQUEST_SECONDS.observe(time.perf_counter() - start, view=view or 'unknown')
+        REQUEST_DB_QUERIES.observe(count_queries[0], view=view or 'unknown')
+        REGISTRY.flush()
+
+
+@receiver(post_save, sender=Attempt)
+def _count_attempt_written(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ATTEMPTS_WRITTEN.inc()
+
+
+@receiver(post_save, sender=Schedule)
+def _count_schedule_written(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        SCHEDULES_WRITTEN.inc()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0010_alter_question_answer'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['user', 'datetime_added'], name='questions_q_user_id_304ec1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['question', 'user', '-datetime_added'], name='questions_s_questio_10cd6a_idx'),
+        ),
+    ]
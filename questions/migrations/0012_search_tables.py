@@ -0,0 +1,60 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# The full-text search tables for questions.search, filled from the existing questions, answers and attempts.
+# They aren't models, because their columns are db-specific:
+#   - Postgres: a tsvector column with a GIN index
+#   - sqlite: an FTS5 virtual table
+# Other db's (or a sqlite without FTS5) don't get search tables, and questions.search falls back to icontains.
+
+POSTGRES_TEXT_SEARCH_CONFIG = 'english'
+
+# (search table, id column, model table, SELECT of (id, document) for the backfill)
+SEARCH_TABLES = (
+    ('questions_question_search', 'question_id', 'questions_question',
+     "SELECT q.id, q.question || ' ' || COALESCE(a.answer, '') "
+     "FROM questions_question q LEFT OUTER JOIN questions_answer a ON a.id = q.answer_id"),
+    ('questions_answer_search', 'answer_id', 'questions_answer',
+     "SELECT id, answer FROM questions_answer"),
+    ('questions_attempt_search', 'attempt_id', 'questions_attempt',
+     "SELECT id, attempt FROM questions_attempt"),
+)
+
+
+def create_search_tables(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for search_table, id_column, model_table, select_documents in SEARCH_TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(
+                f'CREATE TABLE {search_table} ('
+                f'{id_column} integer PRIMARY KEY REFERENCES {model_table} (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                f'document tsvector NOT NULL)')
+            schema_editor.execute(f'CREATE INDEX {search_table}_document_idx ON {search_table} USING GIN (document)')
+            schema_editor.execute(
+                f'INSERT INTO {search_table} ({id_column}, document) '
+                f"SELECT id, to_tsvector('{POSTGRES_TEXT_SEARCH_CONFIG}', document) FROM ({select_documents}) AS documents (id, document)")
+        elif vendor == 'sqlite':
+            # The porter tokenizer stems words (e.g., "searching" matches "search"), like Postgres' english config
+            try:
+                schema_editor.execute(
+                    f"CREATE VIRTUAL TABLE {search_table} USING fts5({id_column} UNINDEXED, document, tokenize='porter unicode61')")
+            except OperationalError:
+                # sqlite was compiled without FTS5
+                continue
+            schema_editor.execute(f'INSERT INTO {search_table} ({id_column}, document) {select_documents}')
+
+
+def drop_search_tables(apps, schema_editor):
+    for search_table, _, _, _ in SEARCH_TABLES:
+        schema_editor.execute(f'DROP TABLE IF EXISTS {search_table}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0011_scheduler_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_tables, drop_search_tables),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from questions.partitions import PARTITIONED_TABLES, unpartition_table
+
+# Partitioning the history tables is explicit, with "./manage.py partition_history --convert" (postgres only; see
+# questions.partitions), so that the schema that migrate creates doesn't depend on the environment.  Forwards, this
+# migration does nothing.  Backwards, it converts partitioned tables back to regular tables, so that a db whose
+# tables were converted can be migrated back to before partitioning existed.
+
+
+def unpartition_history(apps, schema_editor):
+    using = schema_editor.connection.alias
+    for table in PARTITIONED_TABLES:
+        unpartition_table(table=table, using=using)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0013_archivedhistory'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, unpartition_history),
+    ]
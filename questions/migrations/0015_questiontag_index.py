@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0014_partition_history'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='questiontag',
+            index=models.Index(fields=['question', 'tag'], name='questions_q_questio_e841ea_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0015_questiontag_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudySession',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime_added', models.DateTimeField(auto_now_add=True)),
+                ('datetime_updated', models.DateTimeField(auto_now=True)),
+                ('query_name', models.TextField()),
+                ('tag_ids_selected', models.TextField()),
+                ('tag_ids_expanded', models.JSONField(default=list)),
+                ('tag_ids_remaining', models.JSONField(default=list)),
+                ('tag_index', models.PositiveIntegerField(default=0)),
+                ('cards_per_tag', models.PositiveIntegerField(default=1)),
+                ('count_answered_for_tag', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'query_name', 'tag_ids_selected', 'cards_per_tag'], name='questions_s_user_id_0ba951_idx')],
+            },
+        ),
+    ]
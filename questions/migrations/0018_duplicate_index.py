@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0017_offlinereview'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionLSHBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['user', 'content_hash'], name='questions_q_user_id_d571cb_idx'),
+        ),
+        migrations.AddField(
+            model_name='questionlshbucket',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='questions.question'),
+        ),
+        migrations.AddField(
+            model_name='questionlshbucket',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='questionlshbucket',
+            index=models.Index(fields=['user', 'band', 'bucket'], name='questions_q_user_id_a9572d_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0018_duplicate_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedRow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime_deleted', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('table', models.CharField(max_length=100)),
+                ('row_id', models.BigIntegerField()),
+                ('user_id', models.IntegerField(null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='answer',
+            name='datetime_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='archivedhistory',
+            name='datetime_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='attempt',
+            name='datetime_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='offlinereview',
+            name='datetime_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='datetime_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='questiontag',
+            name='datetime_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='schedule',
+            name='datetime_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='studysession',
+            name='datetime_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='datetime_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='taglineage',
+            name='datetime_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
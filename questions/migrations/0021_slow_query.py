@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0020_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime_added', models.DateTimeField(auto_now_add=True)),
+                ('db_alias', models.CharField(max_length=100)),
+                ('duration_ms', models.FloatField()),
+                ('sql', models.TextField()),
+                ('params', models.TextField(blank=True, default='')),
+                ('origin', models.CharField(blank=True, default='', max_length=500)),
+                ('view', models.CharField(blank=True, default='', max_length=200)),
+                ('plan', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'verbose_name_plural': 'slow queries',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0021_slow_query'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['user', 'date_show_next'], name='questions_s_user_id_aa5e57_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+from django.db import migrations
+
+# Triggers that add a tombstone (a DeletedRow) for each row deleted from the tables in the incremental backups (see
+# questions.backups), in the db, rather than with post_delete receivers (which turn off Django's fast deletes, and
+# add one tombstone per INSERT).  They also add the tombstones of rows deleted with QuerySet._raw_delete().
+#   - Postgres: a statement trigger per table, which adds all of a DELETE's tombstones with one INSERT (from the
+#     transition table of the deleted rows).  On a partitioned table, it's on the parent (see questions.partitions,
+#     which re-creates it when converting a table).
+#   - sqlite: a row trigger per table.
+# Other db's don't get the triggers: take a new base backup (--full) after deleting rows.
+
+# (table, the column with the row's user id), for the tables in questions.backups.BACKUP_MODELS
+TOMBSTONE_TABLES = (
+    ('emailusername_user', 'id'),
+    ('questions_tag', 'user_id'),
+    ('questions_taglineage', 'user_id'),
+    ('questions_answer', 'user_id'),
+    ('questions_question', 'user_id'),
+    ('questions_questiontag', 'user_id'),
+    ('questions_attempt', 'user_id'),
+    ('questions_schedule', 'user_id'),
+    ('questions_archivedhistory', 'user_id'),
+    ('questions_studysession', 'user_id'),
+    ('questions_offlinereview', 'user_id'),
+)
+POSTGRES_FUNCTION = 'questions_add_tombstones'
+
+
+def get_trigger_name(table):
+    return f'{table}_tombstones'
+
+
+def create_tombstone_triggers(apps, schema_editor):
+    # The statements have no params (params=None), so that the "%"s in them aren't taken as placeholders
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        # TG_ARGV[0] is the column with the row's user id
+        schema_editor.execute(
+            f"CREATE FUNCTION {POSTGRES_FUNCTION}() RETURNS trigger LANGUAGE plpgsql AS $$ "
+            f"BEGIN "
+            f"EXECUTE format('INSERT INTO questions_deletedrow (datetime_deleted, \"table\", row_id, user_id) "
+            f"SELECT clock_timestamp(), %L, id, %I FROM deleted_rows', TG_TABLE_NAME, TG_ARGV[0]); "
+            f"RETURN NULL; "
+            f"END $$", params=None)
+        for table, user_column in TOMBSTONE_TABLES:
+            schema_editor.execute(
+                f'CREATE TRIGGER {get_trigger_name(table)} AFTER DELETE ON {table} REFERENCING OLD TABLE AS deleted_rows '
+                f"FOR EACH STATEMENT EXECUTE FUNCTION {POSTGRES_FUNCTION}('{user_column}')", params=None)
+    elif vendor == 'sqlite':
+        for table, user_column in TOMBSTONE_TABLES:
+            # The datetime in the format of Django's sqlite DateTimeFields (UTC)
+            schema_editor.execute(
+                f'CREATE TRIGGER {get_trigger_name(table)} AFTER DELETE ON {table} FOR EACH ROW BEGIN '
+                f'INSERT INTO questions_deletedrow (datetime_deleted, "table", row_id, user_id) '
+                f"VALUES (strftime('%Y-%m-%d %H:%M:%f', 'now'), '{table}', OLD.id, OLD.{user_column}); "
+                f'END', params=None)
+
+
+def drop_tombstone_triggers(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in ('postgresql', 'sqlite'):
+        return
+    for table, _ in TOMBSTONE_TABLES:
+        on_table = f' ON {table}' if vendor == 'postgresql' else ''
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {get_trigger_name(table)}{on_table}', params=None)
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP FUNCTION IF EXISTS {POSTGRES_FUNCTION}()', params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emailusername', '0001_initial'),
+        ('questions', '0022_schedule_due_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_tombstone_triggers, drop_tombstone_triggers),
+    ]
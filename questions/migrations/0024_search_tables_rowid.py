@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# On sqlite, the FTS5 search tables (see 0012_search_tables) keep each object's row at rowid = the object's id, so
+# that questions.search updates a row by its rowid (an indexed lookup), rather than by the UNINDEXED id column (a scan
+# of the whole table).  This re-inserts the existing rows with their ids as rowids.  Postgres' search tables are keyed
+# by their id column already.
+
+# (search table, id column)
+SEARCH_TABLES = (
+    ('questions_question_search', 'question_id'),
+    ('questions_answer_search', 'answer_id'),
+    ('questions_attempt_search', 'attempt_id'),
+)
+
+
+def set_rowids(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    table_names = connection.introspection.table_names()
+    for search_table, id_column in SEARCH_TABLES:
+        if search_table not in table_names:
+            # sqlite was compiled without FTS5
+            continue
+        schema_editor.execute(f'CREATE TEMPORARY TABLE {search_table}_rows AS SELECT {id_column}, document FROM {search_table}')
+        schema_editor.execute(f'DELETE FROM {search_table}')
+        schema_editor.execute(
+            f'INSERT INTO {search_table} (rowid, {id_column}, document) '
+            f'SELECT {id_column}, {id_column}, document FROM {search_table}_rows GROUP BY {id_column}')
+        schema_editor.execute(f'DROP TABLE {search_table}_rows')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0023_tombstone_triggers'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_rowids, migrations.RunPython.noop),
+    ]
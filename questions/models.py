@@ -22,9 +22,21 @@ CHOICES_UNITS = (
 )
 
 
+# The largest interval_secs (an IntegerField), about 68 years
+MAX_INTERVAL_SECS = 2 ** 31 - 1
+
+
+def get_interval_secs(date_show_next, datetime_added):
+    # Return Schedule.interval_secs: the number of seconds from datetime_added until date_show_next, limited to what
+    # fits in an IntegerField (e.g., 999 years doesn't)
+    interval_secs = round((date_show_next - datetime_added).total_seconds())
+    return max(-MAX_INTERVAL_SECS, min(interval_secs, MAX_INTERVAL_SECS))
+
+
 class CreatedBy(models.Model):
     datetime_added = models.DateTimeField(auto_now_add=True)
-    datetime_updated = models.DateTimeField(auto_now=True)
+    # indexed for the incremental backups' "changed since" queries (see questions.backups)
+    datetime_updated = models.DateTimeField(auto_now=True, db_index=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=False)
 
     class Meta:
@@ -33,6 +45,8 @@ class CreatedBy(models.Model):
 class Question(CreatedBy):
     question = models.TextField()
     answer = models.ForeignKey('Answer', on_delete=models.CASCADE, null=True, blank=True)
+    # A hash of the normalized question and answer text, for finding exact duplicates (see questions.duplicates)
+    content_hash = models.CharField(max_length=40, blank=True, default='', editable=False)
     # attempt_set
     # questiontag_set
     # schedule_set
@@ -40,14 +54,32 @@ class Question(CreatedBy):
     # user
     # user_set
 
+    class Meta:
+        indexes = [
+            # For the scheduler's "oldest unseen question" ordering, e.g., QUERY_UNSEEN
+            models.Index(fields=['user', 'datetime_added']),
+            # For looking up a user's exact duplicates (see questions.duplicates)
+            models.Index(fields=['user', 'content_hash']),
+        ]
+
     def __str__(self):
         return '<Question id=[%s] question=[%s] datetime_added=[%s]>' % (self.id, self.question, self.datetime_added)
 
+    def save(self, *args, **kwargs):
+        # Set the content_hash here, rather than in the duplicate index's background job, so that a question's exact
+        # duplicates are found as soon as it's saved (see questions.duplicates)
+        from questions.duplicates import get_content_hash
+        self.content_hash = get_content_hash(question=self.question, answer=self.answer.answer if self.answer_id else None)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'content_hash'}
+        super().save(*args, **kwargs)
+
 @receiver(post_delete, sender=Question)
-def delete_answer(sender, instance, **kwargs):
-    # After a Question is deleted, delete its Answer if there is one.
-    if instance.answer:
-        instance.answer.delete()
+def delete_answer(sender, instance, using, **kwargs):
+    # After a Question is deleted, delete its Answer if there is one.  (It may already be deleted, e.g., when deleting
+    # a user cascades to the answers, or when restoring the tombstones of a backup; see questions.backups.)
+    if instance.answer_id:
+        Answer.objects.using(using).filter(id=instance.answer_id).delete()
 
 
 
@@ -125,10 +157,38 @@ class QuestionTag(CreatedBy):
     # user
     # user_set
 
+    class Meta:
+        indexes = [
+            # For the scheduler's "question has one of the selected tags" EXISTS subqueries (question_id = ? AND tag_id IN (...)).
+            # Without it, the db may use the tag_id index, and scan all of a tag's questions for each question.
+            models.Index(fields=['question', 'tag']),
+        ]
+
     def __str__(self):
         return 'QuestionTag: tag.name=[%s] question.id=[%s]' % (self.tag.name, self.question.id)
 
 
+class ScheduleQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # Set the date_show_next and interval_secs of the schedules that don't have them (like Schedule.save() does)
+        # in one pass, without a save() (and a query) per schedule.  The schedules that have them (e.g., restored or
+        # imported ones) are kept as they are.
+        objs = list(objs)
+        time_now = timezone.now()
+        for schedule in objs:
+            if schedule.date_show_next is None or schedule.interval_secs is None:
+                schedule.set_date_show_next(time_now=time_now)
+        objs = super().bulk_create(objs, *args, **kwargs)
+        # bulk_create() doesn't send post_save, so invalidate the due forecasts and count the writes here (imported
+        # here, since those modules import this one)
+        from questions.due_forecast import invalidate_due_forecasts
+        from questions.metrics import SCHEDULES_WRITTEN
+        for user_id in {schedule.user_id for schedule in objs}:
+            invalidate_due_forecasts(user_id=user_id)
+        SCHEDULES_WRITTEN.inc(len(objs))
+        return objs
+
+
 class Schedule(CreatedBy):
     # A record indicating the next time that a question should be shown.
     date_show_next = models.DateTimeField(null=True, default=None)  # when to show the question next
@@ -141,32 +201,213 @@ class Schedule(CreatedBy):
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     # user
 
+    class Meta:
+        indexes = [
+            # For the scheduler's "newest schedule for each question" subqueries (ORDER BY datetime_added DESC LIMIT 1)
+            models.Index(fields=['question', 'user', '-datetime_added']),
+            # For QUERY_RANDOM_IN_DUE_WINDOW's probe of the schedules due at or after a time
+            models.Index(fields=['user', 'date_show_next']),
+        ]
+
+    objects = ScheduleQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         # Note that datetime_added and datetime_updated are not set until super() is called.
         # Rather than doing 2 db calls, get a new timezone.now instead, which will be slightly off
         # (maybe a fraction of a second) from datetime_added and datetime_updated.
-        time_now = timezone.now()
-        if self.interval_num is not None:
-            if self.interval_unit in ('months', 'years'):
-                interval_num = int(self.interval_num)
-            else:
-                interval_num = float(self.interval_num)
-        else:
-            interval_num = 0
+        if self.interval_num is None:
             self.interval_unit = 'seconds'
-        interval = relativedelta(**({self.interval_unit: interval_num}))
-        # TODO: set interval_secs
+        self.set_date_show_next(time_now=timezone.now())
+        return super(Schedule, self).save(*args, **kwargs)
+
+    def set_date_show_next(self, time_now):
+        # Set date_show_next (unless it's already set) to time_now + the interval, and interval_secs to the number of
+        # seconds from when the record was added (time_now for a new record) until date_show_next.
+        # No db calls, so it can be used for many schedules at once (see ScheduleQuerySet.bulk_create()).
         if self.date_show_next:
             # It's already set, so don't modify it.  e.g., modifying the
             # schedule in the django admin.
             pass
         else:
             try:
-                self.date_show_next = time_now + interval
+                self.date_show_next = time_now + self._get_interval()
             except TypeError as exception:
                 print("Exception: interval_unit=[%s] interval_num=[%s] type(interval_num)=[%s] "
                       "exception=[%s]" % (
-                          self.interval_unit, interval_num, type(interval_num), exception))
+                          self.interval_unit, self.interval_num, type(self.interval_num), exception))
                 raise
-        return super(Schedule, self).save(*args, **kwargs)
-    
\ No newline at end of file
+        self.interval_secs = get_interval_secs(date_show_next=self.date_show_next, datetime_added=self.datetime_added or time_now)
+
+    def _get_interval(self):
+        # The interval (a relativedelta) of interval_num interval_units; none if there's no interval_num
+        if self.interval_num is None:
+            return relativedelta()
+        if self.interval_unit in ('months', 'years'):
+            interval_num = int(self.interval_num)
+        else:
+            interval_num = float(self.interval_num)
+        return relativedelta(**({self.interval_unit: interval_num}))
+
+
+class ArchivedHistory(CreatedBy):
+    # The number of a question's Schedule's and Attempt's (for the user) that were archived, i.e., moved out of their
+    # tables and into archive files by "./manage.py archive_history".  Counts of all of a question's history
+    # (e.g., NextQuestion.count_times_question_seen) add these.
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    count_attempts = models.PositiveIntegerField(default=0)
+    count_schedules = models.PositiveIntegerField(default=0)
+    # user
+
+    class Meta:
+        unique_together = ('question', 'user')
+
+
+class StudySession(CreatedBy):
+    # A round-robin pass through the selected tags, one tag at a time (see TODO.md "iterate through x selected tags one
+    # at a time, select y cards from each tag"): NextQuestion picks from the current tag only, and after cards_per_tag
+    # answers, the session moves on to the next tag.  Tags with no question left to pick are dropped from
+    # tag_ids_remaining; when none are left, the next round starts with all of tag_ids_expanded again.
+    # Selecting the same tags, query and cards_per_tag again resumes the same session (see questions.study_session).
+    query_name = models.TextField()
+    tag_ids_selected = models.TextField()  # comma-separated, as in the urls (TagList.as_id_comma_str())
+    tag_ids_expanded = models.JSONField(default=list)  # the selected tags and their descendants, in the order of the turns
+    tag_ids_remaining = models.JSONField(default=list)  # the tags still in this round, in the order of the turns
+    tag_index = models.PositiveIntegerField(default=0)  # the current tag: tag_ids_remaining[tag_index]
+    cards_per_tag = models.PositiveIntegerField(default=1)
+    count_answered_for_tag = models.PositiveIntegerField(default=0)  # answers for the current tag in its current turn
+    # user
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'query_name', 'tag_ids_selected', 'cards_per_tag']),
+        ]
+
+    def get_current_tag_id(self):
+        if not self.tag_ids_remaining:
+            return None
+        return self.tag_ids_remaining[self.tag_index % len(self.tag_ids_remaining)]
+
+    def record_answer(self, tag_id=None):
+        # Count an answer for tag_id (the tag that its question was picked from; the current tag if none), and move on to
+        # the next tag once it has had cards_per_tag answers.  NextQuestion drops the tags before tag_id that have no
+        # question to pick only in memory (it runs for GETs), so drop them here first.
+        if tag_id in self.tag_ids_remaining:
+            while self.get_current_tag_id() != tag_id:
+                self.drop_current_tag()
+        self.count_answered_for_tag += 1
+        if self.count_answered_for_tag >= self.cards_per_tag:
+            self.tag_index = (self.tag_index + 1) % max(1, len(self.tag_ids_remaining))
+            self.count_answered_for_tag = 0
+        self._save_cursor()
+
+    def drop_current_tag(self):
+        # Remove the current tag from this round (it has no question to pick), and make the next tag current.
+        # When the round has no tags left, start the next round.  Doesn't save it (see record_answer()).
+        index = self.tag_index % len(self.tag_ids_remaining)
+        self.tag_ids_remaining = self.tag_ids_remaining[:index] + self.tag_ids_remaining[index + 1:]
+        if not self.tag_ids_remaining:
+            self.tag_ids_remaining = list(self.tag_ids_expanded)
+        self.tag_index = index % max(1, len(self.tag_ids_remaining))
+        self.count_answered_for_tag = 0
+
+    def _save_cursor(self):
+        self.save(update_fields=['tag_ids_remaining', 'tag_index', 'count_answered_for_tag', 'datetime_updated'])
+
+
+class OfflineReview(CreatedBy):
+    # A receipt for a review (an Attempt and a Schedule) that was made offline and uploaded by the bulk sync endpoint
+    # (see questions.offline), so that uploading the same review again (e.g., a retry after a dropped connection)
+    # doesn't apply it twice.
+    client_id = models.UUIDField()  # generated by the client for each review
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    # user
+
+    class Meta:
+        unique_together = ('user', 'client_id')
+
+
+class QuestionLSHBucket(models.Model):
+    # The locality-sensitive hashing (LSH) buckets of a question's MinHash signature, one row per band, for finding
+    # near-duplicate questions: questions that share a bucket in any band are candidates (see questions.duplicates).
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'band', 'bucket']),
+        ]
+
+
+class DeletedRow(models.Model):
+    # A tombstone for a deleted row, so that an incremental backup can record deletions (see questions.backups).
+    # Not a CreatedBy: the ids are plain ints rather than foreign keys, since the rows (and the user) are gone.
+    datetime_deleted = models.DateTimeField(auto_now_add=True, db_index=True)
+    table = models.CharField(max_length=100)  # the model's db_table
+    row_id = models.BigIntegerField()
+    user_id = models.IntegerField(null=True)
+
+
+class Job(models.Model):
+    # A background job (see questions.jobs): a call of a registered function with args, run by "./manage.py run_worker"
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    CHOICES_STATUS = (
+        (STATUS_PENDING, STATUS_PENDING),
+        (STATUS_RUNNING, STATUS_RUNNING),
+        (STATUS_DONE, STATUS_DONE),
+        (STATUS_FAILED, STATUS_FAILED),
+    )
+
+    datetime_added = models.DateTimeField(auto_now_add=True)
+    datetime_updated = models.DateTimeField(auto_now=True)
+    name = models.CharField(max_length=100)  # the registered name of the function
+    args = models.JSONField(default=dict)  # the function's keyword arguments
+    # Jobs with the same coalesce_key (e.g., "update_duplicate_index:<user id>") are run once: enqueuing a job while
+    # another with the same key is pending adds nothing
+    coalesce_key = models.CharField(max_length=200, blank=True, default='')
+    priority = models.SmallIntegerField(default=0)  # higher runs first
+    status = models.CharField(max_length=10, choices=CHOICES_STATUS, default=STATUS_PENDING)
+    run_after = models.DateTimeField()  # not run before this (e.g., the backoff of a retry)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    datetime_started = models.DateTimeField(null=True, default=None)  # of the current or last attempt
+    datetime_finished = models.DateTimeField(null=True, default=None)
+    worker = models.CharField(max_length=100, blank=True, default='')  # the worker that claimed the job
+    error = models.TextField(blank=True, default='')  # the traceback of the last failed attempt
+
+    class Meta:
+        indexes = [
+            # For claiming the next job: the pending jobs, by priority
+            models.Index(fields=['status', '-priority', 'run_after']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['coalesce_key'], name='unique_pending_job_coalesce_key',
+                condition=models.Q(status='pending') & ~models.Q(coalesce_key='')),
+        ]
+
+    def __str__(self):
+        return f'<Job id=[{self.id}] name=[{self.name}] status=[{self.status}]>'
+
+
+class SlowQuery(models.Model):
+    # A query that took longer than settings.SLOW_QUERY_MS, with the code that ran it, and (for a sample) its plan.
+    # Only the newest settings.SLOW_QUERY_KEEP are kept.  See questions.slow_queries.
+    datetime_added = models.DateTimeField(auto_now_add=True)
+    db_alias = models.CharField(max_length=100)
+    duration_ms = models.FloatField()
+    sql = models.TextField()
+    params = models.TextField(blank=True, default='')  # repr() of the params
+    origin = models.CharField(max_length=500, blank=True, default='')  # "<file>:<line> in <function>" of this repo
+    view = models.CharField(max_length=200, blank=True, default='')  # the request's view name, e.g., "admin:..."
+    plan = models.TextField(blank=True, default='')  # EXPLAIN output, if sampled
+
+    class Meta:
+        verbose_name_plural = 'slow queries'
+
+    def __str__(self):
+        return f'<SlowQuery id=[{self.id}] duration_ms=[{self.duration_ms:.1f}] origin=[{self.origin}]>'
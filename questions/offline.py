@@ -0,0 +1,195 @@
+import datetime
+import gzip
+import hashlib
+import json
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from emailusername.models import User
+from questions.db_router import replica_reads
+from questions.get_next_question import QuestionSelection
+from questions.metrics import ATTEMPTS_WRITTEN
+from questions.models import CHOICES_UNITS, Attempt, OfflineReview, Question, Schedule
+from questions.search import ATTEMPT_SEARCH
+
+'''
+Offline review, e.g., on a phone with a bad connection: download a deck once, review it offline, and upload all the
+reviews at once, rather than a GET, a POST and a redirect per card.
+
+    - OfflineDeck: a snapshot of a tag selection (the questions, answers, each question's newest schedule, and the tag
+      names), as gzipped JSON, with an ETag, so that an unchanged deck isn't downloaded again.
+    - apply_offline_reviews(): applies a batch of reviews (an Attempt and a Schedule each) in one transaction, with
+      bulk_create().  Each review has a client-generated id, and a review that was already applied is skipped, so
+      a batch can be uploaded again after a failed or interrupted upload.
+
+The deck format (DECK_FORMAT_VERSION):
+    {"format": 1, "generated_at": "<iso datetime>", "tag_ids_selected": [1, 2], "tags": {"1": "<tag name>", ...},
+     "questions": [{"id": 5, "question": "...", "answer": "..." or null, "tag_ids": [1],
+                    "schedule": null or {"datetime_added": "...", "date_show_next": "...", "interval_num": "1.00",
+                                         "interval_unit": "days"}}, ...]}
+
+The sync format (a JSON body, optionally with "Content-Encoding: gzip"):
+    {"format": 1, "reviews": [{"id": "<uuid>", "question_id": 5, "reviewed_at": "<iso datetime>", "attempt": "...",
+                               "percent_correct": 80, "percent_importance": 50, "interval_num": 1,
+                               "interval_unit": "days"}, ...]}
+"reviewed_at" is the client's time of the review: the schedule's date_show_next is reviewed_at + the interval, and the
+attempt's and schedule's datetime_added are reviewed_at, so that a review uploaded after a newer one (e.g., made online
+in the meantime) doesn't become the question's newest schedule.
+'''
+
+DECK_FORMAT_VERSION = 1
+MAX_SYNC_REVIEWS = 5000  # reviews per upload
+UNITS = {unit for unit, _ in CHOICES_UNITS}
+
+
+class OfflineDeck(QuestionSelection):
+    @replica_reads()
+    def __init__(self, user, tag_ids_selected, search_text=None):
+        super().__init__(tag_ids_selected=tag_ids_selected, user=user, search_text=search_text)
+        self.content, self.etag = self._get_content_and_etag()  # the gzipped JSON, and its ETag
+
+    def as_dict(self):
+        # One query for the questions, their answers and their newest schedules; the tags are from the tag hierarchy.
+        rows = (self._annotate_last_schedule(queryset=self._queryset__questions_tagged)
+                .order_by('id')
+                .values('id', 'question', 'answer__answer', *(
+                    f'last_schedule_{field}' for field in ('datetime_added', 'date_show_next', 'interval_num', 'interval_unit'))))
+        tag_ids_for_question = {}
+        for tag_id in sorted(self._tag_ids_selected_expanded):
+            for question_id in self._tag_hierarchy[tag_id]['question_ids_for_tag']:
+                tag_ids_for_question.setdefault(question_id, []).append(tag_id)
+        return dict(
+            format=DECK_FORMAT_VERSION,
+            generated_at=timezone.now(),
+            tag_ids_selected=self._tag_ids_selected,
+            tags={tag_id: str(self._tag_hierarchy[tag_id]['tag_name']) for tag_id in sorted(self._tag_ids_selected_expanded)},
+            questions=[
+                dict(
+                    id=row['id'],
+                    question=row['question'],
+                    answer=row['answer__answer'],
+                    tag_ids=tag_ids_for_question.get(row['id'], []),
+                    schedule=None if row['last_schedule_datetime_added'] is None else dict(
+                        datetime_added=row['last_schedule_datetime_added'],
+                        date_show_next=row['last_schedule_date_show_next'],
+                        interval_num=row['last_schedule_interval_num'],
+                        interval_unit=row['last_schedule_interval_unit'],
+                    ))
+                for row in rows
+            ])
+
+    def _get_content_and_etag(self):
+        deck = self.as_dict()
+        content = json.dumps(deck, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+        # The ETag is a hash of everything but generated_at, so it only changes when the deck does
+        deck.pop('generated_at')
+        etag = hashlib.sha1(json.dumps(deck, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')).hexdigest()
+        return gzip.compress(content), f'"{etag}"'
+
+
+@transaction.atomic
+def apply_offline_reviews(user, reviews):
+    # Apply the reviews (the "reviews" of the sync format) for user, in one transaction.
+    # Returns (applied, skipped): the client ids of the reviews applied, and of those already applied before.
+    # Raises ValueError for an invalid batch (then nothing is applied).
+    if len(reviews) > MAX_SYNC_REVIEWS:
+        raise ValueError(f'Too many reviews: [{len(reviews)}] (max [{MAX_SYNC_REVIEWS}])')
+    reviews_by_client_id = {}
+    for review in reviews:
+        review = _parse_review(review)
+        reviews_by_client_id.setdefault(review['client_id'], review)
+
+    # Lock the user's row, so that concurrent uploads of the same batch (e.g., a retry) are applied one after the other
+    User.objects.select_for_update().filter(id=user.id).first()
+    skipped = set(OfflineReview.objects
+                  .filter(user=user, client_id__in=reviews_by_client_id.keys())
+                  .values_list('client_id', flat=True))
+    # In the order of the reviews, so that a question's last review is its newest schedule
+    new_reviews = sorted(
+        (review for client_id, review in reviews_by_client_id.items() if client_id not in skipped),
+        key=lambda review: review['reviewed_at'])
+    question_ids = {review['question_id'] for review in new_reviews}
+    unknown_question_ids = question_ids - set(Question.objects.filter(user=user, id__in=question_ids).values_list('id', flat=True))
+    if unknown_question_ids:
+        raise ValueError(f'Unknown question ids: {sorted(unknown_question_ids)}')
+
+    attempts = Attempt.objects.bulk_create([
+        Attempt(attempt=review['attempt'], question_id=review['question_id'], user=user) for review in new_reviews])
+    _set_datetime_added(model=Attempt, rows=attempts, reviews=new_reviews)
+    # bulk_create() doesn't send post_save, which updates the search index and the metrics
+    ATTEMPT_SEARCH.update(ids=[attempt.id for attempt in attempts])
+    ATTEMPTS_WRITTEN.inc(len(attempts))
+    schedules = []
+    for review in new_reviews:
+        schedule = Schedule(
+            percent_correct=review['percent_correct'],
+            percent_importance=review['percent_importance'],
+            interval_num=review['interval_num'],
+            interval_unit=review['interval_unit'],
+            question_id=review['question_id'],
+            user=user)
+        # Due an interval after the review, not after the upload
+        schedule.set_date_show_next(time_now=review['reviewed_at'])
+        schedules.append(schedule)
+    Schedule.objects.bulk_create(schedules)
+    _set_datetime_added(model=Schedule, rows=schedules, reviews=new_reviews)
+    OfflineReview.objects.bulk_create([
+        OfflineReview(client_id=review['client_id'], question_id=review['question_id'], user=user) for review in new_reviews])
+    return [str(review['client_id']) for review in new_reviews], [str(client_id) for client_id in skipped]
+
+
+def _set_datetime_added(model, rows, reviews):
+    # Set each row's datetime_added (a model row, just bulk_create()'d for the review at the same index) to
+    # the review's reviewed_at.  bulk_create() sets it to now (auto_now_add), but bulk_update() saves the values as they
+    # are (it doesn't call pre_save()), and leaves datetime_updated as now, so the incremental backups still see the rows.
+    for row, review in zip(rows, reviews):
+        row.datetime_added = review['reviewed_at']
+    model.objects.bulk_update(rows, ['datetime_added'])
+
+
+def _parse_review(review):
+    # Return the review (a dict of the sync format) with its values converted and checked; raise ValueError if invalid
+    try:
+        client_id = uuid.UUID(str(review['id']))
+        question_id = int(review['question_id'])
+        reviewed_at = parse_datetime(str(review['reviewed_at']))
+    except (KeyError, TypeError, ValueError) as exception:
+        raise ValueError(f'Invalid review: [{review}]: {exception!r}')
+    if reviewed_at is None:
+        raise ValueError(f'Invalid reviewed_at: [{review["reviewed_at"]}]')
+    if timezone.is_naive(reviewed_at):
+        reviewed_at = reviewed_at.replace(tzinfo=datetime.timezone.utc)
+    interval_unit = review.get('interval_unit') or None
+    if interval_unit is not None and interval_unit not in UNITS:
+        raise ValueError(f'Invalid interval_unit: [{interval_unit}]')
+    interval_num = _parse_decimal(review, 'interval_num')
+    if interval_num is not None and interval_unit is None:
+        raise ValueError(f'interval_num without interval_unit: [{review}]')
+    return dict(
+        client_id=client_id,
+        question_id=question_id,
+        # A client's clock can be ahead
+        reviewed_at=min(reviewed_at, timezone.now()),
+        attempt=str(review.get('attempt') or ''),
+        percent_correct=_parse_decimal(review, 'percent_correct'),
+        percent_importance=_parse_decimal(review, 'percent_importance'),
+        interval_num=interval_num,
+        interval_unit=interval_unit,
+    )
+
+
+def _parse_decimal(review, key):
+    # Return the value of the Schedule field key, checked by the field (e.g., that it fits in its max_digits, which
+    # would otherwise be a DataError when saving on Postgres), or None if there isn't one
+    value = review.get(key)
+    if value is None or value == '':
+        return None
+    try:
+        return Schedule._meta.get_field(key).clean(str(value), None)
+    except ValidationError as exception:
+        raise ValueError(f'Invalid {key}: [{value}]: {" ".join(exception.messages)}')
@@ -0,0 +1,237 @@
+import datetime
+import re
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+'''
+Optional Postgres declarative partitioning of the history tables (Schedule and Attempt) by datetime_added month.
+
+The history tables only grow, while the queries that matter most only look at recent rows (e.g., "schedules added
+in the last 60 minutes" in NextQuestion._get_count_recent_seen()).  With a partition per month, the db only reads
+the partitions whose months overlap the query's datetime_added range ("partition pruning").
+
+Partitioning is explicit, so that the schema that migrate creates never depends on the environment:
+    - "./manage.py partition_history --convert" converts the tables (in one transaction per table)
+    - after each migrate, and whenever "./manage.py partition_history" runs (e.g., daily from cron), partitions are
+      created for the next settings.DB_PARTITION_MONTHS_AHEAD months (if the tables are partitioned)
+    - migrating back past 0014_partition_history converts them back to regular tables
+Code that depends on the schema checks is_partitioned() (e.g., questions.backups).
+A DEFAULT partition catches rows for months without a partition; creating a month's partition moves its rows out
+of the DEFAULT partition.
+
+Partitioning is a Postgres feature, so on other db's (e.g., sqlite for the tests) all of this does nothing, and the
+tables stay regular tables.
+
+Notes on the partitioned tables:
+    - The primary key is (id, datetime_added), because a partitioned table's unique constraints must include the
+      partition key.  "id" is still unique in practice (it comes from a sequence), and Django still uses it as the pk.
+    - Foreign keys can't reference a partitioned table's "id" alone, so those are dropped (i.e., the full-text search
+      table's foreign key to questions_attempt; "./manage.py rebuild_search_index" removes rows for deleted attempts).
+    - The indexes, foreign keys and triggers (i.e., the backups' tombstone trigger) are re-created on the new table.
+'''
+
+PARTITIONED_TABLES = ('questions_schedule', 'questions_attempt')
+PARTITION_KEY = 'datetime_added'
+
+
+def is_supported(using='default'):
+    return connections[using].vendor == 'postgresql'
+
+
+def get_month_starts(start, months):
+    # Return the first instant (in UTC) of each of the months months, starting with the month of start, e.g.,
+    #   get_month_starts(start=datetime(2026, 11, 15), months=3) == [datetime(2026, 11, 1), datetime(2026, 12, 1), datetime(2027, 1, 1)]
+    start = start.astimezone(datetime.timezone.utc)
+    year, month = start.year, start.month
+    month_starts = []
+    for _ in range(months):
+        month_starts.append(datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return month_starts
+
+
+def get_partition_name(table, month_start):
+    # e.g., "questions_schedule_p202611"
+    return f'{table}_p{month_start:%Y%m}'
+
+
+def get_default_partition_name(table):
+    return f'{table}_default'
+
+
+def get_create_partition_sql(table, month_start, month_end):
+    # Return the statements that add the partition for [month_start, month_end) to table.
+    # The rows for that month are first moved out of the DEFAULT partition (if any are there, attaching the partition
+    # would fail), into a new table, which is then attached as the partition.
+    partition = get_partition_name(table=table, month_start=month_start)
+    default_partition = get_default_partition_name(table=table)
+    bounds = f"'{month_start.isoformat()}'", f"'{month_end.isoformat()}'"
+    in_month = f'{PARTITION_KEY} >= {bounds[0]} AND {PARTITION_KEY} < {bounds[1]}'
+    return [
+        f'CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+        f'INSERT INTO {partition} SELECT * FROM {default_partition} WHERE {in_month}',
+        f'DELETE FROM {default_partition} WHERE {in_month}',
+        f'ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM ({bounds[0]}) TO ({bounds[1]})',
+    ]
+
+
+def get_recreate_sql(table, table_old, definitions):
+    # Return the statements that re-create the indexes, foreign keys and triggers of table_old on table.
+    # definitions: [(kind, name, definition), ...] as returned by _get_definitions(), where kind is 'index', 'fk' or
+    # 'trigger'
+    statements = []
+    for kind, name, definition in definitions:
+        if kind in ('index', 'trigger'):
+            # e.g., "CREATE INDEX name ON public.questions_schedule_old USING btree (...)" (or "ON ONLY ..." for a partitioned
+            # table), or "CREATE TRIGGER name AFTER DELETE ON public.questions_schedule_old ..."
+            statements.append(re.sub(rf' ON (ONLY )?(\S+\.)?{table_old} ', f' ON {table} ', definition, count=1))
+        else:
+            statements.append(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+    return statements
+
+
+def is_partitioned(table, using='default'):
+    if not is_supported(using=using):
+        return False
+    with connections[using].cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [table])
+        return cursor.fetchone() is not None
+
+
+def partition_table(table, months_ahead, using='default'):
+    # Convert table to a table partitioned by month, with partitions from the month of its oldest row until
+    # months_ahead months from now, and a DEFAULT partition.  Does nothing if it's already partitioned.
+    if not is_supported(using=using) or is_partitioned(table=table, using=using):
+        return
+    table_old = f'{table}_unpartitioned'
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        # Check the deferred foreign keys of this transaction's earlier writes now: ALTER TABLE fails on a table with
+        # pending trigger events
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {table_old}')
+        definitions = _get_definitions(cursor=cursor, table=table_old)
+        _drop_definitions(cursor=cursor, table=table_old, definitions=definitions)
+        _drop_referencing_foreign_keys(cursor=cursor, table=table_old)
+        # Identity columns can't be used for partitioned tables (before Postgres 17), so use a sequence for id instead:
+        # dbs created by newer Django versions have an identity column (dropping it drops its sequence), and dbs created
+        # by older versions have a "serial" column (a default of nextval() of a sequence owned by the column).
+        cursor.execute(f'ALTER TABLE {table_old} ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table_old])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(f'CREATE TABLE {table} (LIKE {table_old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE ({PARTITION_KEY})')
+        if sequence:
+            # LIKE copied the nextval() default
+            cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+        else:
+            sequence = f'{table}_id_seq'
+            cursor.execute(f'CREATE SEQUENCE {sequence} OWNED BY {table}.id')
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+        cursor.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, {PARTITION_KEY})')
+        for statement in get_recreate_sql(table=table, table_old=table_old, definitions=definitions):
+            cursor.execute(statement)
+        cursor.execute(f'CREATE TABLE {get_default_partition_name(table=table)} PARTITION OF {table} DEFAULT')
+
+        cursor.execute(f'SELECT MIN({PARTITION_KEY}) FROM {table_old}')
+        oldest = cursor.fetchone()[0] or timezone.now()
+        create_partitions(table=table, months_ahead=months_ahead, start=oldest, using=using)
+
+        cursor.execute(f'INSERT INTO {table} SELECT * FROM {table_old}')
+        cursor.execute(f"SELECT setval('{sequence}', COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+        cursor.execute(f'DROP TABLE {table_old}')
+
+
+def unpartition_table(table, using='default'):
+    # The reverse of partition_table(): convert table back to a regular table.
+    if not is_partitioned(table=table, using=using):
+        return
+    table_old = f'{table}_partitioned'
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        # Check the deferred foreign keys of this transaction's earlier writes now: ALTER TABLE fails on a table with
+        # pending trigger events
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {table_old}')
+        definitions = _get_definitions(cursor=cursor, table=table_old)
+        _drop_definitions(cursor=cursor, table=table_old, definitions=definitions)
+        cursor.execute(f'CREATE TABLE {table} (LIKE {table_old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        # The sequence is owned by table_old.id, so it would be dropped with table_old
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table_old])
+        cursor.execute(f'ALTER SEQUENCE {cursor.fetchone()[0]} OWNED BY {table}.id')
+        cursor.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id)')
+        for statement in get_recreate_sql(table=table, table_old=table_old, definitions=definitions):
+            cursor.execute(statement)
+        cursor.execute(f'INSERT INTO {table} SELECT * FROM {table_old}')
+        cursor.execute(f'DROP TABLE {table_old}')
+
+
+def create_partitions(table, months_ahead, start=None, using='default'):
+    # Create the missing monthly partitions of table, from the month of start (default: now) until months_ahead months
+    # from now.  Returns the names of the partitions created.
+    if not is_partitioned(table=table, using=using):
+        return []
+    now = timezone.now()
+    start = min(start or now, now)
+    months = (now.year - start.year) * 12 + (now.month - start.month) + months_ahead + 2  # +1 for this month, +1 for the end of the last one
+    month_starts = get_month_starts(start=start, months=months)
+    created = []
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = to_regclass(%s)', [table])
+        existing = {row[0] for row in cursor.fetchall()}
+        for month_start, month_end in zip(month_starts, month_starts[1:]):
+            partition = get_partition_name(table=table, month_start=month_start)
+            if partition in existing:
+                continue
+            for statement in get_create_partition_sql(table=table, month_start=month_start, month_end=month_end):
+                cursor.execute(statement)
+            created.append(partition)
+    return created
+
+
+def create_all_partitions(months_ahead=None, using='default'):
+    # Create the missing future partitions of all the partitioned tables.  Returns the names of the partitions created.
+    if months_ahead is None:
+        months_ahead = settings.DB_PARTITION_MONTHS_AHEAD
+    created = []
+    for table in PARTITIONED_TABLES:
+        created += create_partitions(table=table, months_ahead=months_ahead, using=using)
+    return created
+
+
+def _get_definitions(cursor, table):
+    # Return [(kind, name, definition), ...] for table's indexes (other than the primary key), foreign keys and triggers
+    # (other than the foreign keys' internal ones)
+    cursor.execute(
+        "SELECT 'index', indexname, indexdef FROM pg_indexes "
+        "WHERE tablename = %s AND indexname NOT IN ("
+        "  SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p') "
+        "UNION ALL "
+        "SELECT 'fk', conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype = 'f' "
+        "UNION ALL "
+        "SELECT 'trigger', tgname, pg_get_triggerdef(oid) FROM pg_trigger "
+        "WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal",
+        [table, table, table, table])
+    return cursor.fetchall()
+
+
+def _drop_definitions(cursor, table, definitions):
+    # Drop them from the old table, so that their names can be reused for the new table
+    for kind, name, _ in definitions:
+        if kind == 'index':
+            cursor.execute(f'DROP INDEX {name}')
+        elif kind == 'trigger':
+            cursor.execute(f'DROP TRIGGER {name} ON {table}')
+        else:
+            cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {name}')
+
+
+def _drop_referencing_foreign_keys(cursor, table):
+    # Drop the foreign keys (of other tables) that reference table, since they can't reference a partitioned table's id
+    cursor.execute(
+        "SELECT conrelid::regclass::text, conname FROM pg_constraint WHERE confrelid = to_regclass(%s) AND contype = 'f'",
+        [table])
+    for referencing_table, name in cursor.fetchall():
+        cursor.execute(f'ALTER TABLE {referencing_table} DROP CONSTRAINT {name}')
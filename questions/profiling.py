@@ -0,0 +1,227 @@
+import contextlib
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+'''
+An on-demand sampling profiler for production requests (unlike the debug toolbar, which isn't safe to enable there).
+
+ProfilingMiddleware profiles a fraction (settings.PROFILE_SAMPLE, QM_PROFILE_SAMPLE) of the requests, and each request
+with a valid signed header (PROFILE_HEADER; get a value with "./manage.py profile_requests --token").  A profiled
+request's thread is sampled by a background thread every settings.PROFILE_INTERVAL_SECS: its stack is read with
+sys._current_frames(), so the request itself runs at full speed, and the overhead is one stack walk per interval.
+
+Each profile is written to settings.PROFILE_DIR as collapsed stacks ("frame;frame;frame <count>" lines, outermost
+frame first), which flamegraph.pl and speedscope (https://www.speedscope.app) read.  The oldest files are deleted to
+keep at most settings.PROFILE_MAX_FILES files and PROFILE_MAX_BYTES bytes.  "./manage.py profile_requests" prints
+the split of each profile's time between the CATEGORIES (e.g., the ORM, get_tag_hierarchy and template rendering).
+
+Only one thread is sampled: the one that runs the request.  Under ASGI, with an async view (e.g., the async question
+view), that's the request's sync_to_async() thread, where its queries and templates run; the view's own code, in the
+event loop, shows only as the thread waiting.
+'''
+
+PROFILE_HEADER = 'X-Quizme-Profile'
+PROFILE_SALT = 'questions.profiling'
+PROFILE_SIGNED_VALUE = 'profile'
+PROFILE_FILE_SUFFIX = '.collapsed'
+# The category of a sample is that of its innermost frame in one of these (file path parts, or function names)
+CATEGORIES = (
+    ('orm', ('django/db/',)),
+    ('templates', ('django/template/', 'django/templatetags/')),
+    ('get_tag_hierarchy', ('get_tag_hierarchy',)),
+    ('get_next_question', ('get_next_question',)),
+)
+_REPO_DIR = os.path.dirname(settings.BASEDIR)
+
+
+def get_profile_token():
+    # The value of PROFILE_HEADER for profiling a request, valid for settings.PROFILE_TOKEN_MAX_AGE_SECS
+    return signing.TimestampSigner(salt=PROFILE_SALT).sign(PROFILE_SIGNED_VALUE)
+
+
+def is_valid_profile_token(token):
+    try:
+        return signing.TimestampSigner(salt=PROFILE_SALT).unsign(
+            token, max_age=settings.PROFILE_TOKEN_MAX_AGE_SECS) == PROFILE_SIGNED_VALUE
+    except signing.BadSignature:
+        return False
+
+
+class SamplingProfiler:
+    # Count the stacks of the thread thread_id, sampled every interval seconds, between start() and stop()
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()  # {(outermost frame label, ..., innermost frame label): number of samples}
+        self._labels = {}  # {code object: label}
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='quizme-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._get_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.counts[tuple(reversed(stack))] += 1
+
+    def _get_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            # ';' separates the frames in the collapsed format (and the count is after the last ' ')
+            label = f'{code.co_name} ({get_short_path(code.co_filename)}:{code.co_firstlineno})'
+            label = self._labels[code] = label.replace(';', ':')
+        return label
+
+    def write_collapsed(self, file):
+        for stack, count in sorted(self.counts.items()):
+            file.write(f"{';'.join(stack)} {count}\n")
+
+
+def get_short_path(path):
+    # The path relative to site-packages (e.g., "django/db/models/query.py"), or to this repo
+    path = path.replace(os.sep, '/')
+    if '/site-packages/' in path:
+        return path.rsplit('/site-packages/', 1)[1]
+    if path.startswith(_REPO_DIR.replace(os.sep, '/') + '/'):
+        return path[len(_REPO_DIR) + 1:]
+    return path
+
+
+def get_category(stack):
+    # Return the category (see CATEGORIES) of the innermost frame of stack that has one, or 'other'
+    for label in reversed(stack):
+        for category, markers in CATEGORIES:
+            if any(marker in label for marker in markers):
+                return category
+    return 'other'
+
+
+def read_collapsed(path):
+    # Return {stack tuple: count} from a collapsed stacks file
+    counts = Counter()
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                counts[tuple(stack.split(';'))] += int(count)
+    return counts
+
+
+def summarize(counts):
+    # Return {category: fraction of the samples}, for the stack counts of a profile
+    total = sum(counts.values())
+    by_category = Counter()
+    for stack, count in counts.items():
+        by_category[get_category(stack)] += count
+    return {category: count / total for category, count in by_category.most_common()} if total else {}
+
+
+def write_profile(profiler, name, directory=None):
+    # Write the profile to directory (settings.PROFILE_DIR) as "<time>-<name>.collapsed", delete the oldest files to
+    # keep within the caps, and return the path
+    directory = directory or settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name)[:100]
+    path = os.path.join(directory, f'{timezone.now():%Y%m%d-%H%M%S-%f}-{name}{PROFILE_FILE_SUFFIX}')
+    with open(path, 'w', encoding='utf-8') as file:
+        profiler.write_collapsed(file)
+    rotate_profiles(directory=directory)
+    return path
+
+
+def rotate_profiles(directory, max_files=None, max_bytes=None):
+    # Delete the oldest profiles in directory, until there are at most max_files, of at most max_bytes in all
+    max_files = settings.PROFILE_MAX_FILES if max_files is None else max_files
+    max_bytes = settings.PROFILE_MAX_BYTES if max_bytes is None else max_bytes
+    # The names start with the time, so the oldest are first.  Another process may be deleting them too.
+    files = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(PROFILE_FILE_SUFFIX):
+            with contextlib.suppress(FileNotFoundError):
+                files.append((os.path.join(directory, name), os.path.getsize(os.path.join(directory, name))))
+    total = sum(size for _, size in files)
+    for num, (path, size) in enumerate(files):
+        if len(files) - num <= max_files and total <= max_bytes:
+            break
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        total -= size
+
+
+class ProfilingMiddleware:
+    # Profile the sampled requests, and those with a valid PROFILE_HEADER (see above).  Sync and async capable, so
+    # that an async view isn't run in a thread under ASGI.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+        profile, requested = self._should_profile(request)
+        if not profile:
+            return self.get_response(request)
+        profiler = SamplingProfiler(thread_id=threading.get_ident(), interval=settings.PROFILE_INTERVAL_SECS)
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        self._write_profile(request=request, response=response, profiler=profiler, start=start, requested=requested)
+        return response
+
+    async def __acall__(self, request):
+        profile, requested = self._should_profile(request)
+        if not profile:
+            return await self.get_response(request)
+        # Sample the request's sync_to_async() thread (thread_sensitive), where its queries and templates run, rather
+        # than the event loop, which runs the other requests too
+        thread_id = await sync_to_async(threading.get_ident)()
+        profiler = SamplingProfiler(thread_id=thread_id, interval=settings.PROFILE_INTERVAL_SECS)
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.stop()
+        await sync_to_async(self._write_profile)(
+            request=request, response=response, profiler=profiler, start=start, requested=requested)
+        return response
+
+    def _should_profile(self, request):
+        # Return (whether to profile the request, whether it has a valid PROFILE_HEADER)
+        token = request.headers.get(PROFILE_HEADER)
+        requested = token is not None and is_valid_profile_token(token)
+        return requested or bool(settings.PROFILE_SAMPLE and random.random() < settings.PROFILE_SAMPLE), requested
+
+    def _write_profile(self, request, response, profiler, start, requested):
+        view = request.resolver_match.view_name if getattr(request, 'resolver_match', None) else request.path
+        path = write_profile(profiler=profiler, name=f'{view}-{(time.perf_counter() - start) * 1000:.0f}ms')
+        if requested:
+            response[f'{PROFILE_HEADER}-File'] = os.path.basename(path)
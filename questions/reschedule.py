@@ -0,0 +1,122 @@
+import math
+
+from django.db import connections, router, transaction
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Greatest, Least
+from django.utils import timezone
+
+from questions.due_forecast import invalidate_due_forecasts
+from questions.get_next_question import QuestionSelection
+from questions.models import MAX_INTERVAL_SECS, Schedule, get_interval_secs
+
+'''
+Bulk rescheduling of the questions for a tag selection (including the descendants of the selected tags), e.g., after
+a vacation, when thousands of questions are due at once.
+
+A question's due date is its newest Schedule's date_show_next (see NextQuestion), so rescheduling changes the
+date_show_next of each question's newest Schedule, like editing the Schedule in the admin does (no Schedule's are
+added, so "times this flashcard has been seen" doesn't change).  The rows are written set-based, rather than with a
+Schedule.save() per row:
+    - shift: one UPDATE ... SET date_show_next = date_show_next + <shift>
+    - spread: the new due dates are computed in one pass over the due questions (oldest due first), and written with
+      one "UPDATE ... SET date_show_next = v.column1, ... FROM (VALUES (...), (...), ...) AS v WHERE id = v.column3"
+      per SPREAD_BATCH_SIZE rows, i.e., one round trip per batch (an executemany() of per-row UPDATEs is a round
+      trip per row on psycopg2, and QuerySet.bulk_update() builds a CASE expression per row in Python, which takes
+      seconds for 10k rows)
+'''
+
+SPREAD_BATCH_SIZE = 1000  # rows per UPDATE
+
+
+class BulkReschedule(QuestionSelection):
+    def __init__(self, user, tag_ids_selected, search_text=None):
+        self.count_rescheduled = None  # the number of questions rescheduled by the last shift() or spread()
+        super().__init__(tag_ids_selected=tag_ids_selected, user=user, search_text=search_text)
+
+    @transaction.atomic
+    def shift(self, delta, only_due=False):
+        # Move the due date of each scheduled question by delta (a timedelta; negative for earlier).
+        # only_due: only move the questions that are due now (e.g., to push back the backlog, but not the future questions)
+        # Returns the number of questions rescheduled.
+        scheduled_questions = self._get_scheduled_questions()
+        if only_due:
+            scheduled_questions = scheduled_questions.filter(last_schedule_date_show_next__lte=timezone.now())
+        self.count_rescheduled = (Schedule.objects
+            .filter(id__in=scheduled_questions.values('last_schedule_id'), date_show_next__isnull=False)
+            .update(
+                date_show_next=F('date_show_next') + delta,
+                # Limited to what fits in an IntegerField, like get_interval_secs() (added as bigints, so that the
+                # sum itself can't overflow on Postgres)
+                interval_secs=Greatest(Least(
+                    Cast('interval_secs', output_field=BigIntegerField()) + round(delta.total_seconds()),
+                    MAX_INTERVAL_SECS), -MAX_INTERVAL_SECS),
+                datetime_updated=timezone.now()))
+        invalidate_due_forecasts(user_id=self._user.id)
+        return self.count_rescheduled
+
+    @transaction.atomic
+    def spread(self, days, max_per_day=None):
+        # Spread the questions that are due now evenly over the next days days (starting now), keeping their order
+        # (the oldest due first).  If max_per_day is given, no day gets more than that, so questions that don't fit
+        # in days days go on the days after.
+        # Returns the number of questions rescheduled.
+        if days < 1:
+            raise ValueError(f'Invalid days: [{days}]')
+        if max_per_day is not None and max_per_day < 1:
+            raise ValueError(f'Invalid max_per_day: [{max_per_day}]')
+        now = timezone.now()
+        schedules = list(self._get_scheduled_questions()
+            .filter(last_schedule_date_show_next__lte=now)
+            .order_by('last_schedule_date_show_next', 'id')
+            .values_list('last_schedule_id', 'last_schedule_datetime_added'))
+
+        dates_show_next = get_spread_dates(start=now, count=len(schedules), days=days, max_per_day=max_per_day)
+        rows = [
+            (date_show_next, get_interval_secs(date_show_next=date_show_next, datetime_added=datetime_added), schedule_id)
+            for (schedule_id, datetime_added), date_show_next in zip(schedules, dates_show_next)]
+        connection = connections[router.db_for_write(Schedule)]
+        # 3 parameters per row, and one for datetime_updated (sqlite allows 999 per query)
+        batch_size = min(SPREAD_BATCH_SIZE, ((connection.features.max_query_params or 3 * SPREAD_BATCH_SIZE + 1) - 1) // 3)
+        for start in range(0, len(rows), batch_size):
+            _update_schedules(connection=connection, rows=rows[start:start + batch_size], now=now)
+        invalidate_due_forecasts(user_id=self._user.id)
+        self.count_rescheduled = len(schedules)
+        return self.count_rescheduled
+
+
+def _update_schedules(connection, rows, now):
+    # Set the date_show_next and interval_secs of the schedules in rows ([(date_show_next, interval_secs, id), ...])
+    # with one UPDATE.  The VALUES columns are named column1, column2, ... (on both Postgres and sqlite).
+    adapt = connection.ops.adapt_datetimefield_value
+    table = Schedule._meta.db_table
+    if connection.vendor == 'sqlite' and connection.Database.sqlite_version_info < (3, 33):
+        # UPDATE ... FROM needs sqlite 3.33
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {table} SET date_show_next = %s, interval_secs = %s, datetime_updated = %s WHERE id = %s',
+                [(adapt(date_show_next), interval_secs, adapt(now), id_) for date_show_next, interval_secs, id_ in rows])
+        return
+    if connection.vendor == 'postgresql':
+        # The types of the parameters in VALUES aren't inferred from the columns they are assigned to
+        row_sql = '(%s::timestamptz, %s::integer, %s::integer)'
+    else:
+        row_sql = '(%s, %s, %s)'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET date_show_next = v.column1, interval_secs = v.column2, datetime_updated = %s '
+            f'FROM (VALUES {", ".join([row_sql] * len(rows))}) AS v WHERE {table}.id = v.column3',
+            [adapt(now)] + [value for date_show_next, interval_secs, id_ in rows
+                            for value in (adapt(date_show_next), interval_secs, id_)])
+
+
+def get_spread_dates(start, count, days, max_per_day=None):
+    # Return count due dates, in order, spread evenly over days days from start, with at most max_per_day per day.
+    # Each day's questions are spaced evenly through the day, e.g., with 2 per day: start, start + 12h, start + 1d, ...
+    per_day = math.ceil(count / days) if count else 0
+    if max_per_day is not None:
+        per_day = min(per_day, max_per_day)
+    one_day = timezone.timedelta(days=1)
+    return [
+        start + one_day * (num // per_day) + one_day * (num % per_day) / per_day
+        for num in range(count)
+    ]
@@ -0,0 +1,180 @@
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_migrate, post_save
+from django.dispatch import receiver
+
+from questions.models import Answer, Attempt, Question
+
+'''
+Full-text search over Question's (question and answer text), Answer's (answer text) and Attempt's (attempt text).
+
+The searchable text of each object is kept in a "search table" that is maintained on save (see the receivers below):
+    - Postgres: a table with a tsvector column and a GIN index, e.g.,
+        questions_question_search(question_id, document tsvector)
+    - sqlite: an FTS5 virtual table, whose rowid is the object's id (so that a row is updated by an indexed lookup,
+      rather than a scan of the UNINDEXED id column), e.g.,
+        questions_question_search(question_id, document)
+The search tables are created by the 0012_search_tables migration (and keyed by rowid by 0024_search_tables_rowid).  For other db's (or sqlite without FTS5),
+there are no search tables, and searches fall back to icontains.
+
+bulk_create() and QuerySet.update() don't send post_save, so after using them, call SearchIndex.update() for the
+ids, or run "./manage.py rebuild_search_index".
+
+Rows for deleted objects are not removed on sqlite (they're harmless, because searches are filtered against the
+object's table, and ids are not reused); "./manage.py rebuild_search_index" removes them.  On Postgres, the rows are
+deleted by the foreign key's ON DELETE CASCADE (except for Attempt's when the history tables are partitioned; see
+questions.partitions).
+
+Usage:
+    Question.objects.filter(QUESTION_SEARCH.filter_q(text='binary search'))
+'''
+
+POSTGRES_TEXT_SEARCH_CONFIG = 'english'
+
+
+class SearchIndex:
+    def __init__(self, model, id_column, get_documents, fallback_lookups):
+        # model: the model that is searched, e.g., Question
+        # id_column: the search table's column with the model's id, e.g., "question_id"
+        # get_documents: function(ids) that returns {id: document_text, ...} for the model's ids
+        # fallback_lookups: the lookups to use (OR'ed together) when there is no search table, e.g., ['question__icontains']
+        self.model = model
+        self.id_column = id_column
+        self.table_name = f'{model._meta.db_table}_search'
+        self._get_documents = get_documents
+        self._fallback_lookups = fallback_lookups
+        self._supported_dbs = {}  # {(alias, db name): whether the db has the search table}
+
+    def is_supported(self, using='default'):
+        # Return True if the db has this search table.
+        # The result is cached (per db), and the cache is cleared after migrate, which may create the table (see below).
+        connection = connections[using]
+        cache_key = (using, connection.settings_dict['NAME'])
+        if cache_key not in self._supported_dbs:
+            self._supported_dbs[cache_key] = (
+                connection.vendor in ('postgresql', 'sqlite')
+                and self.table_name in connection.introspection.table_names())
+        return self._supported_dbs[cache_key]
+
+    def filter_q(self, text, field='pk', using='default'):
+        # Return a Q() for the objects whose document matches all the words in text, for use in a filter on the model
+        # (field='pk'), or on a model with a foreign key to it (e.g., field='question' for Attempt's).
+        if not self.is_supported(using=using):
+            q = Q()
+            for lookup in self._fallback_lookups:
+                q |= Q(**{self._prefix(field, lookup): text})
+            return q
+        sql, params = self._search_sql(text=text, using=using)
+        return Q(**{f'{field}__in': RawSQL(sql, params)})
+
+    def update(self, ids, using='default'):
+        # (Re)compute the documents for the model's ids
+        if not ids or not self.is_supported(using=using):
+            return
+        documents = self._get_documents(ids)
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.executemany(
+                    f'INSERT INTO {self.table_name} ({self.id_column}, document) '
+                    f'VALUES (%s, to_tsvector(%s, %s)) '
+                    f'ON CONFLICT ({self.id_column}) DO UPDATE SET document = EXCLUDED.document',
+                    [(id_, POSTGRES_TEXT_SEARCH_CONFIG, document) for id_, document in documents.items()])
+            else:
+                cursor.execute(
+                    f'DELETE FROM {self.table_name} WHERE rowid IN ({", ".join(["%s"] * len(ids))})', list(ids))
+                cursor.executemany(
+                    f'INSERT INTO {self.table_name} (rowid, {self.id_column}, document) VALUES (%s, %s, %s)',
+                    [(id_, id_, document) for id_, document in documents.items()])
+
+    def rebuild(self, batch_size=1000, using='default'):
+        # Recompute the documents for all objects, and remove the rows of deleted objects.
+        # Returns the number of objects indexed.
+        if not self.is_supported(using=using):
+            return 0
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table_name}')
+        ids = list(self.model.objects.using(using).order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(ids), batch_size):
+            self.update(ids=ids[start:start + batch_size], using=using)
+        return len(ids)
+
+    def _prefix(self, field, lookup):
+        return lookup if field == 'pk' else f'{field}__{lookup}'
+
+    def _search_sql(self, text, using):
+        if connections[using].vendor == 'postgresql':
+            # plainto_tsquery() ANDs the words, and ignores punctuation/operators in text
+            return (f'SELECT {self.id_column} FROM {self.table_name} '
+                    f'WHERE document @@ plainto_tsquery(%s, %s)', [POSTGRES_TEXT_SEARCH_CONFIG, text])
+        return (f'SELECT {self.id_column} FROM {self.table_name} WHERE {self.table_name} MATCH %s',
+                [self._fts5_query(text=text)])
+
+    def _fts5_query(self, text):
+        # Quote each word, so that FTS5 query syntax in text (e.g., "-", "*", "OR") is searched for literally.
+        # Quoted words separated by spaces are AND'ed.
+        words = text.split() or ['']
+        return ' '.join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+def _get_question_documents(question_ids):
+    # e.g., {1: "<question text> <answer text>", ...}
+    return {
+        question['id']: f"{question['question']} {question['answer__answer'] or ''}"
+        for question in Question.objects.filter(id__in=question_ids).values('id', 'question', 'answer__answer')
+    }
+
+
+def _get_answer_documents(answer_ids):
+    return dict(Answer.objects.filter(id__in=answer_ids).values_list('id', 'answer'))
+
+
+def _get_attempt_documents(attempt_ids):
+    return dict(Attempt.objects.filter(id__in=attempt_ids).values_list('id', 'attempt'))
+
+
+QUESTION_SEARCH = SearchIndex(
+    model=Question,
+    id_column='question_id',
+    get_documents=_get_question_documents,
+    fallback_lookups=['question__icontains', 'answer__answer__icontains'])
+
+ANSWER_SEARCH = SearchIndex(
+    model=Answer,
+    id_column='answer_id',
+    get_documents=_get_answer_documents,
+    fallback_lookups=['answer__icontains'])
+
+ATTEMPT_SEARCH = SearchIndex(
+    model=Attempt,
+    id_column='attempt_id',
+    get_documents=_get_attempt_documents,
+    fallback_lookups=['attempt__icontains'])
+
+
+@receiver(post_migrate)
+def _clear_is_supported(**kwargs):
+    # A migration may have created (or dropped) the search tables
+    for search in (QUESTION_SEARCH, ANSWER_SEARCH, ATTEMPT_SEARCH):
+        search._supported_dbs.clear()
+
+
+@receiver(post_save, sender=Question)
+def _update_question_search(sender, instance, using, raw=False, **kwargs):
+    if not raw:
+        QUESTION_SEARCH.update(ids=[instance.id], using=using)
+
+
+@receiver(post_save, sender=Answer)
+def _update_answer_search(sender, instance, using, raw=False, **kwargs):
+    # The answer text is also part of the document of each of its questions
+    if not raw:
+        ANSWER_SEARCH.update(ids=[instance.id], using=using)
+        QUESTION_SEARCH.update(ids=list(instance.question_set.values_list('id', flat=True)), using=using)
+
+
+@receiver(post_save, sender=Attempt)
+def _update_attempt_search(sender, instance, using, raw=False, **kwargs):
+    if not raw:
+        ATTEMPT_SEARCH.update(ids=[instance.id], using=using)
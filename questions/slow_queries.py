@@ -0,0 +1,160 @@
+import contextlib
+import os
+import random
+import threading
+import time
+import traceback
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from questions.models import SlowQuery
+
+'''
+Slow-query capture: record each query that takes longer than settings.SLOW_QUERY_MS (QM_SLOW_QUERY_MS; off if None)
+as a SlowQuery, browsable in the admin, with:
+    - origin: the innermost frame of this repo's code that ran it (e.g., "questions/get_next_question.py:385 in
+      _get_oldest_viewed_tag"), and view: the request's view name (e.g., "admin:questions_question_changelist")
+    - plan: for a sample (settings.SLOW_QUERY_EXPLAIN_SAMPLE) of the SELECTs, the plan from running the query again
+      with EXPLAIN (ANALYZE, BUFFERS) on postgres, or EXPLAIN QUERY PLAN on sqlite.  Only SELECTs, since ANALYZE
+      executes the statement.
+The queries are captured in requests by SlowQueryMiddleware, and elsewhere (e.g., the jobs in run_worker) in a
+"with capture_slow_queries():" block.  Only the newest settings.SLOW_QUERY_KEEP rows are kept (a ring buffer).
+
+A SlowQuery is written after the transaction that ran the query commits (at once, outside a transaction), so it
+doesn't change what the transaction does; the slow queries of a transaction that rolls back aren't kept.
+'''
+
+_local = threading.local()  # recording: True while writing a SlowQuery or running an EXPLAIN (not captured)
+_REPO_DIR = os.path.dirname(settings.BASEDIR)
+# This module's frames, and those of the other execute wrappers, aren't the origin
+_SKIP_FILES = {os.path.abspath(__file__), os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics.py')}
+
+
+@contextlib.contextmanager
+def capture_slow_queries(view=''):
+    # Capture the slow queries run in the block on this thread's connections (if settings.SLOW_QUERY_MS is set)
+    if settings.SLOW_QUERY_MS is None:
+        yield
+        return
+    wrapper = SlowQueryWrapper(view=view)
+    with contextlib.ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(wrapper))
+        yield wrapper
+
+
+class SlowQueryWrapper:
+    # A database execute wrapper (see connection.execute_wrapper()) that records the slow queries
+    def __init__(self, view=''):
+        self.view = view  # a string, or a callable that returns one (e.g., once the request's url is resolved)
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_local, 'recording', False):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration_ms = (time.perf_counter() - start) * 1000
+        if settings.SLOW_QUERY_MS is not None and duration_ms >= settings.SLOW_QUERY_MS:
+            self._record(sql=sql, params=params, many=many, duration_ms=duration_ms,
+                         connection=context['connection'])
+        return result
+
+    def _record(self, sql, params, many, duration_ms, connection):
+        _local.recording = True
+        try:
+            plan = ''
+            if not many and is_explainable(sql) and random.random() < settings.SLOW_QUERY_EXPLAIN_SAMPLE:
+                plan = explain(connection=connection, sql=sql, params=params)
+            slow_query = SlowQuery(
+                db_alias=connection.alias, duration_ms=duration_ms, sql=sql, params=repr(params)[:10000],
+                origin=get_origin(), view=(self.view() if callable(self.view) else self.view)[:200], plan=plan)
+        finally:
+            _local.recording = False
+        transaction.on_commit(lambda: _save(slow_query), using=connection.alias)
+
+
+def _save(slow_query):
+    _local.recording = True
+    try:
+        using = router.db_for_write(SlowQuery)
+        slow_query.save(using=using)
+        # Keep only the newest SLOW_QUERY_KEEP (the ids are increasing)
+        SlowQuery.objects.using(using).filter(id__lte=slow_query.id - settings.SLOW_QUERY_KEEP).delete()
+    finally:
+        _local.recording = False
+
+
+def is_explainable(sql):
+    return sql.lstrip().upper().startswith('SELECT')
+
+
+def explain(connection, sql, params):
+    # Return the plan of the query, or the error, if EXPLAIN fails.  In a savepoint, so that a failed EXPLAIN doesn't
+    # break the transaction on postgres.
+    if connection.vendor == 'postgresql':
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+    elif connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    try:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except Exception as exception:
+        return f'EXPLAIN failed: {exception!r}'
+    if connection.vendor == 'sqlite':
+        # (id, parent id, notused, detail): indent each step under its parent
+        depths = {0: -1}
+        lines = []
+        for id_, parent_id, _, detail in rows:
+            depths[id_] = depths.get(parent_id, -1) + 1
+            lines.append('  ' * depths[id_] + detail)
+        return '\n'.join(lines)
+    return '\n'.join(' '.join(str(value) for value in row) for row in rows)
+
+
+def get_origin():
+    # Return "<path>:<line> in <function>" of the innermost frame of this repo's code (not of the installed packages),
+    # e.g., the NextQuestion method that ran the query
+    for frame in reversed(traceback.extract_stack()):
+        path = os.path.abspath(frame.filename)
+        if (path.startswith(_REPO_DIR + os.sep) and path not in _SKIP_FILES
+                and 'site-packages' not in path and f'{os.sep}.venv{os.sep}' not in path):
+            return f'{os.path.relpath(path, _REPO_DIR)}:{frame.lineno} in {frame.name}'[:500]
+    return ''
+
+
+class SlowQueryMiddleware:
+    # Capture the slow queries of each request (see capture_slow_queries()).  Sync and async capable, so that an async
+    # view isn't run in a thread under ASGI.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+        with capture_slow_queries(view=self._get_view_getter(request)):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Capture on the connections of the request's sync_to_async() thread, where its queries run (thread_sensitive)
+        stack = contextlib.ExitStack()
+        await sync_to_async(stack.enter_context)(capture_slow_queries(view=self._get_view_getter(request)))
+        try:
+            return await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+
+    def _get_view_getter(self, request):
+        def get_view():
+            return request.resolver_match.view_name if getattr(request, 'resolver_match', None) else request.path
+        return get_view
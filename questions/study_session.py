@@ -0,0 +1,27 @@
+from questions.get_tag_hierarchy import expand_all_tag_ids, get_tag_hierarchy
+from questions.models import StudySession
+from questions.VerifyTagIds import VerifyTagIds
+
+
+def get_study_session(user, query_name, tag_ids_selected, cards_per_tag):
+    # Return the user's StudySession for these tags, query_name and cards_per_tag, resuming the most recent one, or
+    # starting a new one.  A new session's turns go through the selected tags and their descendants by tag name.
+    tag_ids_comma_str = ','.join(str(tag_id) for tag_id in tag_ids_selected)
+    study_session = (StudySession.objects
+                     .filter(user=user, query_name=query_name, tag_ids_selected=tag_ids_comma_str, cards_per_tag=cards_per_tag)
+                     .order_by('-datetime_updated')
+                     .first())
+    if study_session:
+        return study_session
+    VerifyTagIds(tag_ids=tag_ids_selected, user=user)
+    hierarchy = get_tag_hierarchy(user=user)
+    tag_ids_expanded = sorted(
+        expand_all_tag_ids(hierarchy=hierarchy, tag_ids=tag_ids_selected),
+        key=lambda tag_id: (str(hierarchy[tag_id]['tag_name']).lower(), tag_id))
+    return StudySession.objects.create(
+        user=user,
+        query_name=query_name,
+        tag_ids_selected=tag_ids_comma_str,
+        tag_ids_expanded=tag_ids_expanded,
+        tag_ids_remaining=list(tag_ids_expanded),
+        cards_per_tag=cards_per_tag)
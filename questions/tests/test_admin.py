@@ -1,7 +1,7 @@
 import pytest
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from questions.models import Answer, Tag, Question, QuestionTag
+from questions.models import Answer, Attempt, Tag, Question, QuestionTag
 
 @pytest.fixture
 def admin_client(client, django_user_model):
@@ -73,3 +73,32 @@ def test_question_admin_tags_display(admin_client, django_user_model):
     response = admin_client.get(url)
     assert response.status_code == 200
     assert "TestTag" in response.content.decode()
+
+@pytest.mark.django_db
+def test_question_admin_search(admin_client, django_user_model):
+    # Searches the question and answer text (with the search table), the id, and the tag names
+    admin_user = django_user_model.objects.get(email='admin@example.com')
+    tag = Tag.objects.create(name="geography", user=admin_user)
+    question_text = Question.objects.create(question="Capital of France", user=admin_user)
+    question_answer = Question.objects.create(
+        question="Capital of Spain", answer=Answer.objects.create(answer="Madrid", user=admin_user), user=admin_user)
+    question_tag = Question.objects.create(question="Longest river", user=admin_user)
+    QuestionTag.objects.create(question=question_tag, tag=tag, user=admin_user)
+    url = reverse('admin:questions_question_changelist')
+    for search_term, question_expected in (
+            ('france', question_text), ('madrid', question_answer), ('geography', question_tag), (question_tag.id, question_tag)):
+        response = admin_client.get(url, {'q': search_term})
+        assert response.status_code == 200
+        assert list(response.context['cl'].result_list) == [question_expected]
+
+@pytest.mark.django_db
+def test_attempt_admin_search(admin_client, django_user_model):
+    admin_user = django_user_model.objects.get(email='admin@example.com')
+    question = Question.objects.create(question="What is a tuple?", user=admin_user)
+    attempt = Attempt.objects.create(attempt="an immutable sequence", question=question, user=admin_user)
+    Attempt.objects.create(attempt="something else", question=Question.objects.create(question="other", user=admin_user), user=admin_user)
+    url = reverse('admin:questions_attempt_changelist')
+    for search_term in ('immutable', 'tuple'):
+        response = admin_client.get(url, {'q': search_term})
+        assert response.status_code == 200
+        assert list(response.context['cl'].result_list) == [attempt]
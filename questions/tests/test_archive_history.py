@@ -0,0 +1,120 @@
+import gzip
+import json
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from emailusername.models import User
+from questions.get_next_question import NextQuestion
+from questions.forms import QUERY_OLDEST_DUE
+from questions.models import ArchivedHistory, Attempt, Question, QuestionTag, Schedule, Tag
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+@pytest.fixture
+def question(user):
+    return Question.objects.create(question="question", user=user)
+
+def create_history(model, question, user, days_ago, **kwargs):
+    # Create a Schedule or Attempt, added days_ago days ago (datetime_added is auto_now_add, so set it afterwards)
+    obj = model.objects.create(question=question, user=user, **kwargs)
+    model.objects.filter(id=obj.id).update(datetime_added=timezone.now() - timezone.timedelta(days=days_ago))
+    return obj
+
+def archive(tmp_path, *args):
+    file = StringIO()
+    call_command('archive_history', f'--archive-dir={tmp_path}', '--keep-days=30', *args, stdout=file)
+    return file.getvalue()
+
+def read_archive(tmp_path, table):
+    rows = []
+    for path in tmp_path.glob(f'{table}-*.jsonl.gz'):
+        with gzip.open(path, mode='rt', encoding='utf-8') as file:
+            rows += [json.loads(line) for line in file]
+    return rows
+
+def test_archive_schedules(tmp_path, user, question):
+    old_1 = create_history(Schedule, question, user, days_ago=300)
+    old_2 = create_history(Schedule, question, user, days_ago=200)
+    recent = create_history(Schedule, question, user, days_ago=10)
+    # The only (so newest) schedule of another question is kept, even though it's old
+    other_question = Question.objects.create(question="other", user=user)
+    newest_old = create_history(Schedule, other_question, user, days_ago=300)
+
+    output = archive(tmp_path)
+
+    assert 'questions_schedule: archived [2]' in output
+    assert set(Schedule.objects.values_list('id', flat=True)) == {recent.id, newest_old.id}
+    assert sorted(row['id'] for row in read_archive(tmp_path, 'questions_schedule')) == [old_1.id, old_2.id]
+    history = ArchivedHistory.objects.get(question=question, user=user)
+    assert history.count_schedules == 2
+    assert history.count_attempts == 0
+    assert not ArchivedHistory.objects.filter(question=other_question).exists()
+
+def test_archive_keeps_newest_when_all_old(tmp_path, user, question):
+    create_history(Schedule, question, user, days_ago=300)
+    newest = create_history(Schedule, question, user, days_ago=200)
+    archive(tmp_path)
+    assert list(Schedule.objects.all()) == [newest]
+
+def test_archive_attempts(tmp_path, user, question):
+    create_history(Attempt, question, user, days_ago=300, attempt="first try")
+    newest = create_history(Attempt, question, user, days_ago=100, attempt="second try")
+    output = archive(tmp_path)
+    assert 'questions_attempt: archived [1]' in output
+    assert list(Attempt.objects.all()) == [newest]
+    assert [row['attempt'] for row in read_archive(tmp_path, 'questions_attempt')] == ["first try"]
+    assert ArchivedHistory.objects.get(question=question, user=user).count_attempts == 1
+
+def test_archive_in_batches_and_runs(tmp_path, user, question):
+    for days_ago in (400, 300, 200, 100):
+        create_history(Schedule, question, user, days_ago=days_ago)
+    assert 'questions_schedule: archived [3] to [2] files' in archive(tmp_path, '--batch-size=2')
+    assert len(list(tmp_path.glob('questions_schedule-*.jsonl.gz'))) == 2
+    create_history(Schedule, question, user, days_ago=50)
+    assert 'questions_schedule: archived [1]' in archive(tmp_path)
+    assert ArchivedHistory.objects.get(question=question, user=user).count_schedules == 4
+    assert Schedule.objects.count() == 1
+
+def test_archive_file_complete_before_delete(tmp_path, user, question, monkeypatch):
+    # If the delete fails (e.g., the process is killed), the batch's file is already complete, and the rows are kept
+    old = create_history(Schedule, question, user, days_ago=300)
+    create_history(Schedule, question, user, days_ago=200)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('killed')
+    monkeypatch.setattr(QuerySet, '_raw_delete', fail)
+    with pytest.raises(RuntimeError):
+        archive(tmp_path)
+    assert [row['id'] for row in read_archive(tmp_path, 'questions_schedule')] == [old.id]
+    assert not list(tmp_path.glob('*.tmp'))
+    assert Schedule.objects.count() == 2
+    assert not ArchivedHistory.objects.exists()
+
+def test_archive_user_id(tmp_path, user, question):
+    other_user = User.objects.create(email="other@example.com")
+    for days_ago in (300, 200):
+        create_history(Schedule, question, user, days_ago=days_ago)
+        create_history(Schedule, question, other_user, days_ago=days_ago)
+    archive(tmp_path, f'--user-id={other_user.id}')
+    assert Schedule.objects.filter(user=user).count() == 2
+    assert Schedule.objects.filter(user=other_user).count() == 1
+
+def test_count_times_question_seen_includes_archived(tmp_path, user, question):
+    tag = Tag.objects.create(name="tag", user=user)
+    QuestionTag.objects.create(question=question, tag=tag, user=user)
+    for days_ago in (300, 200, 100):
+        create_history(Schedule, question, user, days_ago=days_ago)
+    archive(tmp_path)
+    assert Schedule.objects.count() == 1
+    nq = NextQuestion(query_name=QUERY_OLDEST_DUE, tag_ids_selected=[tag.id], user=user)
+    assert nq.question == question
+    assert nq.count_times_question_seen == 3
@@ -0,0 +1,191 @@
+import json
+import threading
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from emailusername.models import User
+from questions import backups
+from questions.jobs import run_pending_jobs
+from questions.models import Answer, Attempt, DeletedRow, Job, Question, QuestionTag, Schedule, Tag
+from questions.partitions import PARTITIONED_TABLES, is_partitioned, partition_table
+from questions.search import QUESTION_SEARCH
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture(autouse=True)
+def no_overlap(monkeypatch):
+    # Without the overlap, a delta has only the rows changed after the previous backup
+    monkeypatch.setattr(backups, 'WATERMARK_OVERLAP', timezone.timedelta(0))
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+def backup(tmp_path, *args):
+    out = StringIO()
+    call_command('backup_incremental', f'--backup-dir={tmp_path}', *args, stdout=out)
+    return out.getvalue()
+
+def get_counts(tmp_path):
+    return backups.read_manifest(tmp_path)['backups'][-1]['counts']
+
+def snapshot():
+    return dict(
+        users=list(User.objects.order_by('id').values()),
+        questions=list(Question.objects.order_by('id').values()),
+        answers=list(Answer.objects.order_by('id').values()),
+        tags=list(QuestionTag.objects.order_by('id').values()),
+        attempts=list(Attempt.objects.order_by('id').values()),
+        schedules=list(Schedule.objects.order_by('id').values()),
+    )
+
+def test_tombstones(user):
+    question = Question.objects.create(question="question", user=user)
+    schedule = Schedule.objects.create(question=question, user=user)
+    schedule_id = schedule.id
+    schedule.delete()
+    assert list(DeletedRow.objects.filter(table='questions_schedule', row_id=schedule_id).values_list('user_id', flat=True)) == [user.id]
+
+def test_tombstones_of_fast_and_raw_deletes(user):
+    # The triggers add the tombstones, so a delete is one query, however many rows, and raw deletes get them too
+    question = Question.objects.create(question="question", user=user)
+    attempts = [Attempt.objects.create(question=question, user=user, attempt="attempt") for _ in range(3)]
+    with CaptureQueriesContext(connection) as context:
+        Attempt.objects.filter(id__in=[attempt.id for attempt in attempts[:2]]).delete()
+    assert len(context.captured_queries) == 1
+    Schedule.objects.create(question=question, user=user)
+    Schedule.objects.all()._raw_delete(using='default')
+    assert DeletedRow.objects.filter(table='questions_attempt').count() == 2
+    assert DeletedRow.objects.filter(table='questions_schedule').count() == 1
+
+def test_delta_has_imported_rows(tmp_path, user):
+    # An import keeps datetime_added, but datetime_updated is the time of the import
+    question = Question.objects.create(question="question", user=user)
+    Schedule.objects.create(question=question, user=user)
+    archive = tmp_path / 'user.jsonl.gz'
+    call_command('export_user_archive', f'--user-id={user.id}', f'--file={archive}', stdout=StringIO())
+    backup(tmp_path / 'backups')
+    user_2 = User.objects.create(email="testuser2@example.com")
+    call_command('import_user_archive', f'--user-id={user_2.id}', f'--file={archive}', stdout=StringIO())
+    backup(tmp_path / 'backups')
+    counts = get_counts(tmp_path / 'backups')
+    assert (counts['questions_question'], counts['questions_schedule']) == (1, 1)
+
+def test_base_and_deltas(tmp_path, user):
+    answer = Answer.objects.create(answer="answer", user=user)
+    question = Question.objects.create(question="question", answer=answer, user=user)
+    Question.objects.create(question="unchanged", user=user)
+    schedule = Schedule.objects.create(question=question, user=user, interval_num=1, interval_unit='days')
+    assert 'base:' in backup(tmp_path)
+    assert get_counts(tmp_path)['questions_question'] == 2
+
+    # The delta has only the changed rows, and the tombstones
+    question.question = "question edited"
+    question.save()
+    new_question = Question.objects.create(question="new question", user=user)
+    tag = Tag.objects.create(name="tag", user=user)
+    QuestionTag.objects.create(question=new_question, tag=tag, user=user)
+    schedule.delete()
+    run_pending_jobs()  # index the questions, as a worker would
+    assert 'delta:' in backup(tmp_path)
+    counts = get_counts(tmp_path)
+    assert counts['questions_question'] == 2
+    assert counts['questions_answer'] == 0
+    assert counts['deleted'] == 1
+    assert counts['emailusername_user'] == 1  # always all the users
+
+    # Rebuild the database from the base and the delta
+    expected = snapshot()
+    User.objects.all().delete()
+    DeletedRow.objects.all().delete()
+    out = StringIO()
+    call_command('restore_backups', f'--backup-dir={tmp_path}', stdout=out)
+    assert len(out.getvalue().splitlines()) == 2
+    assert snapshot() == expected
+    assert Question.objects.filter(QUESTION_SEARCH.filter_q(text="edited")).get().id == question.id
+    # New rows get ids after the restored rows
+    assert Question.objects.create(question="after", user=User.objects.get()).id > new_question.id
+
+def test_restore_until(tmp_path, user):
+    backup(tmp_path)
+    question = Question.objects.create(question="question", user=user)
+    backup(tmp_path)
+    base = backups.read_manifest(tmp_path)['backups'][0]['file']
+    question.delete()
+    User.objects.all().delete()
+    call_command('restore_backups', f'--backup-dir={tmp_path}', f'--until={base}', stdout=StringIO())
+    assert User.objects.count() == 1
+    assert not Question.objects.exists()
+
+def test_full_backup_prunes_tombstones(tmp_path, user):
+    Question.objects.create(question="question", user=user).delete()
+    DeletedRow.objects.update(datetime_deleted=timezone.now() - timezone.timedelta(days=1))
+    backup(tmp_path, '--full')
+    assert not DeletedRow.objects.exists()
+    manifest = json.loads((tmp_path / backups.MANIFEST_NAME).read_text())
+    assert [entry['type'] for entry in manifest['backups']] == ['base']
+
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason='partitioning is postgres only')
+def test_restore_partitioned(tmp_path, user):
+    # A partitioned table's rows are upserted by its primary key, (id, datetime_added)
+    question = Question.objects.create(question="question", user=user)
+    schedule = Schedule.objects.create(question=question, user=user, interval_num=1, interval_unit='days')
+    Attempt.objects.create(question=question, user=user, attempt="attempt")
+    for table in PARTITIONED_TABLES:
+        partition_table(table=table, months_ahead=1)
+    assert is_partitioned(table='questions_schedule')
+    run_pending_jobs()
+    backup(tmp_path)
+    Schedule.objects.filter(id=schedule.id).update(interval_num=2)
+    expected = snapshot()
+    expected['schedules'][0]['interval_num'] = 1
+    # Restore over the existing rows (each is an update), then into empty tables (each is an insert)
+    call_command('restore_backups', f'--backup-dir={tmp_path}', stdout=StringIO())
+    assert snapshot() == expected
+    Schedule.objects.all().delete()
+    Attempt.objects.all().delete()
+    call_command('restore_backups', f'--backup-dir={tmp_path}', stdout=StringIO())
+    assert snapshot() == expected
+
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason="sqlite's read lock keeps writers out of a backup")
+@pytest.mark.django_db(transaction=True)
+def test_base_is_one_snapshot(tmp_path, user, monkeypatch):
+    # A question and its schedule inserted (and committed, by another connection) while the base is being written,
+    # after its questions section, are in none of its sections, so that the base can be restored
+    write_section = backups._write_section
+    inserted = []
+
+    def insert():
+        question = Question.objects.create(question="inserted during the backup", user=user)
+        inserted.append(Schedule.objects.create(question=question, user=user))
+        connections.close_all()
+
+    def write_section_then_insert(file, section, **kwargs):
+        count = write_section(file=file, section=section, **kwargs)
+        if section == Question._meta.db_table:
+            thread = threading.Thread(target=insert)
+            thread.start()
+            thread.join()
+        return count
+    monkeypatch.setattr(backups, '_write_section', write_section_then_insert)
+    backup(tmp_path)
+    assert inserted
+    assert (get_counts(tmp_path)['questions_question'], get_counts(tmp_path)['questions_schedule']) == (0, 0)
+
+    # The next delta has them
+    monkeypatch.setattr(backups, '_write_section', write_section)
+    backup(tmp_path)
+    assert (get_counts(tmp_path)['questions_question'], get_counts(tmp_path)['questions_schedule']) == (1, 1)
+    User.objects.all().delete()
+    call_command('restore_backups', f'--backup-dir={tmp_path}', stdout=StringIO())
+    assert Schedule.objects.get().question.question == "inserted during the backup"
+    # Committed, so delete the rows
+    User.objects.all().delete()
+    DeletedRow.objects.all().delete()
+    Job.objects.all().delete()
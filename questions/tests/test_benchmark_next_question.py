@@ -0,0 +1,25 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from questions.forms import QUERY_CHOICES, QUERY_RANDOM_IN_DUE_WINDOW
+from questions.models import Question, User
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+def test_benchmark_next_question_command():
+    file = StringIO()
+    call_command('benchmark_next_question', '--questions=20', '--tags=3', '--note-kb=1', '--repeat=1', stdout=file)
+
+    lines = file.getvalue().splitlines()
+    # a settings line, a heading line, one line per query name, and the order_by('?') baseline
+    assert len(lines) == 2 + len(QUERY_CHOICES) + 1
+    for line, (query_name, _) in zip(lines[2:], QUERY_CHOICES):
+        assert line.startswith(query_name)
+    assert lines[-1].startswith(f"{QUERY_RANDOM_IN_DUE_WINDOW} (order_by('?'))")
+
+    # The generated dataset is rolled back
+    assert Question.objects.count() == 0
+    assert User.objects.count() == 0
@@ -0,0 +1,18 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from questions.models import User
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+def test_benchmark_requests_command():
+    user = User.objects.create(email='user@domain.com')
+    file = StringIO()
+    call_command('benchmark_requests', f'--user-id={user.id}', '--requests=3', stdout=file)
+
+    output = file.getvalue()
+    assert 'requests=[3]' in output
+    assert 'requests/sec=[' in output
@@ -0,0 +1,119 @@
+import pytest
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save
+from django.http import HttpResponse
+from django.utils import timezone
+
+from questions import db_router
+from questions.db_router import (
+    REPLICA_DB_ALIAS,
+    SESSION_KEY_PIN_PRIMARY_UNTIL,
+    ReplicaPinningMiddleware,
+    ReplicaRouter,
+    replica_reads,
+)
+from questions.models import Tag
+
+@pytest.fixture(autouse=True)
+def replica_configured(monkeypatch):
+    monkeypatch.setattr(db_router, '_is_replica_configured', lambda: True)
+
+@pytest.fixture
+def in_request():
+    token = db_router._in_request.set(True)
+    token_pinned = db_router._pinned_to_primary.set(False)
+    yield
+    db_router._in_request.reset(token)
+    db_router._pinned_to_primary.reset(token_pinned)
+
+def test_reads_use_primary_outside_replica_reads(in_request):
+    assert ReplicaRouter().db_for_read(Tag) == DEFAULT_DB_ALIAS
+
+def test_reads_use_replica_inside_replica_reads(in_request):
+    with replica_reads():
+        assert ReplicaRouter().db_for_read(Tag) == REPLICA_DB_ALIAS
+    assert ReplicaRouter().db_for_read(Tag) == DEFAULT_DB_ALIAS
+
+def test_reads_use_primary_outside_a_request():
+    # e.g., management commands
+    with replica_reads():
+        assert ReplicaRouter().db_for_read(Tag) == DEFAULT_DB_ALIAS
+
+def test_reads_use_primary_when_replica_not_configured(in_request, monkeypatch):
+    monkeypatch.setattr(db_router, '_is_replica_configured', lambda: False)
+    with replica_reads():
+        assert ReplicaRouter().db_for_read(Tag) == DEFAULT_DB_ALIAS
+
+def test_writes_use_primary(in_request):
+    with replica_reads():
+        assert ReplicaRouter().db_for_write(Tag) == DEFAULT_DB_ALIAS
+
+def test_reads_use_primary_after_a_write(in_request):
+    with replica_reads():
+        assert ReplicaRouter().db_for_read(Tag) == REPLICA_DB_ALIAS
+        post_save.send(sender=Tag, instance=Tag(name='tag'), created=True)
+        assert ReplicaRouter().db_for_read(Tag) == DEFAULT_DB_ALIAS
+
+class TestReplicaPinningMiddleware:
+    def _get_response(self, request):
+        # A view that reads inside replica_reads(), and records which db it read from
+        with replica_reads():
+            request.db_for_read = ReplicaRouter().db_for_read(Tag)
+        return HttpResponse()
+
+    def _request(self, rf, method, session):
+        request = getattr(rf, method)('/')
+        request.session = session
+        ReplicaPinningMiddleware(get_response=self._get_response)(request)
+        return request
+
+    def test_get_reads_from_replica(self, rf):
+        session = {}
+        request = self._request(rf=rf, method='get', session=session)
+        assert request.db_for_read == REPLICA_DB_ALIAS
+        assert SESSION_KEY_PIN_PRIMARY_UNTIL not in session
+
+    def test_post_pins_session_to_primary(self, rf):
+        session = {}
+        request = self._request(rf=rf, method='post', session=session)
+        assert request.db_for_read == DEFAULT_DB_ALIAS
+        assert session[SESSION_KEY_PIN_PRIMARY_UNTIL] > timezone.now().timestamp()
+
+        # The next GET in the same session reads from the primary, since the replica might not have the POST's writes yet
+        request = self._request(rf=rf, method='get', session=session)
+        assert request.db_for_read == DEFAULT_DB_ALIAS
+
+    def test_pin_expires(self, rf):
+        session = {SESSION_KEY_PIN_PRIMARY_UNTIL: timezone.now().timestamp() - 1}
+        request = self._request(rf=rf, method='get', session=session)
+        assert request.db_for_read == REPLICA_DB_ALIAS
+
+class TestReplicaPinningMiddlewareAsync:
+    # Under ASGI, with an async view, the middleware runs in the event loop (rather than in a thread)
+    async def _get_response(self, request):
+        with replica_reads():
+            request.db_for_read = ReplicaRouter().db_for_read(Tag)
+        return HttpResponse()
+
+    def _request(self, rf, method, session):
+        request = getattr(rf, method)('/')
+        request.session = session
+        middleware = ReplicaPinningMiddleware(get_response=self._get_response)
+        assert iscoroutinefunction(middleware)
+        async_to_sync(middleware)(request)
+        return request
+
+    def test_get_reads_from_replica(self, rf):
+        request = self._request(rf=rf, method='get', session=SessionStore())
+        assert request.db_for_read == REPLICA_DB_ALIAS
+        assert SESSION_KEY_PIN_PRIMARY_UNTIL not in request.session
+
+    def test_post_pins_session_to_primary(self, rf):
+        session = SessionStore()
+        request = self._request(rf=rf, method='post', session=session)
+        assert request.db_for_read == DEFAULT_DB_ALIAS
+        assert session[SESSION_KEY_PIN_PRIMARY_UNTIL] > timezone.now().timestamp()
+        request = self._request(rf=rf, method='get', session=session)
+        assert request.db_for_read == DEFAULT_DB_ALIAS
@@ -0,0 +1,159 @@
+from io import StringIO
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from emailusername.models import User
+from questions.due_forecast import BUCKET_DAY, BUCKET_HOUR, BUCKET_WEEK, DueForecast
+from questions.forms import QUERY_UNSEEN
+from questions.jobs import run_pending_jobs
+from questions.models import Job, Question, QuestionTag, Schedule, Tag
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Forecasts are cached, and the cache isn't rolled back between tests
+    cache.clear()
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+@pytest.fixture
+def tag(user):
+    return Tag.objects.create(name="tag 1", user=user)
+
+def create_question(user, tag, *dates_show_next):
+    # Create a question with a Schedule for each of dates_show_next (the last one is the newest)
+    question = Question.objects.create(question="question", user=user)
+    if tag:
+        QuestionTag.objects.create(question=question, tag=tag, user=user)
+    for date_show_next in dates_show_next:
+        Schedule.objects.create(question=question, user=user, date_show_next=date_show_next)
+    return question
+
+def count_grouped_queries(context):
+    return len([query for query in context.captured_queries if 'GROUP BY' in query['sql']])
+
+def today_midnight():
+    return timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+
+class TestDueForecast:
+    def test_buckets_by_day(self, user, tag):
+        midnight = today_midnight()
+        create_question(user, tag, midnight - timezone.timedelta(days=3))  # overdue
+        create_question(user, tag, midnight + timezone.timedelta(days=1, hours=1))
+        create_question(user, tag, midnight + timezone.timedelta(days=1, hours=5))
+        # Only the newest schedule counts
+        create_question(user, tag, midnight + timezone.timedelta(days=1), midnight + timezone.timedelta(days=10, hours=2))
+        create_question(user, tag, midnight + timezone.timedelta(days=31))  # after the last bucket
+        create_question(user, tag)  # unseen
+        create_question(user, None, midnight + timezone.timedelta(days=1))  # not tagged
+
+        with CaptureQueriesContext(connection) as context:
+            forecast = DueForecast(user=user, tag_ids_selected=[tag.id], bucket=BUCKET_DAY, days=30)
+        assert count_grouped_queries(context) == 1
+
+        assert len(forecast.bucket_starts) == 30
+        assert forecast.bucket_starts[0] == midnight
+        assert forecast.count_overdue == 1
+        assert forecast.counts[0] == 0
+        assert forecast.counts[1] == 2
+        assert forecast.counts[10] == 1
+        assert sum(forecast.counts) == 3
+
+    def test_due_earlier_in_the_first_bucket(self, user, tag):
+        # Questions due earlier in the current bucket are counted in it, rather than as overdue
+        now = timezone.localtime()
+        create_question(user, tag, now.replace(minute=0, second=0, microsecond=0))
+        forecast = DueForecast(user=user, tag_ids_selected=[tag.id], bucket=BUCKET_HOUR, days=1)
+        assert forecast.count_overdue == 0
+        assert forecast.counts[0] == 1
+
+    def test_bucket_sizes(self, user, tag):
+        forecast = DueForecast(user=user, tag_ids_selected=[tag.id], bucket=BUCKET_HOUR, days=1)
+        assert forecast.bucket_starts[0] == timezone.localtime().replace(minute=0, second=0, microsecond=0)
+        assert 23 <= len(forecast.bucket_starts) <= 25  # depends on DST changes
+        forecast = DueForecast(user=user, tag_ids_selected=[tag.id], bucket=BUCKET_WEEK, days=28)
+        assert len(forecast.bucket_starts) == 4
+        assert forecast.bucket_starts[0].weekday() == 0
+        assert forecast.counts == [0, 0, 0, 0]
+
+    def test_week_buckets(self, user, tag):
+        forecast = DueForecast(user=user, tag_ids_selected=[tag.id], bucket=BUCKET_WEEK, days=28)
+        create_question(user, tag, forecast.bucket_starts[2] + timezone.timedelta(days=6, hours=23))
+        forecast = DueForecast(user=user, tag_ids_selected=[tag.id], bucket=BUCKET_WEEK, days=28)
+        assert forecast.counts == [0, 0, 1, 0]
+
+    def test_cached_until_schedule_write(self, user, tag):
+        question = create_question(user, tag, today_midnight() + timezone.timedelta(days=2))
+        DueForecast(user=user, tag_ids_selected=[tag.id])
+
+        with CaptureQueriesContext(connection) as context:
+            forecast = DueForecast(user=user, tag_ids_selected=[tag.id])
+        assert count_grouped_queries(context) == 0
+        assert forecast.counts[2] == 1
+
+        Schedule.objects.create(question=question, user=user, date_show_next=today_midnight() + timezone.timedelta(days=3))
+        with CaptureQueriesContext(connection) as context:
+            forecast = DueForecast(user=user, tag_ids_selected=[tag.id])
+        assert count_grouped_queries(context) == 1
+        assert forecast.counts[2] == 0
+        assert forecast.counts[3] == 1
+
+    def test_invalid_arguments(self, user, tag):
+        with pytest.raises(ValueError):
+            DueForecast(user=user, tag_ids_selected=[tag.id], bucket='month')
+        with pytest.raises(ValueError):
+            DueForecast(user=user, tag_ids_selected=[tag.id], days=0)
+
+def test_view_due_forecast(client, user, tag):
+    create_question(user, tag, today_midnight() + timezone.timedelta(days=1, hours=1))
+    client.force_login(user=user)
+    response = client.get(reverse('due_forecast'), {'tag_ids_selected': str(tag.id), 'bucket': 'day', 'days': '7'})
+    assert response.status_code == 200
+    data = response.json()
+    assert data['bucket'] == 'day'
+    assert data['count_overdue'] == 0
+    assert [bucket['count'] for bucket in data['buckets']] == [0, 1, 0, 0, 0, 0, 0]
+
+    response = client.get(reverse('due_forecast'), {'tag_ids_selected': str(tag.id), 'bucket': 'year'})
+    assert response.status_code == 400
+
+    response = client.get(reverse('due_forecast'), {'tag_ids_selected': f'{tag.id},x'})
+    assert response.status_code == 400
+
+def test_answers_enqueue_refresh(client, user, tag):
+    # Each answer invalidates the forecasts, and enqueues one (coalesced) job that computes the selection's forecast again
+    question = create_question(user, tag)
+    run_pending_jobs()  # the question's indexing
+    client.force_login(user=user)
+    for _ in range(2):
+        response = client.post(reverse('question'), {
+            'hidden_question_id': question.id, 'hidden_query_name': QUERY_UNSEEN, 'hidden_tag_ids_selected': str(tag.id),
+            'attempt': 'attempt', 'percent_correct': 80, 'percent_importance': 70, 'interval_num': 1,
+            'interval_unit': 'days'})
+        assert response.status_code == 301
+    job = Job.objects.get(name='refresh_due_forecast', status=Job.STATUS_PENDING)
+    assert job.args == dict(user_id=user.id, tag_ids_selected=[tag.id], search_text=None)
+    Job.objects.update(run_after=timezone.now())
+    assert run_pending_jobs() == 1
+    with CaptureQueriesContext(connection) as context:
+        forecast = DueForecast(user=user, tag_ids_selected=[tag.id])
+    assert count_grouped_queries(context) == 0
+    assert forecast.counts[1] == 1
+
+def test_due_forecast_command(user, tag):
+    create_question(user, tag, today_midnight() - timezone.timedelta(days=1))
+    file = StringIO()
+    call_command('due_forecast', f'--user-id={user.id}', f'--tag-ids={tag.id}', '--days=3', stdout=file)
+    lines = file.getvalue().splitlines()
+    assert lines[0].split() == ['overdue', '1']
+    assert len(lines) == 4
@@ -0,0 +1,134 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+
+from emailusername.models import User
+from questions import duplicates
+from questions.duplicates import (
+    NUM_BANDS, find_duplicate_clusters, get_content_hash, get_jaccard, get_shingles, update_duplicate_index)
+from questions.jobs import run_pending_jobs
+from questions.models import Answer, Job, Question, QuestionLSHBucket
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+TEXT = "what is the time complexity of looking up a key in a python dict on average"
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+def create_question(user, question, answer=None):
+    # Create the question, and run the jobs that index it
+    if answer is not None:
+        answer = Answer.objects.create(answer=answer, user=user)
+    question = Question.objects.create(question=question, answer=answer, user=user)
+    run_pending_jobs()
+    return question
+
+def test_content_hash_is_normalized():
+    assert get_content_hash("What is  a Dict?", "A map.") == get_content_hash("what is a dict", "a map")
+    # The question and the answer are separate
+    assert get_content_hash("a b", "c") != get_content_hash("a", "b c")
+
+def test_jaccard():
+    assert get_jaccard(get_shingles(TEXT, None), get_shingles(TEXT, None)) == 1.0
+    assert get_jaccard(get_shingles("a b c d", None), get_shingles("w x y z", None)) == 0.0
+    assert get_jaccard(set(), set()) == 0.0
+
+def test_index_maintained_on_save(user):
+    # The content_hash is set on save, and the buckets by the job
+    answer = Answer.objects.create(answer="O(1)", user=user)
+    question = Question.objects.create(question=TEXT, answer=answer, user=user)
+    assert question.content_hash == get_content_hash(TEXT, "O(1)")
+    assert not QuestionLSHBucket.objects.filter(question=question).exists()
+    assert run_pending_jobs() == 1
+    assert QuestionLSHBucket.objects.filter(question=question).count() == NUM_BANDS
+    # Editing the answer updates its questions' content_hash, and enqueues a job for their buckets, which the
+    # question's own save is coalesced with
+    Question.objects.filter(id=question.id).update(content_hash='')
+    question.answer.answer = "constant"
+    question.answer.save()
+    question.refresh_from_db()
+    assert question.content_hash == get_content_hash(TEXT, "constant")
+    question.save(update_fields=['question'])
+    assert Job.objects.filter(status=Job.STATUS_PENDING).count() == 1
+    assert run_pending_jobs() == 1
+    question.refresh_from_db()
+    assert question.content_hash == get_content_hash(TEXT, "constant")
+
+def test_content_hash_set_on_save_without_a_worker(user):
+    # Exact duplicates are found without running the jobs, e.g., an admin's edit
+    question = create_question(user, TEXT, "O(1)")
+    other = Question.objects.create(question="something else", user=user)
+    other.question = TEXT.upper()
+    other.answer = question.answer
+    other.save(update_fields=['question', 'answer'])
+    assert Question.objects.filter(user=user, content_hash=question.content_hash).count() == 2
+
+def test_find_duplicate_clusters(user):
+    exact_1 = create_question(user, TEXT, "O(1)")
+    exact_2 = create_question(user, TEXT.upper() + "?", "O(1).")
+    near = create_question(user, TEXT, "O(1) time")
+    create_question(user, "name the capital city of france", "paris")
+    # Another user's questions aren't in the user's clusters
+    create_question(User.objects.create(email="other@example.com"), TEXT, "O(1)")
+    assert find_duplicate_clusters(user=user) == [[exact_1.id, exact_2.id, near.id]]
+    assert find_duplicate_clusters(user=user, threshold=1.0) == [[exact_1.id, exact_2.id]]
+
+@pytest.mark.parametrize('max_bucket_all_pairs', [50, 1])
+def test_bucket_first_question_not_similar(user, monkeypatch, max_bucket_all_pairs):
+    # The bucket's first question isn't similar to the others, which are similar to each other (compared as all the
+    # pairs of a small bucket, or with the anchors of a large one)
+    monkeypatch.setattr(duplicates, 'MAX_BUCKET_ALL_PAIRS', max_bucket_all_pairs)
+    other = create_question(user, "name the capital city of france", "paris")
+    near_1 = create_question(user, TEXT, "O(1)")
+    near_2 = create_question(user, TEXT, "O(1) time")
+    QuestionLSHBucket.objects.all().delete()
+    QuestionLSHBucket.objects.bulk_create([
+        QuestionLSHBucket(question=question, user=user, band=0, bucket=1) for question in (other, near_1, near_2)])
+    assert find_duplicate_clusters(user=user) == [[near_1.id, near_2.id]]
+
+def test_update_duplicate_index_after_bulk_create(user):
+    questions = Question.objects.bulk_create([Question(question=TEXT, user=user) for _ in range(2)])
+    assert find_duplicate_clusters(user=user) == []
+    update_duplicate_index(question_ids=[question.id for question in questions])
+    assert find_duplicate_clusters(user=user) == [[question.id for question in questions]]
+
+def test_find_duplicates_command(user):
+    questions = Question.objects.bulk_create([Question(question=TEXT, user=user) for _ in range(2)])
+    out = StringIO()
+    call_command('find_duplicates', '--rebuild', f'--user-id={user.id}', stdout=out)
+    assert out.getvalue().splitlines() == [
+        'indexed [2] questions',
+        'cluster of [2] questions:',
+        f'    [{questions[0].id}] {TEXT!r}',
+        f'    [{questions[1].id}] {TEXT!r}',
+        'found [1] clusters',
+    ]
+
+def test_import_skip_duplicates(tmp_path, user):
+    create_question(user, "What is 1 + 1?", "2")
+    path = tmp_path / 'notes.jsonl'
+    path.write_text(
+        '{"question": "what is 1 + 1", "answer": "2"}\n'
+        '{"question": "What is 2 + 2?", "answer": "4"}\n'
+        '{"question": "What is 2 + 2?", "answer": "4"}\n')
+    out = StringIO()
+    call_command('import_questions', f'--file={path}', f'--user-id={user.id}', '--skip-duplicates', stdout=out)
+    assert 'Imported [1] questions' in out.getvalue()
+    assert '[2] duplicates' in out.getvalue()
+    imported = Question.objects.get(question="What is 2 + 2?")
+    assert imported.content_hash == get_content_hash("What is 2 + 2?", "4")
+    assert QuestionLSHBucket.objects.filter(question=imported).count() == NUM_BANDS
+
+def test_duplicates_admin(client, django_user_model):
+    admin_user = django_user_model.objects.create_superuser(email='admin@example.com', password='adminpassword')
+    create_question(admin_user, TEXT)
+    create_question(admin_user, TEXT)
+    client.login(email='admin@example.com', password='adminpassword')
+    response = client.get(reverse('admin:questions_question_duplicates'))
+    assert response.status_code == 200
+    assert b'Cluster of 2 questions' in response.content
@@ -1,17 +1,22 @@
 import pytest
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from questions.forms import (
    QUERY_FUTURE,
    QUERY_OLDEST_DUE,
    QUERY_OLDEST_DUE_OR_UNSEEN_BY_TAG,
    QUERY_OLDEST_DUE_OR_UNSEEN,
+   QUERY_RANDOM_IN_DUE_WINDOW,
    QUERY_REINFORCE,
    QUERY_UNSEEN,
    QUERY_UNSEEN_BY_OLDEST_VIEWED_TAG,
    QUERY_UNSEEN_THEN_OLDEST_DUE,
 )
-from questions.models import Question, Tag, QuestionTag, Schedule
-from questions.get_next_question import NextQuestion
+from questions.models import Answer, Question, Tag, QuestionTag, Schedule, TagLineage
+from questions import get_next_question
+from questions.get_next_question import RANDOM_DUE_CANDIDATES, NextQuestion
 from emailusername.models import User
 
 # Use the Django database for all the tests
@@ -156,6 +161,214 @@ class Test__get_count_questions_due:
         assert nq.tag_names_for_question == [tag.name]
         assert nq.tag_names_selected == [tag.name]
 
+class TestNoDistinct:
+    @pytest.mark.parametrize('query_name', [
+        QUERY_FUTURE,
+        QUERY_OLDEST_DUE,
+        QUERY_OLDEST_DUE_OR_UNSEEN,
+        QUERY_OLDEST_DUE_OR_UNSEEN_BY_TAG,
+        QUERY_REINFORCE,
+        QUERY_UNSEEN,
+        QUERY_UNSEEN_BY_OLDEST_VIEWED_TAG,
+        QUERY_UNSEEN_THEN_OLDEST_DUE,
+    ])
+    def test_question_with_multiple_selected_tags_is_not_duplicated(self, user, tag, query_name):
+        # A question with several of the selected tags must only be counted once, without using DISTINCT
+        # (the tagged-question querysets use EXISTS semi-joins instead of joins).
+        tag2 = Tag.objects.create(name="tag 2", user=user)
+        q_seen = Question.objects.create(question="seen", user=user)
+        q_unseen = Question.objects.create(question="unseen", user=user)
+        for question in (q_seen, q_unseen):
+            QuestionTag.objects.create(question=question, tag=tag, user=user)
+            QuestionTag.objects.create(question=question, tag=tag2, user=user)
+        Schedule.objects.create(user=user, question=q_seen, date_show_next=timezone.now() - timezone.timedelta(hours=1))
+        Schedule.objects.create(user=user, question=q_seen, date_show_next=timezone.now() - timezone.timedelta(hours=2))
+
+        with CaptureQueriesContext(connection) as context:
+            nq = NextQuestion(query_name=query_name, tag_ids_selected=[tag.id, tag2.id], user=user)
+
+        assert nq.count_questions_tagged == 2
+        assert nq.count_questions_due == 1
+        assert nq.count_questions_unseen == 1
+        for query in context.captured_queries:
+            assert 'DISTINCT' not in query['sql'].upper()
+
+class TestLastScheduleAndTagNames:
+    def test_last_schedule_added(self, user, tag, question):
+        QuestionTag.objects.create(question=question, tag=tag, user=user)
+        old_schedule = Schedule.objects.create(user=user, question=question, interval_num=1, interval_unit='days')
+        old_schedule.datetime_added = timezone.now() - timezone.timedelta(days=2)
+        old_schedule.save()
+        new_schedule = Schedule.objects.create(user=user, question=question, interval_num=2, interval_unit='hours',
+                                               date_show_next=timezone.now() - timezone.timedelta(hours=1))
+
+        for query_name in (QUERY_OLDEST_DUE, QUERY_OLDEST_DUE_OR_UNSEEN, QUERY_REINFORCE):
+            nq = NextQuestion(query_name=query_name, tag_ids_selected=[tag.id], user=user)
+            assert nq.question == question
+            assert nq.last_schedule_added.id == new_schedule.id
+            assert nq.last_schedule_added.datetime_added == new_schedule.datetime_added
+            assert nq.last_schedule_added.date_show_next == new_schedule.date_show_next
+            assert nq.last_schedule_added.interval_num == 2
+            assert nq.last_schedule_added.interval_unit == 'hours'
+
+    def test_last_schedule_added_unseen(self, user, tag, question):
+        QuestionTag.objects.create(question=question, tag=tag, user=user)
+        for query_name in (QUERY_UNSEEN, QUERY_OLDEST_DUE_OR_UNSEEN):
+            nq = NextQuestion(query_name=query_name, tag_ids_selected=[tag.id], user=user)
+            assert nq.question == question
+            assert nq.last_schedule_added is None
+
+    def test_tag_names_use_no_queries(self, user, tag, question, django_assert_num_queries):
+        tag_child = Tag.objects.create(name="child", user=user)
+        TagLineage.objects.create(parent_tag=tag, child_tag=tag_child, user=user)
+        QuestionTag.objects.create(question=question, tag=tag_child, user=user)
+        nq = NextQuestion(query_name=QUERY_UNSEEN, tag_ids_selected=[tag.id], user=user)
+
+        with django_assert_num_queries(0):
+            nq._get_tag_names()
+        assert nq.tag_names_for_question == [tag_child.name]
+        assert nq.tag_names_selected == [tag.name]
+        assert nq.tag_names_selected_implicit_descendants == [tag_child.name]
+
+class TestDeferredLoading:
+    def test_pick_queries_only_select_narrow_columns(self, user, tag):
+        answer = Answer.objects.create(answer="Test answer", user=user)
+        question = Question.objects.create(question="Test question", answer=answer, user=user)
+        QuestionTag.objects.create(question=question, tag=tag, user=user)
+
+        with CaptureQueriesContext(connection) as context:
+            nq = NextQuestion(query_name=QUERY_OLDEST_DUE_OR_UNSEEN, tag_ids_selected=[tag.id], user=user)
+
+        # Only the query that loads the picked question selects the question and answer text
+        queries_with_text = [
+            query['sql'] for query in context.captured_queries
+            if '"questions_question"."question"' in query['sql'] or '"questions_answer"."answer"' in query['sql']]
+        assert len(queries_with_text) == 1
+        assert 'JOIN "questions_answer"' in queries_with_text[0]
+        assert nq.question == question
+
+    def test_answer_is_loaded_with_question(self, user, tag, django_assert_num_queries):
+        answer = Answer.objects.create(answer="Test answer", user=user)
+        question = Question.objects.create(question="Test question", answer=answer, user=user)
+        QuestionTag.objects.create(question=question, tag=tag, user=user)
+
+        nq = NextQuestion(query_name=QUERY_UNSEEN, tag_ids_selected=[tag.id], user=user)
+        with django_assert_num_queries(0):
+            assert nq.question.question == "Test question"
+            assert nq.question.answer.answer == "Test answer"
+
+class TestAsync:
+    def _create_questions(self, user, tag):
+        q_due = Question.objects.create(question="due", user=user)
+        q_unseen = Question.objects.create(question="unseen", user=user)
+        QuestionTag.objects.create(question=q_due, tag=tag, user=user)
+        QuestionTag.objects.create(question=q_unseen, tag=tag, user=user)
+        Schedule.objects.create(user=user, question=q_due, date_show_next=timezone.now() - timezone.timedelta(hours=1))
+        return q_due, q_unseen
+
+    def _assert_same(self, nq_async, nq_sync):
+        assert nq_async.question == nq_sync.question
+        for attr in ('count_questions_due', 'count_questions_unseen', 'count_questions_tagged', 'count_recent_seen_mins_30',
+                     'count_recent_seen_mins_60', 'count_times_question_seen', 'tag_names_for_question', 'tag_names_selected'):
+            assert getattr(nq_async, attr) == getattr(nq_sync, attr)
+
+    def test_acreate_in_transaction(self, user, tag):
+        # In a transaction (as in this test), the counts run on the same connection, one after another
+        self._create_questions(user=user, tag=tag)
+        assert not get_next_question._can_query_concurrently()
+
+        nq_async = async_to_sync(NextQuestion.acreate)(query_name=QUERY_OLDEST_DUE, tag_ids_selected=[tag.id], user=user)
+        nq_sync = NextQuestion(query_name=QUERY_OLDEST_DUE, tag_ids_selected=[tag.id], user=user)
+        self._assert_same(nq_async=nq_async, nq_sync=nq_sync)
+        assert nq_async.count_questions_due == 1
+        assert nq_async.count_questions_unseen == 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_acreate_concurrently(self, user, tag, monkeypatch):
+        # Not in a transaction, so the counts can run concurrently in their own threads and connections.
+        # (Patched, because the in-memory sqlite test db would otherwise disable it.)
+        self._create_questions(user=user, tag=tag)
+        monkeypatch.setattr(get_next_question, '_can_query_concurrently', lambda: True)
+
+        nq_async = async_to_sync(NextQuestion.acreate)(query_name=QUERY_UNSEEN, tag_ids_selected=[tag.id], user=user)
+        nq_sync = NextQuestion(query_name=QUERY_UNSEEN, tag_ids_selected=[tag.id], user=user)
+        self._assert_same(nq_async=nq_async, nq_sync=nq_sync)
+        assert nq_async.count_questions_tagged == 2
+
+    def test_concurrent_only_with_a_pool(self, monkeypatch):
+        # As outside the test's transaction, on postgres
+        monkeypatch.setattr(connection, 'in_atomic_block', False)
+        monkeypatch.setattr(connection, 'vendor', 'postgresql')
+        monkeypatch.setitem(connection.settings_dict, 'OPTIONS', {})
+        assert not get_next_question._can_query_concurrently()
+        monkeypatch.setitem(connection.settings_dict, 'OPTIONS', {'pool': {'max_size': 4}})
+        assert get_next_question._can_query_concurrently()
+
+    def test_own_connection_closed(self, monkeypatch):
+        # The executor threads aren't part of a request, so their connections are closed after each count, even if it fails
+        closed = []
+        monkeypatch.setattr(get_next_question.connections, 'close_all', lambda: closed.append(True))
+        get_next_question._run_in_own_connection(lambda: None)()
+        with pytest.raises(ZeroDivisionError):
+            get_next_question._run_in_own_connection(lambda: 1 / 0)()
+        assert closed == [True, True]
+
+class TestSearchText:
+    # search_text limits the questions to those whose question or answer text matches, and composes with the tags
+    def _create_questions(self, user, tag):
+        other_tag = Tag.objects.create(name="other tag", user=user)
+        q_python = Question.objects.create(question="What does a python list comprehension return?", user=user)
+        q_answer = Question.objects.create(
+            question="What is a generator?", answer=Answer.objects.create(answer="A lazy python iterator", user=user), user=user)
+        q_other = Question.objects.create(question="What is a rust trait?", user=user)
+        q_other_tag = Question.objects.create(question="python question with another tag", user=user)
+        for question in (q_python, q_answer, q_other):
+            QuestionTag.objects.create(question=question, tag=tag, user=user)
+        QuestionTag.objects.create(question=q_other_tag, tag=other_tag, user=user)
+        return q_python, q_answer, q_other
+
+    def test_search_text(self, user, tag):
+        q_python, q_answer, q_other = self._create_questions(user=user, tag=tag)
+        nq = NextQuestion(query_name=QUERY_UNSEEN, tag_ids_selected=[tag.id], user=user, search_text="python")
+        assert nq.question == q_python
+        assert nq.count_questions_tagged == 2
+        assert nq.count_questions_unseen == 2
+
+    def test_search_text_all_words(self, user, tag):
+        q_python, q_answer, q_other = self._create_questions(user=user, tag=tag)
+        nq = NextQuestion(query_name=QUERY_UNSEEN, tag_ids_selected=[tag.id], user=user, search_text="lazy python")
+        assert nq.question == q_answer
+        assert nq.count_questions_tagged == 1
+
+    def test_search_text_no_match(self, user, tag):
+        self._create_questions(user=user, tag=tag)
+        nq = NextQuestion(query_name=QUERY_UNSEEN_BY_OLDEST_VIEWED_TAG, tag_ids_selected=[tag.id], user=user, search_text="haskell")
+        assert nq.question is None
+        assert nq.oldest_viewed_tag is None
+        assert nq.count_questions_tagged == 0
+
+    def test_search_text_blank(self, user, tag):
+        q_python, q_answer, q_other = self._create_questions(user=user, tag=tag)
+        nq = NextQuestion(query_name=QUERY_UNSEEN, tag_ids_selected=[tag.id], user=user, search_text="  ")
+        assert nq.question == q_python
+        assert nq.count_questions_tagged == 3
+
+    def test_search_text_uses_queryset_db(self, user, tag, monkeypatch):
+        # The search SQL is built for the db that the scheduler's queries read from (e.g., the replica)
+        self._create_questions(user=user, tag=tag)
+        usings = []
+        filter_q = get_next_question.QUESTION_SEARCH.filter_q
+
+        def filter_q_recording_using(text, using):
+            # (There's no replica db in the tests, so build the Q() for the default db)
+            usings.append(using)
+            return filter_q(text=text)
+        monkeypatch.setattr(get_next_question.QUESTION_SEARCH, 'filter_q', filter_q_recording_using)
+        nq = NextQuestion(query_name=QUERY_UNSEEN, tag_ids_selected=[tag.id], user=user, search_text="python")
+        nq._filter_search_text(queryset=Question.objects.using('replica'))
+        assert usings[0] == 'default'
+        assert usings[-1] == 'replica'
+
 def test_invalid_query_name(user, tag):
     with pytest.raises(ValueError) as exc_info:
         NextQuestion(query_name="invalid", tag_ids_selected=[tag.id], user=user)
@@ -290,6 +503,98 @@ class Test__QUERY_OLDEST_DUE:
         assert nq.tag_names_for_question == [tag2.name]
         assert nq.tag_names_selected == [tag1.name, tag2.name]
     
+class Test__QUERY_RANDOM_IN_DUE_WINDOW:
+    def _create_questions(self, user, tag, hours_due):
+        # Return one question per hours_due, each scheduled that many hours from now, plus one unseen question
+        questions = []
+        for hours in hours_due:
+            question = Question.objects.create(question=f"Question due {hours}h", user=user)
+            QuestionTag.objects.create(question=question, tag=tag)
+            Schedule.objects.create(user=user, question=question, date_show_next=timezone.now() + timezone.timedelta(hours=hours))
+            questions.append(question)
+        QuestionTag.objects.create(question=Question.objects.create(question="unseen", user=user), tag=tag)
+        return questions
+
+    def test_picks_from_the_window(self, user, tag, monkeypatch):
+        # The window is 1 day from the oldest due date (-30h), so the question due at +5h isn't in it.  The probe is at
+        # -30h, -18h (both after only the oldest), then -6h (the first candidate is the question due at -10h).
+        q_30h, q_10h, q_5h = self._create_questions(user, tag, hours_due=(-30, -10, 5))
+        picked = []
+        monkeypatch.setattr(get_next_question.random, 'randrange', lambda stop: 0)  # the first candidate
+        for fraction in (0, 0.5, 0.99):
+            monkeypatch.setattr(get_next_question.random, 'random', lambda fraction=fraction: fraction)
+            nq = NextQuestion(query_name=QUERY_RANDOM_IN_DUE_WINDOW, tag_ids_selected=[tag.id], user=user)
+            picked.append(nq.question)
+            assert nq.last_schedule_added.date_show_next == nq.question.last_schedule_date_show_next
+        assert picked == [q_30h, q_30h, q_10h]
+
+    def test_probe_skips_old_schedules_and_other_tags(self, user, tag, monkeypatch):
+        # The probe (at -8.4h) passes a question whose newest schedule is due later (+40h), and one with another tag
+        q_30h, q_10h = self._create_questions(user, tag, hours_due=(-30, -10))
+        q_rescheduled, = self._create_questions(user, tag, hours_due=(-15,))
+        Schedule.objects.create(user=user, question=q_rescheduled, date_show_next=timezone.now() + timezone.timedelta(hours=40))
+        q_other_tag = Question.objects.create(question="other tag", user=user)
+        QuestionTag.objects.create(question=q_other_tag, tag=Tag.objects.create(name="other", user=user))
+        Schedule.objects.create(user=user, question=q_other_tag, date_show_next=timezone.now() - timezone.timedelta(hours=12))
+        monkeypatch.setattr(get_next_question.random, 'random', lambda: 0.9)
+        monkeypatch.setattr(get_next_question.random, 'randrange', lambda stop: 0)
+        nq = NextQuestion(query_name=QUERY_RANDOM_IN_DUE_WINDOW, tag_ids_selected=[tag.id], user=user)
+        assert nq.question == q_10h
+        assert nq.last_schedule_added.id == Schedule.objects.get(question=q_10h).id
+
+    def test_picks_from_the_candidates(self, user, tag, monkeypatch):
+        # The probe (at the end of the window) gets the RANDOM_DUE_CANDIDATES due last before it, and picks one of them
+        questions = self._create_questions(user, tag, hours_due=range(-30, -30 + RANDOM_DUE_CANDIDATES + 2))
+        monkeypatch.setattr(get_next_question.random, 'random', lambda: 0.99)
+        picked = set()
+        for num in range(RANDOM_DUE_CANDIDATES + 1):
+            monkeypatch.setattr(get_next_question.random, 'randrange', lambda stop, num=num: min(num, stop - 1))
+            picked.add(NextQuestion(query_name=QUERY_RANDOM_IN_DUE_WINDOW, tag_ids_selected=[tag.id], user=user).question)
+        assert picked == set(questions[-RANDOM_DUE_CANDIDATES:])
+
+    @pytest.mark.parametrize('count_tied', [5, RANDOM_DUE_CANDIDATES * 3])
+    def test_questions_due_at_the_same_time(self, user, tag, count_tied):
+        # Each of the questions due at the same time can be picked (fewer than the candidates, or more)
+        questions = []
+        date_show_next = timezone.now() - timezone.timedelta(hours=1)
+        for num in range(count_tied):
+            question = Question.objects.create(question=f"Question {num}", user=user)
+            QuestionTag.objects.create(question=question, tag=tag)
+            Schedule.objects.create(user=user, question=question, date_show_next=date_show_next)
+            questions.append(question)
+        picked = {
+            NextQuestion(query_name=QUERY_RANDOM_IN_DUE_WINDOW, tag_ids_selected=[tag.id], user=user,
+                         get_counts=False).question.id
+            for _ in range(40)}
+        assert len(picked) > 1
+        assert picked <= {question.id for question in questions}
+        if count_tied > RANDOM_DUE_CANDIDATES:
+            # Not only the tie's last candidates
+            assert min(picked) < questions[-RANDOM_DUE_CANDIDATES].id
+
+    def test_window_in_future(self, user, tag):
+        # Nothing is due yet, so the window starts at the next due date
+        q_2h, = self._create_questions(user, tag, hours_due=(2,))
+        nq = NextQuestion(query_name=QUERY_RANDOM_IN_DUE_WINDOW, tag_ids_selected=[tag.id], user=user)
+        assert nq.question == q_2h
+
+    def test_no_scheduled_questions(self, user, tag):
+        self._create_questions(user, tag, hours_due=())
+        nq = NextQuestion(query_name=QUERY_RANDOM_IN_DUE_WINDOW, tag_ids_selected=[tag.id], user=user)
+        assert nq.question is None
+        assert nq.count_questions_tagged == 1
+
+    def test_query_count_does_not_grow(self, user, tag):
+        # the oldest due, then the probe: the same number of queries however many questions are in the window
+        self._create_questions(user, tag, hours_due=(-1,))
+        with CaptureQueriesContext(connection) as context_1:
+            NextQuestion(query_name=QUERY_RANDOM_IN_DUE_WINDOW, tag_ids_selected=[tag.id], user=user, get_counts=False)
+        self._create_questions(user, tag, hours_due=range(-20, 0))
+        with CaptureQueriesContext(connection) as context_20:
+            NextQuestion(query_name=QUERY_RANDOM_IN_DUE_WINDOW, tag_ids_selected=[tag.id], user=user, get_counts=False)
+        assert len(context_20.captured_queries) == len(context_1.captured_queries)
+        assert not any('RANDOM()' in query['sql'] for query in context_20.captured_queries)
+
 class TestAllQueryTypesSameData:
 
     def test_different_results_for_query_seen_and_due(self, user, tag):
@@ -224,6 +224,15 @@ class TestGetQuestionTags:
         result = get_question_tags(user=user1)
         assert result == {user1_tag.id: {user1_q.id}}
 
+    def test_get_question_tags_without_questiontag_user(self, user):
+        # e.g., QuestionTag's added through the admin inlines don't have a user
+        tag = Tag.objects.create(name="tag", user=user)
+        question = Question.objects.create(question="Q", user=user)
+        QuestionTag.objects.create(question=question, tag=tag)
+
+        result = get_question_tags(user)
+        assert result == {tag.id: {question.id}}
+
     def test_get_question_tags_query_count(self, user, setup_question_tags):
         with CaptureQueriesContext(connection) as context:
             get_question_tags(user)
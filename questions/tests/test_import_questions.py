@@ -0,0 +1,90 @@
+import json
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from emailusername.models import User
+from questions.get_tag_hierarchy import get_tag_hierarchy
+from questions.models import Answer, Question, QuestionTag, Tag, TagLineage
+from questions.search import QUESTION_SEARCH
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+def import_questions(path, user, *args):
+    out = StringIO()
+    call_command('import_questions', f'--file={path}', f'--user-id={user.id}', *args, stdout=out)
+    return out.getvalue()
+
+def tag_names(question):
+    return sorted(question.tag_set.values_list('name', flat=True))
+
+def test_import_csv(tmp_path, user):
+    existing_tag = Tag.objects.create(name="python", user=user)
+    path = tmp_path / 'notes.csv'
+    path.write_text(
+        'question,answer,tags\n'
+        '"What is 1, 2?","A tuple",python\n'
+        'No answer,,"python, new tag"\n'
+        ',orphan answer,python\n')
+    out = import_questions(path, user, '--batch-size=1')
+    assert 'Imported [2] questions, [1] answers, [1] new tags, [0] new tag lineages; skipped [1]' in out
+    question_1, question_2 = Question.objects.order_by('id')
+    assert (question_1.question, question_1.answer.answer) == ("What is 1, 2?", "A tuple")
+    assert question_2.answer is None
+    assert tag_names(question_1) == ['python']
+    assert tag_names(question_2) == ['new tag', 'python']
+    # The existing tag is used, rather than a new one with the same name
+    assert Tag.objects.filter(name='python').get() == existing_tag
+
+def test_import_jsonl_tag_paths(tmp_path, user):
+    path = tmp_path / 'notes.jsonl'
+    path.write_text('\n'.join(json.dumps(record) for record in (
+        dict(question="q1", answer="a1", tags=["lang::python::generators"]),
+        dict(question="q2", tags="lang::rust, misc"),
+    )))
+    out = import_questions(path, user, '--parent-tag=imported')
+    assert 'Imported [2] questions, [1] answers, [6] new tags, [5] new tag lineages' in out
+    q1, q2 = Question.objects.order_by('id')
+    assert tag_names(q1) == ['generators']
+    assert tag_names(q2) == ['misc', 'rust']
+    lineages = {(lineage.parent_tag.name, lineage.child_tag.name) for lineage in TagLineage.objects.all()}
+    assert lineages == {('lang', 'python'), ('python', 'generators'), ('lang', 'rust'), ('imported', 'lang'), ('imported', 'misc')}
+    # The hierarchy includes the imported questions under their ancestors
+    hierarchy = get_tag_hierarchy(user=user)
+    imported = Tag.objects.get(name='imported')
+    assert hierarchy[imported.id]['question_ids_for_all'] == {q1.id, q2.id}
+
+def test_import_markdown(tmp_path, user):
+    path = tmp_path / 'notes.md'
+    path.write_text(
+        'Q: What does a list comprehension return?\n'
+        'A: A list.\n'
+        '\n'
+        '```python\n[x for x in y]\n```\n'
+        'tags: python, syntax\n'
+        '---\n'
+        'Q: A question\n'
+        'on two lines\n')
+    import_questions(path, user)
+    q1, q2 = Question.objects.order_by('id')
+    assert q1.question == 'What does a list comprehension return?'
+    assert q1.answer.answer == 'A list.\n\n```python\n[x for x in y]\n```'
+    assert tag_names(q1) == ['python', 'syntax']
+    assert q2.question == 'A question\non two lines'
+    assert tag_names(q2) == []
+    if QUESTION_SEARCH.is_supported():
+        assert Question.objects.filter(QUESTION_SEARCH.filter_q('comprehension')).get() == q1
+
+def test_dry_run(tmp_path, user):
+    path = tmp_path / 'notes.jsonl'
+    path.write_text(json.dumps(dict(question="q1", answer="a1", tags=["t1"])) + '\n')
+    out = import_questions(path, user, '--dry-run')
+    assert 'DRY RUN' in out
+    assert 'Imported [1] questions, [1] answers, [1] new tags' in out
+    assert Question.objects.count() == Answer.objects.count() == Tag.objects.count() == QuestionTag.objects.count() == 0
@@ -0,0 +1,77 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from emailusername.models import User
+from questions.db_functions import SecondsBetween
+from questions.models import MAX_INTERVAL_SECS, Question, Schedule
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+@pytest.fixture
+def question(user):
+    return Question.objects.create(question="question", user=user)
+
+def test_save_sets_interval_secs(user, question):
+    schedule = Schedule.objects.create(question=question, user=user, interval_num=2, interval_unit='days')
+    assert schedule.interval_secs == 2 * 24 * 60 * 60
+    schedule = Schedule.objects.create(question=question, user=user)
+    assert schedule.interval_secs == 0
+
+def test_save_sets_interval_secs_from_date_show_next(user, question):
+    # e.g., the date_show_next set in the admin
+    schedule = Schedule.objects.create(
+        question=question, user=user, date_show_next=timezone.now() + timezone.timedelta(hours=3))
+    assert schedule.interval_secs == 3 * 60 * 60
+    schedule.date_show_next = schedule.datetime_added + timezone.timedelta(hours=5)
+    schedule.save()
+    assert Schedule.objects.get(id=schedule.id).interval_secs == 5 * 60 * 60
+
+def test_save_limits_interval_secs(user, question):
+    schedule = Schedule.objects.create(question=question, user=user, interval_num=999, interval_unit='years')
+    assert schedule.interval_secs == MAX_INTERVAL_SECS
+
+def test_bulk_create_sets_date_show_next_and_interval_secs(user, question):
+    now = timezone.now()
+    Schedule.objects.bulk_create([
+        Schedule(question=question, user=user, interval_num=1, interval_unit='weeks'),
+        Schedule(question=question, user=user, interval_num=30, interval_unit='minutes'),
+    ])
+    schedules = Schedule.objects.order_by('id')
+    assert [schedule.interval_secs for schedule in schedules] == [7 * 24 * 60 * 60, 30 * 60]
+    assert now + timezone.timedelta(weeks=1) <= schedules[0].date_show_next <= timezone.now() + timezone.timedelta(weeks=1)
+
+def test_bulk_create_keeps_schedules_that_have_them(user, question):
+    # e.g., restored or imported schedules: their values are kept, and interval_unit isn't changed
+    date_show_next = timezone.now() + timezone.timedelta(days=3)
+    Schedule.objects.bulk_create([
+        Schedule(question=question, user=user, date_show_next=date_show_next, interval_secs=12345),
+        Schedule(question=question, user=user, date_show_next=date_show_next),
+    ])
+    kept, computed = Schedule.objects.order_by('id')
+    assert (kept.date_show_next, kept.interval_secs, kept.interval_unit) == (date_show_next, 12345, None)
+    assert computed.interval_secs in (3 * 24 * 60 * 60, 3 * 24 * 60 * 60 - 1)
+    assert computed.interval_unit is None
+
+def test_seconds_between(user, question):
+    schedule = Schedule.objects.create(
+        question=question, user=user, date_show_next=timezone.now() + timezone.timedelta(days=400, seconds=7))
+    seconds = Schedule.objects.annotate(seconds=SecondsBetween('date_show_next', 'datetime_added')).get(id=schedule.id).seconds
+    assert seconds == 400 * 24 * 60 * 60 + 7
+
+def test_backfill_interval_secs(user, question):
+    schedules = [
+        Schedule.objects.create(question=question, user=user, date_show_next=timezone.now() + timezone.timedelta(hours=hours))
+        for hours in (1, 2, 3)]
+    Schedule.objects.update(interval_secs=None)
+    out = StringIO()
+    call_command('backfill_interval_secs', '--batch-size=2', stdout=out)
+    assert 'interval_secs set for [3] schedules' in out.getvalue()
+    assert [Schedule.objects.get(id=schedule.id).interval_secs for schedule in schedules] == [3600, 7200, 10800]
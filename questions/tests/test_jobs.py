@@ -0,0 +1,118 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from questions import jobs
+from questions.models import Job
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+calls = []
+
+@jobs.register_job('test_record')
+def record(value):
+    calls.append(value)
+
+@jobs.register_job('test_fail')
+def fail():
+    raise RuntimeError('failed')
+
+@pytest.fixture(autouse=True)
+def clear_calls():
+    calls.clear()
+
+def test_enqueue_unknown_job():
+    with pytest.raises(ValueError):
+        jobs.enqueue('unknown')
+
+def test_claim_by_priority():
+    low = jobs.enqueue('test_record', value='low')
+    high = jobs.enqueue('test_record', value='high', priority=10)
+    jobs.enqueue('test_record', value='later', delay=timezone.timedelta(hours=1))
+    assert jobs.claim_job(worker='w') == high
+    assert jobs.claim_job(worker='w') == low
+    # The delayed job isn't due yet
+    assert jobs.claim_job(worker='w') is None
+    assert Job.objects.get(id=high.id).status == Job.STATUS_RUNNING
+
+def test_run_job():
+    jobs.enqueue('test_record', value=1)
+    job = jobs.claim_job(worker='w')
+    assert jobs.run_job(job)
+    assert calls == [1]
+    job.refresh_from_db()
+    assert (job.status, job.attempts, job.worker) == (Job.STATUS_DONE, 1, 'w')
+
+def test_coalesce():
+    job = jobs.enqueue('test_record', value=1, coalesce_key='key')
+    assert jobs.enqueue('test_record', value=1, coalesce_key='key', priority=5) == job
+    assert Job.objects.get().priority == 5
+    # A running job isn't coalesced with
+    jobs.claim_job(worker='w')
+    assert jobs.enqueue('test_record', value=1, coalesce_key='key') != job
+    assert Job.objects.count() == 2
+
+def test_warn_of_overdue_pending_job(caplog, settings):
+    # Without a worker, the pending jobs are overdue
+    settings.JOB_PENDING_WARNING_SECS = 60
+    job = jobs.enqueue('test_record', value=1, coalesce_key='key')
+    jobs.enqueue('test_record', value=1, coalesce_key='key')
+    assert not caplog.records
+    Job.objects.filter(id=job.id).update(run_after=timezone.now() - timezone.timedelta(minutes=2))
+    jobs.enqueue('test_record', value=1, coalesce_key='key')
+    assert 'run_worker' in caplog.text
+
+def test_coalesce_with_concurrent_enqueue_and_claim(monkeypatch):
+    pending = jobs.enqueue('test_record', value=1, coalesce_key='key')
+    filter_ = Job.objects.filter
+    lookups = []
+
+    def filter_concurrently(*args, **kwargs):
+        # The first lookup doesn't see the pending job (enqueued by another process, not yet committed), so the insert
+        # fails; a worker claims the pending job before the second lookup
+        if 'coalesce_key' in kwargs:
+            lookups.append(kwargs)
+            if len(lookups) == 1:
+                return filter_(*args, **kwargs).none()
+            if len(lookups) == 2:
+                jobs.claim_job(worker='w')
+        return filter_(*args, **kwargs)
+    monkeypatch.setattr(Job.objects, 'filter', filter_concurrently)
+    job = jobs.enqueue('test_record', value=1, coalesce_key='key')
+    assert len(lookups) == 2
+    assert job != pending
+    assert Job.objects.get(id=job.id).status == Job.STATUS_PENDING
+    assert Job.objects.get(id=pending.id).status == Job.STATUS_RUNNING
+
+def test_retries():
+    jobs.enqueue('test_fail', max_attempts=2)
+    job = jobs.claim_job(worker='w')
+    assert not jobs.run_job(job)
+    job.refresh_from_db()
+    assert job.status == Job.STATUS_PENDING
+    assert 'RuntimeError' in job.error
+    assert job.run_after > timezone.now()
+    Job.objects.update(run_after=timezone.now())
+    assert not jobs.run_job(jobs.claim_job(worker='w'))
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == (Job.STATUS_FAILED, 2)
+
+def test_requeue_stale_jobs():
+    jobs.enqueue('test_record', value=1)
+    jobs.claim_job(worker='w')
+    Job.objects.update(datetime_started=timezone.now() - timezone.timedelta(hours=2))
+    assert jobs.requeue_stale_jobs(stale_after=timezone.timedelta(hours=1)) == 1
+    assert Job.objects.get().status == Job.STATUS_PENDING
+
+def test_run_worker_command():
+    jobs.enqueue('test_record', value=1)
+    jobs.enqueue('test_record', value=2)
+    jobs.enqueue('test_fail', max_attempts=1)
+    out = StringIO()
+    call_command('run_worker', '--once', stdout=out)
+    assert sorted(calls) == [1, 2]
+    assert out.getvalue().splitlines()[-1] == 'ran [3] jobs; [1] errors'
+    assert not Job.objects.filter(status=Job.STATUS_PENDING).exists()
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+from django.core.management import call_command
+
+from emailusername.models import User
+from questions.forms import QUERY_OLDEST_DUE, QUERY_UNSEEN
+from questions.management.commands.load_test import (
+    ENDPOINT_ANSWER_POST, ENDPOINT_QUESTION_GET, ENDPOINT_SELECT_TAGS_GET, ENDPOINT_SELECT_TAGS_POST, get_percentile)
+from questions.models import Attempt, Question, Schedule, TagLineage
+
+def test_get_percentile():
+    values = list(range(1, 101))
+    assert get_percentile(values, 50) == 50
+    assert get_percentile(values, 95) == 95
+    assert get_percentile(values, 99) == 99
+    assert get_percentile([7], 99) == 7
+    assert get_percentile([], 50) is None
+
+@pytest.mark.django_db(transaction=True)
+def test_load_test(live_server, tmp_path):
+    output = tmp_path / 'results.json'
+    call_command(
+        'load_test', base_url=live_server.url, users=2, answers=2, questions=10, tags=4,
+        query_names=[QUERY_UNSEEN, QUERY_OLDEST_DUE], output=str(output))
+    results = json.loads(output.read_text())
+    assert set(results['query_names']) == {QUERY_UNSEEN, QUERY_OLDEST_DUE}
+    unseen = results['query_names'][QUERY_UNSEEN]
+    assert unseen['answers'] == 4
+    assert set(unseen['endpoints']) == {
+        ENDPOINT_SELECT_TAGS_GET, ENDPOINT_SELECT_TAGS_POST, ENDPOINT_QUESTION_GET, ENDPOINT_ANSWER_POST}
+    assert unseen['endpoints'][ENDPOINT_QUESTION_GET]['count'] == 4
+    assert all(stats['errors'] == 0 for stats in unseen['endpoints'].values())
+    assert unseen['endpoints'][ENDPOINT_ANSWER_POST]['p50_ms'] <= unseen['endpoints'][ENDPOINT_ANSWER_POST]['p99_ms']
+
+    users = User.objects.filter(email__startswith='load_test_')
+    assert users.count() == 2
+    assert Question.objects.filter(user__in=users).count() == 20
+    assert TagLineage.objects.filter(user__in=users).count() == 6
+    assert Attempt.objects.filter(user__in=users).count() == results['query_names'][QUERY_OLDEST_DUE]['answers'] + 4
+    assert Schedule.objects.filter(user__in=users).count() > 4
+
+    # Again, with the same users
+    call_command('load_test', base_url=live_server.url, users=2, answers=1, query_names=[QUERY_UNSEEN],
+                 no_seed=True, output=str(output))
+    assert json.loads(output.read_text())['query_names'][QUERY_UNSEEN]['answers'] == 2
+    assert Question.objects.filter(user__in=users).count() == 20
@@ -0,0 +1,134 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.http import HttpResponse
+from django.urls import reverse
+
+from emailusername.models import User
+from questions.forms import QUERY_UNSEEN
+from questions.get_next_question import NextQuestion
+from questions.metrics import (
+    ATTEMPTS_WRITTEN, REGISTRY, REQUEST_DB_QUERIES, Counter, Histogram, MetricsMiddleware, Registry)
+from questions.models import Attempt, Question, QuestionTag, Tag
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+@pytest.fixture
+def registry():
+    registry = Registry()
+    registry.register(Counter('test_writes_total', 'Writes'))
+    registry.register(Histogram('test_seconds', 'Seconds', buckets=(0.1, 1.0), label_names=('view',)))
+    return registry
+
+def get_metric(registry, name):
+    return registry._metrics[name]
+
+def test_render(registry):
+    get_metric(registry, 'test_writes_total').inc(2)
+    histogram = get_metric(registry, 'test_seconds')
+    for seconds in (0.05, 0.5, 5):
+        histogram.observe(seconds, view='question')
+    assert registry.render().splitlines() == [
+        '# HELP test_seconds Seconds',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{view="question",le="0.1"} 1',
+        'test_seconds_bucket{view="question",le="1.0"} 2',
+        'test_seconds_bucket{view="question",le="+Inf"} 3',
+        'test_seconds_sum{view="question"} 5.55',
+        'test_seconds_count{view="question"} 3',
+        '# HELP test_writes_total Writes',
+        '# TYPE test_writes_total counter',
+        'test_writes_total 2',
+    ]
+
+def test_labels_are_checked_and_escaped(registry):
+    histogram = get_metric(registry, 'test_seconds')
+    with pytest.raises(ValueError):
+        histogram.observe(1)
+    histogram.observe(1, view='a "b"\n')
+    assert 'test_seconds_count{view="a \\"b\\"\\n"} 1' in registry.render()
+
+def test_multiple_processes(tmp_path, registry):
+    # Each process writes its own file, and the sum of all the files is rendered
+    get_metric(registry, 'test_writes_total').inc(2)
+    get_metric(registry, 'test_seconds').observe(0.5, view='question')
+    registry.flush(directory=str(tmp_path), force=True)
+    (tmp_path / 'metrics-999999.json').write_text(json.dumps({
+        'test_writes_total': {'[]': 3},
+        'test_seconds': {'[["view", "question"]]': [1, 0, 0, 0.05, 1]},
+    }))
+    text = registry.render(directory=str(tmp_path))
+    assert 'test_writes_total 5' in text
+    assert 'test_seconds_bucket{view="question",le="1.0"} 2' in text
+    assert 'test_seconds_count{view="question"} 2' in text
+
+def test_writes_and_next_question_observed(user):
+    tag = Tag.objects.create(name="tag", user=user)
+    question = Question.objects.create(question="question", user=user)
+    QuestionTag.objects.create(question=question, tag=tag, user=user)
+    count_before = ATTEMPTS_WRITTEN._values.get('[]', 0)
+    Attempt.objects.create(attempt="attempt", question=question, user=user)
+    assert ATTEMPTS_WRITTEN._values['[]'] == count_before + 1
+    NextQuestion(query_name=QUERY_UNSEEN, tag_ids_selected=[tag.id], user=user)
+    text = REGISTRY.render()
+    assert f'quizme_next_question_seconds_count{{query_name="{QUERY_UNSEEN}"}}' in text
+    assert 'quizme_tag_hierarchy_tags_count ' in text
+
+class TestMetricsMiddleware:
+    # The middleware counts the queries of a sync view, and (in the event loop, under ASGI) of an async view, whose
+    # queries run in sync_to_async()'s thread
+    def _get_response(self, request):
+        request.resolver_match = SimpleNamespace(url_name='test_sync')
+        list(Tag.objects.all())
+        list(Question.objects.all())
+        return HttpResponse()
+
+    async def _aget_response(self, request):
+        request.resolver_match = SimpleNamespace(url_name='test_async')
+        await sync_to_async(lambda: list(Tag.objects.all()))()
+        await sync_to_async(lambda: list(Question.objects.all()))()
+        return HttpResponse()
+
+    def _get_queries_observed(self, view):
+        # The (count, sum) of the view's observed queries
+        values = REQUEST_DB_QUERIES._values.get(json.dumps([['view', view]]), [0, 0])
+        return values[-1], values[-2]
+
+    def test_sync(self, rf):
+        count_before, sum_before = self._get_queries_observed(view='test_sync')
+        MetricsMiddleware(get_response=self._get_response)(rf.get('/'))
+        assert self._get_queries_observed(view='test_sync') == (count_before + 1, sum_before + 2)
+
+    def test_async(self, rf):
+        count_before, sum_before = self._get_queries_observed(view='test_async')
+        middleware = MetricsMiddleware(get_response=self._aget_response)
+        assert iscoroutinefunction(middleware)
+        async_to_sync(middleware)(rf.get('/'))
+        assert self._get_queries_observed(view='test_async') == (count_before + 1, sum_before + 2)
+
+class TestViewMetrics:
+    def test_forbidden(self, client, user):
+        assert client.get(reverse('metrics')).status_code == 403
+        client.force_login(user=user)
+        assert client.get(reverse('metrics')).status_code == 403
+
+    def test_token(self, client, settings):
+        settings.METRICS_TOKEN = 'secret'
+        assert client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code == 403
+        response = client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        assert response.status_code == 200
+        assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+        # The previous requests were observed by the middleware
+        assert b'quizme_request_seconds_count{view="metrics"}' in response.content
+        assert b'quizme_request_db_queries_bucket{view="metrics",le="1"}' in response.content
+
+    def test_staff(self, client, django_user_model):
+        client.force_login(user=django_user_model.objects.create_superuser(email='admin@example.com', password='p'))
+        assert client.get(reverse('metrics')).status_code == 200
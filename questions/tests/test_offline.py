@@ -0,0 +1,156 @@
+import gzip
+import json
+import uuid
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.urls import reverse
+from django.utils import timezone
+
+from questions.forms import QUERY_OLDEST_DUE
+from questions.get_next_question import NextQuestion
+from questions.models import Answer, Attempt, OfflineReview, Question, QuestionTag, Schedule, Tag
+from questions.offline import OfflineDeck, apply_offline_reviews
+from questions.search import ATTEMPT_SEARCH
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return get_user_model().objects.create_user(email='testuser@example.com', password='12345')
+
+@pytest.fixture
+def tag(user):
+    return Tag.objects.create(name='tag 1', user=user)
+
+@pytest.fixture
+def questions(user, tag):
+    question_1 = Question.objects.create(
+        question='question 1', answer=Answer.objects.create(answer='answer 1', user=user), user=user)
+    question_2 = Question.objects.create(question='question 2', user=user)
+    for question in (question_1, question_2):
+        QuestionTag.objects.create(question=question, tag=tag, user=user)
+    return question_1, question_2
+
+def review(question, hours_ago, interval_num=1, interval_unit='days', **kwargs):
+    return dict(
+        id=str(uuid.uuid4()), question_id=question.id, attempt=f'attempt {hours_ago}',
+        reviewed_at=(timezone.now() - timezone.timedelta(hours=hours_ago)).isoformat(),
+        interval_num=interval_num, interval_unit=interval_unit, **kwargs)
+
+class TestOfflineDeck:
+    def test_deck(self, user, tag, questions):
+        question_1, question_2 = questions
+        schedule = Schedule.objects.create(question=question_1, user=user, interval_num=2, interval_unit='days')
+        deck = json.loads(gzip.decompress(OfflineDeck(user=user, tag_ids_selected=[tag.id]).content))
+        assert deck['format'] == 1
+        assert deck['tags'] == {str(tag.id): 'tag 1'}
+        schedule_deck = deck['questions'][0].pop('schedule')
+        assert deck['questions'][0] == dict(id=question_1.id, question='question 1', answer='answer 1', tag_ids=[tag.id])
+        # (DjangoJSONEncoder keeps milliseconds)
+        assert schedule_deck['date_show_next'] == DjangoJSONEncoder().default(schedule.date_show_next)
+        assert schedule_deck['datetime_added'] == DjangoJSONEncoder().default(schedule.datetime_added)
+        assert Decimal(schedule_deck['interval_num']) == 2
+        assert schedule_deck['interval_unit'] == 'days'
+        assert deck['questions'][1]['schedule'] is None
+        assert deck['questions'][1]['answer'] is None
+
+    def test_etag(self, user, tag, questions):
+        etag = OfflineDeck(user=user, tag_ids_selected=[tag.id]).etag
+        assert OfflineDeck(user=user, tag_ids_selected=[tag.id]).etag == etag
+        Schedule.objects.create(question=questions[0], user=user)
+        assert OfflineDeck(user=user, tag_ids_selected=[tag.id]).etag != etag
+
+class TestApplyOfflineReviews:
+    def test_apply(self, user, tag, questions):
+        question_1, question_2 = questions
+        reviews = [review(question_1, hours_ago=1), review(question_1, hours_ago=2, interval_num=3), review(question_2, hours_ago=30)]
+        applied, skipped = apply_offline_reviews(user=user, reviews=reviews)
+        assert sorted(applied) == sorted(r['id'] for r in reviews)
+        assert skipped == []
+        assert Attempt.objects.filter(user=user).count() == 3
+        assert OfflineReview.objects.filter(user=user).count() == 3
+        # date_show_next is from the client's reviewed_at; the newest schedule is from the last review
+        nq = NextQuestion(query_name=QUERY_OLDEST_DUE, tag_ids_selected=[tag.id], user=user)
+        assert nq.question == question_2
+        assert nq.last_schedule_added.date_show_next.isoformat() == (
+            timezone.datetime.fromisoformat(reviews[2]['reviewed_at']) + timezone.timedelta(days=1)).isoformat()
+        newest_1 = Schedule.objects.filter(question=question_1).order_by('-datetime_added').first()
+        assert newest_1.interval_num == 1
+        if ATTEMPT_SEARCH.is_supported():
+            assert Attempt.objects.filter(ATTEMPT_SEARCH.filter_q('attempt')).count() == 3
+
+    def test_review_uploaded_after_a_newer_one(self, user, tag, questions):
+        # Reviewed offline 2 hours ago, but uploaded after an online review an hour ago: the online one stays the newest
+        question_1, _ = questions
+        online = Schedule.objects.create(question=question_1, user=user, interval_num=0, interval_unit='days')
+        Schedule.objects.filter(id=online.id).update(datetime_added=timezone.now() - timezone.timedelta(hours=1))
+        offline = review(question_1, hours_ago=2, interval_num=5)
+        apply_offline_reviews(user=user, reviews=[offline])
+        reviewed_at = timezone.datetime.fromisoformat(offline['reviewed_at'])
+        schedule_offline = Schedule.objects.get(question=question_1, interval_num=5)
+        assert schedule_offline.datetime_added == reviewed_at
+        assert Attempt.objects.get(question=question_1).datetime_added == reviewed_at
+        assert schedule_offline.interval_secs == 5 * 24 * 60 * 60
+        assert Schedule.objects.filter(question=question_1).order_by('-datetime_added').first() == online
+        nq = NextQuestion(query_name=QUERY_OLDEST_DUE, tag_ids_selected=[tag.id], user=user)
+        assert nq.last_schedule_added.id == online.id
+
+    def test_idempotent(self, user, questions):
+        reviews = [review(questions[0], hours_ago=1), review(questions[1], hours_ago=2)]
+        apply_offline_reviews(user=user, reviews=reviews[:1])
+        applied, skipped = apply_offline_reviews(user=user, reviews=reviews + reviews[1:])
+        assert applied == [reviews[1]['id']]
+        assert skipped == [reviews[0]['id']]
+        assert Schedule.objects.count() == 2
+        assert Attempt.objects.count() == 2
+
+    def test_invalid_batch_applies_nothing(self, user, questions):
+        other_user = get_user_model().objects.create_user(email='other@example.com', password='12345')
+        other_question = Question.objects.create(question='other', user=other_user)
+        with pytest.raises(ValueError, match='Unknown question ids'):
+            apply_offline_reviews(user=user, reviews=[review(questions[0], hours_ago=1), review(other_question, hours_ago=1)])
+        with pytest.raises(ValueError, match='Invalid interval_unit'):
+            apply_offline_reviews(user=user, reviews=[review(questions[0], hours_ago=1, interval_unit='fortnights')])
+        with pytest.raises(ValueError, match='Invalid review'):
+            apply_offline_reviews(user=user, reviews=[dict(review(questions[0], hours_ago=1), id='not a uuid')])
+        # Values that don't fit in the Schedule's fields
+        with pytest.raises(ValueError, match='Invalid interval_num'):
+            apply_offline_reviews(user=user, reviews=[review(questions[0], hours_ago=1, interval_num=100000)])
+        with pytest.raises(ValueError, match='Invalid percent_correct'):
+            apply_offline_reviews(user=user, reviews=[review(questions[0], hours_ago=1, percent_correct='0.125')])
+        with pytest.raises(ValueError, match='Invalid percent_importance'):
+            apply_offline_reviews(user=user, reviews=[review(questions[0], hours_ago=1, percent_importance='NaN')])
+        assert Schedule.objects.count() == 0
+        assert OfflineReview.objects.count() == 0
+
+class TestViews:
+    def test_deck(self, client, user, tag, questions):
+        client.force_login(user=user)
+        response = client.get(reverse('offline_deck'), {'tag_ids_selected': str(tag.id)})
+        assert response.status_code == 200
+        assert response['Content-Encoding'] == 'gzip'
+        assert len(json.loads(gzip.decompress(response.content))['questions']) == 2
+        response = client.get(reverse('offline_deck'), {'tag_ids_selected': str(tag.id)}, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 304
+
+    def test_sync(self, client, user, questions):
+        client.force_login(user=user)
+        body = gzip.compress(json.dumps(dict(format=1, reviews=[review(questions[0], hours_ago=1)])).encode())
+        response = client.post(
+            reverse('offline_sync'), body, content_type='application/json', HTTP_CONTENT_ENCODING='gzip')
+        assert response.status_code == 200
+        assert len(response.json()['applied']) == 1
+        assert Schedule.objects.count() == 1
+
+    def test_sync_invalid(self, client, user, questions):
+        client.force_login(user=user)
+        too_long = json.dumps(dict(format=1, reviews=[review(questions[0], hours_ago=1, interval_num=100000)]))
+        for body in ('not json', json.dumps(dict(format=2, reviews=[])), json.dumps(dict(format=1, reviews=[{}])), '[]',
+                     too_long):
+            response = client.post(reverse('offline_sync'), body, content_type='application/json')
+            assert response.status_code == 400
+        assert client.get(reverse('offline_sync')).status_code == 405
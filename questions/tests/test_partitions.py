@@ -0,0 +1,129 @@
+import datetime
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+
+from emailusername.models import User
+from questions.models import Attempt, DeletedRow, Question, Schedule
+
+from questions.partitions import (
+    PARTITIONED_TABLES,
+    create_all_partitions,
+    get_create_partition_sql,
+    get_month_starts,
+    get_partition_name,
+    get_recreate_sql,
+    is_partitioned,
+    unpartition_table,
+)
+
+UTC = datetime.timezone.utc
+
+def test_get_month_starts():
+    start = datetime.datetime(2026, 11, 15, 12, 30, tzinfo=UTC)
+    assert get_month_starts(start=start, months=3) == [
+        datetime.datetime(2026, 11, 1, tzinfo=UTC),
+        datetime.datetime(2026, 12, 1, tzinfo=UTC),
+        datetime.datetime(2027, 1, 1, tzinfo=UTC),
+    ]
+
+def test_get_month_starts_in_utc():
+    # 2026-11-30 20:00 in Los Angeles is already December in UTC
+    start = datetime.datetime(2026, 11, 30, 20, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=-8)))
+    assert get_month_starts(start=start, months=1) == [datetime.datetime(2026, 12, 1, tzinfo=UTC)]
+
+def test_get_create_partition_sql():
+    month_start = datetime.datetime(2026, 12, 1, tzinfo=UTC)
+    month_end = datetime.datetime(2027, 1, 1, tzinfo=UTC)
+    assert get_partition_name(table='questions_schedule', month_start=month_start) == 'questions_schedule_p202612'
+    assert get_create_partition_sql(table='questions_schedule', month_start=month_start, month_end=month_end) == [
+        'CREATE TABLE questions_schedule_p202612 (LIKE questions_schedule INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+        "INSERT INTO questions_schedule_p202612 SELECT * FROM questions_schedule_default "
+        "WHERE datetime_added >= '2026-12-01T00:00:00+00:00' AND datetime_added < '2027-01-01T00:00:00+00:00'",
+        "DELETE FROM questions_schedule_default "
+        "WHERE datetime_added >= '2026-12-01T00:00:00+00:00' AND datetime_added < '2027-01-01T00:00:00+00:00'",
+        "ALTER TABLE questions_schedule ATTACH PARTITION questions_schedule_p202612 "
+        "FOR VALUES FROM ('2026-12-01T00:00:00+00:00') TO ('2027-01-01T00:00:00+00:00')",
+    ]
+
+def test_get_recreate_sql():
+    definitions = [
+        ('index', 'questions_s_questio_10cd6a_idx',
+         'CREATE INDEX questions_s_questio_10cd6a_idx ON public.questions_schedule_unpartitioned USING btree (question_id, user_id, datetime_added DESC)'),
+        ('index', 'questions_schedule_user_id_idx',
+         'CREATE INDEX questions_schedule_user_id_idx ON ONLY public.questions_schedule_partitioned USING btree (user_id)'),
+        ('fk', 'questions_schedule_user_id_fk',
+         'FOREIGN KEY (user_id) REFERENCES emailusername_user(id) DEFERRABLE INITIALLY DEFERRED'),
+        ('trigger', 'questions_schedule_tombstones',
+         'CREATE TRIGGER questions_schedule_tombstones AFTER DELETE ON public.questions_schedule_partitioned '
+         "REFERENCING OLD TABLE AS deleted_rows FOR EACH STATEMENT EXECUTE FUNCTION questions_add_tombstones('user_id')"),
+    ]
+    assert get_recreate_sql(table='questions_schedule', table_old='questions_schedule_unpartitioned', definitions=definitions[:1]) == [
+        'CREATE INDEX questions_s_questio_10cd6a_idx ON questions_schedule USING btree (question_id, user_id, datetime_added DESC)',
+    ]
+    assert get_recreate_sql(table='questions_schedule', table_old='questions_schedule_partitioned', definitions=definitions[1:]) == [
+        'CREATE INDEX questions_schedule_user_id_idx ON questions_schedule USING btree (user_id)',
+        'ALTER TABLE questions_schedule ADD CONSTRAINT questions_schedule_user_id_fk '
+        'FOREIGN KEY (user_id) REFERENCES emailusername_user(id) DEFERRABLE INITIALLY DEFERRED',
+        'CREATE TRIGGER questions_schedule_tombstones AFTER DELETE ON questions_schedule '
+        "REFERENCING OLD TABLE AS deleted_rows FOR EACH STATEMENT EXECUTE FUNCTION questions_add_tombstones('user_id')",
+    ]
+
+postgres_only = pytest.mark.skipif(connection.vendor != 'postgresql', reason='partitioning is postgres only')
+
+@pytest.mark.django_db
+def test_migrate_does_not_partition():
+    # Partitioning is explicit ("partition_history --convert"), whatever the environment when migrate ran
+    assert not any(is_partitioned(table=table) for table in PARTITIONED_TABLES)
+
+@postgres_only
+@pytest.mark.django_db
+def test_convert_and_back():
+    # (DDL is transactional on postgres, so the test's transaction rolls all of this back)
+    user = User.objects.create(email="testuser@example.com")
+    question = Question.objects.create(question="question", user=user)
+    old = Schedule.objects.create(question=question, user=user)
+    Schedule.objects.filter(id=old.id).update(datetime_added=timezone.now() - datetime.timedelta(days=100))
+    recent = Schedule.objects.create(question=question, user=user)
+    attempt = Attempt.objects.create(question=question, user=user, attempt="attempt")
+
+    file = StringIO()
+    call_command('partition_history', '--convert', '--months-ahead=2', stdout=file)
+    assert all(is_partitioned(table=table) for table in PARTITIONED_TABLES)
+    assert 'questions_schedule: converted to a partitioned table' in file.getvalue()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            "WHERE pg_inherits.inhparent = 'questions_schedule'::regclass")
+        partitions = {row[0] for row in cursor.fetchall()}
+    assert get_partition_name(table='questions_schedule', month_start=get_month_starts(start=old.datetime_added, months=1)[0]) in partitions
+    assert 'questions_schedule_default' in partitions
+    # The rows are kept, and new rows get ids from the same sequence
+    assert set(Schedule.objects.values_list('id', flat=True)) == {old.id, recent.id}
+    assert Schedule.objects.create(question=question, user=user).id > recent.id
+    assert list(Attempt.objects.all()) == [attempt]
+    assert Schedule.objects.filter(user=user, datetime_added__gte=timezone.now() - datetime.timedelta(hours=1)).count() == 2
+    # Already partitioned, and the partitions exist
+    assert create_all_partitions(months_ahead=2) == []
+    # The backups' tombstone trigger is re-created on the partitioned table
+    Attempt.objects.filter(id=attempt.id).delete()
+    assert DeletedRow.objects.filter(table='questions_attempt', row_id=attempt.id).exists()
+
+    for table in PARTITIONED_TABLES:
+        unpartition_table(table=table)
+    assert not any(is_partitioned(table=table) for table in PARTITIONED_TABLES)
+    assert Schedule.objects.count() == 3
+    assert Schedule.objects.create(question=question, user=user).id > recent.id
+
+@pytest.mark.skipif(connection.vendor == 'postgresql', reason='sqlite only')
+@pytest.mark.django_db
+def test_sqlite_fallback():
+    # On sqlite (e.g., the tests), which doesn't have partitioning, the tables stay regular tables
+    assert not any(is_partitioned(table=table) for table in PARTITIONED_TABLES)
+    assert create_all_partitions(months_ahead=3) == []
+    file = StringIO()
+    call_command('partition_history', '--convert', stdout=file)
+    assert 'only supported on postgres' in file.getvalue()
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+
+import pytest
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.urls import reverse
+
+from emailusername.models import User
+from questions.profiling import (
+    PROFILE_HEADER, ProfilingMiddleware, SamplingProfiler, get_category, get_profile_token, is_valid_profile_token, read_collapsed,
+    rotate_profiles, summarize, write_profile)
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+@pytest.fixture
+def profile_dir(settings, tmp_path):
+    settings.PROFILE_DIR = str(tmp_path)
+    settings.PROFILE_INTERVAL_SECS = 0.001
+    return tmp_path
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def profile_busy(min_samples=10, timeout_secs=10):
+    # Busy until the profiler has taken min_samples (rather than for a fixed time, since the sampling thread may get
+    # little of the CPU, e.g., when the tests run in parallel)
+    profiler = SamplingProfiler(thread_id=threading.get_ident(), interval=0.001)
+    profiler.start()
+    end = time.perf_counter() + timeout_secs
+    while sum(list(profiler.counts.values())) < min_samples and time.perf_counter() < end:
+        busy(0.01)
+    profiler.stop()
+    return profiler
+
+def test_sampling_profiler():
+    profiler = profile_busy()
+    assert sum(profiler.counts.values()) > 5
+    stack = profiler.counts.most_common(1)[0][0]
+    assert stack[-1].startswith('busy (questions/tests/test_profiling.py:')
+    assert stack[-2].startswith('profile_busy (')
+
+def test_write_and_read(profile_dir):
+    profiler = profile_busy()
+    path = write_profile(profiler=profiler, name='admin:index-12ms')
+    assert os.path.dirname(path) == str(profile_dir)
+    assert path.endswith('-admin_index-12ms.collapsed')
+    assert read_collapsed(path) == profiler.counts
+
+def test_categories():
+    orm = ('view (questions/views.py:1)', 'get_tag_hierarchy (questions/get_tag_hierarchy.py:5)',
+           'execute (django/db/backends/utils.py:9)')
+    hierarchy = ('view (questions/views.py:1)', 'get_tag_hierarchy (questions/get_tag_hierarchy.py:5)')
+    assert get_category(orm) == 'orm'
+    assert get_category(hierarchy) == 'get_tag_hierarchy'
+    assert get_category(('view (questions/views.py:1)',)) == 'other'
+    assert summarize({orm: 1, hierarchy: 3}) == {'get_tag_hierarchy': 0.75, 'orm': 0.25}
+    assert summarize({}) == {}
+
+def test_rotate(tmp_path):
+    for num in range(5):
+        (tmp_path / f'2026010{num}-view.collapsed').write_text('a;b 1\n' * 10)
+    (tmp_path / 'other.txt').write_text('kept')
+    rotate_profiles(directory=str(tmp_path), max_files=3, max_bytes=10 ** 6)
+    assert sorted(os.listdir(tmp_path)) == [
+        '20260102-view.collapsed', '20260103-view.collapsed', '20260104-view.collapsed', 'other.txt']
+    rotate_profiles(directory=str(tmp_path), max_files=3, max_bytes=60)
+    assert sorted(os.listdir(tmp_path)) == ['20260104-view.collapsed', 'other.txt']
+
+def test_token(settings):
+    assert is_valid_profile_token(get_profile_token())
+    assert not is_valid_profile_token(get_profile_token() + 'x')
+    assert not is_valid_profile_token('profile')
+    settings.PROFILE_TOKEN_MAX_AGE_SECS = -1
+    assert not is_valid_profile_token(get_profile_token())
+
+def test_middleware(user, client, profile_dir, settings):
+    client.force_login(user=user)
+    settings.PROFILE_SAMPLE = 0
+    response = client.get(reverse('select_tags'))
+    assert PROFILE_HEADER + '-File' not in response
+    assert os.listdir(profile_dir) == []
+
+    response = client.get(reverse('select_tags'), headers={PROFILE_HEADER: 'invalid'})
+    assert os.listdir(profile_dir) == []
+
+    response = client.get(reverse('select_tags'), headers={PROFILE_HEADER: get_profile_token()})
+    assert response.status_code == 200
+    assert os.listdir(profile_dir) == [response[PROFILE_HEADER + '-File']]
+    assert '-select_tags-' in response[PROFILE_HEADER + '-File']
+
+    settings.PROFILE_SAMPLE = 1.0
+    client.get(reverse('select_tags'))
+    assert len(os.listdir(profile_dir)) == 2
+
+def test_middleware_async(rf, profile_dir):
+    # Under ASGI, with an async view, the middleware runs in the event loop, and samples the thread where the view's
+    # sync code runs
+    async def get_response(request):
+        await sync_to_async(busy)(0.2)
+        return HttpResponse()
+
+    middleware = ProfilingMiddleware(get_response=get_response)
+    assert iscoroutinefunction(middleware)
+    response = async_to_sync(middleware)(rf.get('/', headers={PROFILE_HEADER: get_profile_token()}))
+    counts = read_collapsed(profile_dir / response[PROFILE_HEADER + '-File'])
+    assert any(stack[-1].startswith('busy (questions/tests/test_profiling.py:') for stack in counts)
+
+def test_command(profile_dir, capsys):
+    write_profile(profiler=profile_busy(), name='question-50ms')
+    call_command('profile_requests')
+    assert 'question-50ms.collapsed: [' in capsys.readouterr().out
+    call_command('profile_requests', '--token')
+    assert is_valid_profile_token(capsys.readouterr().out.strip())
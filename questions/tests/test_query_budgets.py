@@ -0,0 +1,467 @@
+import gzip
+import io
+import json
+import re
+import uuid
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib import admin
+from django.core.management import call_command, get_commands
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+
+from emailusername.models import User
+from questions import views
+from questions.forms import (
+    QUERY_CHOICES, QUERY_FUTURE, QUERY_OLDEST_DUE, QUERY_OLDEST_DUE_OR_UNSEEN, QUERY_OLDEST_DUE_OR_UNSEEN_BY_TAG,
+    QUERY_RANDOM_IN_DUE_WINDOW, QUERY_REINFORCE, QUERY_UNSEEN, QUERY_UNSEEN_BY_OLDEST_VIEWED_TAG,
+    QUERY_UNSEEN_THEN_OLDEST_DUE)
+from questions.get_next_question import NextQuestion
+from questions.jobs import enqueue, run_pending_jobs
+from questions.models import (
+    Answer, ArchivedHistory, Attempt, Job, OfflineReview, Question, QuestionTag, Schedule, SlowQuery, StudySession, Tag,
+    TagLineage)
+from questions.TagList import FIELD_NAME__TAG_ID_PREFIX
+
+'''
+Query budgets: for each query name of NextQuestion, each view of questions/views.py, each admin changelist and each
+management command, run it on small data, and again after adding SCALE - 1 times more of the same data, and check
+that each run makes at most its budget (BUDGETS) of queries.  So the number of queries doesn't grow with the number of
+rows (e.g., an N+1 query in a list_display method, or in a loop over the rows).
+
+A test that goes over its budget fails with the queries that the larger data added (normalized, with their counts),
+then all the queries of the run.  When a change makes fewer queries, lower the budget.
+'''
+
+SCALE = 10
+
+BUDGETS = {
+    # NextQuestion, by query name
+    f'next_question {QUERY_UNSEEN}': 12,
+    f'next_question {QUERY_REINFORCE}': 10,
+    f'next_question {QUERY_OLDEST_DUE}': 10,
+    f'next_question {QUERY_FUTURE}': 12,
+    f'next_question {QUERY_OLDEST_DUE_OR_UNSEEN}': 12,
+    f'next_question {QUERY_OLDEST_DUE_OR_UNSEEN_BY_TAG}': 13,
+    f'next_question {QUERY_UNSEEN_BY_OLDEST_VIEWED_TAG}': 13,
+    f'next_question {QUERY_UNSEEN_THEN_OLDEST_DUE}': 12,
+    f'next_question {QUERY_RANDOM_IN_DUE_WINDOW}': 13,
+    # Views: questions/views.py
+    f'view question GET {QUERY_UNSEEN}': 14,
+    f'view question GET {QUERY_REINFORCE}': 12,
+    f'view question GET {QUERY_OLDEST_DUE}': 12,
+    f'view question GET {QUERY_FUTURE}': 14,
+    f'view question GET {QUERY_OLDEST_DUE_OR_UNSEEN}': 14,
+    f'view question GET {QUERY_OLDEST_DUE_OR_UNSEEN_BY_TAG}': 15,
+    f'view question GET {QUERY_UNSEEN_BY_OLDEST_VIEWED_TAG}': 15,
+    f'view question GET {QUERY_UNSEEN_THEN_OLDEST_DUE}': 14,
+    f'view question GET {QUERY_RANDOM_IN_DUE_WINDOW}': 15,
+    'view question POST': 15,
+    'view question_async GET': 12,  # not counting the counts, which run concurrently on other connections
+    'view select_tags GET': 3,
+    'view select_tags POST': 5,
+    'view select_tags POST study session': 12,
+    'view due_forecast GET': 8,
+    'view offline_deck GET': 8,
+    'view offline_sync POST': 18,
+    'view metrics GET': 1,
+    # The admin's changelists (of each registered model), and its other pages
+    'admin answer changelist': 6,
+    'admin archivedhistory changelist': 5,
+    'admin attempt changelist': 6,
+    'admin job changelist': 6,
+    'admin offlinereview changelist': 5,
+    'admin question changelist': 6,
+    'admin questiontag changelist': 5,
+    'admin schedule changelist': 5,
+    'admin site changelist': 5,
+    'admin slowquery changelist': 7,
+    'admin studysession changelist': 5,
+    'admin tag changelist': 5,
+    'admin taglineage changelist': 5,
+    'admin user changelist': 5,
+    'admin question duplicates': 3,
+    # Management commands
+    'command archive_history': 18,
+    'command backfill_interval_secs': 7,
+    'command backup_incremental': 14,
+    'command benchmark_next_question': 259,  # on its own generated data
+    'command benchmark_requests': 22,
+    'command due_forecast': 7,
+    'command dump': 4,
+    'command export_tags': 5,
+    'command export_user_archive': 9,
+    'command find_duplicates': 3,
+    'command import_questions': 20,
+    'command import_tags': 4,
+    'command import_user_archive': 34,
+    'command partition_history': 0,  # postgres only
+    'command profile_requests': 0,
+    'command rebuild_search_index': 15,
+    'command reschedule': 9,
+    'command restore_backups': 34,
+    'command run_worker': 21,
+}
+# Commands without a budget, and why
+COMMANDS_NOT_BUDGETED = {
+    'load_test': 'drives a running server over HTTP; its requests are the views above',
+}
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+@pytest.fixture
+def data(user):
+    # The small data, with grow() to add SCALE - 1 times more of it
+    root_tag = Tag.objects.create(name='root', user=user)
+    add_data(user=user, root_tag=root_tag, batches=range(1))
+    return SimpleNamespace(
+        user=user, root_tag=root_tag, grow=lambda: add_data(user=user, root_tag=root_tag, batches=range(1, SCALE)))
+
+def add_data(user, root_tag, batches):
+    # Add to the user's data, for each batch: 3 tags under root_tag (one the parent of the other two), 4 questions with
+    # answers and tags, 2 of them seen (with 2 schedules and 2 attempts each, one of them due), and a row of each of
+    # the other models in the admin
+    now = timezone.now()
+    for batch in batches:
+        parent = Tag.objects.create(name=f'tag {batch}', user=user)
+        children = [Tag.objects.create(name=f'tag {batch}.{num}', user=user) for num in range(2)]
+        TagLineage.objects.create(parent_tag=root_tag, child_tag=parent, user=user)
+        for child in children:
+            TagLineage.objects.create(parent_tag=parent, child_tag=child, user=user)
+        for num in range(4):
+            answer = Answer.objects.create(answer=f'answer {batch}.{num}', user=user)
+            question = Question.objects.create(question=f'question {batch}.{num} text', answer=answer, user=user)
+            QuestionTag.objects.create(question=question, tag=children[num % 2], user=user)
+            QuestionTag.objects.create(question=question, tag=parent, user=user)
+            if num < 2:
+                for days in (-1 - num, 1 + num):
+                    Schedule.objects.create(
+                        question=question, user=user, interval_num=1, interval_unit='days',
+                        date_show_next=now + timezone.timedelta(days=days))
+                    Attempt.objects.create(attempt=f'attempt {batch}.{num}', question=question, user=user)
+                ArchivedHistory.objects.create(question=question, user=user, count_schedules=1, count_attempts=1)
+                OfflineReview.objects.create(client_id=uuid.uuid4(), question=question, user=user)
+        StudySession.objects.create(
+            user=user, query_name=QUERY_UNSEEN, tag_ids_selected=[parent.id], cards_per_tag=2)
+        Job.objects.create(name='rebuild_search_index', run_after=now, status=Job.STATUS_DONE, datetime_finished=now)
+        SlowQuery.objects.create(db_alias='default', duration_ms=1000, sql=f'SELECT {batch}')
+    # Run the jobs enqueued on save (e.g., indexing the questions), as a worker would
+    run_pending_jobs()
+
+def normalize(sql):
+    # The sql without its values, so that the same query with different ids is counted as one
+    sql = re.sub(r'"s\d+_x\d+"', '"s?"', sql)  # savepoint names
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\((\?, )+\?\)', '(...)', sql)
+    return re.sub(r'(\(\.\.\.\), )+\(\.\.\.\)', '(...), ...', sql)
+
+def format_report(name, budget, queries_small, queries_large):
+    added = Counter(map(normalize, queries_large))
+    added.subtract(Counter(map(normalize, queries_small)))
+    lines = [
+        f'[{name}] query budget [{budget}] exceeded: [{len(queries_small)}] queries on the small data, '
+        f'[{len(queries_large)}] on the {SCALE}x data',
+        f'Queries added on the {SCALE}x data (normalized, with the number of times):',
+        *(f'  {count:+d}  {sql}' for sql, count in added.most_common() if count),
+        f'All the queries on the {SCALE}x data:',
+        *(f'  {num}. {sql}' for num, sql in enumerate(queries_large, start=1)),
+    ]
+    return '\n'.join(lines)
+
+def assert_query_budget(name, data, run, setup=None):
+    # Run run(**setup()) on the small data, then on the SCALE times larger data (setup() isn't counted), and fail if
+    # either makes more than BUDGETS[name] queries
+    queries = []
+    for grow in (False, True):
+        if grow:
+            data.grow()
+        kwargs = setup() if setup else {}
+        with CaptureQueriesContext(connection) as context:
+            run(**kwargs)
+        queries.append([query['sql'] for query in context.captured_queries])
+    budget = BUDGETS[name]
+    queries_small, queries_large = queries
+    if len(queries_small) > budget or len(queries_large) > budget:
+        pytest.fail(format_report(
+            name=name, budget=budget, queries_small=queries_small, queries_large=queries_large), pytrace=False)
+
+def get_questions_seen(data):
+    return list(Question.objects.filter(user=data.user, schedule__isnull=False).distinct().order_by('id'))
+
+class TestNextQuestion:
+    @pytest.mark.parametrize('query_name', [query_name for query_name, _ in QUERY_CHOICES])
+    def test_query_name(self, data, query_name):
+        assert_query_budget(
+            name=f'next_question {query_name}', data=data,
+            run=lambda: NextQuestion(query_name=query_name, tag_ids_selected=[data.root_tag.id], user=data.user))
+
+class TestViews:
+    @pytest.fixture
+    def client(self, client, data):
+        client.force_login(user=data.user)
+        return client
+
+    def get_ok(self, client, path, status_code=200, **kwargs):
+        response = client.get(path, **kwargs)
+        assert response.status_code == status_code, response.content[:1000]
+        return response
+
+    def test_all_views_have_budgets(self):
+        url_names = {
+            pattern.name for pattern in get_resolver().url_patterns
+            if getattr(pattern, 'name', None) and pattern.callback.__module__ == views.__name__}
+        budgeted = {name.split(' ')[1] for name in BUDGETS if name.startswith('view ')}
+        assert url_names and url_names <= budgeted
+
+    @pytest.mark.parametrize('query_name', [query_name for query_name, _ in QUERY_CHOICES])
+    def test_question_get(self, client, data, query_name):
+        assert_query_budget(
+            name=f'view question GET {query_name}', data=data,
+            run=lambda: self.get_ok(client, reverse('question'), data=dict(
+                query_name=query_name, tag_ids_selected=data.root_tag.id)))
+
+    def test_question_post(self, client, data):
+        def run(question):
+            response = client.post(reverse('question'), data=dict(
+                hidden_question_id=question.id, hidden_query_name=QUERY_UNSEEN,
+                hidden_tag_ids_selected=str(data.root_tag.id), attempt='an attempt', percent_correct=80,
+                percent_importance=50, interval_num=2, interval_unit='days'))
+            assert response.status_code == 301
+
+        assert_query_budget(
+            name='view question POST', data=data, run=run, setup=lambda: dict(question=get_questions_seen(data)[0]))
+
+    def test_question_async_get(self, data):
+        # Not in the urls unless settings.ASYNC_QUESTION_VIEW, so called directly
+        def run():
+            request = RequestFactory().get(
+                '/question/', data=dict(query_name=QUERY_UNSEEN, tag_ids_selected=data.root_tag.id))
+            request.user = data.user
+
+            async def auser():
+                return data.user
+            request.auser = auser
+            assert async_to_sync(views.view_question_async)(request).status_code == 200
+
+        assert_query_budget(name='view question_async GET', data=data, run=run)
+
+    def test_select_tags_get(self, client, data):
+        assert_query_budget(
+            name='view select_tags GET', data=data,
+            run=lambda: self.get_ok(client, reverse('select_tags'), data=dict(
+                query_name=QUERY_UNSEEN, tag_ids_selected=data.root_tag.id)))
+
+    @pytest.mark.parametrize('name, cards_per_tag', [
+        ('view select_tags POST', ''), ('view select_tags POST study session', 2)])
+    def test_select_tags_post(self, client, data, name, cards_per_tag):
+        def run(tag_ids):
+            response = client.post(reverse('select_tags'), data=dict(
+                query_name=QUERY_UNSEEN, search_text='', cards_per_tag=cards_per_tag,
+                **{f'{FIELD_NAME__TAG_ID_PREFIX}{tag_id}': 'on' for tag_id in tag_ids}))
+            assert response.status_code == 301
+
+        # All the tags are selected, so there are more of them on the larger data
+        assert_query_budget(name=name, data=data, run=run, setup=lambda: dict(
+            tag_ids=list(Tag.objects.filter(user=data.user).values_list('id', flat=True))))
+
+    def test_due_forecast_get(self, client, data):
+        assert_query_budget(
+            name='view due_forecast GET', data=data,
+            run=lambda: self.get_ok(client, reverse('due_forecast'), data=dict(tag_ids_selected=data.root_tag.id)))
+
+    def test_offline_deck_get(self, client, data):
+        assert_query_budget(
+            name='view offline_deck GET', data=data,
+            run=lambda: self.get_ok(client, reverse('offline_deck'), data=dict(tag_ids_selected=data.root_tag.id)))
+
+    def test_offline_sync_post(self, client, data):
+        # A review of each seen question, so there are more reviews on the larger data
+        def setup():
+            reviews = [
+                dict(id=str(uuid.uuid4()), question_id=question.id, attempt='offline attempt',
+                     reviewed_at=timezone.now().isoformat(), interval_num=1, interval_unit='days')
+                for question in get_questions_seen(data)]
+            return dict(body=gzip.compress(json.dumps(dict(format=1, reviews=reviews)).encode()))
+
+        def run(body):
+            response = client.post(
+                reverse('offline_sync'), body, content_type='application/json', HTTP_CONTENT_ENCODING='gzip')
+            assert response.status_code == 200
+
+        assert_query_budget(name='view offline_sync POST', data=data, run=run, setup=setup)
+
+    def test_metrics_get(self, client, data, settings):
+        settings.METRICS_TOKEN = 'token'
+        assert_query_budget(
+            name='view metrics GET', data=data,
+            run=lambda: self.get_ok(client, reverse('metrics'), HTTP_AUTHORIZATION='Bearer token'))
+
+class TestAdmin:
+    @pytest.fixture
+    def admin_client(self, client, django_user_model):
+        client.force_login(user=django_user_model.objects.create_superuser(email='admin@example.com', password='p'))
+        return client
+
+    @pytest.mark.parametrize('model', list(admin.site._registry), ids=lambda model: model._meta.model_name)
+    def test_changelist(self, admin_client, data, model):
+        def run():
+            response = admin_client.get(reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist'))
+            assert response.status_code == 200
+
+        assert_query_budget(name=f'admin {model._meta.model_name} changelist', data=data, run=run)
+
+    def test_question_duplicates(self, admin_client, data):
+        def run():
+            response = admin_client.get(reverse('admin:questions_question_duplicates'), data=dict(user_id=data.user.id))
+            assert response.status_code == 200
+
+        assert_query_budget(name='admin question duplicates', data=data, run=run)
+
+class TestCommands:
+    def test_all_commands_have_budgets(self):
+        commands = {name for name, app in get_commands().items() if app == 'questions'}
+        budgeted = {name.split(' ', 1)[1] for name in BUDGETS if name.startswith('command ')}
+        assert commands == budgeted | set(COMMANDS_NOT_BUDGETED)
+
+    def call(self, *args):
+        call_command(*args, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_archive_history(self, data, tmp_path):
+        assert_query_budget(
+            name='command archive_history', data=data,
+            run=lambda: self.call('archive_history', '--keep-days=-1', f'--archive-dir={tmp_path}'))
+
+    def test_backfill_interval_secs(self, data):
+        assert_query_budget(
+            name='command backfill_interval_secs', data=data,
+            run=lambda: self.call('backfill_interval_secs'), setup=self.clear_interval_secs)
+
+    def clear_interval_secs(self):
+        Schedule.objects.update(interval_secs=None)
+        return {}
+
+    def test_backup_incremental(self, data, tmp_path):
+        assert_query_budget(
+            name='command backup_incremental', data=data,
+            run=lambda: self.call('backup_incremental', f'--backup-dir={tmp_path}', '--full'))
+
+    def test_benchmark_next_question(self, data):
+        assert_query_budget(
+            name='command benchmark_next_question', data=data,
+            run=lambda: self.call('benchmark_next_question', '--questions=8', '--tags=2', '--note-kb=1', '--repeat=1'))
+
+    def test_benchmark_requests(self, data):
+        assert_query_budget(
+            name='command benchmark_requests', data=data,
+            run=lambda: self.call('benchmark_requests', f'--user-id={data.user.id}', '--requests=2'))
+
+    def test_due_forecast(self, data):
+        assert_query_budget(
+            name='command due_forecast', data=data,
+            run=lambda: self.call('due_forecast', f'--user-id={data.user.id}', f'--tag-ids={data.root_tag.id}'))
+
+    def test_dump(self, data, capsys):
+        # (capsys, for its print()s)
+        assert_query_budget(name='command dump', data=data, run=lambda: self.call('dump'))
+
+    def test_export_tags(self, data):
+        assert_query_budget(
+            name='command export_tags', data=data, run=lambda: self.call('export_tags', f'--user-id={data.user.id}'))
+
+    def test_export_user_archive(self, data, tmp_path):
+        assert_query_budget(
+            name='command export_user_archive', data=data,
+            run=lambda: self.call(
+                'export_user_archive', f'--user-id={data.user.id}', f"--file={tmp_path / 'archive.jsonl.gz'}"))
+
+    def test_find_duplicates(self, data):
+        assert_query_budget(
+            name='command find_duplicates', data=data,
+            run=lambda: self.call('find_duplicates', f'--user-id={data.user.id}'))
+
+    def test_import_questions(self, data, tmp_path):
+        # A file with as many questions as the user has, so the larger data imports more
+        def setup():
+            path = tmp_path / 'questions.jsonl'
+            path.write_text('\n'.join(
+                json.dumps(dict(question=f'imported {question.question}', answer='an answer', tags=['imported', tag.name]))
+                for question, tag in zip(Question.objects.filter(user=data.user), Tag.objects.filter(user=data.user))))
+            return dict(path=path)
+
+        assert_query_budget(
+            name='command import_questions', data=data, setup=setup,
+            run=lambda path: self.call('import_questions', f'--file={path}', f'--user-id={data.user.id}'))
+
+    def test_import_tags(self, data, tmp_path):
+        # Rename one tag, and move it under another; the other tags are unchanged
+        def setup():
+            tag, parent = Tag.objects.filter(user=data.user).exclude(id=data.root_tag.id).order_by('-id')[:2]
+            path = tmp_path / 'tags.csv'
+            path.write_text(
+                'tag_id,tag_rename,child_tag_ids_to_add,child_tag_ids_to_remove,parent_tag_ids_to_add,parent_tag_ids_to_remove\n'
+                f'{tag.id},{tag.name} renamed,,,{parent.id},\n')
+            return dict(path=path)
+
+        assert_query_budget(
+            name='command import_tags', data=data, setup=setup,
+            run=lambda path: self.call('import_tags', f'--csv-file={path}', f'--user-id={data.user.id}'))
+
+    def test_import_user_archive(self, data, tmp_path):
+        # Import the user's archive for another user
+        other = User.objects.create(email='other@example.com')
+
+        def setup():
+            path = tmp_path / 'archive.jsonl.gz'
+            self.call('export_user_archive', f'--user-id={data.user.id}', f'--file={path}')
+            return dict(path=path)
+
+        assert_query_budget(
+            name='command import_user_archive', data=data, setup=setup,
+            run=lambda path: self.call('import_user_archive', f'--user-id={other.id}', f'--file={path}'))
+
+    def test_partition_history(self, data):
+        assert_query_budget(name='command partition_history', data=data, run=lambda: self.call('partition_history'))
+
+    def test_profile_requests(self, data, settings, tmp_path):
+        settings.PROFILE_DIR = str(tmp_path)
+        assert_query_budget(name='command profile_requests', data=data, run=lambda: self.call('profile_requests'))
+
+    def test_rebuild_search_index(self, data):
+        assert_query_budget(
+            name='command rebuild_search_index', data=data, run=lambda: self.call('rebuild_search_index'))
+
+    def test_reschedule(self, data):
+        assert_query_budget(
+            name='command reschedule', data=data,
+            run=lambda: self.call(
+                'reschedule', f'--user-id={data.user.id}', f'--tag-ids={data.root_tag.id}', '--shift-days=1'))
+
+    def test_restore_backups(self, data, tmp_path):
+        # Restore a backup of all the data (into the same database, so the rows are upserted)
+        def setup():
+            backup_dir = tmp_path / f'backups-{Question.objects.count()}'
+            self.call('backup_incremental', f'--backup-dir={backup_dir}')
+            return dict(backup_dir=backup_dir)
+
+        assert_query_budget(
+            name='command restore_backups', data=data, setup=setup,
+            run=lambda backup_dir: self.call('restore_backups', f'--backup-dir={backup_dir}'))
+
+    def test_run_worker(self, data):
+        assert_query_budget(
+            name='command run_worker', data=data,
+            setup=lambda: dict(job=enqueue('update_duplicate_index', question_ids=list(
+                Question.objects.filter(user=data.user).values_list('id', flat=True)))),
+            run=lambda job: self.call('run_worker', '--once', '--max-jobs=2'))
@@ -0,0 +1,136 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from emailusername.models import User
+from questions.due_forecast import DueForecast
+from questions.models import MAX_INTERVAL_SECS, Question, QuestionTag, Schedule, Tag, TagLineage
+from questions import reschedule
+from questions.reschedule import BulkReschedule, get_spread_dates
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+@pytest.fixture
+def tag(user):
+    return Tag.objects.create(name="tag 1", user=user)
+
+def create_question(user, tag, *dates_show_next):
+    question = Question.objects.create(question="question", user=user)
+    QuestionTag.objects.create(question=question, tag=tag, user=user)
+    schedules = [Schedule.objects.create(question=question, user=user, date_show_next=date) for date in dates_show_next]
+    return question, schedules
+
+def date_show_next(schedule):
+    return Schedule.objects.get(id=schedule.id).date_show_next
+
+def test_get_spread_dates():
+    start = timezone.now()
+    day = timezone.timedelta(days=1)
+    assert get_spread_dates(start=start, count=4, days=2) == [start, start + day / 2, start + day, start + day * 1.5]
+    # max_per_day limits each day, so the questions go past days
+    assert get_spread_dates(start=start, count=3, days=1, max_per_day=1) == [start, start + day, start + day * 2]
+    assert get_spread_dates(start=start, count=0, days=3) == []
+
+class TestShift:
+    def test_shift_newest_schedules(self, user, tag):
+        now = timezone.now()
+        _, (old, newest) = create_question(user, tag, now - timezone.timedelta(days=9), now - timezone.timedelta(days=2))
+        _, (future,) = create_question(user, tag, now + timezone.timedelta(days=1))
+        assert BulkReschedule(user=user, tag_ids_selected=[tag.id]).shift(delta=timezone.timedelta(days=7)) == 2
+        assert date_show_next(newest) == now + timezone.timedelta(days=5)
+        assert date_show_next(future) == now + timezone.timedelta(days=8)
+        assert Schedule.objects.get(id=newest.id).interval_secs == newest.interval_secs + 7 * 24 * 60 * 60
+        # Only the newest schedule of each question is changed, and no schedules are added
+        assert date_show_next(old) == now - timezone.timedelta(days=9)
+        assert Schedule.objects.count() == 3
+
+    def test_shift_limits_interval_secs(self, user, tag):
+        _, (schedule,) = create_question(user, tag, timezone.now() + timezone.timedelta(days=1))
+        Schedule.objects.filter(id=schedule.id).update(interval_secs=MAX_INTERVAL_SECS - 10)
+        BulkReschedule(user=user, tag_ids_selected=[tag.id]).shift(delta=timezone.timedelta(days=365))
+        assert Schedule.objects.get(id=schedule.id).interval_secs == MAX_INTERVAL_SECS
+        BulkReschedule(user=user, tag_ids_selected=[tag.id]).shift(delta=-timezone.timedelta(days=365 * 140))
+        assert Schedule.objects.get(id=schedule.id).interval_secs == -MAX_INTERVAL_SECS
+
+    def test_shift_only_due(self, user, tag):
+        now = timezone.now()
+        _, (due,) = create_question(user, tag, now - timezone.timedelta(days=2))
+        _, (future,) = create_question(user, tag, now + timezone.timedelta(days=1))
+        assert BulkReschedule(user=user, tag_ids_selected=[tag.id]).shift(delta=timezone.timedelta(days=3), only_due=True) == 1
+        assert date_show_next(due) == now + timezone.timedelta(days=1)
+        assert date_show_next(future) == now + timezone.timedelta(days=1)
+
+    def test_shift_tag_subtree(self, user, tag):
+        # The descendants of the selected tags are included, other tags are not
+        now = timezone.now()
+        child = Tag.objects.create(name="child", user=user)
+        other = Tag.objects.create(name="other", user=user)
+        TagLineage.objects.create(parent_tag=tag, child_tag=child, user=user)
+        _, (schedule_child,) = create_question(user, child, now)
+        _, (schedule_other,) = create_question(user, other, now)
+        assert BulkReschedule(user=user, tag_ids_selected=[tag.id]).shift(delta=timezone.timedelta(days=1)) == 1
+        assert date_show_next(schedule_child) == now + timezone.timedelta(days=1)
+        assert date_show_next(schedule_other) == now
+
+    def test_shift_invalidates_due_forecast(self, user, tag):
+        midnight = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        create_question(user, tag, midnight + timezone.timedelta(days=1, hours=1))
+        assert DueForecast(user=user, tag_ids_selected=[tag.id]).counts[1] == 1
+        BulkReschedule(user=user, tag_ids_selected=[tag.id]).shift(delta=timezone.timedelta(days=1))
+        assert DueForecast(user=user, tag_ids_selected=[tag.id]).counts[2] == 1
+
+class TestSpread:
+    def test_spread_overdue(self, user, tag):
+        now = timezone.now()
+        overdue = [create_question(user, tag, now - timezone.timedelta(days=num))[1][0] for num in range(1, 7)]
+        _, (future,) = create_question(user, tag, now + timezone.timedelta(days=10))
+        assert BulkReschedule(user=user, tag_ids_selected=[tag.id]).spread(days=3) == 6
+        dates = [date_show_next(schedule) for schedule in overdue]
+        # Oldest due first, 2 per day
+        days_from_now = sorted(round((date - now) / timezone.timedelta(days=1), 1) for date in dates)
+        assert days_from_now == [0.0, 0.5, 1.0, 1.5, 2.0, 2.5]
+        assert dates[-1] < dates[0]  # overdue[-1] was the most overdue, so it's first
+        assert all(
+            schedule.interval_secs == round((schedule.date_show_next - schedule.datetime_added).total_seconds())
+            for schedule in Schedule.objects.filter(id__in=[schedule.id for schedule in overdue]))
+        assert date_show_next(future) == now + timezone.timedelta(days=10)
+
+    def test_spread_max_per_day(self, user, tag):
+        now = timezone.now()
+        for num in range(1, 6):
+            create_question(user, tag, now - timezone.timedelta(hours=num))
+        BulkReschedule(user=user, tag_ids_selected=[tag.id]).spread(days=2, max_per_day=2)
+        dates = sorted(Schedule.objects.values_list('date_show_next', flat=True))
+        assert [int((date - dates[0]) / timezone.timedelta(days=1)) for date in dates] == [0, 0, 1, 1, 2]
+
+    def test_spread_batches(self, user, tag, monkeypatch):
+        # One UPDATE per batch of rows
+        monkeypatch.setattr(reschedule, 'SPREAD_BATCH_SIZE', 2)
+        now = timezone.now()
+        overdue = [create_question(user, tag, now - timezone.timedelta(hours=num))[1][0] for num in range(1, 6)]
+        with CaptureQueriesContext(connection) as context:
+            assert BulkReschedule(user=user, tag_ids_selected=[tag.id]).spread(days=5) == 5
+        assert len([query for query in context.captured_queries if query['sql'].startswith('UPDATE')]) == 3
+        dates = sorted(date_show_next(schedule) for schedule in overdue)
+        assert [date - dates[0] for date in dates] == [timezone.timedelta(days=num) for num in range(5)]
+
+    def test_spread_invalid(self, user, tag):
+        with pytest.raises(ValueError):
+            BulkReschedule(user=user, tag_ids_selected=[tag.id]).spread(days=0)
+
+def test_reschedule_command(user, tag):
+    now = timezone.now()
+    _, (schedule,) = create_question(user, tag, now - timezone.timedelta(days=1))
+    file = StringIO()
+    call_command('reschedule', f'--user-id={user.id}', f'--tag-ids={tag.id}', '--shift-days=2', stdout=file)
+    assert file.getvalue().strip() == 'rescheduled [1] questions'
+    assert date_show_next(schedule) == now + timezone.timedelta(days=1)
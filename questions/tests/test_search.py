@@ -0,0 +1,102 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+
+from emailusername.models import User
+from questions.models import Answer, Attempt, Question
+from questions.search import ANSWER_SEARCH, ATTEMPT_SEARCH, QUESTION_SEARCH, SearchIndex
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+def search_questions(text):
+    return set(Question.objects.filter(QUESTION_SEARCH.filter_q(text=text)))
+
+def test_search_table_is_used():
+    # The tests use sqlite, which has FTS5
+    assert QUESTION_SEARCH.is_supported()
+    assert ANSWER_SEARCH.is_supported()
+    assert ATTEMPT_SEARCH.is_supported()
+
+def test_question_and_answer_text(user):
+    answer = Answer.objects.create(answer="Paris is the capital", user=user)
+    question = Question.objects.create(question="What is the capital of France?", answer=answer, user=user)
+    Question.objects.create(question="What is the capital of Spain?", user=user)
+    assert search_questions("france") == {question}
+    assert search_questions("paris") == {question}
+    assert search_questions("paris france") == {question}
+    assert search_questions("paris spain") == set()
+
+def test_stemming(user):
+    question = Question.objects.create(question="Searching sorted lists", user=user)
+    assert search_questions("search") == {question}
+    assert search_questions("sorting") == {question}
+
+def test_query_syntax_is_literal(user):
+    # FTS5 operators and quotes in the text are searched for as words, rather than raising a syntax error
+    question = Question.objects.create(question="cats AND dogs", user=user)
+    assert search_questions('cats OR "birds') == set()
+    assert search_questions('"cats" -dogs*') == {question}
+    assert search_questions('(') == set()
+
+def test_update_on_save(user):
+    answer = Answer.objects.create(answer="old answer", user=user)
+    question = Question.objects.create(question="old question", answer=answer, user=user)
+    question.question = "new question"
+    question.save()
+    answer.answer = "updated answer"
+    answer.save()
+    assert search_questions("old") == set()
+    assert search_questions("new updated") == {question}
+    assert set(Answer.objects.filter(ANSWER_SEARCH.filter_q(text="updated"))) == {answer}
+
+def test_attempts(user):
+    question = Question.objects.create(question="What is a tuple?", user=user)
+    attempt = Attempt.objects.create(attempt="an immutable sequence", question=question, user=user)
+    Attempt.objects.create(attempt="a mutable sequence", question=question, user=user)
+    assert set(Attempt.objects.filter(ATTEMPT_SEARCH.filter_q(text="immutable"))) == {attempt}
+    # Attempt's by the text of their question
+    assert Attempt.objects.filter(QUESTION_SEARCH.filter_q(text="tuple", field='question')).count() == 2
+
+def test_rows_keyed_by_id(user):
+    # On sqlite, each row's rowid is its object's id, so that it's updated without a scan (see SearchIndex.update)
+    if connection.vendor != 'sqlite':
+        pytest.skip("FTS5 rowids are sqlite's")
+    question = Question.objects.create(question="What is a set?", user=user)
+    question.question = "What is a frozenset?"
+    question.save()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT rowid, question_id FROM questions_question_search')
+        assert cursor.fetchall() == [(question.id, question.id)]
+
+def test_fallback_without_search_table(user, monkeypatch):
+    # A db without the search table falls back to icontains
+    search = SearchIndex(
+        model=Question, id_column='question_id', get_documents=None, fallback_lookups=['question__icontains'])
+    search.table_name = 'questions_no_such_table'
+    question = Question.objects.create(question="What is a tuple?", user=user)
+    assert not search.is_supported()
+    assert set(Question.objects.filter(search.filter_q(text="TUPLE"))) == {question}
+    # The result is cached, rather than looking for the table again on each save or search
+    monkeypatch.setattr(connection.introspection, 'table_names', None)
+    assert not search.is_supported()
+
+def test_rebuild_search_index_command(user):
+    question = Question.objects.create(question="bulk created question", user=user)
+    Question.objects.filter(id=question.id).update(question="updated without signals")
+    deleted = Question.objects.create(question="deleted question", user=user)
+    deleted.delete()
+
+    file = StringIO()
+    call_command('rebuild_search_index', stdout=file)
+    assert 'questions_question_search: indexed [1]' in file.getvalue()
+    assert search_questions("signals") == {question}
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT question_id FROM questions_question_search')
+        assert [row[0] for row in cursor.fetchall()] == [question.id]
@@ -0,0 +1,112 @@
+from types import SimpleNamespace
+
+import pytest
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.db import connection
+from django.http import HttpResponse
+from django.urls import reverse
+
+from emailusername.models import User
+from questions.forms import QUERY_UNSEEN
+from questions.get_next_question import NextQuestion
+from questions.models import Question, QuestionTag, SlowQuery, Tag
+from questions.slow_queries import SlowQueryMiddleware, capture_slow_queries, explain
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+@pytest.fixture
+def capture_all(settings):
+    # Capture every query, and explain all of them
+    settings.SLOW_QUERY_MS = 0
+    settings.SLOW_QUERY_EXPLAIN_SAMPLE = 1.0
+    settings.SLOW_QUERY_KEEP = 1000
+
+def add_question(user):
+    tag = Tag.objects.create(user=user, name='tag1')
+    question = Question.objects.create(user=user, question='q1')
+    QuestionTag.objects.create(user=user, question=question, tag=tag)
+    return tag
+
+def test_capture_records_origin_and_plan(user, capture_all, django_capture_on_commit_callbacks):
+    tag = add_question(user)
+    with django_capture_on_commit_callbacks(execute=True):
+        with capture_slow_queries(view='test'):
+            NextQuestion(query_name=QUERY_UNSEEN, tag_ids_selected=[tag.id], user=user)
+    slow_queries = list(SlowQuery.objects.all())
+    assert slow_queries
+    assert all(slow_query.view == 'test' for slow_query in slow_queries)
+    assert any(slow_query.origin.startswith('questions/get_next_question.py:') for slow_query in slow_queries)
+    selects = [slow_query for slow_query in slow_queries if slow_query.sql.startswith('SELECT')]
+    assert selects and all(slow_query.plan for slow_query in selects)
+    assert 'SCAN' in selects[0].plan or 'SEARCH' in selects[0].plan
+
+def test_capture_off_and_threshold(user, settings, django_capture_on_commit_callbacks):
+    settings.SLOW_QUERY_MS = None
+    with django_capture_on_commit_callbacks(execute=True):
+        with capture_slow_queries():
+            add_question(user)
+    settings.SLOW_QUERY_MS = 60 * 1000
+    with django_capture_on_commit_callbacks(execute=True):
+        with capture_slow_queries():
+            list(Question.objects.all())
+    assert not SlowQuery.objects.exists()
+
+def test_only_selects_are_explained(user, capture_all, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        with capture_slow_queries():
+            Tag.objects.create(user=user, name='tag1')
+    inserts = SlowQuery.objects.filter(sql__startswith='INSERT')
+    assert inserts.count() == 1
+    assert inserts[0].plan == ''
+    assert 'tests/test_slow_queries.py' in inserts[0].origin
+
+def test_saved_only_on_commit(user, capture_all, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=False) as callbacks:
+        with capture_slow_queries():
+            list(Question.objects.all())
+    assert callbacks
+    assert not SlowQuery.objects.exists()
+
+def test_keep_newest(user, capture_all, settings, django_capture_on_commit_callbacks):
+    settings.SLOW_QUERY_KEEP = 3
+    with django_capture_on_commit_callbacks(execute=True):
+        with capture_slow_queries():
+            for _ in range(5):
+                list(Question.objects.all())
+    assert SlowQuery.objects.count() == 3
+
+def test_explain_error():
+    assert explain(connection=connection, sql='SELECT * FROM no_such_table', params=()).startswith('EXPLAIN failed')
+
+def test_middleware_and_admin(capture_all, client, django_user_model, django_capture_on_commit_callbacks):
+    client.force_login(user=django_user_model.objects.create_superuser(email='admin@example.com', password='p'))
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.get(reverse('admin:questions_question_changelist'))
+    assert response.status_code == 200
+    assert SlowQuery.objects.filter(view='admin:questions_question_changelist').exists()
+    response = client.get(reverse('admin:questions_slowquery_changelist'))
+    assert response.status_code == 200
+    slow_query = SlowQuery.objects.first()
+    response = client.get(reverse('admin:questions_slowquery_change', args=[slow_query.id]))
+    assert response.status_code == 200
+
+def test_middleware_async(rf, user, capture_all, django_capture_on_commit_callbacks):
+    # Under ASGI, with an async view, the middleware runs in the event loop, and captures the queries that the view runs
+    # in sync_to_async()'s thread
+    tag = add_question(user)
+
+    async def get_response(request):
+        request.resolver_match = SimpleNamespace(view_name='test_async')
+        await sync_to_async(NextQuestion)(query_name=QUERY_UNSEEN, tag_ids_selected=[tag.id], user=user)
+        return HttpResponse()
+
+    middleware = SlowQueryMiddleware(get_response=get_response)
+    assert iscoroutinefunction(middleware)
+    with django_capture_on_commit_callbacks(execute=True):
+        async_to_sync(middleware)(rf.get('/'))
+    assert SlowQuery.objects.filter(view='test_async', origin__startswith='questions/get_next_question.py:').exists()
@@ -0,0 +1,144 @@
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from emailusername.models import User
+from questions.forms import QUERY_OLDEST_DUE, QUERY_UNSEEN
+from questions.get_next_question import NextQuestion
+from questions.models import Question, QuestionTag, Schedule, StudySession, Tag, TagLineage
+from questions.study_session import get_study_session
+from questions.TagList import FIELD_NAME__TAG_ID_PREFIX
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(email="testuser@example.com", password="12345")
+
+@pytest.fixture
+def tags(user):
+    # "b tag" is a child of "c tag", so selecting "c tag" and "a tag" also selects "b tag"
+    tag_a, tag_b, tag_c = (Tag.objects.create(name=name, user=user) for name in ("a tag", "b tag", "c tag"))
+    TagLineage.objects.create(parent_tag=tag_c, child_tag=tag_b, user=user)
+    return tag_a, tag_b, tag_c
+
+def create_questions(user, tag, count):
+    questions = [Question.objects.create(question=f"{tag.name} question {num}", user=user) for num in range(count)]
+    for question in questions:
+        QuestionTag.objects.create(question=question, tag=tag, user=user)
+    return questions
+
+def next_question(user, study_session, query_name=QUERY_UNSEEN):
+    return NextQuestion(
+        query_name=query_name, tag_ids_selected=[int(tag_id) for tag_id in study_session.tag_ids_selected.split(',')],
+        user=user, study_session=study_session)
+
+def answer(user, nq):
+    Schedule.objects.create(question=nq.question, user=user, date_show_next=timezone.now() + timezone.timedelta(days=1))
+    # As view_flashcard_post() does, with the session from the db
+    StudySession.objects.get(id=nq._study_session.id).record_answer(tag_id=nq.study_session_tag_id)
+
+def test_get_study_session(user, tags):
+    tag_a, tag_b, tag_c = tags
+    study_session = get_study_session(user=user, query_name=QUERY_UNSEEN, tag_ids_selected=[tag_c.id, tag_a.id], cards_per_tag=2)
+    # In tag name order, with the descendants
+    assert study_session.tag_ids_expanded == [tag_a.id, tag_b.id, tag_c.id]
+    assert study_session.tag_ids_remaining == [tag_a.id, tag_b.id, tag_c.id]
+    # The same selection resumes the same session; a different one starts a new session
+    assert get_study_session(user=user, query_name=QUERY_UNSEEN, tag_ids_selected=[tag_c.id, tag_a.id], cards_per_tag=2) == study_session
+    assert get_study_session(user=user, query_name=QUERY_UNSEEN, tag_ids_selected=[tag_c.id, tag_a.id], cards_per_tag=3) != study_session
+
+def test_round_robin(user, tags):
+    tag_a, tag_b, tag_c = tags
+    for tag in tags:
+        create_questions(user, tag, count=3)
+    study_session = get_study_session(user=user, query_name=QUERY_UNSEEN, tag_ids_selected=[tag_a.id, tag_c.id], cards_per_tag=2)
+    tag_names = []
+    for _ in range(7):
+        nq = next_question(user, StudySession.objects.get(id=study_session.id))
+        tag_names.append(nq.study_session_tag_name)
+        assert nq.tag_names_for_question == [nq.study_session_tag_name]
+        answer(user, nq)
+    assert tag_names == ["a tag", "a tag", "b tag", "b tag", "c tag", "c tag", "a tag"]
+    # The counts are still for all the selected tags
+    assert nq.count_questions_tagged == 9
+
+def test_drops_tags_without_questions(user, tags):
+    tag_a, tag_b, tag_c = tags
+    create_questions(user, tag_a, count=1)
+    create_questions(user, tag_c, count=2)
+    study_session = get_study_session(user=user, query_name=QUERY_UNSEEN, tag_ids_selected=[tag_a.id, tag_c.id], cards_per_tag=5)
+    tag_names = []
+    for _ in range(3):
+        nq = next_question(user, StudySession.objects.get(id=study_session.id))
+        tag_names.append(nq.study_session_tag_name)
+        answer(user, nq)
+    # "a tag" has no unseen questions left after one, and "b tag" has none at all, so they're dropped when "c tag"'s
+    # first question is answered
+    assert tag_names == ["a tag", "c tag", "c tag"]
+    assert StudySession.objects.get(id=study_session.id).tag_ids_remaining == [tag_c.id]
+
+def test_no_questions_starts_next_round(user, tags):
+    tag_a, tag_b, tag_c = tags
+    create_questions(user, tag_a, count=1)
+    study_session = get_study_session(user=user, query_name=QUERY_OLDEST_DUE, tag_ids_selected=[tag_a.id], cards_per_tag=1)
+    nq = next_question(user, study_session, query_name=QUERY_OLDEST_DUE)
+    assert nq.question is None
+    assert nq.study_session_tag_name is None
+    assert StudySession.objects.get(id=study_session.id).tag_ids_remaining == [tag_a.id]
+
+def test_get_does_not_save(user, tags):
+    # Picking a question drops the tags without one only in memory; answering it saves that
+    tag_a, tag_b, tag_c = tags
+    create_questions(user, tag_c, count=1)
+    study_session = get_study_session(user=user, query_name=QUERY_UNSEEN, tag_ids_selected=[tag_a.id, tag_c.id], cards_per_tag=2)
+    datetime_updated = study_session.datetime_updated
+    nq = next_question(user, study_session)
+    assert nq.study_session_tag_name == "c tag"
+    study_session = StudySession.objects.get(id=study_session.id)
+    assert (study_session.tag_ids_remaining, study_session.datetime_updated) == ([tag_a.id, tag_b.id, tag_c.id], datetime_updated)
+    answer(user, nq)
+    study_session = StudySession.objects.get(id=study_session.id)
+    assert (study_session.tag_ids_remaining, study_session.tag_index, study_session.count_answered_for_tag) == ([tag_c.id], 0, 1)
+
+def test_record_answer_for_another_tag(user, tags):
+    # A tag that isn't in the round any more (e.g., an answer from an old page) counts for the current tag
+    tag_a, tag_b, tag_c = tags
+    study_session = get_study_session(user=user, query_name=QUERY_UNSEEN, tag_ids_selected=[tag_a.id, tag_b.id], cards_per_tag=2)
+    study_session.record_answer(tag_id=tag_c.id)
+    study_session = StudySession.objects.get(id=study_session.id)
+    assert (study_session.tag_ids_remaining, study_session.count_answered_for_tag) == ([tag_a.id, tag_b.id], 1)
+
+def test_views(client, user, tags):
+    tag_a, tag_b, tag_c = tags
+    create_questions(user, tag_a, count=2)
+    create_questions(user, tag_b, count=2)
+    client.force_login(user=user)
+    response = client.post(reverse('select_tags'), {
+        'query_name': QUERY_UNSEEN,
+        f'{FIELD_NAME__TAG_ID_PREFIX}{tag_a.id}': tag_a.name,
+        f'{FIELD_NAME__TAG_ID_PREFIX}{tag_b.id}': tag_b.name,
+        'cards_per_tag': 1,
+    })
+    study_session = StudySession.objects.get(user=user)
+    assert response.url.endswith(f'&study_session_id={study_session.id}')
+
+    response = client.get(response.url)
+    nq = response.context['next_question']
+    assert nq.study_session_tag_name == "a tag"
+    assert response.context['form_flashcard']['hidden_study_session_id'].value() == study_session.id
+    assert response.context['form_flashcard']['hidden_study_session_tag_id'].value() == tag_a.id
+    assert 'cards_per_tag=1' in response.context['select_tags_url']
+
+    response = client.post(reverse('question'), {
+        'hidden_question_id': nq.question.id,
+        'hidden_query_name': QUERY_UNSEEN,
+        'hidden_tag_ids_selected': f'{tag_a.id},{tag_b.id}',
+        'hidden_study_session_id': study_session.id,
+        'hidden_study_session_tag_id': tag_a.id,
+        'interval_num': 1,
+        'interval_unit': 'days',
+    })
+    assert response.url.endswith(f'&study_session_id={study_session.id}')
+    assert client.get(response.url).context['next_question'].study_session_tag_name == "b tag"
@@ -0,0 +1,108 @@
+import gzip
+import json
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from emailusername.models import User
+from questions.jobs import run_pending_jobs
+from questions.models import Answer, ArchivedHistory, Attempt, Question, QuestionTag, Schedule, Tag, TagLineage
+from questions.search import QUESTION_SEARCH
+
+# Use the Django database for all the tests
+pytestmark = pytest.mark.django_db
+
+@pytest.fixture
+def user():
+    return User.objects.create(email="testuser@example.com")
+
+@pytest.fixture
+def user_2():
+    return User.objects.create(email="testuser2@example.com")
+
+def create_deck(user):
+    parent = Tag.objects.create(name="lang", user=user)
+    child = Tag.objects.create(name="python", user=user)
+    TagLineage.objects.create(parent_tag=parent, child_tag=child, user=user)
+    answer = Answer.objects.create(answer="a list", user=user)
+    question = Question.objects.create(question="what does a list comprehension return", answer=answer, user=user)
+    Question.objects.create(question="no answer", user=user)
+    QuestionTag.objects.create(question=question, tag=child, user=user)
+    Attempt.objects.create(attempt="a list?", question=question, user=user)
+    Schedule.objects.create(question=question, user=user, interval_num=3, interval_unit='days', percent_correct=90)
+    ArchivedHistory.objects.create(question=question, user=user, count_attempts=4, count_schedules=5)
+    # Old timestamps, to check that they're kept
+    datetime_added = timezone.now() - timezone.timedelta(days=30, microseconds=123)
+    Schedule.objects.update(datetime_added=datetime_added, date_show_next=datetime_added + timezone.timedelta(days=3))
+    run_pending_jobs()
+    return question
+
+def export(user, path):
+    out = StringIO()
+    call_command('export_user_archive', f'--user-id={user.id}', f'--file={path}', stdout=out)
+    return out.getvalue()
+
+def import_(user, path):
+    out = StringIO()
+    call_command('import_user_archive', f'--user-id={user.id}', f'--file={path}', '--batch-size=1', stdout=out)
+    return out.getvalue()
+
+def test_round_trip(tmp_path, user, user_2):
+    question = create_deck(user)
+    Question.objects.create(question="another user's", user=user_2)
+    path = tmp_path / 'user.jsonl.gz'
+    assert 'questions: exported [2]' in export(user, path)
+    out = import_(user_2, path)
+    assert 'questions: imported [2]' in out
+    assert 'schedules: imported [1]' in out
+
+    question_2 = Question.objects.get(user=user_2, question=question.question)
+    assert question_2.id != question.id
+    assert question_2.answer.answer == "a list"
+    assert question_2.answer.user == user_2
+    assert list(question_2.tag_set.values_list('name', flat=True)) == ["python"]
+    lineage = TagLineage.objects.get(user=user_2)
+    assert (lineage.parent_tag.name, lineage.child_tag.name) == ("lang", "python")
+    assert question_2.attempt_set.get().attempt == "a list?"
+    archived_history = ArchivedHistory.objects.get(user=user_2)
+    assert (archived_history.question, archived_history.count_attempts, archived_history.count_schedules) == (question_2, 4, 5)
+    schedule, schedule_2 = Schedule.objects.get(user=user), Schedule.objects.get(user=user_2)
+    for field in ('datetime_added', 'date_show_next', 'interval_num', 'interval_unit', 'interval_secs', 'percent_correct'):
+        assert getattr(schedule_2, field) == getattr(schedule, field), field
+    # datetime_updated is the time of the import, for the incremental backups
+    assert schedule_2.datetime_updated > schedule.datetime_updated
+    # The indexes are updated for the imported rows
+    assert question_2 in Question.objects.filter(QUESTION_SEARCH.filter_q(text="comprehension"))
+    assert Question.objects.get(id=question_2.id).content_hash == Question.objects.get(id=question.id).content_hash
+    # The source user's deck is unchanged
+    assert Question.objects.filter(user=user).count() == 2
+
+def test_archive_format(tmp_path, user):
+    create_deck(user)
+    path = tmp_path / 'user.jsonl.gz'
+    export(user, path)
+    with gzip.open(path, mode='rt', encoding='utf-8') as file:
+        lines = [json.loads(line) for line in file]
+    assert lines[0]['format'] == 1
+    assert [line['section'] for line in lines if 'section' in line] == [
+        'tags', 'tag_lineages', 'answers', 'questions', 'question_tags', 'attempts', 'schedules', 'archived_history']
+    assert all('user_id' not in line for line in lines[1:])
+
+def test_import_skips_missing_references(tmp_path, user_2):
+    path = tmp_path / 'user.jsonl.gz'
+    with gzip.open(path, mode='wt', encoding='utf-8') as file:
+        file.write('{"format": 1}\n{"section": "schedules"}\n{"id": 1, "question_id": 99}\n')
+    assert 'skipped [1] rows' in import_(user_2, path)
+    assert not Schedule.objects.exists()
+
+def test_import_invalid_archive(tmp_path, user_2):
+    path = tmp_path / 'user.jsonl.gz'
+    with gzip.open(path, mode='wt', encoding='utf-8') as file:
+        file.write('{"format": 1}\n{"section": "tags"}\n{"id": 1, "name": "tag"}\n{"section": "unknown"}\n')
+    with pytest.raises(CommandError, match='unknown section'):
+        import_(user_2, path)
+    # The import is one transaction
+    assert not Tag.objects.exists()
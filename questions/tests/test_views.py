@@ -1,10 +1,12 @@
 import pytest
+from asgiref.sync import async_to_sync
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
 from questions.models import Question, Tag, Attempt, Schedule
 from questions.forms import FormFlashcard, FormSelectTags, QUERY_UNSEEN
 from questions.TagList import FIELD_NAME__TAG_ID_PREFIX
+from questions.views import view_question_async
 
 HTTP_STATUS_301_MOVED_PERMANENTLY = 301
 
@@ -45,12 +47,46 @@ def test_view_select_tags_post(authenticated_client, tag):
     assert response.status_code == HTTP_STATUS_301_MOVED_PERMANENTLY
     assert response.url == f"{reverse('question')}?query_name={QUERY_NAME}&tag_ids_selected={tag.id}"
 
+def test_view_select_tags_post_search_text(authenticated_client, tag):
+    data = {
+        'query_name': QUERY_UNSEEN,
+        f'{FIELD_NAME__TAG_ID_PREFIX}{tag.id}': tag.name,
+        'search_text': 'binary search',
+    }
+    response = authenticated_client.post(reverse('select_tags'), data)
+    assert response.status_code == HTTP_STATUS_301_MOVED_PERMANENTLY
+    assert response.url == f"{reverse('question')}?query_name={QUERY_UNSEEN}&tag_ids_selected={tag.id}&search_text=binary+search"
+
+def test_view_question_get_search_text(authenticated_client, user, tag):
+    question_match = Question.objects.create(question='What is a binary search?', user=user)
+    question_other = Question.objects.create(question='What is a hash table?', user=user)
+    for question in (question_other, question_match):
+        question.questiontag_set.create(tag=tag, user=user)
+    response = authenticated_client.get(
+        reverse('question'), {'tag_ids_selected': str(tag.id), 'query_name': QUERY_UNSEEN, 'search_text': 'binary'})
+    assert response.status_code == 200
+    assert response.context['next_question'].question == question_match
+    assert response.context['form_flashcard']['hidden_search_text'].value() == 'binary'
+    assert 'search_text=binary' in response.context['select_tags_url']
+
 def test_view_question_get(authenticated_client, tag):
     response = authenticated_client.get(reverse('question'), {'tag_ids_selected': str(tag.id), 'query_name': QUERY_UNSEEN})
     assert response.status_code == 200
     assert 'question.html' in [t.name for t in response.templates]
     assert isinstance(response.context['form_flashcard'], FormFlashcard)
 
+def test_view_question_async_get(rf, user, tag, question):
+    question.questiontag_set.create(tag=tag, user=user)
+    request = rf.get(reverse('question'), {'tag_ids_selected': str(tag.id), 'query_name': QUERY_UNSEEN})
+    request.user = user
+    async def auser():
+        return user
+    request.auser = auser
+
+    response = async_to_sync(view_question_async)(request)
+    assert response.status_code == 200
+    assert 'Test Question' in response.content.decode()
+
 def test_view_flashcard_post(authenticated_client, question, tag):
     data = {
         'hidden_question_id': question.id,
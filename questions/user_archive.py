@@ -0,0 +1,211 @@
+import datetime
+import gzip
+import json
+import uuid
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from questions.duplicates import update_duplicate_index
+from questions.models import Answer, ArchivedHistory, Attempt, Question, QuestionTag, Schedule, Tag, TagLineage
+from questions.search import ANSWER_SEARCH, ATTEMPT_SEARCH, QUESTION_SEARCH
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+'''
+A per-user archive: all of a user's tags, questions and history in one compressed file, to back up one user, or to
+move a user's deck to another instance (unlike pg_dump, which is all-or-nothing for the whole database).
+
+The format (ARCHIVE_FORMAT_VERSION) is JSON lines, gzipped (or zstd-compressed, for a path ending in ".zst", if the
+zstandard package is installed):
+    {"format": 1, "exported_at": "<iso datetime>", "user_id": 1}
+    {"section": "tags"}
+    {"id": 3, "datetime_added": "<iso datetime>", "datetime_updated": "<iso datetime>", "name": "python"}
+    ...
+    {"section": "tag_lineages"}
+    {"id": 1, ..., "parent_tag_id": 3, "child_tag_id": 4}
+    ...
+with a section for each of SECTIONS, in that order (each after the sections that it refers to).  Each row has the
+id and the fields of the model (foreign keys as "<field>_id"), except the user (the archive is one user's).
+
+Export streams each table with .iterator(), so memory stays bounded.  Import reads the file line by line, and inserts
+each section in batches with bulk_create(), remapping the ids: each row gets a new id, and its foreign keys are mapped
+to the new ids of the rows they refer to (so only {old id: new id} maps are kept, for the tags, answers and
+questions).  The datetime_added's are kept (see set_timestamps()), and datetime_updated is the time of the import, so
+that the next incremental backup has the imported rows (see questions.backups).  The import is one transaction, so a
+failed import adds nothing.
+'''
+
+ARCHIVE_FORMAT_VERSION = 1
+SECTIONS = {
+    'tags': Tag,
+    'tag_lineages': TagLineage,
+    'answers': Answer,
+    'questions': Question,
+    'question_tags': QuestionTag,
+    'attempts': Attempt,
+    'schedules': Schedule,
+    'archived_history': ArchivedHistory,  # the counts of the history moved out by archive_history
+}
+EXCLUDE_FIELDS = {'id', 'user', 'content_hash'}  # content_hash is recomputed by the duplicate index
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def get_fields(model):
+    return [field for field in model._meta.concrete_fields if field.name not in EXCLUDE_FIELDS]
+
+
+def open_archive(path, mode):
+    # Open the archive at path for writing text (mode 'wt') or reading text (mode 'rt').  Reading detects the
+    # compression from the file's first bytes.
+    use_zstd = path.endswith('.zst') if mode == 'wt' else _read_magic(path) == ZSTD_MAGIC
+    if not use_zstd:
+        return gzip.open(path, mode=mode, encoding='utf-8')
+    if zstandard is None:
+        raise ValueError(f'zstd archives need the zstandard package: [{path}]')
+    return zstandard.open(path, mode=mode, encoding='utf-8')
+
+
+def _read_magic(path):
+    with open(path, 'rb') as file:
+        return file.read(len(ZSTD_MAGIC))
+
+
+def to_json(value):
+    # Like DjangoJSONEncoder, but keeping the microseconds of datetimes, so that they round-trip
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def export_user_archive(user, file, chunk_size=2000):
+    # Write the user's archive to file (a text file, see open_archive()).  Returns {section: number of rows}.
+    counts = {}
+    file.write(json.dumps(dict(format=ARCHIVE_FORMAT_VERSION, exported_at=timezone.now(),
+                               user_id=user.id), default=to_json) + '\n')
+    for section, model in SECTIONS.items():
+        file.write(json.dumps(dict(section=section)) + '\n')
+        counts[section] = 0
+        rows = (model.objects.filter(user=user)
+                .order_by('id')
+                .values('id', *(field.attname for field in get_fields(model)))
+                .iterator(chunk_size=chunk_size))
+        for row in rows:
+            file.write(json.dumps(row, default=to_json) + '\n')
+            counts[section] += 1
+    return counts
+
+
+def is_timestamp(field):
+    return getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+
+
+def set_timestamps(model, objs, timestamps):
+    # bulk_create() sets the auto_now and auto_now_add fields (datetime_added, datetime_updated) to now, so after
+    # inserting objs, set them to their values in timestamps ([{attname: value}, ...], one per obj) with bulk_update(),
+    # which saves the values as they are.  (Rather than turning off auto_now on the fields while inserting, which
+    # would change them for every thread.)
+    if not objs or not timestamps[0]:
+        return
+    for obj, values in zip(objs, timestamps):
+        for attname, value in values.items():
+            setattr(obj, attname, value)
+    model.objects.bulk_update(objs, fields=list(timestamps[0]))
+
+
+class UserArchiveImport:
+    # Import an archive (see export_user_archive()) for user, with new ids.
+    #   counts: {section: number of rows imported}; skipped: the number of rows whose references weren't in the archive
+    def __init__(self, user, batch_size=1000):
+        self._user = user
+        self._batch_size = batch_size
+        self._new_ids = {section: {} for section in SECTIONS}  # {section: {archived id: new id}}
+        self.counts = {section: 0 for section in SECTIONS}
+        self.skipped = 0
+        self._time_now = timezone.now()
+
+    @transaction.atomic
+    def run(self, file):
+        header = json.loads(file.readline() or '{}')
+        if header.get('format') != ARCHIVE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported archive format: [{header.get('format')}]")
+        section = None
+        batch = []
+        for line_num, line in enumerate(file, start=2):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if 'section' in row:
+                self._insert(section=section, rows=batch)
+                batch = []
+                section = row['section']
+                if section not in SECTIONS:
+                    raise ValueError(f'Line [{line_num}]: unknown section: [{section}]')
+                continue
+            if section is None:
+                raise ValueError(f'Line [{line_num}]: row before the first section')
+            batch.append(row)
+            if len(batch) >= self._batch_size:
+                self._insert(section=section, rows=batch)
+                batch = []
+        self._insert(section=section, rows=batch)
+        return self.counts
+
+    def _insert(self, section, rows):
+        if not rows:
+            return
+        model = SECTIONS[section]
+        fields = get_fields(model)
+        objs = []
+        timestamps = []
+        ids_archived = []
+        for row in rows:
+            values = self._get_values(row=row, fields=fields)
+            if values is None:
+                self.skipped += 1
+                continue
+            timestamps.append({
+                field.attname: values.pop(field.attname) for field in fields if getattr(field, 'auto_now_add', False)})
+            objs.append(model(user_id=self._user.id, **values))
+            ids_archived.append(row['id'])
+        objs = model.objects.bulk_create(objs)
+        set_timestamps(model=model, objs=objs, timestamps=timestamps)
+        self._new_ids[section].update((id_archived, obj.id) for id_archived, obj in zip(ids_archived, objs))
+        self.counts[section] += len(objs)
+
+        # bulk_create() doesn't send post_save, so update the search and duplicate indexes here
+        ids = [obj.id for obj in objs]
+        if model is Answer:
+            ANSWER_SEARCH.update(ids=ids)
+        elif model is Question:
+            QUESTION_SEARCH.update(ids=ids)
+            update_duplicate_index(question_ids=ids)
+        elif model is Attempt:
+            ATTEMPT_SEARCH.update(ids=ids)
+
+    def _get_values(self, row, fields):
+        # Return {attname: value} for the row, with the foreign keys mapped to the new ids, or None if it refers to a
+        # row that isn't in the archive
+        values = {}
+        for field in fields:
+            value = row.get(field.attname)
+            if field.is_relation:
+                value = self._new_ids[_get_section(field.related_model)].get(value)
+                if value is None and not field.null:
+                    return None
+            elif value is None and is_timestamp(field):
+                value = self._time_now  # e.g., an archive written by hand
+            else:
+                value = field.to_python(value)
+            values[field.attname] = value
+        return values
+
+
+def _get_section(model):
+    return next(section for section, section_model in SECTIONS.items() if section_model is model)
@@ -1,17 +1,26 @@
+import gzip
+import hmac
 import humanize
+import json
 import os
 import re
 import traceback
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.exceptions import ObjectDoesNotExist
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.http import urlencode
 
+from .due_forecast import BUCKET_DAY, DEFAULT_DAYS, DueForecast, enqueue_due_forecast_refresh
 from .forms import FormFlashcard, FormSelectTags
 from .get_next_question import NextQuestion
+from .metrics import REGISTRY
+from .offline import DECK_FORMAT_VERSION, OfflineDeck, apply_offline_reviews
+from .study_session import get_study_session
 from .TagList import TagList
 from questions import models
 
@@ -20,7 +29,9 @@ debug_sql = eval(os.environ.get('QM_DEBUG_SQL', 'False'))
 
 
 @login_required(login_url='/login')
-def _render_question(request, query_name, select_tags_url, tag_list):
+def _render_question(request, query_name, select_tags_url, tag_list, search_text='', study_session=None, next_question=None):
+    # next_question: a NextQuestion for query_name and tag_list, if the caller already has one (e.g., view_question_async)
+    # study_session: a StudySession for query_name and tag_list, if the user is in one
     MINUTES = 'minutes'
     HOURS = 'hours'
     DAYS = 'days'
@@ -35,30 +46,36 @@ def _render_question(request, query_name, select_tags_url, tag_list):
     ]
     
     # nq stands for "next question"
-    nq = NextQuestion(user=request.user, query_name=query_name, tag_ids_selected=tag_list.as_id_int_list())
+    nq = next_question
+    if nq is None:
+        nq = NextQuestion(
+            user=request.user, query_name=query_name, tag_ids_selected=tag_list.as_id_int_list(), search_text=search_text,
+            study_session=study_session)
     id_question = nq.question.id if nq.question else 0
 
-    form_flashcard = FormFlashcard(data=dict(hidden_query_name=query_name, hidden_tag_ids_selected=tag_list.as_id_comma_str(), hidden_question_id=id_question))
+    form_flashcard = FormFlashcard(data=dict(
+        hidden_query_name=query_name,
+        hidden_tag_ids_selected=tag_list.as_id_comma_str(),
+        hidden_question_id=id_question,
+        hidden_search_text=search_text,
+        hidden_study_session_id=study_session.id if study_session else None,
+        hidden_study_session_tag_id=nq.study_session_tag_id))
 
 
-    try:
-        last_schedule_added = (
-            models.Schedule.objects.filter(
-                user=request.user,
-                question=nq.question
-            ).latest('datetime_added')
-        )
+    # NextQuestion already has the last schedule for the question (from the query that picked the question)
+    last_schedule_added = nq.last_schedule_added
+    if last_schedule_added:
         last_schedule_added.human_datetime_added = humanize.precisedelta(
             timezone.now() - last_schedule_added.datetime_added)
-    except ObjectDoesNotExist:
-        last_schedule_added = None
 
     context = dict(
             buttons=BUTTONS,
             next_question=nq,
             form_flashcard=form_flashcard,
             last_schedule_added=last_schedule_added,
+            search_text=search_text,
             select_tags_url=select_tags_url,
+            study_session=study_session,
         )
     return render(
         request=request,
@@ -66,12 +83,30 @@ def _render_question(request, query_name, select_tags_url, tag_list):
         context=context
     )
 
+def _with_optional_params(params, **optional_params):
+    # Return the url query params with the optional_params that have a value added (e.g., search_text, if there is any),
+    # so that URLs without them don't change
+    return dict(params, **{name: value for name, value in optional_params.items() if value})
+
+def _get_study_session(user, study_session_id):
+    # Return the user's StudySession with study_session_id (from a url or form), or None
+    try:
+        study_session_id = int(study_session_id or 0)
+    except ValueError:
+        return None
+    if not study_session_id:
+        return None
+    return models.StudySession.objects.filter(id=study_session_id, user=user).first()
+
 def view_select_tags__get(request):
     query_name = request.GET.get('query_name', None)
     form_select_tags = FormSelectTags(initial=dict(query_name=query_name))
     tag_list = TagList(id_comma_str=request.GET.get('tag_ids_selected', ''))
     query_name = request.GET.get('query_name', None)
-    form_select_tags = FormSelectTags(initial=dict(query_name=query_name))
+    form_select_tags = FormSelectTags(initial=dict(
+        query_name=query_name,
+        search_text=request.GET.get('search_text', ''),
+        cards_per_tag=request.GET.get('cards_per_tag', None)))
     return render(
         request=request,
         template_name='select_tags.html',
@@ -85,11 +120,19 @@ def view_select_tags__post(request):
     form_select_tags = FormSelectTags(data=request.POST)
     if form_select_tags.is_valid():
         tag_list = TagList(form_field_names=request.POST)
-        # redirect to /question/?tag_ids=...&query_name=...
-        query_string = urlencode(dict(
-            query_name=form_select_tags.cleaned_data['query_name'],
-            tag_ids_selected=tag_list.as_id_comma_str()
-        ))
+        query_name = form_select_tags.cleaned_data['query_name']
+        study_session = None
+        if form_select_tags.cleaned_data['cards_per_tag']:
+            study_session = get_study_session(
+                user=request.user, query_name=query_name, tag_ids_selected=tag_list.as_id_int_list(),
+                cards_per_tag=form_select_tags.cleaned_data['cards_per_tag'])
+        # redirect to /question/?tag_ids=...&query_name=...&search_text=...&study_session_id=...
+        query_string = urlencode(_with_optional_params(
+            params=dict(
+                query_name=query_name,
+                tag_ids_selected=tag_list.as_id_comma_str()),
+            search_text=form_select_tags.cleaned_data['search_text'],
+            study_session_id=study_session.id if study_session else None))
         redirect_url = reverse(viewname='question')
         redirect_url += f'?{query_string}'
         return redirect(to=redirect_url, permanent=True)
@@ -107,6 +150,8 @@ def view_flashcard_post(request):
         id_question = form_flashcard.cleaned_data["hidden_question_id"]
         query_name = form_flashcard.cleaned_data["hidden_query_name"]
         tag_ids_str = form_flashcard.cleaned_data["hidden_tag_ids_selected"]
+        search_text = form_flashcard.cleaned_data["hidden_search_text"]
+        study_session = _get_study_session(user=request.user, study_session_id=form_flashcard.cleaned_data["hidden_study_session_id"])
         tag_list = TagList(id_comma_str=tag_ids_str)
         try:
             question = models.Question.objects.get(id=id_question)
@@ -116,7 +161,10 @@ def view_flashcard_post(request):
             debug_print and print("WARNING: No question exists for question.id=[{id_question}]")
             # TODO: print warning to user
             # TODO: redirect instead of _render_question()?  Or will _render_question keep any text that the user inputted?
-            return _render_question(request=request, query_name=query_name, tag_list=tag_list)
+            return _render_question(
+                request=request, query_name=query_name, tag_list=tag_list, search_text=search_text, study_session=study_session,
+                select_tags_url=_get_select_tags_url(
+                    tag_list=tag_list, query_name=query_name, search_text=search_text, study_session=study_session))
         data = form_flashcard.cleaned_data
         attempt = models.Attempt(
             attempt=data['attempt'],
@@ -141,12 +189,19 @@ def view_flashcard_post(request):
             user=request.user
         )
         schedule.save()
+        enqueue_due_forecast_refresh(
+            user_id=request.user.id, tag_ids_selected=tag_list.as_id_int_list(), search_text=search_text)
+        if study_session:
+            study_session.record_answer(tag_id=data['hidden_study_session_tag_id'])
 
-        # redirect to /question/?tag_ids=...&query_name=...
+        # redirect to /question/?tag_ids=...&query_name=...&search_text=...&study_session_id=...
         query_string = ''
-        query_string = urlencode(dict(
-            query_name=query_name,
-            tag_ids_selected=tag_list.as_id_comma_str()))
+        query_string = urlencode(_with_optional_params(
+            params=dict(
+                query_name=query_name,
+                tag_ids_selected=tag_list.as_id_comma_str()),
+            search_text=search_text,
+            study_session_id=study_session.id if study_session else None))
         redirect_url = reverse(viewname='question')
         redirect_url += f'?{query_string}'
         return redirect(to=redirect_url, permanent=True)
@@ -168,19 +223,114 @@ def view_select_tags(request):
     else:
         raise Exception("Unknown request.method=[%s]" % request.method)
 
+def _get_select_tags_url(tag_list, query_name, search_text='', study_session=None):
+    select_tags_url = reverse(viewname='select_tags')
+    query_string = urlencode(_with_optional_params(
+        params=dict(
+            tag_ids_selected=tag_list.as_id_comma_str(),
+            query_name=query_name),
+        search_text=search_text,
+        cards_per_tag=study_session.cards_per_tag if study_session else None))
+    select_tags_url += f'?{query_string}'
+    return select_tags_url
+
 @login_required(login_url='/login')
 def view_question(request):
     if request.method == 'GET':
         tag_list = TagList(id_comma_str=request.GET.get('tag_ids_selected', ''))
         query_name = request.GET.get('query_name', None)
-        
-        select_tags_url = reverse(viewname='select_tags')
-        query_string = urlencode(dict(
-            tag_ids_selected=tag_list.as_id_comma_str(),
-            query_name=query_name))
-        select_tags_url += f'?{query_string}'
-        return _render_question(request=request, tag_list=tag_list, query_name=query_name, select_tags_url=select_tags_url)
+        search_text = request.GET.get('search_text', '')
+        study_session = _get_study_session(user=request.user, study_session_id=request.GET.get('study_session_id'))
+        select_tags_url = _get_select_tags_url(
+            tag_list=tag_list, query_name=query_name, search_text=search_text, study_session=study_session)
+        return _render_question(
+            request=request, tag_list=tag_list, query_name=query_name, search_text=search_text, study_session=study_session,
+            select_tags_url=select_tags_url)
     elif request.method == 'POST':
         return view_flashcard_post(request=request)
     else:
-        raise Exception("Unknown request.method=[%s]" % request.method)
\ No newline at end of file
+        raise Exception("Unknown request.method=[%s]" % request.method)
+
+@login_required(login_url='/login')
+async def view_question_async(request):
+    # Async version of view_question(), used when settings.ASYNC_QUESTION_VIEW is set (and served by quizme.asgi).
+    # NextQuestion.acreate() gets the counts concurrently.  Rendering and POSTs are sync code, so run them in a thread.
+    if request.method == 'GET':
+        tag_list = TagList(id_comma_str=request.GET.get('tag_ids_selected', ''))
+        query_name = request.GET.get('query_name', None)
+        search_text = request.GET.get('search_text', '')
+        user = await request.auser()
+        study_session = await sync_to_async(_get_study_session)(user=user, study_session_id=request.GET.get('study_session_id'))
+        select_tags_url = _get_select_tags_url(
+            tag_list=tag_list, query_name=query_name, search_text=search_text, study_session=study_session)
+        nq = await NextQuestion.acreate(
+            user=user, query_name=query_name, tag_ids_selected=tag_list.as_id_int_list(), search_text=search_text,
+            study_session=study_session)
+        return await sync_to_async(_render_question)(
+            request=request, tag_list=tag_list, query_name=query_name, search_text=search_text, study_session=study_session,
+            select_tags_url=select_tags_url, next_question=nq)
+    elif request.method == 'POST':
+        return await sync_to_async(view_flashcard_post)(request=request)
+    else:
+        raise Exception("Unknown request.method=[%s]" % request.method)
+
+@login_required(login_url='/login')
+def view_due_forecast(request):
+    # Return (as JSON) how many questions come due in each bucket (hour/day/week) of the next N days for the selected tags, e.g.,
+    #   /forecast/?tag_ids_selected=1,2&bucket=day&days=30
+    try:
+        tag_list = TagList(id_comma_str=request.GET.get('tag_ids_selected', ''))
+        forecast = DueForecast(
+            user=request.user,
+            tag_ids_selected=tag_list.as_id_int_list(),
+            bucket=request.GET.get('bucket', BUCKET_DAY),
+            days=int(request.GET.get('days', DEFAULT_DAYS)),
+            search_text=request.GET.get('search_text', ''))
+    except ValueError as exception:
+        return JsonResponse(dict(error=str(exception)), status=400)
+    return JsonResponse(forecast.as_dict())
+
+@login_required(login_url='/login')
+def view_offline_deck(request):
+    # Return (as gzipped JSON) a snapshot of the selected tags' questions for offline review (see questions.offline), e.g.,
+    #   /offline/deck/?tag_ids_selected=1,2
+    # A client that sends the ETag of the deck it has (If-None-Match) gets a 304 if the deck hasn't changed.
+    tag_list = TagList(id_comma_str=request.GET.get('tag_ids_selected', ''))
+    deck = OfflineDeck(
+        user=request.user, tag_ids_selected=tag_list.as_id_int_list(), search_text=request.GET.get('search_text', ''))
+    if request.headers.get('If-None-Match') == deck.etag:
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(deck.content, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    response['ETag'] = deck.etag
+    return response
+
+@login_required(login_url='/login')
+def view_offline_sync(request):
+    # Apply a batch of reviews made offline (a JSON body, optionally gzipped; see questions.offline), and return
+    # (as JSON) the ids of the reviews applied, and of those skipped because they were already applied.
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        body = request.body
+        if request.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        data = json.loads(body)
+        if data.get('format') != DECK_FORMAT_VERSION:
+            raise ValueError(f"Unsupported format: [{data.get('format')}]")
+        applied, skipped = apply_offline_reviews(user=request.user, reviews=data.get('reviews', []))
+    except (AttributeError, OSError, TypeError, ValueError) as exception:
+        # e.g., not gzip (OSError), not JSON (ValueError), not the sync format (AttributeError, TypeError), or an invalid review
+        return JsonResponse(dict(error=str(exception)), status=400)
+    return JsonResponse(dict(applied=applied, skipped=skipped))
+
+def view_metrics(request):
+    # Return the metrics in the Prometheus text exposition format (see questions.metrics), to a staff user, or to a
+    # scraper with "Authorization: Bearer <settings.METRICS_TOKEN>"
+    authorization = request.headers.get('Authorization', '')
+    is_token_valid = bool(settings.METRICS_TOKEN) and hmac.compare_digest(
+        authorization.encode(), f'Bearer {settings.METRICS_TOKEN}'.encode())
+    if not is_token_valid and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
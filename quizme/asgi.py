@@ -0,0 +1,19 @@
+"""
+ASGI config for quizme project.
+
+This module contains the ASGI application for ASGI servers, e.g., uvicorn:
+
+    QM_ASYNC_QUESTION_VIEW=True gunicorn --worker-class uvicorn.workers.UvicornWorker quizme.asgi
+
+With QM_ASYNC_QUESTION_VIEW=True, /question/ is served by the async view, which runs the question page's
+count queries concurrently (with QM_DB_POOL=True; otherwise one after the other).  Sync views still work under ASGI;
+Django runs them in a thread.  Set QM_DB_CONN_MAX_AGE=0 under ASGI (the pool does): persistent connections opened
+outside the thread that ends a request are never closed or reused.
+
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "quizme.settings")
+
+from django.core.asgi import get_asgi_application
+application = get_asgi_application()
@@ -7,6 +7,8 @@ AUTH_USER_MODEL = 'emailusername.User'
 BASEDIR = os.path.abspath(os.path.dirname(__file__))
 DEBUG = eval(os.environ.get('QM_DEBUG', 'True'))
 ENABLE_DJANGO_DEBUG_TOOLBAR = eval(os.environ.get('QM_USE_TOOLBAR', 'False'))
+# Use the async view for /question/ (questions.views.view_question_async); intended for running under ASGI (quizme.asgi)
+ASYNC_QUESTION_VIEW = eval(os.environ.get('QM_ASYNC_QUESTION_VIEW', 'False'))
 
 ADMINS = (
     # ('Your Name', 'your_email@example.com'),
@@ -15,10 +17,26 @@ ADMINS = (
 MANAGERS = ADMINS
 
 # Default database engine to postgres, but can override with QM_ENGINE=sqlite
-engine = 'django.db.backends.postgresql_psycopg2'
+# (django.db.backends.postgresql works with either psycopg2 or psycopg (3); connection pooling requires psycopg (3))
+engine = 'django.db.backends.postgresql'
 if (os.environ.get('QM_ENGINE', None) == 'sqlite'):
     engine = 'django.db.backends.sqlite3'
 
+# Persistent connections: the number of seconds to keep a db connection open for reuse by later requests
+# (0 = close it at the end of each request; None = keep it open indefinitely).
+# Reusing connections avoids paying for a TCP connect and authentication on every request.
+# Under ASGI, it must be 0 (or use DB_POOL): persistent connections opened outside the thread that ends a request are
+# never closed or reused (see quizme/asgi.py).
+DB_CONN_MAX_AGE = eval(os.environ.get('QM_DB_CONN_MAX_AGE', '60'))
+# Check that a persistent connection still works before reusing it for a new request (one "SELECT 1" per request at most)
+DB_CONN_HEALTH_CHECKS = eval(os.environ.get('QM_DB_CONN_HEALTH_CHECKS', 'True'))
+# Connection pooling (postgres only; requires "psycopg[pool]").  Pooling replaces persistent connections,
+# so DB_CONN_MAX_AGE is ignored (Django requires it to be 0) when pooling is enabled.
+DB_POOL = eval(os.environ.get('QM_DB_POOL', 'False'))
+DB_POOL_MIN_SIZE = int(os.environ.get('QM_DB_POOL_MIN_SIZE', '2'))  # connections kept open per process
+DB_POOL_MAX_SIZE = int(os.environ.get('QM_DB_POOL_MAX_SIZE', '4'))  # maximum connections per process
+DB_POOL_TIMEOUT = float(os.environ.get('QM_DB_POOL_TIMEOUT', '10'))  # seconds to wait for a free connection before erroring
+
 DATABASES = {
     'default': {
         'ENGINE': engine,
@@ -28,6 +46,8 @@ DATABASES = {
         'PASSWORD': os.environ.get('QM_DB_PASSWORD', ''),
         'HOST': os.environ.get('QM_DB_HOST', 'localhost'), # Empty for localhost through domain sockets or '127.0.0.1' for localhost through TCP.
         'PORT': os.environ.get('QM_DB_PORT', ''), # Set to empty string for default.
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
         'TEST': {
             # If ENGINE is sqlite, and NAME is None, then in-memory sqlite
             # db will be used, else a file-based sqlite db will be used.
@@ -36,6 +56,64 @@ DATABASES = {
     }
 }
 
+if DB_POOL and engine == 'django.db.backends.postgresql':
+    from psycopg_pool import ConnectionPool
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': DB_POOL_TIMEOUT,
+            # Health check: the pool checks that a connection works before handing it out
+            'check': ConnectionPool.check_connection if DB_CONN_HEALTH_CHECKS else None,
+        },
+    }
+
+# Read replica: if DB_QUIZME_REPLICA and/or QM_DB_REPLICA_HOST is set, add a "replica" db (with the same settings as
+# "default" otherwise).  questions.db_router.ReplicaRouter sends the read-only work to it: the scheduler (NextQuestion),
+# the tag hierarchy, the tag list, and the admin changelists.  Everything else, and all writes, use "default".
+# e.g., to try it locally with two sqlite files (copy the primary to the replica to "replicate" it):
+#   QM_ENGINE=sqlite DB_QUIZME=primary.sqlite3 DB_QUIZME_REPLICA=replica.sqlite3 ./manage.py runserver
+DB_REPLICA_NAME = os.environ.get('DB_QUIZME_REPLICA', None)
+DB_REPLICA_HOST = os.environ.get('QM_DB_REPLICA_HOST', None)
+# Read-your-writes: after a session writes, its reads use the primary for this many seconds (allowing for replication lag)
+DB_REPLICA_PIN_SECONDS = int(os.environ.get('QM_DB_REPLICA_PIN_SECONDS', '5'))
+if DB_REPLICA_NAME or DB_REPLICA_HOST:
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        NAME=DB_REPLICA_NAME or DATABASES['default']['NAME'],
+        HOST=DB_REPLICA_HOST or DATABASES['default']['HOST'],
+        # In tests, the replica is the same db as default
+        TEST={'MIRROR': 'default'},
+    )
+DATABASE_ROUTERS = ['questions.db_router.ReplicaRouter']
+
+# The history tables (Schedule and Attempt) can be partitioned by month (postgres only), so that queries of recent
+# history only read the recent partitions: run "./manage.py partition_history --convert".  See questions.partitions.
+# Create the monthly partitions this many months ahead (after migrate, and by "./manage.py partition_history")
+DB_PARTITION_MONTHS_AHEAD = int(os.environ.get('QM_DB_PARTITION_MONTHS_AHEAD', '3'))
+
+# Metrics (see questions.metrics), served at /metrics to staff users, or with "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_DIR = os.environ.get('QM_METRICS_DIR', None)  # a directory shared by the server processes, if more than one
+METRICS_TOKEN = os.environ.get('QM_METRICS_TOKEN', None)
+# Slow-query capture (see questions.slow_queries): record the queries slower than SLOW_QUERY_MS (off if None), with
+# the EXPLAIN plan of a sample of them, and keep the newest SLOW_QUERY_KEEP
+SLOW_QUERY_MS = eval(os.environ.get('QM_SLOW_QUERY_MS', 'None'))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.environ.get('QM_SLOW_QUERY_EXPLAIN_SAMPLE', '0.1'))
+SLOW_QUERY_KEEP = int(os.environ.get('QM_SLOW_QUERY_KEEP', '1000'))
+# Request profiling (see questions.profiling): profile PROFILE_SAMPLE of the requests (and those with a signed header),
+# and keep the newest PROFILE_MAX_FILES profiles (at most PROFILE_MAX_BYTES) in PROFILE_DIR
+PROFILE_SAMPLE = float(os.environ.get('QM_PROFILE_SAMPLE', '0'))
+PROFILE_DIR = os.environ.get('QM_PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL_SECS = float(os.environ.get('QM_PROFILE_INTERVAL_SECS', '0.005'))
+PROFILE_MAX_FILES = int(os.environ.get('QM_PROFILE_MAX_FILES', '200'))
+PROFILE_MAX_BYTES = int(os.environ.get('QM_PROFILE_MAX_BYTES', str(50 * 1024 * 1024)))
+PROFILE_TOKEN_MAX_AGE_SECS = int(os.environ.get('QM_PROFILE_TOKEN_MAX_AGE_SECS', str(60 * 60)))
+# Background jobs (see questions.jobs) are run by "./manage.py run_worker", which is required along with the server: the
+# duplicate index's buckets and the due forecast warming are only done by the jobs.  enqueue() logs a warning when it
+# finds a job pending for longer than JOB_PENDING_WARNING_SECS past when it was due (e.g., with no worker running).
+JOB_PENDING_WARNING_SECS = int(os.environ.get('QM_JOB_PENDING_WARNING_SECS', '600'))
+
 # Hosts/domain names that are valid for this site; required if DEBUG is False
 # See https://docs.djangoproject.com/en/1.5/ref/settings/#allowed-hosts
 ALLOWED_HOSTS = ['*']
@@ -110,10 +188,14 @@ STATICFILES_FINDERS = (
 SECRET_KEY = ')ltnqpp5h)&r217dm)@4ia9bq)idd5+@jr19qz62!gh0sm@7-p'
 
 MIDDLEWARE = (
+    'questions.metrics.MetricsMiddleware',  # first, so that it times the other middleware too
+    'questions.slow_queries.SlowQueryMiddleware',
+    'questions.profiling.ProfilingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'questions.db_router.ReplicaPinningMiddleware',  # must come after SessionMiddleware
     'django.contrib.messages.middleware.MessageMiddleware',
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -125,6 +207,8 @@ ROOT_URLCONF = 'quizme.urls'
 
 # Python dotted path to the WSGI application used by Django's runserver.
 WSGI_APPLICATION = 'quizme.wsgi.application'
+# Python dotted path to the ASGI application, e.g., for "gunicorn -k uvicorn.workers.UvicornWorker quizme.asgi"
+ASGI_APPLICATION = 'quizme.asgi.application'
 
 TEMPLATES = [
     {
@@ -19,8 +19,15 @@ urlpatterns = [
         name='login'),
     re_path(route=r'^logout$', view=emailusername_views.logout, name='logout'),
     re_path(route=r'^$', view=question_views.view_select_tags),
-    re_path(route=r'^question/$', view=question_views.view_question, name='question'),
+    re_path(
+        route=r'^question/$',
+        view=question_views.view_question_async if settings.ASYNC_QUESTION_VIEW else question_views.view_question,
+        name='question'),
     re_path(route=r'^select-tags/$', view=question_views.view_select_tags, name='select_tags'),
+    re_path(route=r'^forecast/$', view=question_views.view_due_forecast, name='due_forecast'),
+    re_path(route=r'^offline/deck/$', view=question_views.view_offline_deck, name='offline_deck'),
+    re_path(route=r'^offline/sync/$', view=question_views.view_offline_sync, name='offline_sync'),
+    re_path(route=r'^metrics$', view=question_views.view_metrics, name='metrics'),
 
     # Uncomment the admin/doc line below to enable admin documentation:
     re_path(r'^admin/doc/', include('django.contrib.admindocs.urls')),